@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AccountConfig(AppConfig):
     name = 'apps.account'
     verbose_name = '账户'
+
+    def ready(self):
+        from service.account.account_org_index_service import account_org_index_service_ins
+        account_org_index_service_ins.connect_org_model_signals()
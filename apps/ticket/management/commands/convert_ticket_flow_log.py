@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ticket.models import TicketFlowLog
+from service.ticket.ticket_flow_log_data_service import ticket_flow_log_data_service_ins
+
+
+class Command(BaseCommand):
+    help = 'convert ticket_data of existing flow logs according to TICKET_FLOW_LOG_DATA_MODE ' \
+           'and TICKET_FLOW_LOG_DATA_COMPRESS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='tickets per batch')
+
+    def handle(self, *args, **options):
+        last_ticket_id = 0
+        ticket_count, update_count = 0, 0
+        while True:
+            ticket_id_list = list(TicketFlowLog.objects.filter(ticket_id__gt=last_ticket_id).order_by(
+                'ticket_id').values_list('ticket_id', flat=True).distinct()[:options['batch_size']])
+            if not ticket_id_list:
+                break
+            for ticket_id in ticket_id_list:
+                flag, result = ticket_flow_log_data_service_ins.convert_ticket_flow_log(ticket_id)
+                if flag is False:
+                    raise CommandError(result)
+                update_count += result['update_count']
+            ticket_count += len(ticket_id_list)
+            last_ticket_id = ticket_id_list[-1]
+        self.stdout.write('convert ticket flow log finished, ticket count: {}, update count: {}'.format(
+            ticket_count, update_count))
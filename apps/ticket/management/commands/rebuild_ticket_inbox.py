@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from service.ticket.ticket_inbox_service import ticket_inbox_service_ins
+
+
+class Command(BaseCommand):
+    help = 'rebuild the ticket list read model(ticket_ticketinbox)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='tickets per batch')
+
+    def handle(self, *args, **options):
+        flag, result = ticket_inbox_service_ins.rebuild_ticket_inbox(options['batch_size'])
+        if flag is False:
+            raise CommandError(result)
+        self.stdout.write('rebuild ticket inbox finished, ticket count: {}'.format(result['ticket_count']))
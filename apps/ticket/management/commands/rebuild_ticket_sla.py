@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from service.ticket.ticket_sla_service import ticket_sla_service_ins
+
+
+class Command(BaseCommand):
+    help = 'add the current state sla record(ticket_ticketstatesla) of unfinished tickets without one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='tickets per batch')
+
+    def handle(self, *args, **options):
+        flag, result = ticket_sla_service_ins.rebuild_ticket_sla(options['batch_size'])
+        if flag is False:
+            raise CommandError(result)
+        self.stdout.write('rebuild ticket sla finished, ticket count: {}'.format(result['ticket_count']))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from service.ticket.ticket_statistics_service import ticket_statistics_service_ins
+
+
+class Command(BaseCommand):
+    help = 'rebuild the daily ticket statistics(ticket_ticketdailystatistics) from ticket records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', default='', help='ticket creation date from, e.g. 2020-03-01')
+        parser.add_argument('--end-date', default='', help='ticket creation date to(inclusive), e.g. 2020-03-31')
+        parser.add_argument('--batch-size', type=int, default=5000, help='tickets per batch')
+
+    def handle(self, *args, **options):
+        flag, result = ticket_statistics_service_ins.rebuild_ticket_statistics(
+            options['start_date'], options['end_date'], options['batch_size'])
+        if flag is False:
+            raise CommandError(result)
+        self.stdout.write('rebuild ticket statistics finished, ticket count: {}, row count: {}'.format(
+            result['ticket_count'], result['row_count']))
@@ -33,10 +33,14 @@ class TicketRecord(BaseModel):
         '进行状态', default=1, help_text='当前工单的进行状态,详见service.constant_service中定义')
     multi_all_person = models.CharField('全部处理的结果', max_length=1000, default='{}', blank=True,
                                         help_text='需要当前状态处理人全部处理时实际的处理结果，json格式')
+    state_version = models.IntegerField('状态版本', default=0,
+                                        help_text='工单状态及处理人每次变更时加1, 定时器据此判断是否失效')
 
     class Meta:
         verbose_name = '工单记录'
         verbose_name_plural = '工单记录'
+        # 工单列表按工作流、创建时间查询; 子工单按父工单及父工单状态查询
+        index_together = [('workflow_id', 'is_deleted', 'gmt_created'), ('parent_ticket_id', 'parent_ticket_state_id')]
 
 
 class TicketFlowLog(BaseModel):
@@ -61,6 +65,8 @@ class TicketFlowLog(BaseModel):
     class Meta:
         verbose_name = '工单流转日志'
         verbose_name_plural = '工单流转日志'
+        # 流转记录按id倒序分页; 按工单及状态查询状态的处理记录
+        index_together = [('ticket_id', 'is_deleted', 'id'), ('ticket_id', 'state_id')]
 
 
 class TicketCustomField(BaseModel):
@@ -103,6 +109,7 @@ class TicketCustomField(BaseModel):
     class Meta:
         verbose_name = '工单自定义字段'
         verbose_name_plural = '工单自定义字段'
+        index_together = [('ticket_id', 'field_key', 'is_deleted')]
 
 
 class TicketUser(BaseModel):
@@ -114,3 +121,111 @@ class TicketUser(BaseModel):
     username = models.CharField('关系人', max_length=100)
     in_process = models.BooleanField('待处理中', default=False)
     worked = models.BooleanField('处理过', default=False)
+
+    class Meta:
+        index_together = [('username', 'in_process')]
+
+
+class TicketSnSequence(BaseModel):
+    """
+    工单流水号序列, 按天(及部署机房)记录已分配的最大序号. settings.TICKET_SN_STORE为db时使用
+    """
+    name = models.CharField('序列名称', max_length=50, unique=True, help_text='机房_日期,如2020-01-01')
+    value = models.IntegerField('已分配的最大序号', default=0)
+
+    class Meta:
+        verbose_name = '工单流水号序列'
+        verbose_name_plural = '工单流水号序列'
+
+
+class TicketTimer(BaseModel):
+    """
+    工单定时器流转, 由定时任务扫描到期的定时器执行
+    """
+    ticket_id = models.IntegerField('工单id')
+    state_id = models.IntegerField('状态id', help_text='创建定时器时工单所处的状态')
+    state_version = models.IntegerField('状态版本', default=0, help_text='创建定时器时工单的状态版本，不一致时定时器失效')
+    transition_id = models.IntegerField('流转id')
+    due_time = models.DateTimeField('到期时间', help_text='执行中的定时器为租约到期时间，超时未完成将被重新执行')
+    status = models.IntegerField('状态', default=0, help_text='0.待执行,1.执行中,2.已执行,3.已失效')
+    result = models.CharField('执行结果', max_length=1000, default='', blank=True)
+
+    class Meta:
+        verbose_name = '工单定时器'
+        verbose_name_plural = '工单定时器'
+        index_together = [('status', 'due_time')]
+
+
+class TicketHookOutbox(BaseModel):
+    """
+    工单hook发送队列, 与工单状态变更在同一事务中写入，由hook发送任务异步发送，失败时按指数退避重试
+    """
+    ticket_id = models.IntegerField('工单id')
+    state_id = models.IntegerField('状态id', help_text='触发hook时工单所处的状态，工单已不在此状态时不再发送')
+    status = models.IntegerField('状态', default=0, help_text='0.待发送,1.发送中,2.已发送,3.失败(死信),4.已失效')
+    next_retry_time = models.DateTimeField('下次发送时间', help_text='发送中的为租约到期时间，超时未完成将被重新发送')
+    attempt_count = models.IntegerField('已发送次数', default=0)
+    latency = models.IntegerField('最后一次请求耗时(毫秒)', default=0)
+    last_error = models.CharField('最后一次错误信息', max_length=1000, default='', blank=True)
+
+    class Meta:
+        verbose_name = '工单hook发送队列'
+        verbose_name_plural = '工单hook发送队列'
+        index_together = [('status', 'next_retry_time')]
+
+
+class TicketInbox(BaseModel):
+    """
+    工单列表读模型, 按用户及类别(待办、关联的、处理过的)冗余工单列表的查询字段, 由TicketUser及工单记录的变更增量维护.
+    creator为工单的创建人
+    """
+    username = models.CharField('用户名', max_length=100)
+    category = models.CharField('类别', max_length=10, help_text='duty:待办,relation:关联的,worked:处理过的')
+    ticket_gmt_created = models.DateTimeField('工单创建时间')
+    ticket_id = models.IntegerField('工单id')
+    workflow_id = models.IntegerField('工作流id')
+    act_state_id = models.IntegerField('进行状态')
+    state_id = models.IntegerField('状态id')
+    sn = models.CharField('流水号', max_length=25)
+    title = models.CharField('标题', max_length=500, default='', blank=True)
+
+    class Meta:
+        verbose_name = '工单列表读模型'
+        verbose_name_plural = '工单列表读模型'
+        index_together = [('username', 'category', 'ticket_gmt_created', 'ticket_id', 'workflow_id', 'act_state_id'),
+                          ('ticket_id',)]
+
+
+class TicketDailyStatistics(BaseModel):
+    """
+    工单每日统计, 按(工单创建日期, 工作流, 进行状态, 创建人部门)汇总的工单个数, 工单新建、进行状态变化、删除时增量维护
+    """
+    day = models.DateField('工单创建日期')
+    workflow_id = models.IntegerField('工作流id')
+    act_state_id = models.IntegerField('进行状态')
+    creator_dept_id = models.IntegerField('创建人部门id', default=0, help_text='创建人不存在时为0')
+    ticket_count = models.IntegerField('工单个数', default=0)
+
+    class Meta:
+        verbose_name = '工单每日统计'
+        verbose_name_plural = '工单每日统计'
+        unique_together = ('day', 'workflow_id', 'act_state_id', 'creator_dept_id')
+
+
+class TicketStateSla(BaseModel):
+    """
+    工单状态时效: 工单每次进入状态的时间、按状态最后期限(工作日)计算的到期时间及离开时间
+    """
+    ticket_id = models.IntegerField('工单id')
+    workflow_id = models.IntegerField('工作流id')
+    state_id = models.IntegerField('状态id')
+    status = models.IntegerField('状态', default=0, help_text='0.处于该状态 1.已离开')
+    enter_time = models.DateTimeField('进入时间')
+    due_time = models.DateTimeField('到期时间', null=True, blank=True, help_text='状态未设置最后期限时为空')
+    leave_time = models.DateTimeField('离开时间', null=True, blank=True)
+    duration = models.IntegerField('停留时间(秒)', default=0, help_text='离开状态时更新')
+
+    class Meta:
+        verbose_name = '工单状态时效'
+        verbose_name_plural = '工单状态时效'
+        index_together = [('status', 'due_time'), ('ticket_id', 'status'), ('state_id', 'status', 'duration')]
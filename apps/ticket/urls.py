@@ -2,7 +2,8 @@ from django.urls import path
 from apps.ticket.views import TicketListView, TicketView, TicketTransition, TicketFlowlog, TicketFlowStep, TicketState, \
     TicketsStates, TicketAccept, TicketDeliver, TicketAddNode, \
     TicketAddNodeEnd, TicketField, TicketScriptRetry, TicketComment, TicketHookCallBack, TicketParticipantInfo, \
-    TicketClose, TicketsNumStatistics, TicketRetreat
+    TicketClose, TicketsNumStatistics, TicketRetreat, TicketsBatch, TicketsHookStatistics, \
+    TicketsTypeStatistics, TicketsSla, TicketsSlaStatistics
 
 urlpatterns = [
     path('', TicketListView.as_view()),
@@ -23,5 +24,10 @@ urlpatterns = [
     path('/<int:ticket_id>/close', TicketClose.as_view()),
     path('/<int:ticket_id>/retreat', TicketRetreat.as_view()),
     path('/states', TicketsStates.as_view()),  # 批量获取工单状态
-    path('/num_statistics', TicketsNumStatistics.as_view()),  # 批量获取工单状态
+    path('/num_statistics', TicketsNumStatistics.as_view()),  # 工单个数统计
+    path('/type_statistics', TicketsTypeStatistics.as_view()),  # 每种类型工单的创建数量统计
+    path('/sla', TicketsSla.as_view()),  # 超时或即将超时的工单
+    path('/sla_statistics', TicketsSlaStatistics.as_view()),  # 状态时效统计
+    path('/batch', TicketsBatch.as_view()),  # 批量新建、批量处理工单
+    path('/hook_statistics', TicketsHookStatistics.as_view()),  # hook发送统计
 ]
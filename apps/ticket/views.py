@@ -1,3 +1,4 @@
+import datetime
 import json
 from django.http import HttpResponse
 from django.views import View
@@ -6,7 +7,11 @@ from schema import Schema, Regex, And, Or, Use, Optional
 from apps.loon_base_view import LoonBaseView
 from service.account.account_base_service import account_base_service_ins
 from service.format_response import api_response
+from service.manage.overview_service import overview_service_ins
 from service.ticket.ticket_base_service import ticket_base_service_ins
+from service.ticket.ticket_hook_outbox_service import ticket_hook_outbox_service_ins
+from service.ticket.ticket_sla_service import ticket_sla_service_ins
+from service.workflow.workflow_base_service import workflow_base_service_ins
 
 
 class TicketListView(LoonBaseView):
@@ -37,6 +42,8 @@ class TicketListView(LoonBaseView):
         reverse = int(request_data.get('reverse', 1))
         per_page = int(request_data.get('per_page', 10))
         page = int(request_data.get('page', 1))
+        cursor = request_data.get('cursor')  # 提供cursor(第一页为空字符串)时使用游标分页
+        with_total = int(request_data.get('with_total', 0))  # 游标分页时是否返回近似总数
         act_state_id = request_data.get('act_state_id', '')
         from_admin = request_data.get('from_admin', '')
         creator = request_data.get('creator', '')
@@ -59,12 +66,14 @@ class TicketListView(LoonBaseView):
         flag, result = ticket_base_service_ins.get_ticket_list(
             sn=sn, title=title, username=username, create_start=create_start, create_end=create_end,
             workflow_ids=workflow_ids, state_ids=state_ids, ticket_ids=ticket_ids, category=category, reverse=reverse,
-            per_page=per_page, page=page, app_name=app_name, act_state_id=act_state_id, from_admin=from_admin,
-            creator=creator)
+            per_page=per_page, page=page, app_name=app_name, cursor=cursor, with_total=with_total,
+            act_state_id=act_state_id, from_admin=from_admin, creator=creator)
         if flag is not False:
             paginator_info = result.get('paginator_info')
             data = dict(value=result.get('ticket_result_restful_list'), per_page=paginator_info.get('per_page'),
                         page=paginator_info.get('page'), total=paginator_info.get('total'))
+            if 'next_cursor' in paginator_info:
+                data.update(next_cursor=paginator_info.get('next_cursor'), has_next=paginator_info.get('has_next'))
             code, msg, = 0, ''
         else:
             code, data, msg = -1, {}, result
@@ -228,6 +237,8 @@ class TicketFlowlog(LoonBaseView):
         per_page = int(request_data.get('per_page', 10))
         page = int(request_data.get('page', 1))
         ticket_data = int(request_data.get('ticket_data', 0))
+        cursor = request_data.get('cursor')  # 提供cursor(第一页为空字符串)时使用游标分页
+        with_total = int(request_data.get('with_total', 0))  # 游标分页时是否返回近似总数
         app_name = request.META.get('HTTP_APPNAME')
         app_permission_check, msg = account_base_service_ins.app_ticket_permission_check(
             app_name, ticket_id)
@@ -238,12 +249,14 @@ class TicketFlowlog(LoonBaseView):
             return api_response(-1, '参数不全，请提供username', '')
 
         flag, result = ticket_base_service_ins.get_ticket_flow_log(
-            ticket_id, username, per_page, page, ticket_data)
+            ticket_id, username, per_page, page, ticket_data, cursor, with_total)
 
         if flag is not False:
             paginator_info = result.get('paginator_info')
             data = dict(value=result.get('ticket_flow_log_restful_list'), per_page=paginator_info.get('per_page'),
                         page=paginator_info.get('page'), total=paginator_info.get('total'))
+            if 'next_cursor' in paginator_info:
+                data.update(next_cursor=paginator_info.get('next_cursor'), has_next=paginator_info.get('has_next'))
             code, msg, = 0, ''
         else:
             code, data = -1, ''
@@ -352,6 +365,70 @@ class TicketsStates(LoonBaseView):
         return api_response(code, msg, data)
 
 
+class TicketsBatch(LoonBaseView):
+    post_schema = Schema({
+        'workflow_id': And(int, lambda n: n != 0, error='workflow_id is needed and type should be int'),
+        'ticket_list': And([dict], lambda n: len(n) > 0,
+                           error='ticket_list is needed and type should be list of dict'),
+        Optional(str): object
+    })
+    patch_schema = Schema({
+        'ticket_list': And([{'ticket_id': int, 'transition_id': int, Optional(str): object}], lambda n: len(n) > 0,
+                           error='ticket_list is needed and each item should contain ticket_id and transition_id '
+                                 'of type int'),
+        Optional(str): object
+    })
+
+    def post(self, request, *args, **kwargs):
+        """
+        批量新建同一工作流的工单, ticket_list中每项的参数同新建工单
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        json_str = request.body.decode('utf-8')
+        request_data_dict = json.loads(json_str)
+        workflow_id = request_data_dict.get('workflow_id')
+        app_name = request.META.get('HTTP_APPNAME')
+        username = request.META.get('HTTP_USERNAME')
+
+        # 判断是否有创建某工单的权限
+        app_permission, msg = account_base_service_ins.app_workflow_permission_check(app_name, workflow_id)
+        if not app_permission:
+            return api_response(-1, 'APP:{} have no permission to create this workflow ticket'.format(app_name), '')
+
+        flag, result = ticket_base_service_ins.new_ticket_batch(
+            workflow_id, request_data_dict.get('ticket_list'), username, app_name)
+        if flag:
+            code, msg, data = 0, '', {'ticket_id_list': result.get('new_ticket_id_list')}
+        else:
+            code, msg, data = -1, result, {}
+        return api_response(code, msg, data)
+
+    def patch(self, request, *args, **kwargs):
+        """
+        批量处理工单, ticket_list中每项包含ticket_id, transition_id, suggestion及需要更新的字段fields, 返回每个工单的处理结果
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        json_str = request.body.decode('utf-8')
+        request_data_dict = json.loads(json_str)
+        handle_data_list = request_data_dict.get('ticket_list')
+        app_name = request.META.get('HTTP_APPNAME')
+        username = request.META.get('HTTP_USERNAME')
+
+        # 调用方对工单的权限在批量处理中逐个校验, 无权限的工单单独返回失败
+        flag, result = ticket_base_service_ins.handle_ticket_batch(handle_data_list, username, app_name)
+        if flag:
+            code, msg, data = 0, '', dict(value=result)
+        else:
+            code, msg, data = -1, result, {}
+        return api_response(code, msg, data)
+
+
 class TicketAccept(LoonBaseView):
     def post(self, request, *args, **kwargs):
         """
@@ -673,8 +750,9 @@ class TicketsNumStatistics(LoonBaseView):
         :param kwargs:
         :return:
         """
-        start_date = kwargs.get('start_date', '')
-        end_date = kwargs.get('end_date', '')
+        request_data = request.GET
+        start_date = request_data.get('start_date', '')
+        end_date = request_data.get('end_date', '')
         username = request.META.get('HTTP_USERNAME')
 
         flag, result = ticket_base_service_ins.get_ticket_num_statistics(
@@ -685,6 +763,102 @@ class TicketsNumStatistics(LoonBaseView):
             return api_response(-1, result, {})
 
 
+class TicketsTypeStatistics(LoonBaseView):
+    def get(self, request, *args, **kwargs):
+        """
+        每种类型(工作流)工单的创建数量统计
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        request_data = request.GET
+        start_date = request_data.get('start_date', '')
+        end_date = request_data.get('end_date', '')
+        username = request.META.get('HTTP_USERNAME')
+
+        flag, result = overview_service_ins.get_new_ticket_type_count_statistics_info(start_date, end_date, username)
+        if flag:
+            return api_response(0, '', result.get('result_list'))
+        else:
+            return api_response(-1, result, {})
+
+
+class TicketsSla(LoonBaseView):
+    def get(self, request, *args, **kwargs):
+        """
+        超时或即将超时的工单
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        request_data = request.GET
+        category = request_data.get('category', 'overdue')
+        per_page = int(request_data.get('per_page', 10))
+        page = int(request_data.get('page', 1))
+        username = request.META.get('HTTP_USERNAME')
+
+        flag, result = workflow_base_service_ins.get_workflow_manage_list(username)
+        if flag is False:
+            return api_response(-1, result, {})
+        workflow_id_list = [workflow.get('id') for workflow in result.get('workflow_list')]
+        flag, result = ticket_sla_service_ins.get_ticket_sla_list(workflow_id_list, category, per_page, page)
+        if flag is not False:
+            data = dict(value=result.get('sla_result_list'), per_page=result.get('paginator_info').get('per_page'),
+                        page=result.get('paginator_info').get('page'),
+                        total=result.get('paginator_info').get('total'))
+            code, msg, = 0, ''
+        else:
+            code, data, msg = -1, {}, result
+        return api_response(code, msg, data)
+
+
+class TicketsSlaStatistics(LoonBaseView):
+    def get(self, request, *args, **kwargs):
+        """
+        状态时效统计
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        request_data = request.GET
+        state_id = int(request_data.get('state_id', 0))
+        username = request.META.get('HTTP_USERNAME')
+
+        flag, result = workflow_base_service_ins.get_workflow_manage_list(username)
+        if flag is False:
+            return api_response(-1, result, {})
+        workflow_id_list = [workflow.get('id') for workflow in result.get('workflow_list')]
+        flag, result = ticket_sla_service_ins.get_state_sla_statistics(workflow_id_list, state_id)
+        if flag:
+            return api_response(0, '', result)
+        else:
+            return api_response(-1, result, {})
+
+
+class TicketsHookStatistics(LoonBaseView):
+    def get(self, request, *args, **kwargs):
+        """
+        hook发送统计
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        now = datetime.datetime.now()
+        request_data = request.GET
+        start_time = request_data.get('start_time') or str(now - datetime.timedelta(hours=1))[:19]
+        end_time = request_data.get('end_time') or str(now)[:19]
+
+        flag, result = ticket_hook_outbox_service_ins.get_hook_delivery_statistics(start_time, end_time)
+        if flag:
+            return api_response(0, '', result)
+        else:
+            return api_response(-1, result, {})
+
+
 class TicketRetreat(LoonBaseView):
     def post(self, request, *args, **kwargs):
         """
@@ -117,6 +117,7 @@ class Transition(BaseModel):
     class Meta:
         verbose_name = '工作流流转'
         verbose_name_plural = '工作流流转'
+        index_together = [('source_state_id', 'is_deleted')]
 
 
 class CustomField(BaseModel):
@@ -36,15 +36,19 @@ class WorkflowView(LoonBaseView):
         per_page = int(request_data.get('per_page', 10))
         page = int(request_data.get('page', 1))
         from_admin = int(request_data.get('from_admin', 0))  # 获取有管理权限的工作流列表
+        cursor = request_data.get('cursor')  # 提供cursor(第一页为空字符串)时使用游标分页
+        with_total = int(request_data.get('with_total', 0))  # 游标分页时是否返回近似总数
         username = request.META.get('HTTP_USERNAME')
         app_name = request.META.get('HTTP_APPNAME')
 
         flag, result = workflow_base_service_ins.get_workflow_list(search_value, page, per_page,
-                                                                   app_name, username, from_admin)
+                                                                   app_name, username, from_admin, cursor, with_total)
         if flag is not False:
             paginator_info = result.get('paginator_info')
             data = dict(value=result.get('workflow_result_restful_list'), per_page=paginator_info.get('per_page'),
                         page=paginator_info.get('page'), total=paginator_info.get('total'))
+            if 'next_cursor' in paginator_info:
+                data.update(next_cursor=paginator_info.get('next_cursor'), has_next=paginator_info.get('has_next'))
             code, msg, = 0, ''
         else:
             code, data, msg = -1, '', result
@@ -426,13 +430,17 @@ class WorkflowStateView(LoonBaseView):
         page = int(request_data.get('page', 1)
                    ) if request_data.get('page', 1) else 1
         module = request_data.get('module', '')
+        cursor = request_data.get('cursor')  # 提供cursor(第一页为空字符串)时使用游标分页
+        with_total = int(request_data.get('with_total', 0))  # 游标分页时是否返回近似总数
         flag, result = workflow_state_service_ins.get_app_states_serialize(app_name, per_page, page,
-                                                                           search_value, module)
+                                                                           search_value, module, cursor, with_total)
 
         if flag is not False:
             paginator_info = result.get('paginator_info')
             data = dict(items=result.get('workflow_states_restful_list'), per_page=paginator_info.get('per_page'),
                         page=paginator_info.get('page'), total=paginator_info.get('total'))
+            if 'next_cursor' in paginator_info:
+                data.update(next_cursor=paginator_info.get('next_cursor'), has_next=paginator_info.get('has_next'))
             code, msg, = 0, ''
         else:
             code, data, msg = -1, {}, result
@@ -609,16 +617,20 @@ class WorkflowRunScriptView(LoonBaseView):
                        ) if request_data.get('per_page', 10) else 10
         page = int(request_data.get('page', 1)
                    ) if request_data.get('page', 1) else 1
+        cursor = request_data.get('cursor')  # 提供cursor(第一页为空字符串)时使用游标分页
+        with_total = int(request_data.get('with_total', 0))  # 游标分页时是否返回近似总数
         if not username:
             return api_response(-1, '请提供username', '')
         flag, result = workflow_run_script_service_ins.get_run_script_list(
-            search_value, page, per_page)
+            search_value, page, per_page, cursor, with_total)
 
         if flag is not False:
             paginator_info = result.get('paginator_info')
             data = dict(value=result.get('run_script_result_restful_list'), per_page=paginator_info.get('per_page'),
                         page=paginator_info.get('page'),
                         total=paginator_info.get('total'))
+            if 'next_cursor' in paginator_info:
+                data.update(next_cursor=paginator_info.get('next_cursor'), has_next=paginator_info.get('has_next'))
             code, msg, = 0, ''
         else:
             code, data = -1, ''
@@ -739,14 +751,18 @@ class WorkflowCustomNoticeView(LoonBaseView):
                        ) if request_data.get('per_page', 10) else 10
         page = int(request_data.get('page', 1)
                    ) if request_data.get('page', 1) else 1
+        cursor = request_data.get('cursor')  # 提供cursor(第一页为空字符串)时使用游标分页
+        with_total = int(request_data.get('with_total', 0))  # 游标分页时是否返回近似总数
         if not username:
             return api_response(-1, '请提供username', '')
         result, msg = workflow_custom_notice_service_ins.get_notice_list(
-            search_value, page, per_page)
+            search_value, page, per_page, cursor, with_total)
 
         if result is not False:
             data = dict(
                 value=result, per_page=msg['per_page'], page=msg['page'], total=msg['total'])
+            if 'next_cursor' in msg:
+                data.update(next_cursor=msg.get('next_cursor'), has_next=msg.get('has_next'))
             code, msg, = 0, ''
         else:
             code, data = -1, ''
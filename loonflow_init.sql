@@ -320,7 +320,7 @@ CREATE TABLE `ticket_ticketcustomfield` (
   `username_value` varchar(50) NOT NULL DEFAULT '' COMMENT '用户名值',
   `multi_username_value` varchar(1000) NOT NULL DEFAULT '' COMMENT '多选用户名值',
   PRIMARY KEY (`id`),
-  KEY `idx_ticket_id_field_key` (`ticket_id`,`field_key`)
+  KEY `idx_ticket_id_field_key_is_deleted` (`ticket_id`,`field_key`,`is_deleted`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -345,7 +345,8 @@ CREATE TABLE `ticket_ticketflowlog` (
   `intervene_type_id` int(11) NOT NULL  DEFAULT '0' COMMENT '干预类型',
   `ticket_data` varchar(10000) NOT NULL  DEFAULT '' COMMENT '工单数据',
   PRIMARY KEY (`id`),
-  KEY `idx_ticket_id` (`ticket_id`)
+  KEY `idx_ticket_id_is_deleted_id` (`ticket_id`,`is_deleted`,`id`),
+  KEY `idx_ticket_id_state_id` (`ticket_id`,`state_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -375,13 +376,14 @@ CREATE TABLE `ticket_ticketrecord` (
   `script_run_last_result` tinyint(1) NOT NULL DEFAULT '1' COMMENT '脚本/hook执行状态',
   `multi_all_person` varchar(1000) NOT NULL DEFAULT '{}' COMMENT '多人全部处理进展',
   `act_state_id` int(11) NOT NULL DEFAULT '1' COMMENT '进行状态',
+  `state_version` int(11) NOT NULL DEFAULT '0' COMMENT '状态版本',
   PRIMARY KEY (`id`),
   KEY `idx_act_state_id` (`act_state_id`),
   KEY `idx_sn` (`sn`),
-  KEY `idx_workflow_id` (`workflow_id`),
+  KEY `idx_workflow_id_is_deleted_gmt_created` (`workflow_id`,`is_deleted`,`gmt_created`),
   KEY `idx_creator` (`creator`),
   KEY `idx_gmt_created` (`gmt_created`),
-  KEY `idx_parent_ticket_id` (`parent_ticket_id`)
+  KEY `idx_parent_ticket_id_state_id` (`parent_ticket_id`,`parent_ticket_state_id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -408,6 +410,152 @@ CREATE TABLE `ticket_ticketuser` (
 
 
 
+# Dump of table ticket_ticketsnsequence
+# ------------------------------------------------------------
+
+DROP TABLE IF EXISTS `ticket_ticketsnsequence`;
+
+CREATE TABLE `ticket_ticketsnsequence` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键id',
+  `creator` varchar(50) NOT NULL DEFAULT 'admin' COMMENT '创建人',
+  `gmt_created` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `gmt_modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  `is_deleted` tinyint(1) NOT NULL DEFAULT '0' COMMENT '已删除',
+  `name` varchar(50) NOT NULL DEFAULT '' COMMENT '序列名称',
+  `value` int(11) NOT NULL DEFAULT '0' COMMENT '已分配的最大序号',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uniq_name` (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+
+# Dump of table ticket_tickettimer
+# ------------------------------------------------------------
+
+DROP TABLE IF EXISTS `ticket_tickettimer`;
+
+CREATE TABLE `ticket_tickettimer` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键id',
+  `creator` varchar(50) NOT NULL DEFAULT 'admin' COMMENT '创建人',
+  `gmt_created` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `gmt_modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  `is_deleted` tinyint(1) NOT NULL DEFAULT '0' COMMENT '已删除',
+  `ticket_id` int(11) NOT NULL DEFAULT '0' COMMENT '工单id',
+  `state_id` int(11) NOT NULL DEFAULT '0' COMMENT '状态id',
+  `state_version` int(11) NOT NULL DEFAULT '0' COMMENT '状态版本',
+  `transition_id` int(11) NOT NULL DEFAULT '0' COMMENT '流转id',
+  `due_time` datetime NOT NULL COMMENT '到期时间',
+  `status` int(11) NOT NULL DEFAULT '0' COMMENT '状态:0.待执行,1.执行中,2.已执行,3.已失效',
+  `result` varchar(1000) NOT NULL DEFAULT '' COMMENT '执行结果',
+  PRIMARY KEY (`id`),
+  KEY `idx_status_due_time` (`status`,`due_time`),
+  KEY `idx_ticket_id` (`ticket_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+
+# Dump of table ticket_tickethookoutbox
+# ------------------------------------------------------------
+
+DROP TABLE IF EXISTS `ticket_tickethookoutbox`;
+
+CREATE TABLE `ticket_tickethookoutbox` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键id',
+  `creator` varchar(50) NOT NULL DEFAULT 'admin' COMMENT '创建人',
+  `gmt_created` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `gmt_modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  `is_deleted` tinyint(1) NOT NULL DEFAULT '0' COMMENT '已删除',
+  `ticket_id` int(11) NOT NULL DEFAULT '0' COMMENT '工单id',
+  `state_id` int(11) NOT NULL DEFAULT '0' COMMENT '状态id',
+  `status` int(11) NOT NULL DEFAULT '0' COMMENT '状态:0.待发送,1.发送中,2.已发送,3.失败(死信),4.已失效',
+  `next_retry_time` datetime NOT NULL COMMENT '下次发送时间',
+  `attempt_count` int(11) NOT NULL DEFAULT '0' COMMENT '已发送次数',
+  `latency` int(11) NOT NULL DEFAULT '0' COMMENT '最后一次请求耗时(毫秒)',
+  `last_error` varchar(1000) NOT NULL DEFAULT '' COMMENT '最后一次错误信息',
+  PRIMARY KEY (`id`),
+  KEY `idx_status_next_retry_time` (`status`,`next_retry_time`),
+  KEY `idx_gmt_modified` (`gmt_modified`),
+  KEY `idx_ticket_id` (`ticket_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+
+# Dump of table ticket_ticketinbox
+# ------------------------------------------------------------
+
+DROP TABLE IF EXISTS `ticket_ticketinbox`;
+
+CREATE TABLE `ticket_ticketinbox` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键id',
+  `creator` varchar(50) NOT NULL DEFAULT 'admin' COMMENT '工单创建人',
+  `gmt_created` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `gmt_modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  `is_deleted` tinyint(1) NOT NULL DEFAULT '0' COMMENT '已删除',
+  `username` varchar(100) NOT NULL DEFAULT '' COMMENT '用户名',
+  `category` varchar(10) NOT NULL DEFAULT '' COMMENT '类别:duty待办,relation关联的,worked处理过的',
+  `ticket_gmt_created` datetime NOT NULL COMMENT '工单创建时间',
+  `ticket_id` int(11) NOT NULL DEFAULT '0' COMMENT '工单id',
+  `workflow_id` int(11) NOT NULL DEFAULT '0' COMMENT '工作流id',
+  `act_state_id` int(11) NOT NULL DEFAULT '0' COMMENT '进行状态',
+  `state_id` int(11) NOT NULL DEFAULT '0' COMMENT '状态id',
+  `sn` varchar(25) NOT NULL DEFAULT '' COMMENT '流水号',
+  `title` varchar(500) NOT NULL DEFAULT '' COMMENT '标题',
+  PRIMARY KEY (`id`),
+  KEY `idx_username_category_ticket_gmt_created` (`username`,`category`,`ticket_gmt_created`,`ticket_id`,`workflow_id`,`act_state_id`),
+  KEY `idx_ticket_id` (`ticket_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+
+# Dump of table ticket_ticketdailystatistics
+# ------------------------------------------------------------
+
+DROP TABLE IF EXISTS `ticket_ticketdailystatistics`;
+
+CREATE TABLE `ticket_ticketdailystatistics` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键id',
+  `creator` varchar(50) NOT NULL DEFAULT 'admin' COMMENT '创建人',
+  `gmt_created` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `gmt_modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  `is_deleted` tinyint(1) NOT NULL DEFAULT '0' COMMENT '已删除',
+  `day` date NOT NULL COMMENT '工单创建日期',
+  `workflow_id` int(11) NOT NULL DEFAULT '0' COMMENT '工作流id',
+  `act_state_id` int(11) NOT NULL DEFAULT '0' COMMENT '进行状态',
+  `creator_dept_id` int(11) NOT NULL DEFAULT '0' COMMENT '创建人部门id',
+  `ticket_count` int(11) NOT NULL DEFAULT '0' COMMENT '工单个数',
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `uniq_day_workflow_id_act_state_id_creator_dept_id` (`day`,`workflow_id`,`act_state_id`,`creator_dept_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+
+# Dump of table ticket_ticketstatesla
+# ------------------------------------------------------------
+
+DROP TABLE IF EXISTS `ticket_ticketstatesla`;
+
+CREATE TABLE `ticket_ticketstatesla` (
+  `id` int(11) NOT NULL AUTO_INCREMENT COMMENT '主键id',
+  `creator` varchar(50) NOT NULL DEFAULT 'admin' COMMENT '创建人',
+  `gmt_created` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+  `gmt_modified` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+  `is_deleted` tinyint(1) NOT NULL DEFAULT '0' COMMENT '已删除',
+  `ticket_id` int(11) NOT NULL DEFAULT '0' COMMENT '工单id',
+  `workflow_id` int(11) NOT NULL DEFAULT '0' COMMENT '工作流id',
+  `state_id` int(11) NOT NULL DEFAULT '0' COMMENT '状态id',
+  `status` int(11) NOT NULL DEFAULT '0' COMMENT '状态:0处于该状态,1已离开',
+  `enter_time` datetime NOT NULL COMMENT '进入时间',
+  `due_time` datetime DEFAULT NULL COMMENT '到期时间',
+  `leave_time` datetime DEFAULT NULL COMMENT '离开时间',
+  `duration` int(11) NOT NULL DEFAULT '0' COMMENT '停留时间(秒)',
+  PRIMARY KEY (`id`),
+  KEY `idx_status_due_time` (`status`,`due_time`),
+  KEY `idx_ticket_id_status` (`ticket_id`,`status`),
+  KEY `idx_state_id_status_duration` (`state_id`,`status`,`duration`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+
+
 # Dump of table workflow_customfield
 # ------------------------------------------------------------
 
@@ -505,7 +653,8 @@ CREATE TABLE `workflow_transition` (
   `timer` int(11) NOT NULL DEFAULT '0' COMMENT '定时器时长(单位:秒)',
   `attribute_type_id` int(11) NOT NULL DEFAULT '0' COMMENT '属性类型id',
   `condition_expression` varchar(1000) NOT NULL DEFAULT '[]' COMMENT '条件表达式',
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `idx_source_state_id_is_deleted` (`source_state_id`,`is_deleted`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
 
@@ -0,0 +1,161 @@
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from service.base_service import BaseService
+from service.redis_pool import POOL
+
+logger = logging.getLogger('django')
+
+
+class AppCredential(object):
+    """
+    调用方应用凭证: AppToken记录及其有权限的工作流id
+    app credential, the AppToken record and ids of the workflows the app is authorized to
+    """
+    def __init__(self, version, app_token_obj, workflow_id_set: frozenset):
+        self.version = version
+        self.loaded_at = time.time()
+        self.app_token_obj = app_token_obj
+        self.workflow_id_set = workflow_id_set
+
+
+class AccountAppTokenCacheService(BaseService):
+    """
+    调用方应用凭证的进程内缓存: 接口权限校验、签名校验不再每次查询AppToken及Workflow。缓存最长使用APP_TOKEN_CACHE_TIMEOUT秒,
+    AppToken或工作流变更后调用bump_version, 所有进程在APP_TOKEN_VERSION_CHECK_INTERVAL秒内重新加载。
+    另外提供签名的防重放校验(同一签名在有效期内只能使用一次), redis不可用时在进程内校验
+    in-process cache of app credentials, versioned through redis. call bump_version after app tokens or workflows
+    changed. also a nonce store rejecting a signature that has been used within its validity window
+    """
+    VERSION_KEY = 'app_token_version'
+    NONCE_KEY_PREFIX = 'api_signature_nonce_'
+    _credential_dict = {}
+    _deleted_workflow_cache = None
+    _version = None
+    _checked_at = 0
+    _nonce_dict = {}
+    _lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_redis_conn(cls):
+        return redis.Redis(connection_pool=POOL)
+
+    @classmethod
+    def get_version(cls):
+        """
+        当前版本号, 每APP_TOKEN_VERSION_CHECK_INTERVAL秒从redis获取一次
+        :return:
+        """
+        now = time.time()
+        if now - cls._checked_at < settings.APP_TOKEN_VERSION_CHECK_INTERVAL:
+            return cls._version
+        try:
+            version = cls.get_redis_conn().get(cls.VERSION_KEY)
+            version = int(version) if version else 0
+        except redis.RedisError:
+            logger.warning('redis is unavailable, app token cache version is not checked')
+            version = cls._version
+        if version != cls._version:
+            cls._credential_dict = {}
+            cls._deleted_workflow_cache = None
+            cls._version = version
+        cls._checked_at = now
+        return version
+
+    @classmethod
+    def load_credential(cls, version, app_name: str):
+        """
+        从数据库加载应用凭证, 应用不存在时为None(同样缓存, 避免未授权的请求每次查询数据库)
+        :param version:
+        :param app_name:
+        :return:
+        """
+        from apps.account.models import AppToken
+        from apps.workflow.models import Workflow
+        app_token_obj = AppToken.objects.filter(app_name=app_name, is_deleted=0).first()
+        if not app_token_obj:
+            return AppCredential(version, None, frozenset())
+        workflow_id_set = frozenset(Workflow.objects.filter(app_name=app_name, is_deleted=0).values_list(
+            'id', flat=True))
+        return AppCredential(version, app_token_obj, workflow_id_set)
+
+    @classmethod
+    def get_credential(cls, app_name: str) -> AppCredential:
+        """
+        获取应用凭证, 版本变化或超过APP_TOKEN_CACHE_TIMEOUT秒时重新加载
+        :param app_name:
+        :return:
+        """
+        version = cls.get_version()
+        credential = cls._credential_dict.get(app_name)
+        if credential is not None and credential.version == version and \
+                time.time() - credential.loaded_at < settings.APP_TOKEN_CACHE_TIMEOUT:
+            return credential
+        with cls._lock:
+            credential = cls.load_credential(version, app_name)
+            credential_dict = dict(cls._credential_dict)
+            credential_dict[app_name] = credential
+            cls._credential_dict = credential_dict
+        return credential
+
+    @classmethod
+    def get_deleted_workflow_id_set(cls) -> frozenset:
+        """
+        已删除的工作流id, loonflow有权限访问所有未删除的工作流, 工单列表中排除这些工作流的工单即可
+        :return:
+        """
+        from apps.workflow.models import Workflow
+        version = cls.get_version()
+        cache_info = cls._deleted_workflow_cache
+        if cache_info is not None and cache_info[0] == version and \
+                time.time() - cache_info[1] < settings.APP_TOKEN_CACHE_TIMEOUT:
+            return cache_info[2]
+        deleted_workflow_id_set = frozenset(Workflow.objects.filter(is_deleted=1).values_list('id', flat=True))
+        # (版本号, 加载时间, 已删除的工作流id)
+        cls._deleted_workflow_cache = (version, time.time(), deleted_workflow_id_set)
+        return deleted_workflow_id_set
+
+    @classmethod
+    def bump_version(cls):
+        """
+        AppToken或工作流变更后调用, 使所有进程的缓存失效
+        invalidate the app credentials of all workers, call it after app tokens or workflows changed
+        :return:
+        """
+        cls._credential_dict = {}
+        cls._deleted_workflow_cache = None
+        try:
+            cls.get_redis_conn().incr(cls.VERSION_KEY)
+        except redis.RedisError:
+            logger.error('redis is unavailable, app token cache version is not bumped')
+
+    @classmethod
+    def check_nonce(cls, signature: str, timeout: int) -> bool:
+        """
+        防重放: 签名在timeout秒内第一次使用时返回True
+        :param signature:
+        :param timeout:
+        :return:
+        """
+        try:
+            return bool(cls.get_redis_conn().set(cls.NONCE_KEY_PREFIX + signature, 1, nx=True, ex=timeout))
+        except redis.RedisError:
+            logger.warning('redis is unavailable, signature nonce is checked in process')
+        now = time.time()
+        with cls._lock:
+            if len(cls._nonce_dict) >= settings.API_SIGNATURE_NONCE_LOCAL_SIZE:
+                cls._nonce_dict = {key: expire_at for key, expire_at in cls._nonce_dict.items() if expire_at > now}
+            if cls._nonce_dict.get(signature, 0) > now:
+                return False
+            cls._nonce_dict[signature] = now + timeout
+        return True
+
+
+account_app_token_cache_service_ins = AccountAppTokenCacheService()
@@ -4,6 +4,8 @@ from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.contrib.auth.hashers import make_password
 from django.db.models import Q
 from apps.account.models import AppToken
+from service.account.account_app_token_cache_service import account_app_token_cache_service_ins
+from service.account.account_org_index_service import account_org_index_service_ins
 from service.base_service import BaseService
 from service.common.log_service import auto_log
 
@@ -17,12 +19,118 @@ class AccountBaseService(BaseService):
     @auto_log
     def get_token_by_app_name(cls, app_name: str) -> tuple:
         """
-        get app's call token by app_name
+        get app's call token by app_name(from the app credential cache)
         :param app_name:
         :return:
         """
-        app_token_obj = AppToken.objects.filter(app_name=app_name, is_deleted=0).first()
-        return True, app_token_obj
+        return True, account_app_token_cache_service_ins.get_credential(app_name).app_token_obj
+
+    @classmethod
+    @auto_log
+    def get_user_dict_by_username_list(cls, username_list: list) -> tuple:
+        """
+        批量获取用户, 一次查询
+        get user objects by username list with one query
+        :param username_list:
+        :return: {username: user_obj}
+        """
+        from apps.account.models import LoonUser
+        username_list = [username for username in set(username_list) if username]
+        if not username_list:
+            return True, {}
+        user_queryset = LoonUser.objects.filter(username__in=username_list, is_deleted=0).all()
+        return True, {user_obj.username: user_obj for user_obj in user_queryset}
+
+    @classmethod
+    @auto_log
+    def get_dept_dict_by_id_list(cls, dept_id_list: list) -> tuple:
+        """
+        批量获取部门, 一次查询
+        get dept objects by dept id list with one query
+        :param dept_id_list:
+        :return: {dept_id: dept_obj}
+        """
+        from apps.account.models import LoonDept
+        dept_id_list = [dept_id for dept_id in set(dept_id_list) if dept_id]
+        if not dept_id_list:
+            return True, {}
+        dept_queryset = LoonDept.objects.filter(id__in=dept_id_list, is_deleted=0).all()
+        return True, {dept_obj.id: dept_obj for dept_obj in dept_queryset}
+
+    @classmethod
+    @auto_log
+    def get_role_dict_by_id_list(cls, role_id_list: list) -> tuple:
+        """
+        批量获取角色, 一次查询
+        get role objects by role id list with one query
+        :param role_id_list:
+        :return: {role_id: role_obj}
+        """
+        from apps.account.models import LoonRole
+        role_id_list = [role_id for role_id in set(role_id_list) if role_id]
+        if not role_id_list:
+            return True, {}
+        role_queryset = LoonRole.objects.filter(id__in=role_id_list, is_deleted=0).all()
+        return True, {role_obj.id: role_obj for role_obj in role_queryset}
+
+    @classmethod
+    @auto_log
+    def get_dept_username_list(cls, dept_id) -> tuple:
+        """
+        部门成员(组织架构内存索引)
+        get usernames of depts from the in-memory org index
+        :param dept_id: 部门id, 支持逗号隔开的多个部门
+        :return:
+        """
+        dept_id_list = [int(dept_id_str) for dept_id_str in str(dept_id).split(',') if dept_id_str]
+        return True, account_org_index_service_ins.get_dept_username_list(dept_id_list)
+
+    @classmethod
+    @auto_log
+    def get_role_username_list(cls, role_id: int) -> tuple:
+        """
+        角色成员(组织架构内存索引)
+        get usernames of the role from the in-memory org index
+        :param role_id:
+        :return:
+        """
+        return True, account_org_index_service_ins.get_role_username_list(int(role_id))
+
+    @classmethod
+    @auto_log
+    def get_user_role_id_list(cls, username: str) -> tuple:
+        """
+        用户的角色id(组织架构内存索引)
+        get role ids of the user from the in-memory org index
+        :param username:
+        :return:
+        """
+        return True, account_org_index_service_ins.get_user_role_id_list(username)
+
+    @classmethod
+    @auto_log
+    def get_user_up_dept_id_list(cls, username: str) -> tuple:
+        """
+        用户所在部门及所有上级部门的id(组织架构内存索引)
+        get ids of the user's dept and all its ancestors from the in-memory org index
+        :param username:
+        :return:
+        """
+        return True, account_org_index_service_ins.get_user_up_dept_id_list(username)
+
+    @classmethod
+    @auto_log
+    def get_user_dept_approver(cls, username: str) -> tuple:
+        """
+        用户所在部门的审批人, 未设置审批人时为部门负责人(组织架构内存索引)
+        get approver(leader if not set) of the user's dept from the in-memory org index
+        :param username:
+        :return:
+        """
+        flag, approver = account_org_index_service_ins.get_user_dept_approver(username)
+        if flag is False:
+            return False, 'user is not existed or has been deleted'
+        return True, approver
 
     @classmethod
     @auto_log
@@ -37,21 +145,48 @@ class AccountBaseService(BaseService):
             return False, 'app_name is not provided'
         if app_name == 'loonflow':
             # loonflow有权限访问所有workflow
-            workflow_query_set = Workflow.objects.filter(is_deleted=0).all()
-            workflow_id_list = []
-            for workflow_obj in workflow_query_set:
-                workflow_id_list.append(workflow_obj.id)
-            return True, dict(workflow_id_list=workflow_id_list)
+            return True, dict(workflow_id_list=list(Workflow.objects.filter(is_deleted=0).values_list('id', flat=True)))
 
-        app_token_obj = AppToken.objects.filter(app_name=app_name, is_deleted=0).first()
-        if not app_token_obj:
+        credential = account_app_token_cache_service_ins.get_credential(app_name)
+        if not credential.app_token_obj:
+            return False, 'appname is unauthorized'
+        return True, dict(workflow_id_list=sorted(credential.workflow_id_set))
+
+    @classmethod
+    @auto_log
+    def get_app_workflow_query_params(cls, app_name: str, workflow_id_list: list = None) -> tuple:
+        """
+        调用方有权限的工作流对应的工单查询条件: loonflow有权限访问所有工作流, 只排除已删除工作流的工单(通常没有, 即不加条件);
+        其他应用关联查询工作流表(workflow_id IN (SELECT id FROM workflow_workflow WHERE app_name=...)), 不再传入工作流id列表
+        query params of the tickets the app is authorized to, no workflow predicate for loonflow and a subquery on the
+        workflow table for other apps
+        :param app_name:
+        :param workflow_id_list: 指定查询的工作流id, 为空时查询所有有权限的工作流
+        :return: (True, Q), 没有有权限的工作流时为(True, None)
+        """
+        from apps.workflow.models import Workflow
+        if not app_name:
+            return False, 'app_name is not provided'
+        if app_name == 'loonflow':
+            deleted_workflow_id_set = account_app_token_cache_service_ins.get_deleted_workflow_id_set()
+            if workflow_id_list:
+                workflow_id_list = [workflow_id for workflow_id in workflow_id_list
+                                    if workflow_id not in deleted_workflow_id_set]
+                return True, Q(workflow_id__in=workflow_id_list) if workflow_id_list else None
+            if deleted_workflow_id_set:
+                return True, ~Q(workflow_id__in=list(deleted_workflow_id_set))
+            return True, Q()
+
+        credential = account_app_token_cache_service_ins.get_credential(app_name)
+        if not credential.app_token_obj:
             return False, 'appname is unauthorized'
-        flows = Workflow.objects.filter(app_name=app_name).all()
-        workflow_id_list = [flow['id'] for flow in flows]
         if workflow_id_list:
-            return True, dict(workflow_id_list=workflow_id_list)
-        else:
-            return True, dict(workflow_id_list=[])
+            workflow_id_list = [workflow_id for workflow_id in workflow_id_list
+                                if workflow_id in credential.workflow_id_set]
+            return True, Q(workflow_id__in=workflow_id_list) if workflow_id_list else None
+        if not credential.workflow_id_set:
+            return True, None
+        return True, Q(workflow_id__in=Workflow.objects.filter(app_name=app_name, is_deleted=0).values('id'))
 
     @classmethod
     @auto_log
@@ -79,11 +214,14 @@ class AccountBaseService(BaseService):
         :param workflow_id:
         :return:
         """
-        from apps.workflow.models import Workflow
         if app_name == 'loonflow':
             return True, ''
 
-        if Workflow.objects.filter(app_name=app_name, id=workflow_id).exists():
+        try:
+            workflow_id = int(workflow_id)
+        except (TypeError, ValueError):
+            return False, 'the app has no permission to the workflow_id'
+        if workflow_id in account_app_token_cache_service_ins.get_credential(app_name).workflow_id_set:
             return True, ''
         else:
             return False, 'the app has no permission to the workflow_id'
@@ -151,6 +289,7 @@ class AccountBaseService(BaseService):
         app_token_obj = AppToken(app_name=app_name, ticket_sn_prefix=ticket_sn_prefix,
                                  token=token, creator=username)
         app_token_obj.save()
+        account_app_token_cache_service_ins.bump_version()
         return True, dict(app_token_id=app_token_obj.id)
 
     @classmethod
@@ -169,6 +308,7 @@ class AccountBaseService(BaseService):
         app_token_obj.app_name = app_name
         app_token_obj.ticket_sn_prefix = ticket_sn_prefix
         app_token_obj.save()
+        account_app_token_cache_service_ins.bump_version()
         return True, ''
 
     @classmethod
@@ -184,6 +324,7 @@ class AccountBaseService(BaseService):
             return False, 'record is not exist or has been deleted'
         app_token_obj.is_deleted = True
         app_token_obj.save()
+        account_app_token_cache_service_ins.bump_version()
         return True, ''
 
     @classmethod
@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+
+from service.base_service import BaseService
+from service.redis_pool import POOL
+
+logger = logging.getLogger('django')
+
+
+class OrgIndex(object):
+    """
+    组织架构索引: 用户所属部门、部门上级、部门及所有上级部门、部门成员、角色成员、用户角色
+    in-memory org index, built once and never modified
+    """
+    def __init__(self, version, user_dept_dict: dict, dept_dict: dict, user_role_dict: dict):
+        """
+        :param version: 构建时的版本号
+        :param user_dept_dict: {username: dept_id}
+        :param dept_dict: {dept_id: (parent_dept_id, leader, approver)}
+        :param user_role_dict: {username: [role_id]}
+        """
+        self.version = version
+        self.built_at = time.time()
+        self.user_dept_dict = user_dept_dict
+        self.dept_parent_dict = {dept_id: dept_info[0] for dept_id, dept_info in dept_dict.items()}
+        self.dept_approver_dict = {dept_id: dept_info[2] or dept_info[1] for dept_id, dept_info in dept_dict.items()}
+
+        # 部门及所有上级部门(由近到远), 上级部门不存在或出现环时截止
+        self.dept_ancestor_dict = {}
+        for dept_id in dept_dict:
+            ancestor_list = []
+            current_dept_id = dept_id
+            while current_dept_id in dept_dict and current_dept_id not in ancestor_list:
+                if current_dept_id in self.dept_ancestor_dict:
+                    ancestor_list.extend([ancestor_id for ancestor_id in self.dept_ancestor_dict[current_dept_id]
+                                          if ancestor_id not in ancestor_list])
+                    break
+                ancestor_list.append(current_dept_id)
+                current_dept_id = self.dept_parent_dict[current_dept_id]
+            self.dept_ancestor_dict[dept_id] = tuple(ancestor_list)
+
+        dept_username_dict = {}
+        for username, dept_id in user_dept_dict.items():
+            dept_username_dict.setdefault(dept_id, []).append(username)
+        self.dept_username_dict = {dept_id: tuple(username_list)
+                                   for dept_id, username_list in dept_username_dict.items()}
+        role_username_dict = {}
+        for username, role_id_list in user_role_dict.items():
+            for role_id in role_id_list:
+                role_username_dict.setdefault(role_id, []).append(username)
+        self.role_username_dict = {role_id: tuple(username_list)
+                                   for role_id, username_list in role_username_dict.items()}
+        self.user_role_dict = {username: tuple(role_id_list) for username, role_id_list in user_role_dict.items()}
+
+
+class AccountOrgIndexService(BaseService):
+    """
+    组织架构内存索引: 用户、部门、角色及成员关系一次加载到进程内, 部门成员、角色成员、上级部门、部门审批人直接从内存获取。
+    索引带有redis中的版本号, 用户、部门、角色及用户角色保存或删除后(事务提交时)自动调用bump_version, 所有进程在
+    ORG_INDEX_VERSION_CHECK_INTERVAL秒内重建索引; redis不可用时索引最多使用ORG_INDEX_MAX_AGE秒
+    in-process org index of users, depts, roles and memberships, versioned through redis. the version is bumped when
+    org models are saved or deleted, every worker rebuilds its index within ORG_INDEX_VERSION_CHECK_INTERVAL seconds
+    """
+    VERSION_KEY = 'org_index_version'
+    ORG_MODEL_NAME_LIST = ('LoonUser', 'LoonDept', 'LoonRole', 'LoonUserRole')
+    _index = None
+    _checked_at = 0
+    _lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_redis_conn(cls):
+        return redis.Redis(connection_pool=POOL)
+
+    @classmethod
+    def get_version(cls):
+        version = cls.get_redis_conn().get(cls.VERSION_KEY)
+        return int(version) if version else 0
+
+    @classmethod
+    def build_index(cls, version) -> OrgIndex:
+        """
+        从数据库加载组织架构, 每个表一次查询
+        :param version:
+        :return:
+        """
+        from apps.account.models import LoonDept, LoonUser, LoonUserRole
+        user_dept_dict, user_id_dict = {}, {}
+        for user_id, username, dept_id in LoonUser.objects.filter(is_deleted=0).order_by('id').values_list(
+                'id', 'username', 'dept_id'):
+            user_dept_dict[username] = dept_id
+            user_id_dict[user_id] = username
+        dept_dict = {dept_id: (parent_dept_id, leader, approver) for dept_id, parent_dept_id, leader, approver
+                     in LoonDept.objects.filter(is_deleted=0).values_list('id', 'parent_dept_id', 'leader', 'approver')}
+        user_role_dict = {}
+        for user_id, role_id in LoonUserRole.objects.filter(is_deleted=0).order_by('id').values_list(
+                'user_id', 'role_id'):
+            if user_id in user_id_dict:
+                user_role_dict.setdefault(user_id_dict[user_id], []).append(role_id)
+        return OrgIndex(version, user_dept_dict, dept_dict, user_role_dict)
+
+    @classmethod
+    def get_index(cls) -> OrgIndex:
+        """
+        获取索引, 每ORG_INDEX_VERSION_CHECK_INTERVAL秒检查一次版本号, 版本变化或超过ORG_INDEX_MAX_AGE秒时重建
+        :return:
+        """
+        index = cls._index
+        now = time.time()
+        if index is not None and now - cls._checked_at < settings.ORG_INDEX_VERSION_CHECK_INTERVAL:
+            return index
+        with cls._lock:
+            index = cls._index
+            if index is not None and now - cls._checked_at < settings.ORG_INDEX_VERSION_CHECK_INTERVAL:
+                return index
+            try:
+                version = cls.get_version()
+            except redis.RedisError:
+                logger.warning('redis is unavailable, org index version is not checked')
+                version = index.version if index is not None else None
+            if index is None or index.version != version or now - index.built_at > settings.ORG_INDEX_MAX_AGE:
+                index = cls.build_index(version)
+                cls._index = index
+            cls._checked_at = now
+        return index
+
+    @classmethod
+    def bump_version(cls):
+        """
+        组织架构变更后调用, 使所有进程的索引失效
+        invalidate the org index of all workers, call it after users, depts or roles changed
+        :return:
+        """
+        cls._index = None
+        try:
+            cls.get_redis_conn().incr(cls.VERSION_KEY)
+        except redis.RedisError:
+            logger.error('redis is unavailable, org index version is not bumped')
+
+    @classmethod
+    def on_org_model_changed(cls, sender, update_fields=None, **kwargs):
+        """
+        组织架构模型保存或删除后, 事务提交时递增版本号(避免其他进程在提交前用旧数据重建索引)
+        :param sender:
+        :param update_fields:
+        :param kwargs:
+        :return:
+        """
+        # 登录时只更新last_login, 不影响组织架构
+        if update_fields and set(update_fields) == {'last_login'}:
+            return
+        transaction.on_commit(cls.bump_version)
+
+    @classmethod
+    def connect_org_model_signals(cls):
+        """
+        监听组织架构模型的post_save、post_delete, 在AccountConfig.ready中调用.
+        queryset.update、bulk_create等不触发信号的批量写入需要自行调用bump_version
+        :return:
+        """
+        from django.apps import apps
+        for model_name in cls.ORG_MODEL_NAME_LIST:
+            try:
+                model = apps.get_model('account', model_name)
+            except LookupError:
+                # 未安装的账户模型
+                continue
+            post_save.connect(cls.on_org_model_changed, sender=model,
+                              dispatch_uid='org_index_post_save_{}'.format(model_name))
+            post_delete.connect(cls.on_org_model_changed, sender=model,
+                                dispatch_uid='org_index_post_delete_{}'.format(model_name))
+
+    @classmethod
+    def get_dept_username_list(cls, dept_id_list: list) -> list:
+        index = cls.get_index()
+        username_list = []
+        for dept_id in dept_id_list:
+            username_list.extend(index.dept_username_dict.get(dept_id, ()))
+        return username_list
+
+    @classmethod
+    def get_role_username_list(cls, role_id: int) -> list:
+        return list(cls.get_index().role_username_dict.get(role_id, ()))
+
+    @classmethod
+    def get_user_role_id_list(cls, username: str) -> list:
+        return list(cls.get_index().user_role_dict.get(username, ()))
+
+    @classmethod
+    def get_user_dept_id(cls, username: str) -> int:
+        return cls.get_index().user_dept_dict.get(username, 0)
+
+    @classmethod
+    def get_user_up_dept_id_list(cls, username: str) -> list:
+        index = cls.get_index()
+        return list(index.dept_ancestor_dict.get(index.user_dept_dict.get(username), ()))
+
+    @classmethod
+    def get_user_dept_approver(cls, username: str) -> tuple:
+        """
+        用户所在部门的审批人(未设置时为部门负责人)
+        :param username:
+        :return: (用户是否存在, 审批人)
+        """
+        index = cls.get_index()
+        if username not in index.user_dept_dict:
+            return False, ''
+        return True, index.dept_approver_dict.get(index.user_dept_dict[username]) or ''
+
+
+account_org_index_service_ins = AccountOrgIndexService()
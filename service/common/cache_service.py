@@ -0,0 +1,43 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LruCache(object):
+    """
+    进程内LRU缓存, 线程安全
+    in-process thread safe lru cache, entries can expire after timeout seconds(0 means never)
+    """
+    def __init__(self, max_size: int = 1024, timeout: int = 0):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expire_at = item
+            if expire_at and expire_at < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expire_at = time.time() + self.timeout if self.timeout else 0
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,78 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from service.base_service import BaseService
+
+
+class DbQueueService(BaseService):
+    """
+    数据库表实现的任务队列(定时器、hook发送等): 到期的行在事务中加锁(数据库支持时跳过已被其他进程锁定的行)后置为执行中，
+    并把到期时间延后lease秒作为租约，进程异常退出时租约到期后会被重新领取
+    rows of a table used as a job queue. due rows are locked (skip locked when supported), marked as running and
+    leased by pushing their due time forward, so rows of a dead worker are claimed again after the lease
+    """
+    def __init__(self):
+        pass
+
+    @classmethod
+    def lock_due_id_list(cls, model, status_list: list, due_field: str, now: datetime.datetime, batch_size: int,
+                         id_list: list = None) -> list:
+        """
+        锁定到期的行(需要在事务中调用). django2.0的mysql后端不支持skip_locked,
+        settings.SELECT_FOR_UPDATE_SKIP_LOCKED为True(mysql8.0+)时使用原生sql
+        :param model:
+        :param status_list: 可领取的状态
+        :param due_field: 到期时间字段
+        :param now:
+        :param batch_size:
+        :param id_list: 只领取其中的行
+        :return:
+        """
+        if connection.vendor == 'mysql' and settings.SELECT_FOR_UPDATE_SKIP_LOCKED:
+            due_column = model._meta.get_field(due_field).column
+            sql = 'SELECT id FROM {} WHERE status IN ({}) AND {} <= %s AND is_deleted = 0'.format(
+                model._meta.db_table, ', '.join(['%s'] * len(status_list)), due_column)
+            params = list(status_list) + [now]
+            if id_list is not None:
+                sql += ' AND id IN ({})'.format(', '.join(['%s'] * len(id_list)))
+                params += list(id_list)
+            with connection.cursor() as cursor:
+                cursor.execute('{} ORDER BY {} LIMIT %s FOR UPDATE SKIP LOCKED'.format(sql, due_column),
+                               params + [batch_size])
+                return [row[0] for row in cursor.fetchall()]
+        queryset = model.objects.select_for_update(
+            skip_locked=connection.features.has_select_for_update_skip_locked).filter(
+            status__in=status_list, is_deleted=0, **{'{}__lte'.format(due_field): now})
+        if id_list is not None:
+            queryset = queryset.filter(id__in=id_list)
+        return list(queryset.order_by(due_field).values_list('id', flat=True)[:batch_size])
+
+    @classmethod
+    def claim_due_list(cls, model, status_list: list, running_status: int, due_field: str, lease: int,
+                       batch_size: int, id_list: list = None) -> list:
+        """
+        领取到期的行: 置为执行中, 到期时间延后lease秒作为租约
+        :param model:
+        :param status_list: 可领取的状态(包括执行中, 租约到期后重新领取)
+        :param running_status:
+        :param due_field:
+        :param lease: 租约(秒)
+        :param batch_size:
+        :param id_list: 只领取其中的行
+        :return: 领取到的model对象列表
+        """
+        if id_list is not None and not id_list:
+            return []
+        now = datetime.datetime.now()
+        with transaction.atomic():
+            locked_id_list = cls.lock_due_id_list(model, status_list, due_field, now, batch_size, id_list)
+            if not locked_id_list:
+                return []
+            model.objects.filter(id__in=locked_id_list).update(**{
+                'status': running_status, due_field: now + datetime.timedelta(seconds=lease), 'gmt_modified': now})
+        return list(model.objects.filter(id__in=locked_id_list).order_by(due_field))
+
+
+db_queue_service_ins = DbQueueService()
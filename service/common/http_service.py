@@ -0,0 +1,85 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from service.base_service import BaseService
+from service.common.log_service import auto_log
+
+logger = logging.getLogger('django')
+
+
+class HttpService(BaseService):
+    """
+    hook等http调用: 按目标主机复用requests.Session(连接池)，支持超时及失败重试(指数退避)
+    outgoing http calls(hooks). sessions with a connection pool are reused per target host, requests have a timeout
+    and are retried with exponential backoff on connection errors, timeouts and 5xx responses
+    """
+    lock = threading.Lock()
+    session_dict = {}
+    session_pid = None
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_session(cls, url: str) -> requests.Session:
+        """
+        获取目标主机的session, fork后的子进程重新创建(连接不能跨进程共享)
+        :param url:
+        :return:
+        """
+        url_info = urlsplit(url)
+        host_key = '{}://{}'.format(url_info.scheme, url_info.netloc)
+        with cls.lock:
+            if cls.session_pid != os.getpid():
+                cls.session_dict = {}
+                cls.session_pid = os.getpid()
+            session = cls.session_dict.get(host_key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.HTTP_POOL_MAX_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls.session_dict[host_key] = session
+            return session
+
+    @classmethod
+    @auto_log
+    def post_json(cls, url: str, headers: dict, data: dict, timeout: float = 10, retry_count: int = 0,
+                  retry_backoff: float = 0.5) -> tuple:
+        """
+        post json, 返回响应的json. 连接失败、超时及5xx响应时重试retry_count次, 第n次重试前等待retry_backoff * 2^(n-1)秒
+        :param url:
+        :param headers:
+        :param data:
+        :param timeout: 连接及读取超时(秒)
+        :param retry_count:
+        :param retry_backoff:
+        :return: (flag, 响应的json或错误信息)
+        """
+        session = cls.get_session(url)
+        for attempt in range(retry_count + 1):
+            if attempt:
+                time.sleep(retry_backoff * 2 ** (attempt - 1))
+            try:
+                r = session.post(url, headers=headers, json=data, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                msg = e.__str__()
+            else:
+                if r.status_code < 500:
+                    try:
+                        return True, r.json()
+                    except ValueError:
+                        return False, 'invalid json response, status code: {}'.format(r.status_code)
+                msg = 'status code: {}'.format(r.status_code)
+            logger.warning('post {} failed, attempt {}/{}: {}'.format(url, attempt + 1, retry_count + 1, msg))
+        return False, msg
+
+
+http_service_ins = HttpService()
@@ -0,0 +1,125 @@
+import base64
+import datetime
+import json
+
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db import connection
+from django.db.models import Q
+
+from service.base_service import BaseService
+
+
+class PaginatorService(BaseService):
+    """
+    列表分页: 未提供cursor时按page/per_page分页(OFFSET及COUNT), 提供cursor(首页为空字符串)时按(创建时间, id)游标分页,
+    只查询per_page+1条判断是否有下一页, 不再COUNT, 深分页不会变慢
+    list pagination. page/per_page(offset and count) by default, keyset pagination on (gmt_created, id) when a
+    cursor is provided(empty string for the first page), which reads per_page+1 rows and skips the count
+    """
+    CURSOR_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def encode_cursor(cls, gmt_created: datetime.datetime, record_id: int) -> str:
+        """
+        游标: (创建时间, id)的base64编码, 调用方不需要解析
+        :param gmt_created:
+        :param record_id:
+        :return:
+        """
+        cursor_str = json.dumps([gmt_created.strftime(cls.CURSOR_TIME_FORMAT), record_id])
+        return base64.urlsafe_b64encode(cursor_str.encode('utf-8')).decode('utf-8')
+
+    @classmethod
+    def decode_cursor(cls, cursor: str) -> tuple:
+        """
+        解析游标
+        :param cursor:
+        :return:
+        """
+        try:
+            gmt_created_str, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8'))
+            return True, (datetime.datetime.strptime(gmt_created_str, cls.CURSOR_TIME_FORMAT), int(record_id))
+        except Exception:
+            return False, 'cursor is invalid'
+
+    @classmethod
+    def get_approximate_count(cls, queryset) -> int:
+        """
+        近似总数: mysql使用EXPLAIN估算的行数, 其他数据库使用COUNT
+        approximate row count, estimated by EXPLAIN on mysql
+        :param queryset:
+        :return:
+        """
+        queryset = queryset.order_by()
+        if connection.vendor != 'mysql':
+            return queryset.count()
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN {}'.format(sql), params)
+            row = cursor.fetchone()
+            column_list = [column[0] for column in cursor.description]
+        return int(row[column_list.index('rows')] or 0) if row else 0
+
+    @classmethod
+    def get_row_value(cls, row, field: str):
+        return row[field] if isinstance(row, dict) else getattr(row, field)
+
+    @classmethod
+    def paginate(cls, queryset, per_page: int = 10, page: int = 1, cursor: str = None, with_total: int = 0,
+                 reverse: int = 1, created_field: str = 'gmt_created', id_field: str = 'id') -> tuple:
+        """
+        分页
+        :param queryset: 已排序的queryset, 游标分页时按(created_field, id_field)重新排序
+        :param per_page:
+        :param page:
+        :param cursor: None时按page分页, 否则按游标分页, 空字符串为第一页
+        :param with_total: 游标分页时是否返回近似总数
+        :param reverse: 游标分页时是否按创建时间倒序
+        :param created_field:
+        :param id_field:
+        :return: (True, dict(object_list, paginator_info)), paginator_info与原来一样包含per_page、page、total,
+                 游标分页时total为近似总数(with_total为0时为None), 另外包含cursor、next_cursor、has_next
+        """
+        if cursor is None:
+            paginator = Paginator(queryset, per_page)
+            try:
+                result_paginator = paginator.page(page)
+            except PageNotAnInteger:
+                result_paginator = paginator.page(1)
+            except EmptyPage:
+                # If page is out of range (e.g. 9999), deliver last page of results
+                result_paginator = paginator.page(paginator.num_pages)
+            return True, dict(object_list=list(result_paginator.object_list),
+                              paginator_info=dict(per_page=per_page, page=page, total=paginator.count))
+
+        total = cls.get_approximate_count(queryset) if with_total else None
+        if reverse:
+            order_by_list = ['-{}'.format(created_field), '-{}'.format(id_field)]
+            lookup = 'lt'
+        else:
+            order_by_list = [created_field, id_field]
+            lookup = 'gt'
+        if cursor:
+            flag, result = cls.decode_cursor(cursor)
+            if flag is False:
+                return False, result
+            gmt_created, record_id = result
+            queryset = queryset.filter(
+                Q(**{'{}__{}'.format(created_field, lookup): gmt_created})
+                | Q(**{created_field: gmt_created, '{}__{}'.format(id_field, lookup): record_id}))
+        object_list = list(queryset.order_by(*order_by_list)[:per_page + 1])
+        has_next = len(object_list) > per_page
+        object_list = object_list[:per_page]
+        next_cursor = ''
+        if has_next:
+            next_cursor = cls.encode_cursor(cls.get_row_value(object_list[-1], created_field),
+                                            cls.get_row_value(object_list[-1], id_field))
+        return True, dict(object_list=object_list,
+                          paginator_info=dict(per_page=per_page, page=page, total=total, cursor=cursor,
+                                              next_cursor=next_cursor, has_next=has_next))
+
+
+paginator_service_ins = PaginatorService()
@@ -0,0 +1,53 @@
+import datetime
+
+from django.conf import settings
+
+from service.base_service import BaseService
+
+
+class WorkingDayService(BaseService):
+    """
+    工作日日历: settings.WORKING_DAY_WEEKDAYS中的星期为工作日, WORKING_DAY_HOLIDAYS中的日期为节假日,
+    WORKING_DAY_WORKDAYS中的日期为调休上班的工作日
+    working day calendar from weekdays, holidays and extra working days in settings
+    """
+    DATE_FORMAT = '%Y-%m-%d'
+    # 查找工作日时最多向后查找的天数, 避免配置错误(没有工作日)时死循环
+    MAX_SEARCH_DAYS = 3660
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def is_working_day(cls, day: datetime.date) -> bool:
+        day_str = day.strftime(cls.DATE_FORMAT)
+        if day_str in settings.WORKING_DAY_WORKDAYS:
+            return True
+        if day_str in settings.WORKING_DAY_HOLIDAYS:
+            return False
+        return day.weekday() in settings.WORKING_DAY_WEEKDAYS
+
+    @classmethod
+    def add_working_days(cls, start_time: datetime.datetime, days: int) -> datetime.datetime:
+        """
+        start_time之后第days个工作日的同一时间, start_time不是工作日时从下一个工作日的0点开始计算
+        the same time of day on the days-th working day after start_time
+        :param start_time:
+        :param days:
+        :return:
+        """
+        current_time = start_time
+        search_days = 0
+        while not cls.is_working_day(current_time.date()) and search_days < cls.MAX_SEARCH_DAYS:
+            current_time = datetime.datetime.combine(current_time.date() + datetime.timedelta(days=1),
+                                                     datetime.time())
+            search_days += 1
+        while days > 0 and search_days < cls.MAX_SEARCH_DAYS:
+            current_time += datetime.timedelta(days=1)
+            search_days += 1
+            if cls.is_working_day(current_time.date()):
+                days -= 1
+        return current_time
+
+
+working_day_service_ins = WorkingDayService()
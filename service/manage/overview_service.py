@@ -1,4 +1,7 @@
 from service.base_service import BaseService
+from service.common.log_service import auto_log
+from service.ticket.ticket_statistics_service import ticket_statistics_service_ins
+from service.workflow.workflow_base_service import workflow_base_service_ins
 
 
 class OverviewService(BaseService):
@@ -9,9 +12,29 @@ class OverviewService(BaseService):
     def __init__(self):
         pass
 
-    def get_new_ticket_type_count_statistics_info(self, start_time: str, end_time: str) -> tuple:
+    @classmethod
+    @auto_log
+    def get_new_ticket_type_count_statistics_info(cls, start_time: str, end_time: str, username: str = '') -> tuple:
         """
         获取每种类型工单创建数量统计数据
+        :param start_time: 工单创建日期起, 如2020-03-01
+        :param end_time: 工单创建日期止(包含)
+        :param username: 只统计用户有管理权限的工作流
         :return:
         """
-        return '', ''
+        flag, result = workflow_base_service_ins.get_workflow_manage_list(username)
+        if flag is False:
+            return False, result
+        workflow_list = result.get('workflow_list')
+        flag, result = ticket_statistics_service_ins.get_ticket_count_statistics(
+            [workflow.get('id') for workflow in workflow_list], start_time, end_time, ['workflow_id'])
+        if flag is False:
+            return False, result
+        workflow_count_dict = {statistics['workflow_id']: statistics['ticket_count'] for statistics in result}
+        result_list = [dict(workflow_id=workflow.get('id'), workflow_name=workflow.get('name'),
+                            count=workflow_count_dict.get(workflow.get('id'), 0)) for workflow in workflow_list]
+        result_list = sorted(result_list, key=lambda r: r['count'], reverse=True)
+        return True, dict(result_list=result_list)
+
+
+overview_service_ins = OverviewService()
@@ -1,6 +1,8 @@
 import json
+from django.conf import settings
 from django.http import HttpResponse
 from django.utils.deprecation import MiddlewareMixin
+from service.account.account_app_token_cache_service import account_app_token_cache_service_ins
 from service.account.account_base_service import AccountBaseService, account_base_service_ins
 from service.common.common_service import CommonService, common_service_ins
 
@@ -44,4 +46,10 @@ class ApiPermissionCheck(MiddlewareMixin):
             return False, 'Appname:{} in request header is unauthorized, please contact administrator to add ' \
                           'authorization for appname:{} in loonflow'.format(app_name, app_name)
 
-        return common_service_ins.signature_check(timestamp, signature, result.token)
+        flag, msg = common_service_ins.signature_check(timestamp, signature, result.token)
+        if flag is False:
+            return False, msg
+        if settings.API_SIGNATURE_NONCE_ENABLED and not account_app_token_cache_service_ins.check_nonce(
+                signature, settings.API_SIGNATURE_NONCE_TIMEOUT):
+            return False, 'The signature you provide in request header has been used, please generate a new one'
+        return True, ''
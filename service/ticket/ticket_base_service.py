@@ -1,30 +1,42 @@
-import copy
 import json
+import time
 import datetime
 import random
+import logging
 
-import redis
-from django.db.models import Q
+from django.db import transaction, OperationalError
+from django.db.models import F, Q
 from django.conf import settings
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from apps.workflow.models import CustomField
 from apps.ticket.models import TicketRecord, TicketCustomField, TicketFlowLog, TicketUser
-from service.redis_pool import POOL
 from service.base_service import BaseService
 from service.common.log_service import auto_log
+from service.common.paginator_service import paginator_service_ins
 from service.common.common_service import common_service_ins
 from service.common.constant_service import constant_service_ins
 from service.account.account_base_service import account_base_service_ins
+from service.ticket.ticket_flow_log_data_service import ticket_flow_log_data_service_ins
+from service.ticket.ticket_inbox_service import ticket_inbox_service_ins
+from service.ticket.ticket_sla_service import ticket_sla_service_ins
+from service.ticket.ticket_sn_service import ticket_sn_service_ins
+from service.ticket.ticket_statistics_service import ticket_statistics_service_ins
+from service.ticket.ticket_unit_of_work_service import ticket_unit_of_work_service_ins
 from service.workflow.workflow_base_service import workflow_base_service_ins
+from service.workflow.workflow_compile_service import workflow_compile_service_ins
+from service.workflow.workflow_condition_expression_service import workflow_condition_expression_service_ins
 from service.workflow.workflow_state_service import workflow_state_service_ins
 from service.workflow.workflow_transition_service import workflow_transition_service_ins
 from service.workflow.workflow_custom_field_service import workflow_custom_field_service_ins
 
+logger = logging.getLogger('django')
+
 
 class TicketBaseService(BaseService):
     """
     工单基础服务
     """
+    # 需要重试的mysql错误码: 1213死锁, 1205锁等待超时
+    RETRY_ERROR_CODE_LIST = (1213, 1205)
     def __init__(self):
         pass
 
@@ -32,23 +44,106 @@ class TicketBaseService(BaseService):
     @auto_log
     def get_ticket_by_id(cls, ticket_id: int) -> tuple:
         """
-        获取工单对象
+        获取工单对象, 处于工单工作单元中时直接返回工作单元中的工单
         :param ticket_id:
         :return:
         """
+        unit_of_work = ticket_unit_of_work_service_ins.get_current(ticket_id)
+        if unit_of_work:
+            return True, unit_of_work.ticket_obj
         ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
         if ticket_obj:
             return True, ticket_obj
         else:
             return False, 'ticket is not existed or has been deleted'
 
+    @classmethod
+    def save_ticket(cls, ticket_obj: TicketRecord):
+        """
+        保存工单记录, 处于工单工作单元中时只标记修改，由工作单元统一写入
+        save ticket record, only mark it dirty when in a unit of work
+        :param ticket_obj:
+        :return:
+        """
+        unit_of_work = ticket_unit_of_work_service_ins.get_current(ticket_obj.id)
+        if unit_of_work and unit_of_work.ticket_obj is ticket_obj:
+            unit_of_work.mark_ticket_dirty()
+        else:
+            ticket_obj.save()
+            ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_obj.id)
+
+    @classmethod
+    def update_ticket_state_version(cls, ticket_obj: TicketRecord, **update_dict):
+        """
+        更新工单记录的指定字段并原子递增状态版本号, 不整行保存, 避免并发操作时读-改-写丢失版本号或覆盖其他字段
+        update the given fields of the ticket and increase state_version atomically
+        :param ticket_obj:
+        :param update_dict: 需要更新的字段
+        :return:
+        """
+        update_dict['gmt_modified'] = datetime.datetime.now()
+        TicketRecord.objects.filter(id=ticket_obj.id).update(state_version=F('state_version') + 1, **update_dict)
+        for key, value in update_dict.items():
+            setattr(ticket_obj, key, value)
+        # 定时器等依赖更新后的版本号
+        ticket_obj.refresh_from_db(fields=['state_version'])
+        ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_obj.id)
+
+    @classmethod
+    @auto_log
+    def get_ticket_compiled_workflow(cls, ticket_obj: TicketRecord) -> tuple:
+        """
+        获取工单所属工作流的状态机快照, 处于工单工作单元中时使用工作单元中的快照
+        get compiled workflow of the ticket
+        :param ticket_obj:
+        :return:
+        """
+        unit_of_work = ticket_unit_of_work_service_ins.get_current(ticket_obj.id)
+        if unit_of_work:
+            return True, unit_of_work.compiled_workflow
+        return workflow_compile_service_ins.get_compiled_workflow(ticket_obj.workflow_id)
+
+    @classmethod
+    def apply_async_on_commit(cls, task, **kwargs):
+        """
+        事务提交后再投递celery任务，避免worker读取到未提交的数据. 不在事务中时立即投递
+        send celery task after the current transaction committed, immediately if not in a transaction
+        :param task:
+        :param kwargs: apply_async的参数
+        :return:
+        """
+        transaction.on_commit(lambda: task.apply_async(**kwargs))
+
+    @classmethod
+    def add_hook_delivery(cls, ticket_id: int, state_id: int) -> tuple:
+        """
+        触发状态hook: 在当前事务中写入hook发送队列, 事务提交后发送
+        :param ticket_id:
+        :param state_id:
+        :return:
+        """
+        from service.ticket.ticket_hook_outbox_service import ticket_hook_outbox_service_ins
+        return ticket_hook_outbox_service_ins.add_hook_delivery(ticket_id, state_id)
+
+    @classmethod
+    def send_ticket_notice_on_commit(cls, ticket_id_list: list):
+        """
+        事务提交后发送工单通知(配置了合并窗口时进入合并队列)
+        send ticket notices after the current transaction committed, coalesced if NOTICE_COALESCE_WINDOW is set
+        :param ticket_id_list:
+        :return:
+        """
+        from service.ticket.ticket_notice_service import ticket_notice_service_ins
+        transaction.on_commit(lambda: ticket_notice_service_ins.enqueue_ticket_notice(ticket_id_list))
+
     @classmethod
     @auto_log
     def get_ticket_list(cls, sn: str = '', title: str = '', username: str = '', create_start: str = '',
                         create_end: str = '',
                         workflow_ids: str = '', state_ids: str = '', ticket_ids: str = '', category: str = '',
                         reverse: int = 1,
-                        per_page: int = 10, page: int = 1, app_name: str = '', **kwargs):
+                        per_page: int = 10, page: int = 1, app_name: str = '', cursor: str = None,
+                        with_total: int = 0, **kwargs):
         """
         工单列表
         :param sn:
@@ -64,25 +159,19 @@ class TicketBaseService(BaseService):
         :param per_page:
         :param page:
         :param app_name:
+        :param cursor: 游标分页的游标, None时按page分页
+        :param with_total: 游标分页时是否返回近似总数
         act_state_id: int=0 进行状态, 0 草稿中、1.进行中 2.被退回 3.被撤回 4.已完成 5.已关闭
         :return:
         """
         category_list = ['all', 'owner', 'duty', 'relation', 'worked']
         if category not in category_list:
             return False, 'category value is invalid, it should be in all, owner, duty, relation'
-        query_params = Q(is_deleted=False)
-
-        # 获取调用方app_name 有权限的workflow_id_list
-        flag, result = account_base_service_ins.app_workflow_permission_list(app_name)
-
-        if not flag or not result.get('workflow_id_list'):
-            return True, dict(ticket_result_restful_list=[], paginator_info=dict(per_page=per_page, page=page, total=0))
-        else:
-            app_workflow_id_list = result.get('workflow_id_list')
-            # query_params &= Q(workflow_id__in=result.get('workflow_id_list'))
+        # 工单记录的过滤条件, 待办、关联、处理过的类别启用读模型时按对应字段查询读模型
+        filter_dict = dict()
 
         if kwargs.get('act_state_id') != '':
-            query_params &= Q(act_state_id=int(kwargs.get('act_state_id')))
+            filter_dict['act_state_id'] = int(kwargs.get('act_state_id'))
 
         if kwargs.get('from_admin') != '':
             # 管理员查看， 获取其有权限的工作流列表
@@ -96,16 +185,16 @@ class TicketBaseService(BaseService):
 
             if kwargs.get('creator') != '':
                 # 管理员查询的情况下才可用
-                query_params &= Q(creator=kwargs.get('creator'))
+                filter_dict['creator'] = kwargs.get('creator')
 
         if sn:
-            query_params &= Q(sn__startswith=sn)
+            filter_dict['sn__startswith'] = sn
         if title:
-            query_params &= Q(title__contains=title)
+            filter_dict['title__contains'] = title
         if create_start:
-            query_params &= Q(gmt_created__gte=create_start)
+            filter_dict['gmt_created__gte'] = create_start
         if create_end:
-            query_params &= Q(gmt_created__lte=create_end)
+            filter_dict['gmt_created__lte'] = create_end
         if workflow_ids:
             workflow_id_str_list = workflow_ids.split(',')
             query_workflow_id_list = [int(workflow_id_str) for workflow_id_str in workflow_id_str_list]
@@ -116,28 +205,35 @@ class TicketBaseService(BaseService):
         if state_ids:
             state_id_str_list = state_ids.split(',')
             state_id_list = [int(state_id_str) for state_id_str in state_id_str_list]
-            query_params &= Q(state_id__in=state_id_list)
+            filter_dict['state_id__in'] = state_id_list
         if ticket_ids:
             ticket_id_str_list = ticket_ids.split(',')
             ticket_id_list = [int(ticket_id_str) for ticket_id_str in ticket_id_str_list]
-            query_params &= Q(id__in=ticket_id_list)
+            filter_dict['id__in'] = ticket_id_list
 
         if kwargs.get('from_admin'):
-            ending_workflow_id_list = workflow_admin_id_list
+            workflow_query_params = Q(workflow_id__in=workflow_admin_id_list)
         else:
-            if query_workflow_id_list:
-                ending_workflow_id_list = list(
-                    set(app_workflow_id_list) - (set(app_workflow_id_list) - set(query_workflow_id_list)))
-            else:
-                ending_workflow_id_list = app_workflow_id_list
-
-        query_params &= Q(workflow_id__in=ending_workflow_id_list)
+            # 调用方app_name有权限的工作流(有权限访问所有工作流时不加条件, 否则关联查询工作流表)
+            flag, workflow_query_params = account_base_service_ins.get_app_workflow_query_params(
+                app_name, query_workflow_id_list)
+            if flag is False or workflow_query_params is None:
+                return True, dict(ticket_result_restful_list=[],
+                                  paginator_info=dict(per_page=per_page, page=page, total=0))
 
         if reverse:
             order_by_str = '-gmt_created'
         else:
             order_by_str = 'gmt_created'
 
+        if settings.TICKET_INBOX_ENABLED and category in ticket_inbox_service_ins.CATEGORY_LIST:
+            flag, ticket_id_queryset = ticket_inbox_service_ins.get_ticket_inbox_id_queryset(
+                username, category, filter_dict, reverse, workflow_query_params)
+            if flag is False:
+                return False, ticket_id_queryset
+            return cls.get_ticket_list_by_id_queryset(ticket_id_queryset, per_page, page, cursor, with_total, reverse)
+
+        query_params = Q(is_deleted=False, **filter_dict) & workflow_query_params
         if category == 'owner':
             query_params &= Q(creator=username)
             ticket_objects = TicketRecord.objects.filter(query_params).order_by(order_by_str)
@@ -162,32 +258,88 @@ class TicketBaseService(BaseService):
         else:
             ticket_objects = TicketRecord.objects.filter(query_params).order_by(order_by_str)
 
-        paginator = Paginator(ticket_objects, per_page)
+        flag, result = paginator_service_ins.paginate(ticket_objects, per_page, page, cursor, with_total, reverse)
+        if flag is False:
+            return False, result
+        flag, ticket_result_restful_list = cls.format_ticket_list(result['object_list'])
+        if flag is False:
+            return False, ticket_result_restful_list
+        return True, dict(ticket_result_restful_list=ticket_result_restful_list,
+                          paginator_info=result['paginator_info'])
+
+    @classmethod
+    @auto_log
+    def get_ticket_list_by_id_queryset(cls, ticket_id_queryset, per_page: int = 10, page: int = 1, cursor: str = None,
+                                       with_total: int = 0, reverse: int = 1) -> tuple:
+        """
+        按读模型中的工单id分页, 再按id查询当前页的工单记录
+        paginate ticket ids from the read model, then load tickets of the page by id
+        :param ticket_id_queryset:
+        :param per_page:
+        :param page:
+        :param cursor:
+        :param with_total:
+        :param reverse:
+        :return:
+        """
+        flag, result = paginator_service_ins.paginate(ticket_id_queryset, per_page, page, cursor, with_total, reverse,
+                                                      created_field='ticket_gmt_created', id_field='ticket_id')
+        if flag is False:
+            return False, result
+        ticket_id_list = [inbox_dict['ticket_id'] for inbox_dict in result['object_list']]
+        ticket_dict = TicketRecord.objects.in_bulk(ticket_id_list)
+        ticket_result_object_list = [ticket_dict[ticket_id] for ticket_id in ticket_id_list if ticket_id in ticket_dict]
+        flag, ticket_result_restful_list = cls.format_ticket_list(ticket_result_object_list)
+        if flag is False:
+            return False, ticket_result_restful_list
+        return True, dict(ticket_result_restful_list=ticket_result_restful_list,
+                          paginator_info=result['paginator_info'])
 
-        try:
-            ticket_result_paginator = paginator.page(page)
-        except PageNotAnInteger:
-            ticket_result_paginator = paginator.page(1)
-        except EmptyPage:
-            # If page is out of range (e.g. 9999), deliver last page of results
-            ticket_result_paginator = paginator.page(paginator.num_pages)
+    @classmethod
+    @auto_log
+    def format_ticket_list(cls, ticket_obj_list: list) -> tuple:
+        """
+        格式化工单列表: 状态、工作流、创建人、部门、处理人信息分别一次批量查询, 查询次数与每页条数无关
+        format ticket list. states, workflows, creators, depts and participants are loaded with one query each,
+        so query count does not grow with page size
+        :param ticket_obj_list:
+        :return:
+        """
+        flag, state_dict = workflow_state_service_ins.get_states_info_by_state_id_list(
+            list(set([ticket_obj.state_id for ticket_obj in ticket_obj_list])))
+        if flag is False:
+            return False, state_dict
+        flag, workflow_dict = workflow_base_service_ins.get_workflow_dict_by_id_list(
+            [ticket_obj.workflow_id for ticket_obj in ticket_obj_list])
+        if flag is False:
+            return False, workflow_dict
+        flag, creator_dict = account_base_service_ins.get_user_dict_by_username_list(
+            [ticket_obj.creator for ticket_obj in ticket_obj_list])
+        if flag is False:
+            creator_dict = {}
+        flag, dept_dict = account_base_service_ins.get_dept_dict_by_id_list(
+            [creator_obj.dept_id for creator_obj in creator_dict.values()])
+        if flag is False:
+            dept_dict = {}
+        flag, participant_info_dict = cls.get_tickets_format_participant_info(ticket_obj_list)
+        if flag is False:
+            return False, participant_info_dict
 
-        ticket_result_object_list = ticket_result_paginator.object_list
         ticket_result_restful_list = []
-        for ticket_result_object in ticket_result_object_list:
-            flag, state_obj = workflow_state_service_ins.get_workflow_state_by_id(ticket_result_object.state_id)
-            state_name = state_obj.name
-            flag, participant_info = cls.get_ticket_format_participant_info(ticket_result_object.id)
+        for ticket_result_object in ticket_obj_list:
+            state_info = state_dict.get(ticket_result_object.state_id, {})
+            flag, participant_info = participant_info_dict[ticket_result_object.id]
 
-            flag, workflow_obj = workflow_base_service_ins.get_by_id(ticket_result_object.workflow_id)
-            workflow_info_dict = dict(workflow_id=workflow_obj.id, workflow_name=workflow_obj.name)
+            workflow_obj = workflow_dict.get(ticket_result_object.workflow_id)
+            workflow_info_dict = dict(workflow_id=ticket_result_object.workflow_id,
+                                      workflow_name=workflow_obj.name if workflow_obj else '')
 
-            flag, creator_obj = account_base_service_ins.get_user_by_username(ticket_result_object.creator)
-            if flag:
+            creator_obj = creator_dict.get(ticket_result_object.creator)
+            if creator_obj:
                 dept_id = creator_obj.dept_id
                 # 获取部门信息
-                flag, dept_info = account_base_service_ins.get_dept_by_id(dept_id)
-                if flag is False or (not dept_info):
+                dept_info = dept_dict.get(dept_id)
+                if not dept_info:
                     dept_dict_info = dict(id=dept_id, name='')
                 else:
                     dept_dict_info = dept_info.get_dict()
@@ -198,24 +350,39 @@ class TicketBaseService(BaseService):
                 creator_info = dict(username=ticket_result_object.creator, alias='', is_active=False, email='',
                                     phone='', dept_info={})
             ticket_format_obj = ticket_result_object.get_dict()
-            ticket_format_obj.update(dict(state=dict(state_id=ticket_result_object.state_id, state_name=state_name,
-                                                     state_label=json.loads(state_obj.label)),
+            ticket_format_obj.update(dict(state=dict(state_id=ticket_result_object.state_id,
+                                                     state_name=state_info.get('name', ''),
+                                                     state_label=json.loads(state_info.get('label') or '{}')),
                                           participant_info=participant_info, creator_info=creator_info,
                                           workflow_info=workflow_info_dict))
 
             ticket_result_restful_list.append(ticket_format_obj)
-        return True, dict(ticket_result_restful_list=ticket_result_restful_list,
-                          paginator_info=dict(per_page=per_page, page=page, total=paginator.count))
+        return True, ticket_result_restful_list
 
     @classmethod
     @auto_log
     def new_ticket(cls, request_data_dict: dict, app_name: str = '') -> tuple:
         """
-        新建工单
+        新建工单, 工单记录、统计、时效、自定义字段、流转记录在同一个事务中写入, 任一步骤失败时全部回滚
+        new ticket in one transaction, nothing is written when any step failed
         :param request_data_dict:
         :param app_name: 调用源app_name
         :return:
         """
+        # 流水号在事务外生成, 序号的租用不随工单事务回滚
+        flag, result = cls.gen_ticket_sn(app_name)
+        if not flag:
+            return False, result
+        return cls.run_in_transaction(cls.new_ticket_in_transaction, request_data_dict, result.get('ticket_sn'))
+
+    @classmethod
+    def new_ticket_in_transaction(cls, request_data_dict: dict, ticket_sn: str) -> tuple:
+        """
+        新建工单, 需要在事务中调用
+        :param request_data_dict:
+        :param ticket_sn: 流水号
+        :return:
+        """
         workflow_id = request_data_dict.get('workflow_id')
         transition_id = request_data_dict.get('transition_id')
         username = request_data_dict.get('username')
@@ -234,16 +401,22 @@ class TicketBaseService(BaseService):
         if not has_permission:
             return False, msg
 
-        # 获取新建工单必填信息(根据工作流初始状态确定)
-        flag, start_state = workflow_state_service_ins.get_workflow_start_state(workflow_id)
+        flag, compiled_workflow = workflow_compile_service_ins.get_compiled_workflow(workflow_id)
         if flag is False:
-            return False, start_state
-        flag, state_info_dict = cls.get_state_field_info(start_state.id)
+            return False, compiled_workflow
+
+        # 获取新建工单必填信息(根据工作流初始状态确定)
+        start_state = compiled_workflow.start_state
+        if not start_state:
+            return False, 'This workflow have no init state, please check the config'
+        state_info_dict = compiled_workflow.get_state_field_info(start_state.id)
         require_field_list = state_info_dict.get('require_field_list', [])  # 必填字段
         update_field_list = state_info_dict.get('update_field_list', [])  # 必填+可选字段，即需要保存值的字段
 
         # 校验是否所有必填字段都有提供，如果transition对应设置为不校验必填则直接通过
-        flag, req_transition_obj = workflow_transition_service_ins.get_workflow_transition_by_id(transition_id)
+        req_transition_obj = compiled_workflow.get_transition(transition_id, start_state.id)
+        if not req_transition_obj:
+            return False, 'transition_id is invalid'
         if req_transition_obj.field_require_check:
             for require_field in require_field_list:
                 if require_field not in request_field_arg_list:
@@ -255,7 +428,9 @@ class TicketBaseService(BaseService):
         else:
             return False, msg
 
-        flag, destination_state = workflow_state_service_ins.get_workflow_state_by_id(destination_state_id)
+        destination_state = compiled_workflow.get_state(destination_state_id)
+        if not destination_state:
+            return False, 'destination state is not existed or has been deleted'
 
         # 获取目标状态的信息
         flag, participant_info = cls.get_ticket_state_participant_info(destination_state_id,
@@ -266,19 +441,8 @@ class TicketBaseService(BaseService):
         destination_participant = participant_info.get('destination_participant', '')
         multi_all_person = participant_info.get('multi_all_person', '{}')  # 多人需要全部处理情况
 
-        # 生成流水号
-        flag, result = cls.gen_ticket_sn(app_name)
-        if not flag:
-            return False, msg
-        ticket_sn = result.get('ticket_sn')
-
         # 新增工单基础表数据
-        if destination_state.type_id == constant_service_ins.STATE_TYPE_END:
-            act_state_id = constant_service_ins.TICKET_ACT_STATE_FINISH
-        elif destination_state.type_id == constant_service_ins.STATE_TYPE_START:
-            act_state_id = constant_service_ins.TICKET_ACT_STATE_DRAFT
-        else:
-            act_state_id = constant_service_ins.TICKET_ACT_STATE_ONGOING
+        act_state_id = cls.get_act_state_id(destination_state)
 
         new_ticket_obj = TicketRecord(sn=ticket_sn, title=request_data_dict.get('title', ''), workflow_id=workflow_id,
                                       state_id=destination_state_id, parent_ticket_id=parent_ticket_id,
@@ -287,52 +451,57 @@ class TicketBaseService(BaseService):
                                       participant_type_id=destination_participant_type_id, relation=username,
                                       creator=username, act_state_id=act_state_id, multi_all_person=multi_all_person)
         new_ticket_obj.save()
+        ticket_statistics_service_ins.add_tickets([new_ticket_obj])
+        ticket_sla_service_ins.enter_state([(new_ticket_obj, destination_state)])
+
+        # 关系人、自定义字段、流转记录在同一个工作单元中处理, 工单记录和字段值只加载一次.
+        # 工作单元退出时会写入修改, 失败时抛出异常丢弃修改并回滚事务
+        with ticket_unit_of_work_service_ins.begin(new_ticket_obj.id, new_ticket_obj):
+            # 更新工单关系人
+            flag, result = cls.get_ticket_dest_relation(destination_participant_type_id, destination_participant)
+            if flag is True:
+                cls.update_ticket_relation(new_ticket_obj.id, result.get('add_relation'), ticket_creator=username)
+
+            # 新增自定义字段，只保存required_field
+            request_data_dict_allow = {}
+            for key, value in request_data_dict.items():
+                if key in update_field_list:
+                    request_data_dict_allow[key] = value
+
+            update_ticket_custom_field_result, msg = cls.update_ticket_custom_field(new_ticket_obj.id,
+                                                                                    request_data_dict_allow)
+            if not update_ticket_custom_field_result:
+                raise Exception(msg)
+            # 新增流转记录,记录流转时工单所有字段的值
+            flag, result = cls.get_ticket_all_field_value_json(new_ticket_obj.id)
+            if flag is False:
+                raise Exception(result)
 
-        # 更新工单关系人
-        flag, result = cls.get_ticket_dest_relation(destination_participant_type_id, destination_participant)
-        if flag is True:
-            cls.update_ticket_relation(new_ticket_obj.id, result.get('add_relation'), ticket_creator=username)
-
-        # 新增自定义字段，只保存required_field
-        request_data_dict_allow = {}
-        for key, value in request_data_dict.items():
-            if key in update_field_list:
-                request_data_dict_allow[key] = value
-
-        update_ticket_custom_field_result, msg = cls.update_ticket_custom_field(new_ticket_obj.id,
-                                                                                request_data_dict_allow)
-        if not update_ticket_custom_field_result:
-            return False, msg
-        # 新增流转记录,记录流转时工单所有字段的值
-        flag, result = cls.get_ticket_all_field_value_json(new_ticket_obj.id)
-        if flag is False:
-            return False, result
-
-        all_ticket_data_json = result.get('all_field_value_json')
-        new_ticket_flow_log_dict = dict(ticket_id=new_ticket_obj.id, transition_id=transition_id,
-                                        suggestion=suggestion,
-                                        participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL,
-                                        participant=username, state_id=start_state.id, ticket_data=all_ticket_data_json)
-        add_ticket_flow_log_result, msg = cls.add_ticket_flow_log(new_ticket_flow_log_dict)
-        if not add_ticket_flow_log_result:
-            return False, msg
+            all_ticket_data_json = result.get('all_field_value_json')
+            new_ticket_flow_log_dict = dict(ticket_id=new_ticket_obj.id, transition_id=transition_id,
+                                            suggestion=suggestion,
+                                            participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL,
+                                            participant=username, state_id=start_state.id,
+                                            ticket_data=all_ticket_data_json)
+            add_ticket_flow_log_result, msg = cls.add_ticket_flow_log(new_ticket_flow_log_dict)
+            if not add_ticket_flow_log_result:
+                raise Exception(msg)
         # 通知消息
-        from tasks import send_ticket_notice
-        send_ticket_notice.apply_async(args=[new_ticket_obj.id], queue='loonflow')
+        cls.send_ticket_notice_on_commit([new_ticket_obj.id])
 
         # 如果下个状态为脚本处理，则开始执行脚本
         if destination_participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROBOT:
             from tasks import run_flow_task  # 放在文件开头会存在循环引用
-            run_flow_task.apply_async(args=[new_ticket_obj.id, destination_participant, destination_state_id],
-                                      queue='loonflow')
+            cls.apply_async_on_commit(
+                run_flow_task, args=[new_ticket_obj.id, destination_participant, destination_state_id],
+                queue='loonflow')
 
         # 如果下个状态是hook，开始触发hook
         if destination_participant_type_id == constant_service_ins.PARTICIPANT_TYPE_HOOK:
-            from tasks import flow_hook_task  # 放在文件开头会存在循环引用
-            flow_hook_task.apply_async(args=[new_ticket_obj.id], queue='loonflow')
+            cls.add_hook_delivery(new_ticket_obj.id, destination_state_id)
 
         # 定时器处理逻辑
-        cls.handle_timer_transition(new_ticket_obj.id, destination_state_id)
+        cls.handle_timer_transition(new_ticket_obj.id, destination_state_id, workflow_id)
 
         # 父工单逻辑处理
         if destination_state.type_id == constant_service_ins.STATE_TYPE_END and new_ticket_obj.parent_ticket_id \
@@ -366,24 +535,213 @@ class TicketBaseService(BaseService):
                                                                  suggestion='所有子工单处理完毕，自动流转'))
         return True, dict(new_ticket_id=new_ticket_obj.id)
 
+    @classmethod
+    @auto_log
+    def new_ticket_batch(cls, workflow_id: int, ticket_data_list: list, username: str, app_name: str = '') -> tuple:
+        """
+        批量新建同一工作流的工单: 工作流快照、初始状态、权限只校验一次，流水号一次分配，
+        工单、自定义字段、关系人、流转记录批量写入, 通知消息合并为一个任务. 任一工单校验失败则全部不创建
+        new tickets of one workflow in batch
+        :param workflow_id:
+        :param ticket_data_list: 工单参数列表, 每项参数同新建工单(不支持子工单)
+        :param username:
+        :param app_name: 调用源app_name
+        :return:
+        """
+        if not (workflow_id and username and ticket_data_list):
+            return False, u'参数不合法,请提供workflow_id，username，ticket_list'
+        if len(ticket_data_list) > settings.TICKET_BATCH_MAX_SIZE:
+            return False, '一次最多处理{}个工单'.format(settings.TICKET_BATCH_MAX_SIZE)
+
+        has_permission, msg = workflow_base_service_ins.check_new_permission(username, workflow_id)
+        if not has_permission:
+            return False, msg
+        flag, compiled_workflow = workflow_compile_service_ins.get_compiled_workflow(workflow_id)
+        if flag is False:
+            return False, compiled_workflow
+        start_state = compiled_workflow.start_state
+        if not start_state:
+            return False, 'This workflow have no init state, please check the config'
+        state_info_dict = compiled_workflow.get_state_field_info(start_state.id)
+        require_field_list = state_info_dict.get('require_field_list', [])
+        update_field_list = state_info_dict.get('update_field_list', [])
+        flag, format_custom_field_dict = workflow_custom_field_service_ins.get_workflow_custom_field(workflow_id)
+        if flag is False:
+            return False, format_custom_field_dict
+
+        # 目标处理人与请求字段无关时同一目标状态的处理人只计算一次
+        participant_info_cache = {}
+        relation_cache = {}
+        ticket_info_list = []
+        for index, ticket_data in enumerate(ticket_data_list):
+            request_data_dict = dict(ticket_data, workflow_id=workflow_id, username=username)
+            transition_id = request_data_dict.get('transition_id')
+            if request_data_dict.get('parent_ticket_id'):
+                return False, 'ticket_list[{}]: 批量新建不支持子工单'.format(index)
+            req_transition_obj = compiled_workflow.get_transition(transition_id, start_state.id)
+            if not req_transition_obj:
+                return False, 'ticket_list[{}]: transition_id is invalid'.format(index)
+            if req_transition_obj.field_require_check:
+                for require_field in require_field_list:
+                    if require_field not in request_data_dict:
+                        return False, 'ticket_list[{}]: 此工单的必填字段为:{}'.format(index, ','.join(require_field_list))
+
+            flag, result = cls.get_next_state_id_by_transition_and_ticket_info(0, request_data_dict)
+            if flag is False:
+                return False, 'ticket_list[{}]: {}'.format(index, result)
+            destination_state = compiled_workflow.get_state(result.get('destination_state_id'))
+            if not destination_state:
+                return False, 'ticket_list[{}]: destination state is not existed or has been deleted'.format(index)
+
+            participant_info = participant_info_cache.get(destination_state.id)
+            if participant_info is None:
+                flag, participant_info = cls.get_ticket_state_participant_info(destination_state.id,
+                                                                               ticket_req_dict=request_data_dict)
+                if flag is False:
+                    return False, 'ticket_list[{}]: {}'.format(index, participant_info)
+                if destination_state.participant_type_id not in (constant_service_ins.PARTICIPANT_TYPE_FIELD,
+                                                                 constant_service_ins.PARTICIPANT_TYPE_PARENT_FIELD):
+                    participant_info_cache[destination_state.id] = participant_info
+            destination_participant_type_id = participant_info.get('destination_participant_type_id', 0)
+            destination_participant = participant_info.get('destination_participant', '')
+
+            relation_key = (destination_participant_type_id, destination_participant)
+            if relation_key not in relation_cache:
+                flag, result = cls.get_ticket_dest_relation(destination_participant_type_id, destination_participant)
+                relation_cache[relation_key] = result.get('add_relation', '') if flag else ''
+
+            ticket_info_list.append(dict(
+                request_data_dict=request_data_dict, transition_id=transition_id, destination_state=destination_state,
+                destination_participant_type_id=destination_participant_type_id,
+                destination_participant=destination_participant, act_state_id=cls.get_act_state_id(destination_state),
+                multi_all_person=participant_info.get('multi_all_person', '{}'),
+                relation_user_list=[user for user in relation_cache[relation_key].split(',') if user]))
+
+        flag, result = cls.gen_ticket_sn_list(app_name, len(ticket_info_list))
+        if flag is False:
+            return False, result
+        ticket_sn_list = result.get('ticket_sn_list')
+
+        value_enum = constant_service_ins.FIELD_VALUE_ENUM
+        with transaction.atomic():
+            ticket_obj_list = []
+            for ticket_sn, ticket_info in zip(ticket_sn_list, ticket_info_list):
+                relation_set = set(ticket_info['relation_user_list'] + [username])
+                ticket_obj_list.append(TicketRecord(
+                    sn=ticket_sn, title=ticket_info['request_data_dict'].get('title', ''), workflow_id=workflow_id,
+                    state_id=ticket_info['destination_state'].id, participant=ticket_info['destination_participant'],
+                    participant_type_id=ticket_info['destination_participant_type_id'],
+                    relation=','.join(relation_set), creator=username, act_state_id=ticket_info['act_state_id'],
+                    multi_all_person=ticket_info['multi_all_person']))
+            TicketRecord.objects.bulk_create(ticket_obj_list)
+            ticket_statistics_service_ins.add_tickets(ticket_obj_list)
+            # mysql批量插入不返回自增id，按流水号查回
+            ticket_id_dict = dict(TicketRecord.objects.filter(sn__in=ticket_sn_list).values_list('sn', 'id'))
+            ticket_id_list = [ticket_id_dict[ticket_sn] for ticket_sn in ticket_sn_list]
+            for ticket_obj, ticket_id in zip(ticket_obj_list, ticket_id_list):
+                ticket_obj.id = ticket_id
+            ticket_sla_service_ins.enter_state([(ticket_obj, ticket_info['destination_state'])
+                                                for ticket_obj, ticket_info in zip(ticket_obj_list, ticket_info_list)])
+
+            ticket_user_list = []
+            ticket_custom_field_list = []
+            for ticket_id, ticket_info in zip(ticket_id_list, ticket_info_list):
+                relation_user_list = ticket_info['relation_user_list']
+                for relation_user in set(relation_user_list + [username]):
+                    ticket_user_list.append(TicketUser(ticket_id=ticket_id, username=relation_user,
+                                                       in_process=relation_user in relation_user_list))
+                for key, value in ticket_info['request_data_dict'].items():
+                    if key not in update_field_list or key not in format_custom_field_dict or value is None:
+                        continue
+                    field_type_id = format_custom_field_dict[key]['field_type_id']
+                    ticket_custom_field_list.append(TicketCustomField(**{
+                        'name': format_custom_field_dict[key]['field_name'], 'ticket_id': ticket_id,
+                        'field_key': key, 'field_type_id': field_type_id, value_enum[field_type_id]: value}))
+            TicketUser.objects.bulk_create(ticket_user_list)
+            TicketCustomField.objects.bulk_create(ticket_custom_field_list)
+            ticket_inbox_service_ins.sync_tickets_inbox(ticket_id_list)
+
+            # 流转记录中保存工单所有字段的值
+            flag, field_value_dict = cls.get_tickets_all_field_value(ticket_id_list)
+            if flag is False:
+                raise Exception(field_value_dict)
+            ticket_flow_log_list = []
+            for ticket_id, ticket_info in zip(ticket_id_list, ticket_info_list):
+                field_value_info = field_value_dict[ticket_id]
+                for key, value in field_value_info.items():
+                    if type(value) not in [int, str, bool, float]:
+                        field_value_info[key] = str(value)
+                suggestion = ticket_info['request_data_dict'].get('suggestion') or ''
+                if len(suggestion) > 1000:
+                    suggestion = '{}...(be truncated because More than 1000)'.format(suggestion[:960])
+                ticket_flow_log_list.append(TicketFlowLog(
+                    ticket_id=ticket_id, transition_id=ticket_info['transition_id'], suggestion=suggestion,
+                    participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL, participant=username,
+                    state_id=start_state.id,
+                    ticket_data=ticket_flow_log_data_service_ins.encode_full(field_value_info), creator=username))
+            TicketFlowLog.objects.bulk_create(ticket_flow_log_list)
+
+            # 通知消息合并为一个任务
+            cls.send_ticket_notice_on_commit(ticket_id_list)
+            for ticket_id, ticket_info in zip(ticket_id_list, ticket_info_list):
+                destination_state_id = ticket_info['destination_state'].id
+                destination_participant_type_id = ticket_info['destination_participant_type_id']
+                if destination_participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROBOT:
+                    from tasks import run_flow_task  # 放在文件开头会存在循环引用
+                    cls.apply_async_on_commit(
+                        run_flow_task, args=[ticket_id, ticket_info['destination_participant'], destination_state_id],
+                        queue='loonflow')
+                if destination_participant_type_id == constant_service_ins.PARTICIPANT_TYPE_HOOK:
+                    cls.add_hook_delivery(ticket_id, destination_state_id)
+                cls.handle_timer_transition(ticket_id, destination_state_id, workflow_id)
+        return True, dict(new_ticket_id_list=ticket_id_list)
+
+    @classmethod
+    def get_act_state_id(cls, destination_state, transition_obj=None) -> int:
+        """
+        工单进入目标状态后的进行状态: 结束状态为已完成, 初始状态为草稿, 其他为进行中; 拒绝属性的流转为被退回
+        act state of the ticket after it enters the destination state
+        :param destination_state:
+        :param transition_obj: 处理工单时的流转
+        :return:
+        """
+        if transition_obj and transition_obj.attribute_type_id == constant_service_ins.TRANSITION_ATTRIBUTE_TYPE_REFUSE:
+            return constant_service_ins.TICKET_ACT_STATE_BACK
+        if destination_state.type_id == constant_service_ins.STATE_TYPE_END:
+            return constant_service_ins.TICKET_ACT_STATE_FINISH
+        if destination_state.type_id == constant_service_ins.STATE_TYPE_START:
+            return constant_service_ins.TICKET_ACT_STATE_DRAFT
+        return constant_service_ins.TICKET_ACT_STATE_ONGOING
+
     @classmethod
     @auto_log
     def gen_ticket_sn(cls, app_name: str = '') -> tuple:
-        redis_conn = redis.Redis(connection_pool=POOL)
-        ticket_day_count_key = 'ticket_day_count_{}'.format(str(datetime.datetime.now())[:10])
-        ticket_day_count = redis_conn.get(ticket_day_count_key)
-        if ticket_day_count is not None:
-            new_ticket_day_count = redis_conn.incr(ticket_day_count_key)
-        else:
-            # 查询数据库中个数
-            # 今天和明天
-            today = str(datetime.datetime.now())[:10] + " 00:00:00"
-            next_day = str(datetime.datetime.now() + datetime.timedelta(days=1))[:10] + " 00:00:00"
-            # 包括is_deleted=1的数据
-            ticket_day_count = TicketRecord.objects.filter(gmt_created__gte=today, gmt_created__lt=next_day).count()
-            new_ticket_day_count = int(ticket_day_count) + 1
-            redis_conn.set(ticket_day_count_key, new_ticket_day_count, 86400)
-        now_day = datetime.datetime.now()
+        """
+        生成工单流水号
+        gen ticket sn
+        :param app_name:
+        :return:
+        """
+        flag, result = cls.gen_ticket_sn_list(app_name, 1)
+        if flag is False:
+            return False, result
+        return True, dict(ticket_sn=result.get('ticket_sn_list')[0])
+
+    @classmethod
+    @auto_log
+    def gen_ticket_sn_list(cls, app_name: str = '', count: int = 1) -> tuple:
+        """
+        批量生成工单流水号, 序号由ticket_sn_service从进程内租用的序号段中分配
+        gen ticket sn list, sequence numbers are allocated from the block leased by the current process
+        :param app_name:
+        :param count:
+        :return:
+        """
+        flag, result = ticket_sn_service_ins.get_sequence_list(count)
+        if flag is False:
+            return False, result
+        now_day = result.get('day')
+        sequence_list = result.get('sequence_list')
         if not app_name:
             sn_prefix = 'loonflow'
         else:
@@ -397,8 +755,9 @@ class TicketBaseService(BaseService):
             # for multi computer room deploy and use separate redis server
             zone_info = '{}_'.format(settings.DEPLOY_ZONE)
 
-        return True, dict(ticket_sn='%s_%s%04d%02d%02d%04d' % (sn_prefix, zone_info, now_day.year, now_day.month,
-                                                               now_day.day, new_ticket_day_count))
+        ticket_sn_list = ['%s_%s%04d%02d%02d%04d' % (sn_prefix, zone_info, now_day.year, now_day.month, now_day.day,
+                                                     ticket_day_count) for ticket_day_count in sequence_list]
+        return True, dict(ticket_sn_list=ticket_sn_list)
 
     @classmethod
     @auto_log
@@ -410,7 +769,9 @@ class TicketBaseService(BaseService):
         :return:
         """
         if field_key in constant_service_ins.TICKET_BASE_FIELD_LIST:
-            ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+            flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+            if flag is False:
+                return False, ticket_obj
             ticket_obj_dict = ticket_obj.get_dict()
             value = ticket_obj_dict.get(field_key)
         else:
@@ -429,7 +790,9 @@ class TicketBaseService(BaseService):
         :param ticket_id:
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+        if flag is False:
+            return False, ticket_obj
         custom_field_queryset = CustomField.objects.filter(is_deleted=0, workflow_id=ticket_obj.workflow_id).all()
         format_field_key_dict = {}
         for custom_field in custom_field_queryset:
@@ -507,50 +870,70 @@ class TicketBaseService(BaseService):
     def update_ticket_custom_field(cls, ticket_id: int, update_dict: dict) -> tuple:
         """
         update ticket's custom fields's value(create or update)
+        处于工单工作单元中时只记录修改，由工作单元统一写入
         :param ticket_id:
         :param update_dict:
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+        if flag is False:
+            return False, ticket_obj
+        unit_of_work = ticket_unit_of_work_service_ins.get_current(ticket_id)
+        if not unit_of_work:
+            return cls.save_ticket_custom_field(ticket_obj, update_dict)
+
         flag, format_custom_field_dict = workflow_custom_field_service_ins \
             .get_workflow_custom_field(ticket_obj.workflow_id)
         if flag is False:
             return False, format_custom_field_dict
-        format_custom_field_dict = format_custom_field_dict
-        custom_field_key_list = [key for key, value in format_custom_field_dict.items()]
+        unit_of_work.update_custom_field(
+            {key: value for key, value in update_dict.items() if key in format_custom_field_dict})
+        return True, ''
 
-        # 因为工单的自定义字段不会太多，且有可能是新增有可能是更新， 所以直接遍历处理
-        for key, value in update_dict.items():
-            if key in custom_field_key_list:
-                # 判断是否存在，如果存在则更新，如果不存在则新增
-                ticket_custom_field_queryset = TicketCustomField.objects.filter(
-                    ticket_id=ticket_id, field_key=key, is_deleted=0)
-                field_type_id = format_custom_field_dict[key]['field_type_id']
+    @classmethod
+    @auto_log
+    def save_ticket_custom_field(cls, ticket_obj: TicketRecord, update_dict: dict) -> tuple:
+        """
+        写入工单自定义字段的值, 已存在的记录更新，不存在的批量新增，值为None的删除
+        write ticket's custom field value, update existed records, bulk create new ones, delete those set to None
+        :param ticket_obj:
+        :param update_dict:
+        :return:
+        """
+        ticket_id = ticket_obj.id
+        flag, format_custom_field_dict = workflow_custom_field_service_ins \
+            .get_workflow_custom_field(ticket_obj.workflow_id)
+        if flag is False:
+            return False, format_custom_field_dict
+        update_dict = {key: value for key, value in update_dict.items() if key in format_custom_field_dict}
+        if not update_dict:
+            return True, ''
 
-                if update_dict.get(key) is None:
-                    # 值为None。说明此字段为可选，且用户未填写或者清空了该字段,需要清空字段
-                    if ticket_custom_field_queryset:
-                        # 已经存在，需要删除
-                        ticket_custom_field_queryset.update(is_deleted=1)
-                    else:
-                        # 不存在的，直接忽略
-                        pass
-                else:
-                    value_enum = constant_service_ins.FIELD_VALUE_ENUM
-
-                    if ticket_custom_field_queryset:
-                        ticket_custom_field_queryset.update(**{value_enum.get(field_type_id): update_dict.get(key)})
-
-                    elif not ticket_custom_field_queryset:
-                        new_dict = {
-                            'name': format_custom_field_dict[key]['field_name'],
-                            'ticket_id': ticket_id,
-                            'field_key': key,
-                            'field_type_id': field_type_id,
-                            value_enum[field_type_id]: update_dict.get(key)
-                        }
-                        new_ticket_custom_field_record = TicketCustomField(**new_dict)
-                        new_ticket_custom_field_record.save()
+        existed_key_set = set(TicketCustomField.objects.filter(
+            ticket_id=ticket_id, field_key__in=list(update_dict.keys()), is_deleted=0
+        ).values_list('field_key', flat=True))
+        value_enum = constant_service_ins.FIELD_VALUE_ENUM
+        insert_list = []
+        for key, value in update_dict.items():
+            field_type_id = format_custom_field_dict[key]['field_type_id']
+            if value is None:
+                # 值为None。说明此字段为可选，且用户未填写或者清空了该字段,需要清空字段, 不存在的直接忽略
+                if key in existed_key_set:
+                    TicketCustomField.objects.filter(ticket_id=ticket_id, field_key=key, is_deleted=0) \
+                        .update(is_deleted=1)
+            elif key in existed_key_set:
+                TicketCustomField.objects.filter(ticket_id=ticket_id, field_key=key, is_deleted=0) \
+                    .update(**{value_enum.get(field_type_id): value})
+            else:
+                insert_list.append(TicketCustomField(**{
+                    'name': format_custom_field_dict[key]['field_name'],
+                    'ticket_id': ticket_id,
+                    'field_key': key,
+                    'field_type_id': field_type_id,
+                    value_enum[field_type_id]: value
+                }))
+        if insert_list:
+            TicketCustomField.objects.bulk_create(insert_list)
         return True, ''
 
     @classmethod
@@ -568,7 +951,14 @@ class TicketBaseService(BaseService):
                 base_field_dict[key] = value
         # ticket base field
         if base_field_dict:
-            TicketRecord.objects.filter(id=ticket_id, is_deleted=0).update(**base_field_dict)
+            unit_of_work = ticket_unit_of_work_service_ins.get_current(ticket_id)
+            if unit_of_work:
+                for key, value in base_field_dict.items():
+                    setattr(unit_of_work.ticket_obj, key, value)
+                unit_of_work.mark_ticket_dirty()
+            else:
+                TicketRecord.objects.filter(id=ticket_id, is_deleted=0).update(**base_field_dict)
+                ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_id)
         # custom field
         cls.update_ticket_custom_field(ticket_id, update_dict)
 
@@ -591,6 +981,9 @@ class TicketBaseService(BaseService):
 
         if not kwargs.get('creator'):
             kwargs['creator'] = kwargs.get('participant', '')
+        if kwargs.get('ticket_data'):
+            kwargs['ticket_data'] = ticket_flow_log_data_service_ins.encode_ticket_data(
+                kwargs.get('ticket_id'), kwargs.get('ticket_data'))
         new_ticket_flow_log = TicketFlowLog(**kwargs)
         new_ticket_flow_log.save()
         return True, dict(new_ticket_flow_log_id=new_ticket_flow_log.id)
@@ -797,6 +1190,72 @@ class TicketBaseService(BaseService):
         :return:
         """
         ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
+        flag, result = cls.get_tickets_format_participant_info([ticket_obj])
+        if flag is False:
+            return False, result
+        return result[ticket_obj.id]
+
+    @classmethod
+    @auto_log
+    def get_tickets_format_participant_info(cls, ticket_obj_list: list) -> tuple:
+        """
+        批量获取工单格式化后的当前处理人信息, 涉及的用户、部门、角色、脚本各只查询一次
+        get format participant_info of tickets, users/depts/roles/scripts are loaded with one query each
+        :param ticket_obj_list:
+        :return: {ticket_id: (flag, participant_info)}
+        """
+        username_list, dept_id_list, role_id_list, script_id_list = [], [], [], []
+        for ticket_obj in ticket_obj_list:
+            participant_type_id = ticket_obj.participant_type_id
+            if participant_type_id in (constant_service_ins.PARTICIPANT_TYPE_PERSONAL,
+                                       constant_service_ins.PARTICIPANT_TYPE_MULTI):
+                username_list.extend(ticket_obj.participant.split(','))
+            elif participant_type_id == constant_service_ins.PARTICIPANT_TYPE_DEPT:
+                dept_id_list.append(int(ticket_obj.participant))
+            elif participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROLE:
+                role_id_list.append(int(ticket_obj.participant))
+            elif participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROBOT:
+                script_id_list.append(int(ticket_obj.participant))
+            if json.loads(ticket_obj.multi_all_person):
+                username_list.extend(json.loads(ticket_obj.multi_all_person).keys())
+
+        flag, user_dict = account_base_service_ins.get_user_dict_by_username_list(username_list)
+        if flag is False:
+            user_dict = {}
+        dept_dict, role_dict, script_dict = {}, {}, {}
+        if dept_id_list:
+            flag, dept_dict = account_base_service_ins.get_dept_dict_by_id_list(dept_id_list)
+            if flag is False:
+                return False, dept_dict
+        if role_id_list:
+            flag, role_dict = account_base_service_ins.get_role_dict_by_id_list(role_id_list)
+            if flag is False:
+                return False, role_dict
+        if script_id_list:
+            # 脚本类型参数与人是脚本记录的id
+            from apps.workflow.models import WorkflowScript
+            script_queryset = WorkflowScript.objects.filter(id__in=set(script_id_list), is_deleted=0).all()
+            script_dict = {script_obj.id: script_obj for script_obj in script_queryset}
+
+        participant_info_dict = {}
+        for ticket_obj in ticket_obj_list:
+            participant_info_dict[ticket_obj.id] = cls.format_ticket_participant_info(
+                ticket_obj, user_dict, dept_dict, role_dict, script_dict)
+        return True, participant_info_dict
+
+    @classmethod
+    def format_ticket_participant_info(cls, ticket_obj: object, user_dict: dict, dept_dict: dict, role_dict: dict,
+                                       script_dict: dict) -> tuple:
+        """
+        根据预先加载的用户、部门、角色、脚本信息格式化工单当前处理人信息，不做任何查询
+        format ticket's participant_info with preloaded users, depts, roles and scripts, no query
+        :param ticket_obj:
+        :param user_dict: {username: user_obj}
+        :param dept_dict: {dept_id: dept_obj}
+        :param role_dict: {role_id: role_obj}
+        :param script_dict: {script_id: script_obj}
+        :return:
+        """
         participant = ticket_obj.participant
         participant_name = ticket_obj.participant
         participant_type_id = ticket_obj.participant_type_id
@@ -804,9 +1263,8 @@ class TicketBaseService(BaseService):
         participant_alias = ''
         if participant_type_id == constant_service_ins.PARTICIPANT_TYPE_PERSONAL:
             participant_type_name = '个人'
-            # participant_user_obj, msg = AccountBaseService.get_user_by_username(participant)
-            flag, participant_user_obj = account_base_service_ins.get_user_by_username(participant)
-            if flag:
+            participant_user_obj = user_dict.get(participant)
+            if participant_user_obj:
                 participant_alias = participant_user_obj.alias
             else:
                 participant_alias = participant
@@ -816,8 +1274,8 @@ class TicketBaseService(BaseService):
             participant_name_list = participant_name.split(',')
             participant_alias_list = []
             for participant_name0 in participant_name_list:
-                flag, participant_user_obj = account_base_service_ins.get_user_by_username(participant_name0)
-                if flag:
+                participant_user_obj = user_dict.get(participant_name0)
+                if participant_user_obj:
                     participant_alias_list.append(participant_user_obj.alias)
                 else:
                     participant_alias_list.append(participant_name0)
@@ -826,25 +1284,20 @@ class TicketBaseService(BaseService):
 
         elif participant_type_id == constant_service_ins.PARTICIPANT_TYPE_DEPT:
             participant_type_name = '部门'
-            flag, dept_obj = account_base_service_ins.get_dept_by_id(int(ticket_obj.participant))
-            if flag is False:
-                return False, dept_obj
+            dept_obj = dept_dict.get(int(ticket_obj.participant))
             if not dept_obj:
                 return False, 'dept_id:{} is not existed or has been deleted'.format(ticket_obj.participant)
             participant_name = dept_obj.name
             participant_alias = participant_name
         elif participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROLE:
             participant_type_name = '角色'
-            flag, role_obj = account_base_service_ins.get_role_by_id(int(ticket_obj.participant))
-
-            if flag is False or (not role_obj):
+            role_obj = role_dict.get(int(ticket_obj.participant))
+            if not role_obj:
                 return False, 'role is not existed or has been deleted'
             participant_name = role_obj.name
             participant_alias = participant_name
         elif participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROBOT:
-            # 脚本类型参数与人是脚本记录的id
-            from apps.workflow.models import WorkflowScript
-            script_obj = WorkflowScript.objects.filter(id=int(participant), is_deleted=0).first()
+            script_obj = script_dict.get(int(participant))
             if script_obj:
                 participant_name = participant
                 participant_alias = '脚本:{}'.format(script_obj.name)
@@ -855,8 +1308,8 @@ class TicketBaseService(BaseService):
             multi_all_person_dict = json.loads(ticket_obj.multi_all_person)
             participant_alias0_list = []
             for key, value in multi_all_person_dict.items():
-                flag, participant_user_obj = account_base_service_ins.get_user_by_username(key)
-                if not flag:
+                participant_user_obj = user_dict.get(key)
+                if not participant_user_obj:
                     participant_alias0 = key
                 else:
                     participant_alias0 = participant_user_obj.alias
@@ -886,8 +1339,8 @@ class TicketBaseService(BaseService):
         :param by_hook: is by hook or not
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-        if not ticket_obj:
+        flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+        if flag is False:
             return False, '工单不存在或已被删除'
         ticket_state_id = ticket_obj.state_id
         flag, transition_queryset = workflow_transition_service_ins.get_state_transition_queryset(ticket_state_id)
@@ -1013,7 +1466,9 @@ class TicketBaseService(BaseService):
         if not result.get('permission'):
             return True, dict(transition_dict_list=[], msg=result.get('msg'))
 
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id).first()
+        flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+        if flag is False:
+            return False, ticket_obj
 
         if ticket_obj.in_add_node:
             # add node state, just allow 'finish' action, after finish the ticket's participant will be set add_node_man
@@ -1028,9 +1483,11 @@ class TicketBaseService(BaseService):
                                          attribute_type_id=constant_service_ins.TRANSITION_ATTRIBUTE_TYPE_OTHER)]
             return True, dict(transition_dict_list=transition_dict_list)
 
-        flag, transition_queryset = workflow_transition_service_ins.get_state_transition_queryset(ticket_obj.state_id)
+        flag, compiled_workflow = cls.get_ticket_compiled_workflow(ticket_obj)
+        if flag is False:
+            return False, compiled_workflow
         transition_dict_list = []
-        for transition in transition_queryset:
+        for transition in compiled_workflow.get_state_transitions(ticket_obj.state_id):
             transition_dict = dict(transition_id=transition.id, transition_name=transition.name,
                                    field_require_check=transition.field_require_check, is_accept=False,
                                    in_add_node=False, alert_enable=transition.alert_enable,
@@ -1043,6 +1500,49 @@ class TicketBaseService(BaseService):
     def handle_ticket(cls, ticket_id: int, request_data_dict: dict, by_timer: bool = False, by_task: bool = False,
                       by_hook: bool = False):
         """
+        处理工单, 工单状态、字段、处理人、流转记录在同一个事务中写入，处理期间锁定工单记录，
+        并发处理时后到的请求等待锁释放后基于最新的工单状态处理. 遇到死锁或锁等待超时时重试，处理失败时回滚
+        handle ticket in one transaction with the ticket row locked. retry on deadlock or lock wait timeout,
+        rollback when the handle failed
+        :param ticket_id:
+        :param request_data_dict:
+        :param by_timer:  by timer transition
+        :param by_task: by script task transition
+        :param by_hook: by hook transition
+        :return:
+        """
+        return cls.run_in_transaction(cls.handle_ticket_in_transaction, ticket_id, request_data_dict, by_timer,
+                                      by_task, by_hook)
+
+    @classmethod
+    def run_in_transaction(cls, func, *args):
+        """
+        在事务中执行func, func返回False时回滚. 遇到死锁或锁等待超时时重试,
+        已处于事务中时(如子工单结束时自动处理父工单)由外层事务负责重试
+        run func in a transaction, rollback when it returns False, retry on deadlock or lock wait timeout
+        :param func: 返回(flag, result)的方法
+        :param args:
+        :return:
+        """
+        retry_count = 0 if transaction.get_connection().in_atomic_block else settings.TICKET_HANDLE_RETRY_COUNT
+        for retry_index in range(retry_count + 1):
+            try:
+                with transaction.atomic():
+                    flag, result = func(*args)
+                    if flag is False:
+                        transaction.set_rollback(True)
+                    return flag, result
+            except OperationalError as e:
+                # 连接断开、sql错误等其他错误不重试
+                if retry_index >= retry_count or not e.args or e.args[0] not in cls.RETRY_ERROR_CODE_LIST:
+                    raise
+                logger.warning('{} conflicted, retry {}'.format(func.__name__, retry_index + 1))
+                time.sleep(random.uniform(0.05, 0.2) * (retry_index + 1))
+
+    @classmethod
+    def handle_ticket_in_transaction(cls, ticket_id: int, request_data_dict: dict, by_timer: bool = False,
+                                     by_task: bool = False, by_hook: bool = False):
+        """
         处理工单:校验必填参数,获取当前状态必填字段，更新工单基础字段，更新工单自定义字段， 更新工单流转记录，执行必要的脚本，通知消息
         此处逻辑和新建工单有较多重复，下个版本会拆出来
         handle ticket, include params check,update base field, update custom field, update ticket flowlog,
@@ -1060,150 +1560,154 @@ class TicketBaseService(BaseService):
 
         if not (transition_id and username):
             return False, '参数不合法,请提供username，transition_id'
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=False).first()
-        source_ticket_state_id = ticket_obj.state_id
-        if not ticket_obj:
-            return False, '工单不存在或已被删除'
-
-        # 判断用户是否有权限处理该工单
-        flag, result = cls.ticket_handle_permission_check(ticket_id, username, by_timer, by_task, by_hook)
-        if flag is False:
-            return False, result
-        if result.get('permission') is False:
-            return False, result.get('msg')
-        if result.get('need_accept'):
-            return False, '需要先接单再处理'
-        if result.get('in_add_node'):
-            return False, '工单当前处于加签中，只允许加签完成操作'
-
-        flag, state_obj = workflow_state_service_ins.get_workflow_state_by_id(ticket_obj.state_id)
-        if flag is False:
-            return False, state_obj
-
-        # 获取初始状态必填字段 及允许更新的字段
-        flag, state_info_dict = cls.get_state_field_info(state_obj.id)
-        require_field_list = state_info_dict.get('require_field_list', [])
-        update_field_list = state_info_dict.get('update_field_list', [])
-
-        # 校验是否所有必填字段都有提供，如果transition_id对应设置为不校验必填则直接通过
-        flag, req_transition_obj = workflow_transition_service_ins.get_workflow_transition_by_id(transition_id)
-        if req_transition_obj.field_require_check:
-
-            request_field_arg_list = [key for key, value in request_data_dict.items()
-                                      if (key not in ['workflow_id', 'suggestion', 'username'])]
-            for require_field in require_field_list:
-                if require_field not in request_field_arg_list:
-                    return False, '此工单的必填字段为:{}'.format(','.join(require_field_list))
-
-        flag, msg = cls.get_next_state_id_by_transition_and_ticket_info(ticket_id, request_data_dict)
-        if flag:
-            destination_state_id = msg.get('destination_state_id')
-        else:
-            return False, msg
-
-        flag, destination_state = workflow_state_service_ins.get_workflow_state_by_id(destination_state_id)
-
-        # 判断当前处理人类型是否为全部处理，如果处理类型为全部处理（根据json.loads(ticket_obj.multi_all_person)来判断），且有人未处理，则工单状态不变，只记录处理过程
-        if json.loads(ticket_obj.multi_all_person):
-            multi_all_person = ticket_obj.multi_all_person
-            multi_all_person_dict = json.loads(multi_all_person)
-            flag, result = common_service_ins.get_dict_blank_or_false_value_key_list(multi_all_person_dict)
-            if flag and result.get('result_list'):
-                multi_all_person_dict[username] = dict(transition_id=transition_id,
-                                                       transition_name=req_transition_obj.name)
-                has_all_same_value, msg = common_service_ins.check_dict_has_all_same_value(multi_all_person_dict)
-                if has_all_same_value:
-                    # 所有人处理的transition都一致,则工单进入下个状态
-                    flag, participant_info = cls.get_ticket_state_participant_info(destination_state_id, ticket_id,
-                                                                                   ticket_req_dict=request_data_dict)
-                    if not flag:
-                        return False, participant_info
-                    destination_participant_type_id = participant_info.get('destination_participant_type_id', 0)
-                    destination_participant = participant_info.get('destination_participant', '')
-                    multi_all_person = '{}'
-                else:
-                    # 处理人没有没有全部处理完成或者处理动作不一致
-                    destination_participant_type_id = ticket_obj.participant_type_id
-                    flag, result = common_service_ins.get_dict_blank_or_false_value_key_list(multi_all_person_dict)
-                    destination_participant = ','.join(result.get('result_list'))
-                    destination_state_id = ticket_obj.state_id  # 保持原状态
-                    flag, destination_state = workflow_state_service_ins.get_workflow_state_by_id(destination_state_id)
-                    multi_all_person = json.dumps(multi_all_person_dict)
-
-        else:
-            # 当前处理人类型非全部处理
-            # flag, destination_state = workflow_state_service_ins.get_workflow_state_by_id(destination_state_id)
-            # if not destination_state:
-            #     return False, msg
-            # 获取目标状态的信息
-            flag, participant_info = cls.get_ticket_state_participant_info(destination_state_id, ticket_id,
-                                                                           ticket_req_dict=request_data_dict)
-            if not flag:
-                return False, participant_info
-            destination_participant_type_id = participant_info.get('destination_participant_type_id', 0)
-            destination_participant = participant_info.get('destination_participant', '')
-            multi_all_person = participant_info.get('multi_all_person', '')
-            # 如果开启了了记忆最后处理人,且当前状态非全部处理中，那么处理人为之前的处理人
-            if destination_state.remember_last_man_enable and multi_all_person == '{}':
-                # 获取此状态的最后处理人
-                flag, result = cls.get_ticket_state_last_man(ticket_id, destination_state.id)
-                if not flag and result.get('last_man'):
-                    destination_participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
-                    destination_participant = result.get('last_man')
-
-        # 更新工单信息：基础字段及自定义字段， add_relation字段 需要下个处理人是部门、角色等的情况
-        ticket_obj.state_id = destination_state_id
-        ticket_obj.participant_type_id = destination_participant_type_id
-        ticket_obj.participant = destination_participant
-        ticket_obj.multi_all_person = multi_all_person
-        if destination_state.type_id == constant_service_ins.STATE_TYPE_END:
-            ticket_obj.act_state_id = constant_service_ins.TICKET_ACT_STATE_FINISH
-        elif destination_state.type_id == constant_service_ins.STATE_TYPE_START:
-            ticket_obj.act_state_id = constant_service_ins.TICKET_ACT_STATE_DRAFT
-        else:
-            ticket_obj.act_state_id = constant_service_ins.TICKET_ACT_STATE_ONGOING
-
-        if req_transition_obj.attribute_type_id == constant_service_ins.TRANSITION_ATTRIBUTE_TYPE_REFUSE:
-            ticket_obj.act_state_id = constant_service_ins.TICKET_ACT_STATE_BACK
-
-        ticket_obj.save()
-
-        # 记录处理过的人
-        if not (by_timer or by_task or by_hook):
-            cls.update_ticket_worked(ticket_id, username)
-
-        # 更新工单信息：基础字段及自定义字段， add_relation字段 需要考虑下个处理人是部门、角色等的情况
-        flag, result = cls.get_ticket_dest_relation(destination_participant_type_id, destination_participant)
-
-        if flag and result.get('add_relation'):
-            cls.update_ticket_relation(ticket_id, result.get('add_relation'))  # 更新关系人信息
+        # 工单工作单元: 处理过程中工单记录、字段值、工作流快照只加载一次，修改在退出时统一写入
+        with ticket_unit_of_work_service_ins.begin(ticket_id, lock=True) as unit_of_work:
+            if unit_of_work is None:
+                return False, '工单不存在或已被删除'
+            ticket_obj = unit_of_work.ticket_obj
+            source_ticket_state_id = ticket_obj.state_id
+
+            # 判断用户是否有权限处理该工单
+            flag, result = cls.ticket_handle_permission_check(ticket_id, username, by_timer, by_task, by_hook)
+            if flag is False:
+                return False, result
+            if result.get('permission') is False:
+                return False, result.get('msg')
+            if result.get('need_accept'):
+                return False, '需要先接单再处理'
+            if result.get('in_add_node'):
+                return False, '工单当前处于加签中，只允许加签完成操作'
+
+            compiled_workflow = unit_of_work.compiled_workflow
+            state_obj = compiled_workflow.get_state(ticket_obj.state_id)
+            if not state_obj:
+                return False, '工单状态不存在或已被删除'
+
+            # 获取初始状态必填字段 及允许更新的字段
+            state_info_dict = compiled_workflow.get_state_field_info(state_obj.id)
+            require_field_list = state_info_dict.get('require_field_list', [])
+            update_field_list = state_info_dict.get('update_field_list', [])
+
+            # 校验是否所有必填字段都有提供，如果transition_id对应设置为不校验必填则直接通过
+            req_transition_obj = compiled_workflow.get_transition(transition_id, state_obj.id)
+            if not req_transition_obj:
+                return False, 'transition_id is invalid'
+            if req_transition_obj.field_require_check:
+
+                request_field_arg_list = [key for key, value in request_data_dict.items()
+                                          if (key not in ['workflow_id', 'suggestion', 'username'])]
+                for require_field in require_field_list:
+                    if require_field not in request_field_arg_list:
+                        return False, '此工单的必填字段为:{}'.format(','.join(require_field_list))
+
+            flag, msg = cls.get_next_state_id_by_transition_and_ticket_info(ticket_id, request_data_dict)
+            if flag:
+                destination_state_id = msg.get('destination_state_id')
+            else:
+                return False, msg
 
-        # 只更新需要更新的字段
-        update_field_dict = {}
-        for key, value in request_data_dict.items():
-            if key in update_field_list:
-                update_field_dict[key] = value
+            destination_state = compiled_workflow.get_state(destination_state_id)
+            if not destination_state:
+                return False, 'destination state is not existed or has been deleted'
+
+            # 判断当前处理人类型是否为全部处理，如果处理类型为全部处理（根据json.loads(ticket_obj.multi_all_person)来判断），且有人未处理，则工单状态不变，只记录处理过程
+            if json.loads(ticket_obj.multi_all_person):
+                multi_all_person = ticket_obj.multi_all_person
+                multi_all_person_dict = json.loads(multi_all_person)
+                flag, result = common_service_ins.get_dict_blank_or_false_value_key_list(multi_all_person_dict)
+                if flag and result.get('result_list'):
+                    multi_all_person_dict[username] = dict(transition_id=transition_id,
+                                                           transition_name=req_transition_obj.name)
+                    has_all_same_value, msg = common_service_ins.check_dict_has_all_same_value(multi_all_person_dict)
+                    if has_all_same_value:
+                        # 所有人处理的transition都一致,则工单进入下个状态
+                        flag, participant_info = cls.get_ticket_state_participant_info(destination_state_id, ticket_id,
+                                                                                       ticket_req_dict=request_data_dict)
+                        if not flag:
+                            return False, participant_info
+                        destination_participant_type_id = participant_info.get('destination_participant_type_id', 0)
+                        destination_participant = participant_info.get('destination_participant', '')
+                        multi_all_person = '{}'
+                    else:
+                        # 处理人没有没有全部处理完成或者处理动作不一致
+                        destination_participant_type_id = ticket_obj.participant_type_id
+                        flag, result = common_service_ins.get_dict_blank_or_false_value_key_list(multi_all_person_dict)
+                        destination_participant = ','.join(result.get('result_list'))
+                        destination_state_id = ticket_obj.state_id  # 保持原状态
+                        destination_state = state_obj
+                        multi_all_person = json.dumps(multi_all_person_dict)
 
-        cls.update_ticket_field_value(ticket_id, update_field_dict)
-        # 更新工单流转记录，执行必要的脚本，通知消息
-        flag, result = cls.get_ticket_all_field_value_json(ticket_id)
-        if flag is False:
-            return False, result
-        ticket_all_data = result.get('all_field_value_json')
+            else:
+                # 当前处理人类型非全部处理
+                # flag, destination_state = workflow_state_service_ins.get_workflow_state_by_id(destination_state_id)
+                # if not destination_state:
+                #     return False, msg
+                # 获取目标状态的信息
+                flag, participant_info = cls.get_ticket_state_participant_info(destination_state_id, ticket_id,
+                                                                               ticket_req_dict=request_data_dict)
+                if not flag:
+                    return False, participant_info
+                destination_participant_type_id = participant_info.get('destination_participant_type_id', 0)
+                destination_participant = participant_info.get('destination_participant', '')
+                multi_all_person = participant_info.get('multi_all_person', '')
+                # 如果开启了了记忆最后处理人,且当前状态非全部处理中，那么处理人为之前的处理人
+                if destination_state.remember_last_man_enable and multi_all_person == '{}':
+                    # 获取此状态的最后处理人
+                    flag, result = cls.get_ticket_state_last_man(ticket_id, destination_state.id)
+                    if not flag and result.get('last_man'):
+                        destination_participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
+                        destination_participant = result.get('last_man')
+
+            # 更新工单信息：基础字段及自定义字段， add_relation字段 需要下个处理人是部门、角色等的情况
+            ticket_obj.state_id = destination_state_id
+            ticket_obj.state_version += 1
+            ticket_obj.participant_type_id = destination_participant_type_id
+            ticket_obj.participant = destination_participant
+            ticket_obj.multi_all_person = multi_all_person
+            old_act_state_id = ticket_obj.act_state_id
+            ticket_obj.act_state_id = cls.get_act_state_id(destination_state, req_transition_obj)
+
+            cls.save_ticket(ticket_obj)
+            ticket_statistics_service_ins.update_tickets_act_state([(ticket_obj, old_act_state_id)])
+            ticket_sla_service_ins.enter_state([(ticket_obj, destination_state)])
+
+            # 记录处理过的人
+            if not (by_timer or by_task or by_hook):
+                cls.update_ticket_worked(ticket_id, username)
+
+            # 更新工单信息：基础字段及自定义字段， add_relation字段 需要考虑下个处理人是部门、角色等的情况
+            flag, result = cls.get_ticket_dest_relation(destination_participant_type_id, destination_participant)
+
+            if flag and result.get('add_relation'):
+                cls.update_ticket_relation(ticket_id, result.get('add_relation'))  # 更新关系人信息
+
+            # 只更新需要更新的字段
+            update_field_dict = {}
+            for key, value in request_data_dict.items():
+                if key in update_field_list:
+                    update_field_dict[key] = value
+
+            cls.update_ticket_field_value(ticket_id, update_field_dict)
+            # 更新工单流转记录，执行必要的脚本，通知消息
+            flag, result = cls.get_ticket_all_field_value_json(ticket_id)
+            if flag is False:
+                return False, result
+            ticket_all_data = result.get('all_field_value_json')
 
-        if not by_task:
-            # 脚本执行完自动触发的流转，因为在run_flow_task已经有记录操作日志，所以此次不再记录
-            cls.add_ticket_flow_log(dict(ticket_id=ticket_id, transition_id=transition_id, suggestion=suggestion,
-                                         participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL,
-                                         participant=username, state_id=source_ticket_state_id, creator=username,
-                                         ticket_data=json.dumps(ticket_all_data)))
+            if not by_task:
+                # 脚本执行完自动触发的流转，因为在run_flow_task已经有记录操作日志，所以此次不再记录
+                flag, result = cls.add_ticket_flow_log(dict(
+                    ticket_id=ticket_id, transition_id=transition_id, suggestion=suggestion,
+                    participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL, participant=username,
+                    state_id=source_ticket_state_id, creator=username, ticket_data=ticket_all_data))
+                if flag is False:
+                    return False, result
 
         # 通知消息
-        from tasks import send_ticket_notice
-        send_ticket_notice.apply_async(args=[ticket_id], queue='loonflow')
+        cls.send_ticket_notice_on_commit([ticket_id])
 
         # 定时器逻辑
-        cls.handle_timer_transition(ticket_id, destination_state_id)
+        cls.handle_timer_transition(ticket_id, destination_state_id, ticket_obj.workflow_id)
 
         # 父工单逻辑处理
         if destination_state.type_id == constant_service_ins.STATE_TYPE_END and ticket_obj.parent_ticket_id \
@@ -1239,15 +1743,326 @@ class TicketBaseService(BaseService):
 
         if destination_participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROBOT:
             from tasks import run_flow_task  # 放在文件开头会存在循环引用
-            run_flow_task.apply_async(args=[ticket_id, destination_participant, destination_state_id], queue='loonflow')
+            cls.apply_async_on_commit(run_flow_task, args=[ticket_id, destination_participant, destination_state_id],
+                                      queue='loonflow')
 
         # 如果下个状态是hook，开始触发hook
         if destination_participant_type_id == constant_service_ins.PARTICIPANT_TYPE_HOOK:
-            from tasks import flow_hook_task  # 放在文件开头会存在循环引用
-            flow_hook_task.apply_async(args=[ticket_id], queue='loonflow')
+            cls.add_hook_delivery(ticket_id, destination_state_id)
 
         return True, ''
 
+    @classmethod
+    @auto_log
+    def handle_ticket_batch(cls, handle_data_list: list, username: str, app_name: str = '') -> tuple:
+        """
+        批量处理工单: 一个事务中锁定并加载所有工单及自定义字段值，工作流快照、状态、流转、处理人按工作流及状态共享，
+        工单状态、关系人、自定义字段、流转记录批量写入. 全部处理、记忆最后处理人、子工单结束等场景逐个走handle_ticket.
+        返回每个工单的处理结果, 工单不存在或调用方无权限时只有该工单失败
+        handle tickets in batch, return result of each ticket
+        :param handle_data_list: [{'ticket_id': 1, 'transition_id': 1, 'suggestion': '', 'fields': {}}]
+        :param username:
+        :param app_name: 调用源app_name, 提供时逐个校验调用方对工单所属工作流的权限
+        :return:
+        """
+        if not (username and handle_data_list):
+            return False, '参数不合法,请提供username，ticket_list'
+        if len(handle_data_list) > settings.TICKET_BATCH_MAX_SIZE:
+            return False, '一次最多处理{}个工单'.format(settings.TICKET_BATCH_MAX_SIZE)
+        return cls.run_in_transaction(cls.handle_ticket_batch_in_transaction, handle_data_list, username, app_name)
+
+    @classmethod
+    def handle_ticket_batch_in_transaction(cls, handle_data_list: list, username: str, app_name: str = '') -> tuple:
+        """
+        批量处理工单, 需要在事务中调用
+        :param handle_data_list:
+        :param username:
+        :param app_name:
+        :return:
+        """
+        ticket_id_list = [handle_data.get('ticket_id') for handle_data in handle_data_list]
+        # 按id顺序加锁，避免并发批量处理时死锁
+        ticket_obj_list = list(TicketRecord.objects.select_for_update().filter(
+            id__in=ticket_id_list, is_deleted=0).order_by('id'))
+        ticket_obj_dict = {ticket_obj.id: ticket_obj for ticket_obj in ticket_obj_list}
+        flag, custom_field_value_dict = cls.get_tickets_custom_field_value(ticket_obj_list)
+        if flag is False:
+            return False, custom_field_value_dict
+
+        result_list = []
+        plan_list = []
+        fallback_list = []
+        cache_dict = dict(participant_info={}, relation={})
+        for handle_data in handle_data_list:
+            ticket_id = handle_data.get('ticket_id')
+            result = dict(ticket_id=ticket_id, result=False, msg='')
+            result_list.append(result)
+            ticket_obj = ticket_obj_dict.pop(ticket_id, None)
+            if not ticket_obj:
+                result['msg'] = '工单不存在或已被删除, 或在本次请求中重复出现'
+                continue
+            if app_name:
+                flag, msg = account_base_service_ins.app_workflow_permission_check(app_name, ticket_obj.workflow_id)
+                if flag is False:
+                    result['msg'] = msg
+                    continue
+            request_data_dict = dict(handle_data.get('fields') or {}, transition_id=handle_data.get('transition_id'),
+                                     suggestion=handle_data.get('suggestion', ''), username=username)
+            with ticket_unit_of_work_service_ins.begin(ticket_id, ticket_obj,
+                                                       custom_field_value_dict=custom_field_value_dict[ticket_id]):
+                flag, plan = cls.get_ticket_handle_plan(ticket_obj, request_data_dict, cache_dict)
+            if flag is False:
+                result['msg'] = plan
+            elif plan is None:
+                fallback_list.append((result, request_data_dict))
+            else:
+                plan.update(result=result, custom_field_value_dict=custom_field_value_dict[ticket_id])
+                plan_list.append(plan)
+
+        if plan_list:
+            cls.save_ticket_handle_plan_list(plan_list, username)
+        for result, request_data_dict in fallback_list:
+            flag, msg = cls.handle_ticket(result['ticket_id'], request_data_dict)
+            result.update(result=flag is not False, msg=msg)
+        return True, result_list
+
+    @classmethod
+    def get_ticket_handle_plan(cls, ticket_obj: TicketRecord, request_data_dict: dict, cache_dict: dict) -> tuple:
+        """
+        计算批量处理中单个工单的处理结果(目标状态、处理人、关系人、需更新的字段)，不写数据库.
+        需要逐个处理的工单返回None
+        :param ticket_obj:
+        :param request_data_dict:
+        :param cache_dict: 批量处理中共享的处理人、关系人缓存
+        :return:
+        """
+        ticket_id = ticket_obj.id
+        username = request_data_dict.get('username')
+        transition_id = request_data_dict.get('transition_id')
+        if not transition_id:
+            return False, '参数不合法,请提供transition_id'
+        if json.loads(ticket_obj.multi_all_person or '{}'):
+            # 全部处理中的工单需要记录每个人的处理结果，逐个处理
+            return True, None
+
+        flag, result = cls.ticket_handle_permission_check(ticket_id, username)
+        if flag is False:
+            return False, result
+        if result.get('permission') is False:
+            return False, result.get('msg')
+        if result.get('need_accept'):
+            return False, '需要先接单再处理'
+        if result.get('in_add_node'):
+            return False, '工单当前处于加签中，只允许加签完成操作'
+
+        flag, compiled_workflow = cls.get_ticket_compiled_workflow(ticket_obj)
+        if flag is False:
+            return False, compiled_workflow
+        state_obj = compiled_workflow.get_state(ticket_obj.state_id)
+        if not state_obj:
+            return False, '工单状态不存在或已被删除'
+        state_info_dict = compiled_workflow.get_state_field_info(state_obj.id)
+        require_field_list = state_info_dict.get('require_field_list', [])
+        update_field_list = state_info_dict.get('update_field_list', [])
+        req_transition_obj = compiled_workflow.get_transition(transition_id, state_obj.id)
+        if not req_transition_obj:
+            return False, 'transition_id is invalid'
+        if req_transition_obj.field_require_check:
+            for require_field in require_field_list:
+                if require_field not in request_data_dict:
+                    return False, '此工单的必填字段为:{}'.format(','.join(require_field_list))
+
+        flag, msg = cls.get_next_state_id_by_transition_and_ticket_info(ticket_id, request_data_dict)
+        if flag is False:
+            return False, msg
+        destination_state = compiled_workflow.get_state(msg.get('destination_state_id'))
+        if not destination_state:
+            return False, 'destination state is not existed or has been deleted'
+        if destination_state.remember_last_man_enable or (
+                destination_state.type_id == constant_service_ins.STATE_TYPE_END and ticket_obj.parent_ticket_id):
+            # 记忆最后处理人、子工单结束需要联动父工单, 逐个处理
+            return True, None
+
+        # 处理人不依赖工单字段时, 同一目标状态、同一创建人的工单处理人相同
+        participant_cache_key = None
+        if destination_state.participant_type_id not in (constant_service_ins.PARTICIPANT_TYPE_FIELD,
+                                                         constant_service_ins.PARTICIPANT_TYPE_PARENT_FIELD):
+            participant_cache_key = (destination_state.id, ticket_obj.creator)
+        participant_info = cache_dict['participant_info'].get(participant_cache_key)
+        if participant_info is None:
+            flag, participant_info = cls.get_ticket_state_participant_info(destination_state.id, ticket_id,
+                                                                           ticket_req_dict=request_data_dict)
+            if flag is False:
+                return False, participant_info
+            if participant_cache_key:
+                cache_dict['participant_info'][participant_cache_key] = participant_info
+        destination_participant_type_id = participant_info.get('destination_participant_type_id', 0)
+        destination_participant = participant_info.get('destination_participant', '')
+        multi_all_person = participant_info.get('multi_all_person', '{}')
+        if isinstance(multi_all_person, dict):
+            # 已有工单的处理人信息中为json.loads后的值, 与handle_ticket写入的字符串保持一致
+            multi_all_person = json.dumps(multi_all_person)
+
+        relation_cache_key = (destination_participant_type_id, destination_participant)
+        if relation_cache_key not in cache_dict['relation']:
+            flag, result = cls.get_ticket_dest_relation(destination_participant_type_id, destination_participant)
+            cache_dict['relation'][relation_cache_key] = result.get('add_relation', '') if flag else ''
+
+        return True, dict(
+            ticket_obj=ticket_obj, transition_id=transition_id, source_state_id=ticket_obj.state_id,
+            destination_state=destination_state, destination_participant_type_id=destination_participant_type_id,
+            destination_participant=destination_participant,
+            act_state_id=cls.get_act_state_id(destination_state, req_transition_obj),
+            multi_all_person=multi_all_person, suggestion=request_data_dict.get('suggestion') or '',
+            relation_user_list=[user for user in cache_dict['relation'][relation_cache_key].split(',') if user],
+            update_field_dict={key: value for key, value in request_data_dict.items() if key in update_field_list})
+
+    @classmethod
+    def save_ticket_handle_plan_list(cls, plan_list: list, username: str):
+        """
+        批量写入工单处理结果: 工单基础字段按相同的更新值合并更新，关系人、自定义字段、流转记录批量写入
+        persist the handle plans in bulk
+        :param plan_list:
+        :param username:
+        :return:
+        """
+        now = datetime.datetime.now()
+        ticket_update_dict = {}
+        ticket_act_state_list = []
+        for plan in plan_list:
+            ticket_obj = plan['ticket_obj']
+            ticket_act_state_list.append((ticket_obj, ticket_obj.act_state_id))
+            relation_set = set(ticket_obj.relation.split(',') + plan['relation_user_list'])
+            ticket_obj.relation = ','.join([relation for relation in relation_set if relation])
+            ticket_obj.state_id = plan['destination_state'].id
+            ticket_obj.state_version += 1
+            ticket_obj.participant_type_id = plan['destination_participant_type_id']
+            ticket_obj.participant = plan['destination_participant']
+            ticket_obj.multi_all_person = plan['multi_all_person']
+            ticket_obj.act_state_id = plan['act_state_id']
+            ticket_obj.gmt_modified = now
+            # 状态允许修改的基础字段(如标题), 与handle_ticket一致在流转信息之后写入
+            base_field_dict = {key: value for key, value in plan['update_field_dict'].items()
+                               if key in constant_service_ins.TICKET_BASE_FIELD_LIST}
+            for key, value in base_field_dict.items():
+                setattr(ticket_obj, key, value)
+            update_key = (ticket_obj.state_id, ticket_obj.participant_type_id, ticket_obj.participant,
+                          ticket_obj.multi_all_person, ticket_obj.act_state_id, ticket_obj.relation)
+            if base_field_dict:
+                # 各工单的基础字段值不同, 单独更新
+                update_dict = dict(zip(('state_id', 'participant_type_id', 'participant', 'multi_all_person',
+                                        'act_state_id', 'relation'), update_key), gmt_modified=now)
+                update_dict.update(base_field_dict)
+                TicketRecord.objects.filter(id=ticket_obj.id).update(state_version=F('state_version') + 1,
+                                                                     **update_dict)
+            else:
+                ticket_update_dict.setdefault(update_key, []).append(ticket_obj.id)
+        for update_key, ticket_id_list in ticket_update_dict.items():
+            state_id, participant_type_id, participant, multi_all_person, act_state_id, relation = update_key
+            TicketRecord.objects.filter(id__in=ticket_id_list).update(
+                state_id=state_id, participant_type_id=participant_type_id, participant=participant,
+                multi_all_person=multi_all_person, act_state_id=act_state_id, relation=relation,
+                state_version=F('state_version') + 1, gmt_modified=now)
+        ticket_statistics_service_ins.update_tickets_act_state(ticket_act_state_list)
+        ticket_sla_service_ins.enter_state([(plan['ticket_obj'], plan['destination_state']) for plan in plan_list])
+
+        # 工单关系人: 记录处理过的人，更新待处理人
+        ticket_id_list = [plan['ticket_obj'].id for plan in plan_list]
+        worked_ticket_id_set = set(TicketUser.objects.filter(
+            ticket_id__in=ticket_id_list, username=username, is_deleted=0).values_list('ticket_id', flat=True))
+        TicketUser.objects.filter(ticket_id__in=list(worked_ticket_id_set), username=username, is_deleted=0) \
+            .update(worked=True)
+        TicketUser.objects.bulk_create([
+            TicketUser(ticket_id=ticket_id, username=username, in_process=False, worked=True)
+            for ticket_id in ticket_id_list if ticket_id not in worked_ticket_id_set])
+        existed_ticket_user_set = set(TicketUser.objects.filter(ticket_id__in=ticket_id_list).values_list(
+            'ticket_id', 'username'))
+        relation_ticket_dict = {}
+        ticket_user_list = []
+        for plan in plan_list:
+            ticket_id = plan['ticket_obj'].id
+            relation_ticket_dict.setdefault(tuple(sorted(plan['relation_user_list'])), []).append(ticket_id)
+            for relation_user in plan['relation_user_list']:
+                if (ticket_id, relation_user) not in existed_ticket_user_set:
+                    ticket_user_list.append(TicketUser(ticket_id=ticket_id, username=relation_user, in_process=True))
+        for relation_user_tuple, relation_ticket_id_list in relation_ticket_dict.items():
+            TicketUser.objects.filter(ticket_id__in=relation_ticket_id_list, username__in=relation_user_tuple) \
+                .update(in_process=True)
+            TicketUser.objects.filter(ticket_id__in=relation_ticket_id_list) \
+                .exclude(username__in=relation_user_tuple).update(in_process=False)
+        TicketUser.objects.bulk_create(ticket_user_list)
+        ticket_inbox_service_ins.sync_tickets_inbox(ticket_id_list)
+
+        # 自定义字段: 已存在的更新，不存在的批量新增，值为None的删除
+        value_enum = constant_service_ins.FIELD_VALUE_ENUM
+        workflow_custom_field_dict = {}
+        custom_field_key_set = set()
+        for plan in plan_list:
+            workflow_id = plan['ticket_obj'].workflow_id
+            if workflow_id not in workflow_custom_field_dict:
+                flag, result = workflow_custom_field_service_ins.get_workflow_custom_field(workflow_id)
+                if flag is False:
+                    raise Exception(result)
+                workflow_custom_field_dict[workflow_id] = result
+            plan['update_field_dict'] = {key: value for key, value in plan['update_field_dict'].items()
+                                         if key in workflow_custom_field_dict[workflow_id]}
+            custom_field_key_set.update(plan['update_field_dict'].keys())
+        existed_custom_field_set = set()
+        if custom_field_key_set:
+            existed_custom_field_set = set(TicketCustomField.objects.filter(
+                ticket_id__in=ticket_id_list, field_key__in=list(custom_field_key_set), is_deleted=0
+            ).values_list('ticket_id', 'field_key'))
+        ticket_custom_field_list = []
+        for plan in plan_list:
+            ticket_id = plan['ticket_obj'].id
+            format_custom_field_dict = workflow_custom_field_dict[plan['ticket_obj'].workflow_id]
+            for key, value in plan['update_field_dict'].items():
+                field_type_id = format_custom_field_dict[key]['field_type_id']
+                if value is None:
+                    TicketCustomField.objects.filter(ticket_id=ticket_id, field_key=key, is_deleted=0) \
+                        .update(is_deleted=1)
+                elif (ticket_id, key) in existed_custom_field_set:
+                    TicketCustomField.objects.filter(ticket_id=ticket_id, field_key=key, is_deleted=0) \
+                        .update(**{value_enum[field_type_id]: value})
+                else:
+                    ticket_custom_field_list.append(TicketCustomField(**{
+                        'name': format_custom_field_dict[key]['field_name'], 'ticket_id': ticket_id,
+                        'field_key': key, 'field_type_id': field_type_id, value_enum[field_type_id]: value}))
+                plan['custom_field_value_dict'][key] = value
+        TicketCustomField.objects.bulk_create(ticket_custom_field_list)
+
+        # 流转记录，记录流转时工单所有字段的值
+        ticket_flow_log_list = []
+        for plan in plan_list:
+            field_value_info = plan['ticket_obj'].get_dict()
+            field_value_info.update(plan['custom_field_value_dict'])
+            for key, value in field_value_info.items():
+                if type(value) not in [int, str, bool, float]:
+                    field_value_info[key] = str(value)
+            suggestion = plan['suggestion']
+            if len(suggestion) > 1000:
+                suggestion = '{}...(be truncated because More than 1000)'.format(suggestion[:960])
+            ticket_flow_log_list.append(TicketFlowLog(
+                ticket_id=plan['ticket_obj'].id, transition_id=plan['transition_id'], suggestion=suggestion,
+                participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL, participant=username,
+                state_id=plan['source_state_id'],
+                ticket_data=ticket_flow_log_data_service_ins.encode_full(field_value_info), creator=username))
+        TicketFlowLog.objects.bulk_create(ticket_flow_log_list)
+
+        # 通知消息合并为一个任务, 脚本、hook、定时器逐个工单触发
+        cls.send_ticket_notice_on_commit(ticket_id_list)
+        for plan in plan_list:
+            ticket_id = plan['ticket_obj'].id
+            destination_state_id = plan['destination_state'].id
+            if plan['destination_participant_type_id'] == constant_service_ins.PARTICIPANT_TYPE_ROBOT:
+                from tasks import run_flow_task  # 放在文件开头会存在循环引用
+                cls.apply_async_on_commit(run_flow_task, args=[ticket_id, plan['destination_participant'],
+                                                               destination_state_id], queue='loonflow')
+            if plan['destination_participant_type_id'] == constant_service_ins.PARTICIPANT_TYPE_HOOK:
+                cls.add_hook_delivery(ticket_id, destination_state_id)
+            cls.handle_timer_transition(ticket_id, destination_state_id, plan['ticket_obj'].workflow_id)
+            plan['result'].update(result=True, msg='')
+
     @classmethod
     @auto_log
     def add_ticket_relation(cls, ticket_id: int, user_str: str) -> tuple:
@@ -1258,13 +2073,15 @@ class TicketBaseService(BaseService):
         :param user_str: 逗号隔开的
         :return:
         """
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=False).first()
+        flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+        if flag is False:
+            return False, ticket_obj
 
         new_relation_set = set(ticket_obj.relation.split(',') + user_str.split(','))  # 去重， 但是可能存在空元素
         new_relation_list = [new_relation0 for new_relation0 in new_relation_set if new_relation0]  # 去掉空元素
         new_relation = ','.join(new_relation_list)  # 去重
         ticket_obj.relation = new_relation
-        ticket_obj.save()
+        cls.save_ticket(ticket_obj)
         return True, dict(new_relation=new_relation)
 
     @classmethod
@@ -1278,12 +2095,14 @@ class TicketBaseService(BaseService):
         :return:
         """
         # ticket record table, for display ticket detail
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=False).first()
+        flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+        if flag is False:
+            return False, ticket_obj
         new_relation_set = set(ticket_obj.relation.split(',') + user_str.split(',') + [ticket_creator])  # 去重， 但是可能存在空元素
         new_relation_list = [new_relation0 for new_relation0 in new_relation_set if new_relation0]  # 去掉空元素
         new_relation = ','.join(new_relation_list)  # 去重
         ticket_obj.relation = new_relation
-        ticket_obj.save()
+        cls.save_ticket(ticket_obj)
 
         # ticket user table, for ticket list query
         if ticket_creator:
@@ -1306,6 +2125,7 @@ class TicketBaseService(BaseService):
         # 非在user_str中的 更新为in_process=False
         TicketUser.objects.filter(ticket_id=ticket_id).exclude(username__in=user_str_list).all().update(
             in_process=False)
+        ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_id)
 
         return True, ''
 
@@ -1324,6 +2144,7 @@ class TicketBaseService(BaseService):
         else:
             new_worked_record = TicketUser(ticket_id=ticket_id, username=username, in_process=False, worked=True)
             new_worked_record.save()
+        ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_id)
         return True, ''
 
     @classmethod
@@ -1356,7 +2177,7 @@ class TicketBaseService(BaseService):
     @classmethod
     @auto_log
     def get_ticket_flow_log(cls, ticket_id: int, username: str, per_page: int = 10, page: int = 1,
-                            ticket_data=0) -> tuple:
+                            ticket_data=0, cursor: str = None, with_total: int = 0) -> tuple:
         """
         获取工单流转记录
         get ticket's flow log
@@ -1365,62 +2186,44 @@ class TicketBaseService(BaseService):
         :param per_page:
         :param page:
         :param ticket_data: 是否返回当前工单所有字段信息
+        :param cursor: 游标分页的游标, None时按page分页
+        :param with_total: 游标分页时是否返回近似总数
         :return:
         """
         ticket_flow_log_queryset = TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).all().order_by('-id')
-        paginator = Paginator(ticket_flow_log_queryset, per_page)
+        flag, page_result = paginator_service_ins.paginate(ticket_flow_log_queryset, per_page, page, cursor, with_total)
+        if flag is False:
+            return False, page_result
+        if ticket_data:
+            ticket_data_dict = ticket_flow_log_data_service_ins.get_ticket_data_dict(page_result['object_list'])
 
-        try:
-            ticket_result_paginator = paginator.page(page)
-        except PageNotAnInteger:
-            ticket_result_paginator = paginator.page(1)
-        except EmptyPage:
-            # If page is out of range (e.g. 9999), deliver last page of results
-            ticket_result_paginator = paginator.page(paginator.num_pages)
+        flag, flow_log_info_dict = cls.get_flow_log_info_dict(page_result['object_list'])
+        if flag is False:
+            return False, flow_log_info_dict
 
         ticket_flow_log_restful_list = []
-        for ticket_flow_log in ticket_result_paginator.object_list:
-            flag, state_obj = workflow_state_service_ins.get_workflow_state_by_id(ticket_flow_log.state_id)
-
-            flag, result = cls.get_flow_log_transition_name(ticket_flow_log.transition_id,
-                                                            ticket_flow_log.intervene_type_id)
-            if flag is False:
-                return False, result
-            transition_name = result.get('transition_name')
-            attribute_type_id = result.get('attribute_type_id')
-
-            state_info_dict = dict(state_id=state_obj.id, state_name=state_obj.name)
-            transition_info_dict = dict(transition_id=ticket_flow_log.transition_id, transition_name=transition_name,
-                                        attribute_type_id=attribute_type_id)
-            participant_info = dict(participant_type_id=ticket_flow_log.participant_type_id,
-                                    participant=ticket_flow_log.participant,
-                                    participant_alias=ticket_flow_log.participant,
-                                    participant_email='', participant_phone=''
-                                    )
-            if ticket_flow_log.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_PERSONAL:
-                flag, participant_query_obj = account_base_service_ins.get_user_by_username(ticket_flow_log.participant)
-                if flag:
-                    participant_info.update(participant_alias=participant_query_obj.alias,
-                                            participant_email=participant_query_obj.email,
-                                            participant_phone=participant_query_obj.phone
-                                            )
-
+        for ticket_flow_log in page_result['object_list']:
+            flow_log_info = flow_log_info_dict[ticket_flow_log.id]
+            state_info_dict = dict(state_id=ticket_flow_log.state_id, state_name=flow_log_info['state_name'])
+            transition_info_dict = dict(transition_id=ticket_flow_log.transition_id,
+                                        transition_name=flow_log_info['transition_name'],
+                                        attribute_type_id=flow_log_info['attribute_type_id'])
             ticket_flow_log_restful = dict(id=ticket_flow_log.id, ticket_id=ticket_id, state=state_info_dict,
                                            transition=transition_info_dict,
                                            intervene_type_id=ticket_flow_log.intervene_type_id,
                                            participant_type_id=ticket_flow_log.participant_type_id,
                                            participant=ticket_flow_log.participant,
-                                           participant_info=participant_info,
+                                           participant_info=flow_log_info['participant_info'],
                                            suggestion=ticket_flow_log.suggestion,
                                            gmt_created=str(ticket_flow_log.gmt_created)[:19]
                                            )
             if ticket_data:
-                ticket_flow_log_restful.update(ticket_data=json.loads(ticket_flow_log.ticket_data))
+                ticket_flow_log_restful.update(ticket_data=ticket_data_dict[ticket_flow_log.id])
 
-            ticket_flow_log_restful_list.append(dict(ticket_flow_log_restful))
+            ticket_flow_log_restful_list.append(ticket_flow_log_restful)
 
         return True, dict(ticket_flow_log_restful_list=ticket_flow_log_restful_list,
-                          paginator_info=dict(per_page=per_page, page=page, total=paginator.count))
+                          paginator_info=page_result['paginator_info'])
 
     @classmethod
     @auto_log
@@ -1438,54 +2241,89 @@ class TicketBaseService(BaseService):
             return False, '工单不存在或已被删除'
         workflow_id = ticket_obj.workflow_id
         flag, state_objs = workflow_state_service_ins.get_workflow_states(workflow_id)
-        ticket_flow_log_queryset = TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).all()
+        ticket_flow_log_list = list(TicketFlowLog.objects.filter(ticket_id=ticket_id, is_deleted=0).order_by('-id'))
+        flag, flow_log_info_dict = cls.get_flow_log_info_dict(ticket_flow_log_list)
+        if flag is False:
+            return False, flow_log_info_dict
+
+        # 流转记录按状态分组(id倒序)
+        state_flow_log_dict = {}
+        for ticket_flow_log in ticket_flow_log_list:
+            flow_log_info = flow_log_info_dict[ticket_flow_log.id]
+            state_flow_log_dict.setdefault(ticket_flow_log.state_id, []).append(dict(
+                id=ticket_flow_log.id, transition=dict(transition_name=flow_log_info['transition_name'],
+                                                       transition_id=ticket_flow_log.transition_id),
+                participant_type_id=ticket_flow_log.participant_type_id,
+                participant=ticket_flow_log.participant,
+                participant_info=flow_log_info['participant_info'],
+                intervene_type_id=ticket_flow_log.intervene_type_id,
+                suggestion=ticket_flow_log.suggestion,
+                state_id=ticket_flow_log.state_id,
+                attribute_type_id=flow_log_info['attribute_type_id'],
+                gmt_created=str(ticket_flow_log.gmt_created)[:19]))
 
         state_step_dict_list = []
-        for state_obj in state_objs:
+        for state_obj in sorted(state_objs, key=lambda state: state.order_id):
             if state_obj.id == ticket_obj.state_id or (not state_obj.is_hidden):
-                ticket_state_step_dict = dict(state_id=state_obj.id, state_name=state_obj.name,
-                                              order_id=state_obj.order_id)
-                state_flow_log_list = []
-                for ticket_flow_log in ticket_flow_log_queryset:
-                    if ticket_flow_log.state_id == state_obj.id:
-                        # 此部分和get_ticket_flow_log代码冗余，后续会简化下
-                        flag, result = cls.get_flow_log_transition_name(ticket_flow_log.transition_id,
-                                                                        ticket_flow_log.intervene_type_id)
-                        if flag is False:
-                            return False, result
-                        transition_name = result.get('transition_name')
-                        attribute_type_id = result.get('attribute_type_id')
-
-                        participant_info = dict(participant_type_id=ticket_flow_log.participant_type_id,
-                                                participant=ticket_flow_log.participant,
-                                                participant_alias=ticket_flow_log.participant,
-                                                participant_email='', participant_phone=''
-                                                )
-                        if ticket_flow_log.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_PERSONAL:
-                            flag, participant_query_obj = account_base_service_ins.get_user_by_username(
-                                ticket_flow_log.participant)
-                            if flag:
-                                participant_info.update(participant_alias=participant_query_obj.alias,
-                                                        participant_email=participant_query_obj.email,
-                                                        participant_phone=participant_query_obj.phone
-                                                        )
-
-                        state_flow_log_list.append(dict(id=ticket_flow_log.id, transition=dict(
-                            transition_name=transition_name, transition_id=ticket_flow_log.transition_id),
-                            participant_type_id=ticket_flow_log.participant_type_id,
-                            participant=ticket_flow_log.participant,
-                            participant_info=participant_info,
-                            intervene_type_id=ticket_flow_log.intervene_type_id,
-                            suggestion=ticket_flow_log.suggestion,
-                            state_id=ticket_flow_log.state_id,
-                            attribute_type_id=attribute_type_id,
-                            gmt_created=str(ticket_flow_log.gmt_created)[:19]))
-                state_flow_log_list = sorted(state_flow_log_list, key=lambda keys: keys['id'], reverse=True)
-                ticket_state_step_dict['state_flow_log_list'] = state_flow_log_list
-                state_step_dict_list.append(ticket_state_step_dict)
-                state_step_dict_list = sorted(state_step_dict_list, key=lambda keys: keys['order_id'])
+                state_step_dict_list.append(dict(state_id=state_obj.id, state_name=state_obj.name,
+                                                 order_id=state_obj.order_id,
+                                                 state_flow_log_list=state_flow_log_dict.get(state_obj.id, [])))
         return True, dict(state_step_dict_list=state_step_dict_list, current_state_id=ticket_obj.state_id)
 
+    @classmethod
+    @auto_log
+    def get_flow_log_info_dict(cls, ticket_flow_log_list: list) -> tuple:
+        """
+        流转记录的状态名称、流转名称及处理人信息: 状态、流转、处理人分别一次批量查询
+        state name, transition name and participant info of flow logs. states, transitions and users are loaded
+        with one query each
+        :param ticket_flow_log_list:
+        :return: {flow_log_id: dict(state_name, transition_name, attribute_type_id, participant_info)}
+        """
+        flag, state_dict = workflow_state_service_ins.get_states_info_by_state_id_list(
+            list(set([ticket_flow_log.state_id for ticket_flow_log in ticket_flow_log_list])))
+        if flag is False:
+            return False, state_dict
+        flag, transition_dict = workflow_transition_service_ins.get_transition_dict_by_id_list(
+            [ticket_flow_log.transition_id for ticket_flow_log in ticket_flow_log_list])
+        if flag is False:
+            return False, transition_dict
+        flag, user_dict = account_base_service_ins.get_user_dict_by_username_list(
+            [ticket_flow_log.participant for ticket_flow_log in ticket_flow_log_list
+             if ticket_flow_log.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_PERSONAL])
+        if flag is False:
+            user_dict = {}
+
+        flow_log_info_dict = {}
+        for ticket_flow_log in ticket_flow_log_list:
+            if ticket_flow_log.transition_id:
+                transition_obj = transition_dict.get(ticket_flow_log.transition_id)
+                transition_name = transition_obj.name if transition_obj else ''
+                attribute_type_id = transition_obj.attribute_type_id if transition_obj else \
+                    constant_service_ins.TRANSITION_ATTRIBUTE_TYPE_OTHER
+            else:
+                flag, result = cls.get_flow_log_transition_name(0, ticket_flow_log.intervene_type_id)
+                transition_name = result.get('transition_name')
+                attribute_type_id = result.get('attribute_type_id')
+
+            participant_info = dict(participant_type_id=ticket_flow_log.participant_type_id,
+                                    participant=ticket_flow_log.participant,
+                                    participant_alias=ticket_flow_log.participant,
+                                    participant_email='', participant_phone=''
+                                    )
+            participant_obj = user_dict.get(ticket_flow_log.participant) \
+                if ticket_flow_log.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_PERSONAL else None
+            if participant_obj:
+                participant_info.update(participant_alias=participant_obj.alias,
+                                        participant_email=participant_obj.email,
+                                        participant_phone=participant_obj.phone
+                                        )
+            flow_log_info_dict[ticket_flow_log.id] = dict(
+                state_name=state_dict.get(ticket_flow_log.state_id, {}).get('name', ''),
+                transition_name=transition_name, attribute_type_id=attribute_type_id,
+                participant_info=participant_info)
+        return True, flow_log_info_dict
+
     @classmethod
     @auto_log
     def get_flow_log_transition_name(cls, transition_id, intervene_type_id):
@@ -1545,10 +2383,11 @@ class TicketBaseService(BaseService):
         if state_obj.workflow_id == ticket_obj.workflow_id:
             # 获取目标状态的处理人信息
             flag, destination_participant_info = cls.get_ticket_state_participant_info(state_id, ticket_id=ticket_id)
-            ticket_obj.state_id = state_id
-            ticket_obj.participant_type_id = destination_participant_info.get('destination_participant_type_id', 0)
-            ticket_obj.participant = destination_participant_info.get('destination_participant', '')
-            ticket_obj.save()
+            cls.update_ticket_state_version(
+                ticket_obj, state_id=state_id,
+                participant_type_id=destination_participant_info.get('destination_participant_type_id', 0),
+                participant=destination_participant_info.get('destination_participant', ''))
+            ticket_sla_service_ins.enter_state([(ticket_obj, state_obj)])
 
             if destination_participant_info.get('destination_participant_type_id', 0) in (
                     constant_service_ins.PARTICIPANT_TYPE_PERSONAL, constant_service_ins.PARTICIPANT_TYPE_MULTI):
@@ -1571,12 +2410,12 @@ class TicketBaseService(BaseService):
             # 如果目标状态是脚本处理中，需要触发脚本处理
             if ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROBOT:
                 from tasks import run_flow_task  # 放在文件开头会存在循环引用
-                run_flow_task.apply_async(args=[ticket_id, ticket_obj.participant, ticket_obj.state_id],
+                cls.apply_async_on_commit(run_flow_task,
+                                          args=[ticket_id, ticket_obj.participant, ticket_obj.state_id],
                                           queue='loonflow')
             # 目标状态处理人类型是hook，需要出发hook
             if ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_HOOK:
-                from tasks import flow_hook_task  # 放在文件开头会存在循环引用
-                flow_hook_task.apply_async(args=[ticket_id], queue='loonflow')
+                cls.add_hook_delivery(ticket_id, ticket_obj.state_id)
 
             return True, '修改工单状态成功'
 
@@ -1622,9 +2461,8 @@ class TicketBaseService(BaseService):
             cls.update_ticket_relation(ticket_id, username)
 
             ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-            ticket_obj.participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
-            ticket_obj.participant = username
-            ticket_obj.save()
+            cls.update_ticket_state_version(
+                ticket_obj, participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL, participant=username)
 
             # add ticket flow log
             flag, result = cls.get_ticket_all_field_value_json(ticket_id)
@@ -1654,9 +2492,8 @@ class TicketBaseService(BaseService):
         """
         cls.update_ticket_relation(ticket_id, target_username)
         ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-        ticket_obj.participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
-        ticket_obj.participant = target_username
-        ticket_obj.save()
+        cls.update_ticket_state_version(
+            ticket_obj, participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL, participant=target_username)
         # add flow log
         flag, result = cls.get_ticket_all_field_value_json(ticket_id)
         if flag is False:
@@ -1691,11 +2528,9 @@ class TicketBaseService(BaseService):
 
         cls.update_ticket_relation(ticket_id, target_username)
         ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-        ticket_obj.participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
-        ticket_obj.participant = target_username
-        ticket_obj.in_add_node = True
-        ticket_obj.add_node_man = username
-        ticket_obj.save()
+        cls.update_ticket_state_version(
+            ticket_obj, participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL, participant=target_username,
+            in_add_node=True, add_node_man=username)
         # add flow log
 
         flag, result = cls.get_ticket_all_field_value_json(ticket_id)
@@ -1726,11 +2561,9 @@ class TicketBaseService(BaseService):
             return False, result.get('msg')
 
         ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-        ticket_obj.participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
-        ticket_obj.participant = ticket_obj.add_node_man
-        ticket_obj.in_add_node = False
-        ticket_obj.add_node_man = ''
-        ticket_obj.save()
+        cls.update_ticket_state_version(
+            ticket_obj, participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL,
+            participant=ticket_obj.add_node_man, in_add_node=False, add_node_man='')
         # 更新关系人表
         cls.update_ticket_relation(ticket_id, ticket_obj.participant)
 
@@ -1749,24 +2582,33 @@ class TicketBaseService(BaseService):
 
     @classmethod
     @auto_log
-    def handle_timer_transition(cls, ticket_id: int, destination_state_id: int) -> tuple:
+    def handle_timer_transition(cls, ticket_id: int, destination_state_id: int, workflow_id: int = 0) -> tuple:
         """
         定时器处理
         :param ticket_id:
         :param destination_state_id:
+        :param workflow_id: 工单所属工作流, 不提供时从工单记录中获取
         :return:
         """
-        # 定时器处理逻辑，如果新的状态所属transition有配置定时器，那么创建一个定时器流转的任务
-        flag, destination_transition_queryset = workflow_transition_service_ins.get_state_transition_queryset(
-            destination_state_id)
-        if destination_transition_queryset:
-            for destination_transition in destination_transition_queryset:
-                if destination_transition.transition_type_id == constant_service_ins.TRANSITION_TYPE_TIMER:
-                    from tasks import timer_transition
-                    timer_transition.apply_async(args=[ticket_id, destination_state_id, datetime.datetime.now(),
-                                                       destination_transition.id],
-                                                 countdown=destination_transition.timer, queue='loonflow')
-        return True, ''
+        # 定时器处理逻辑，如果新的状态所属transition有配置定时器，那么创建定时器(与工单状态变更在同一事务中保存)
+        ticket_obj = None
+        if not workflow_id:
+            flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+            if flag is False:
+                return False, ticket_obj
+            workflow_id = ticket_obj.workflow_id
+        flag, compiled_workflow = workflow_compile_service_ins.get_compiled_workflow(workflow_id)
+        if flag is False:
+            return False, compiled_workflow
+        timer_transition_list = compiled_workflow.get_timer_transitions(destination_state_id)
+        if not timer_transition_list:
+            return True, ''
+        if ticket_obj is None:
+            flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+            if flag is False:
+                return False, ticket_obj
+        from service.ticket.ticket_timer_service import ticket_timer_service_ins
+        return ticket_timer_service_ins.add_ticket_timer(ticket_obj, destination_state_id, timer_transition_list)
 
     @classmethod
     @auto_log
@@ -1778,23 +2620,83 @@ class TicketBaseService(BaseService):
         :return:
         """
         # 工单基础字段、工单自定义字段
-        ticket_obj = TicketRecord.objects.filter(id=ticket_id).first()
-        if not ticket_obj:
-            return False, '工单已被删除或者不存在'
-        # 获取工单基础表中的字段中的字段信息
-        field_info_dict = ticket_obj.get_dict()
-        # 获取自定义字段的值
-        flag, result = workflow_custom_field_service_ins.get_workflow_custom_field_name_list(ticket_obj.workflow_id)
+        unit_of_work = ticket_unit_of_work_service_ins.get_current(ticket_id)
+        if unit_of_work:
+            field_info_dict = unit_of_work.ticket_obj.get_dict()
+            field_info_dict.update(unit_of_work.custom_field_value_dict)
+            return True, field_info_dict
+        flag, result = cls.get_tickets_all_field_value([ticket_id])
         if flag is False:
             return False, result
-        ticket_custom_field_key_list = result.get('ticket_custom_field_key_list')
+        if ticket_id not in result:
+            return False, '工单已被删除或者不存在'
+        return True, result[ticket_id]
+
+    @classmethod
+    @auto_log
+    def get_tickets_all_field_value(cls, ticket_id_list: list) -> tuple:
+        """
+        批量获取工单所有字段的值: 工单基础表一次查询，自定义字段表一次查询
+        get all field value of tickets, one query for ticket records and one for custom field values
+        :param ticket_id_list:
+        :return: {ticket_id: {field_key: value}}
+        """
+        ticket_obj_list = list(TicketRecord.objects.filter(id__in=ticket_id_list).all())
+        flag, custom_field_value_dict = cls.get_tickets_custom_field_value(ticket_obj_list)
+        if flag is False:
+            return False, custom_field_value_dict
+        field_value_dict = {}
+        for ticket_obj in ticket_obj_list:
+            # 获取工单基础表中的字段中的字段信息
+            field_info_dict = ticket_obj.get_dict()
+            field_info_dict.update(custom_field_value_dict[ticket_obj.id])
+            field_value_dict[ticket_obj.id] = field_info_dict
+        return True, field_value_dict
 
-        for field_key in ticket_custom_field_key_list:
-            flag, result = cls.get_ticket_field_value(ticket_id, field_key)
+    @classmethod
+    @auto_log
+    def get_tickets_custom_field_value(cls, ticket_obj_list: list) -> tuple:
+        """
+        批量获取工单自定义字段的值, 一次查询所有工单的自定义字段记录，按字段类型取对应的值列(FIELD_VALUE_ENUM)
+        get custom field value of tickets. loads the TicketCustomField rows of all tickets with one query and
+        picks the typed value column by FIELD_VALUE_ENUM. fields that have not been assigned are None
+        :param ticket_obj_list:
+        :return: {ticket_id: {field_key: value}}
+        """
+        workflow_custom_field_dict = {}
+        for workflow_id in set([ticket_obj.workflow_id for ticket_obj in ticket_obj_list]):
+            flag, result = workflow_custom_field_service_ins.get_workflow_custom_field(workflow_id)
             if flag is False:
                 return False, result
-            field_info_dict[field_key] = result.get('value')
-        return True, field_info_dict
+            workflow_custom_field_dict[workflow_id] = result
+
+        custom_field_value_dict = {}
+        ticket_workflow_dict = {}
+        for ticket_obj in ticket_obj_list:
+            ticket_workflow_dict[ticket_obj.id] = ticket_obj.workflow_id
+            custom_field_value_dict[ticket_obj.id] = {
+                field_key: None for field_key in workflow_custom_field_dict[ticket_obj.workflow_id]}
+        if not ticket_obj_list:
+            return True, custom_field_value_dict
+
+        value_enum = constant_service_ins.FIELD_VALUE_ENUM
+        assigned_key_set = set()
+        ticket_custom_field_queryset = TicketCustomField.objects.filter(
+            ticket_id__in=list(ticket_workflow_dict.keys()), is_deleted=0).order_by('id')
+        for ticket_custom_field in ticket_custom_field_queryset:
+            custom_field = workflow_custom_field_dict[ticket_workflow_dict[ticket_custom_field.ticket_id]].get(
+                ticket_custom_field.field_key)
+            if not custom_field or (ticket_custom_field.ticket_id, ticket_custom_field.field_key) in assigned_key_set:
+                continue
+            assigned_key_set.add((ticket_custom_field.ticket_id, ticket_custom_field.field_key))
+            value = getattr(ticket_custom_field, value_enum[custom_field['field_type_id']])
+            # 与BaseModel.get_dict保持一致，日期类型转换为字符串
+            if isinstance(value, datetime.datetime):
+                value = value.strftime('%Y-%m-%d %H:%M:%S')
+            elif isinstance(value, datetime.date):
+                value = value.strftime('%Y-%m-%d')
+            custom_field_value_dict[ticket_custom_field.ticket_id][ticket_custom_field.field_key] = value
+        return True, custom_field_value_dict
 
     @classmethod
     @auto_log
@@ -1835,14 +2737,13 @@ class TicketBaseService(BaseService):
             ticket_obj.script_run_last_result = True
             ticket_obj.save()
             from tasks import run_flow_task  # 放在文件开头会存在循环引用问题
-            run_flow_task.apply_async(args=[ticket_id, ticket_obj.participant, ticket_obj.state_id,
-                                            '{}_retry'.format(username)], queue='loonflow')
+            cls.apply_async_on_commit(run_flow_task, args=[ticket_id, ticket_obj.participant, ticket_obj.state_id,
+                                                           '{}_retry'.format(username)], queue='loonflow')
             return True, ''
         elif ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_HOOK:
             ticket_obj.script_run_last_result = True
             ticket_obj.save()
-            from tasks import flow_hook_task
-            flow_hook_task.apply_async(args=[ticket_id], queue='loonflow')
+            cls.add_hook_delivery(ticket_id, ticket_obj.state_id)
             return True, ''
         else:
             return False, "The ticket's participant_type is not robot or hook, do not allow retry"
@@ -2081,46 +2982,50 @@ class TicketBaseService(BaseService):
             # 新建工单获取工单的初始状态
             if not workflow_id:
                 return False, 'new ticket need arg workflow_id'
-            flag, start_state = workflow_state_service_ins.get_workflow_start_state(workflow_id)
+            flag, compiled_workflow = workflow_compile_service_ins.get_compiled_workflow(workflow_id)
             if flag is False:
-                return False, start_state
-            source_state_id = start_state.id
+                return False, compiled_workflow
+            if not compiled_workflow.start_state_id:
+                return False, 'This workflow have no init state, please check the config'
+            source_state_id = compiled_workflow.start_state_id
         else:
             # 已经存在的工单，直接获取工单当前状态
             flag, ticket_obj = cls.get_ticket_by_id(ticket_id)
+            if flag is False:
+                return False, ticket_obj
             source_state_id = ticket_obj.state_id
+            flag, compiled_workflow = cls.get_ticket_compiled_workflow(ticket_obj)
+            if flag is False:
+                return False, compiled_workflow
 
-        flag, transition_queryset = workflow_transition_service_ins.get_transition_by_args(
-            dict(source_state_id=source_state_id, id=transition_id))
-        if not transition_queryset:
+        transition_obj = compiled_workflow.get_transition(transition_id, source_state_id)
+        if not transition_obj:
             return False, 'transition_id is invalid'
 
-        transition_obj = transition_queryset[0]
         condition_expression = transition_obj.condition_expression
         destination_state_id = transition_obj.destination_state_id
 
         if condition_expression and json.loads(condition_expression):
-            # 存在条件表达式，需要根据表达式计算下个状态
-            condition_expression_list = json.loads(condition_expression)
+            # 存在条件表达式，需要根据表达式计算下个状态. 表达式引用的字段都在请求中提供时无需获取工单字段的值
+            flag, field_key_list = workflow_condition_expression_service_ins.get_condition_field_key_list(
+                transition_obj.id, condition_expression)
+            if flag is False:
+                return False, field_key_list
             ticket_all_value_dict = {}
-            if ticket_id:
+            if ticket_id and (set(field_key_list) - set(ticket_req_dict.keys())):
                 # 获取工单所有字段的值
                 flag, ticket_all_value_dict = cls.get_ticket_all_field_value(ticket_id)
+                if flag is False:
+                    return False, ticket_all_value_dict
             # 更新当前更新的字段的值
-            ticket_all_value_dict_copy = copy.deepcopy(ticket_all_value_dict)
-            ticket_all_value_dict_copy.update(ticket_req_dict)
-            for key, value in ticket_all_value_dict_copy.items():
-                if isinstance(ticket_all_value_dict_copy[key], str):
-                    ticket_all_value_dict_copy[key] = "'''" + ticket_all_value_dict_copy[key] + "'''"
-
-            for condition_expression0 in condition_expression_list:
-                expression = condition_expression0.get('expression')
-                expression_format = expression.format(**ticket_all_value_dict_copy)
-                import datetime
-                import time  # 用于支持条件表达式中对时间的操作
-                if eval(expression_format):
-                    destination_state_id = condition_expression0.get('target_state_id')
-                    break
+            value_dict = dict(ticket_all_value_dict)
+            value_dict.update(ticket_req_dict)
+            flag, target_state_id = workflow_condition_expression_service_ins.get_target_state_id(
+                transition_obj.id, condition_expression, value_dict)
+            if flag is False:
+                return False, target_state_id
+            if target_state_id:
+                destination_state_id = target_state_id
 
         return True, dict(destination_state_id=destination_state_id)
 
@@ -2154,6 +3059,8 @@ class TicketBaseService(BaseService):
         flag, msg = cls.add_ticket_flow_log(new_flow_log)
         if flag is False:
             return False, msg
+        # 评论后当前状态的定时器失效
+        TicketRecord.objects.filter(id=ticket_id, is_deleted=0).update(state_version=F('state_version') + 1)
         return True, ''
 
     @classmethod
@@ -2278,14 +3185,14 @@ class TicketBaseService(BaseService):
                                     participant=username, state_id=state_obj.id, ticket_data=all_ticket_data_json,
                                     )
 
-        new_state_id = state_obj.id
-        ticket_obj.state_id = new_state_id
-        ticket_obj.participant_type_id = 0
-        ticket_obj.participant = ''
-        ticket_obj.act_state_id = constant_service_ins.TICKET_ACT_STATE_CLOSED
-        ticket_obj.save()
+        old_act_state_id = ticket_obj.act_state_id
+        cls.update_ticket_state_version(ticket_obj, state_id=state_obj.id, participant_type_id=0, participant='',
+                                        act_state_id=constant_service_ins.TICKET_ACT_STATE_CLOSED)
+        ticket_statistics_service_ins.update_tickets_act_state([(ticket_obj, old_act_state_id)])
+        ticket_sla_service_ins.enter_state([(ticket_obj, state_obj)])
         # 更新ticketuser中in_process状态
         TicketUser.objects.filter(ticket_id=ticket_id, is_deleted=0).update(in_process=False)
+        ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_id)
 
         cls.add_ticket_flow_log(ticket_flow_log_dict)
         return True, ''
@@ -2315,6 +3222,9 @@ class TicketBaseService(BaseService):
 
         result.is_deleted = True
         result.save()
+        ticket_statistics_service_ins.remove_ticket(result)
+        ticket_sla_service_ins.delete_ticket_sla(ticket_id)
+        ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_id)
         return True, ''
 
     @classmethod
@@ -2363,27 +3273,20 @@ class TicketBaseService(BaseService):
             return False, result
         workflow_list = result.get('workflow_list')
         workflow_id_list = [workflow.get('id') for workflow in workflow_list]
-        from django.db.models import Count
-        query_params = {'is_deleted': 0, 'workflow_id__in': workflow_id_list}
-        if start_date:
-            query_params['gmt_gte'] = start_date
-        if end_date:
-            query_params['gmt_gte'] = end_date
-
-        queryset_result = TicketRecord.objects.filter(**query_params).extra(
-            select={'year': 'year(gmt_created)', 'month': 'month(gmt_created)', 'day': 'day(gmt_created)',
-                    'workflow_id': 'workflow_id'}).values('year', 'month', 'day', 'workflow_id').annotate(
-            count_len=Count('gmt_created')).order_by()
+        # 按工单创建日期及工作流汇总(启用TICKET_STATISTICS_ENABLED时查询每日统计汇总表)
+        flag, result = ticket_statistics_service_ins.get_ticket_count_statistics(
+            workflow_id_list, start_date, end_date, ['day', 'workflow_id'])
+        if flag is False:
+            return False, result
 
         workflow_id_dict = {}
         for workflow in workflow_list:
             workflow_id_dict[workflow.get('id')] = workflow
 
         result_list = []
-        for queryset in queryset_result:
-            date_str = '%d-%02d-%02d' % (queryset['year'], queryset['month'], queryset['day'])
-            workflow_name = workflow_id_dict[queryset['workflow_id']]['name']
-            result_list.append(dict(day=date_str, type=workflow_name, count=queryset['count_len']))
+        for statistics in result:
+            workflow_name = workflow_id_dict[statistics['workflow_id']]['name']
+            result_list.append(dict(day=str(statistics['day']), type=workflow_name, count=statistics['ticket_count']))
         # 按日期排序
         result_list = sorted(result_list, key=lambda r: r['day'])
 
@@ -2415,11 +3318,12 @@ class TicketBaseService(BaseService):
         if flag is False:
             return False, result
 
-        ticket_result.state_id = result.id
-        ticket_result.participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
-        ticket_result.participant = ticket_result.creator
-        ticket_result.act_state_id = constant_service_ins.TICKET_ACT_STATE_RETREAT
-        ticket_result.save()
+        old_act_state_id = ticket_result.act_state_id
+        cls.update_ticket_state_version(
+            ticket_result, state_id=result.id, participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL,
+            participant=ticket_result.creator, act_state_id=constant_service_ins.TICKET_ACT_STATE_RETREAT)
+        ticket_statistics_service_ins.update_tickets_act_state([(ticket_result, old_act_state_id)])
+        ticket_sla_service_ins.enter_state([(ticket_result, result)])
 
         cls.update_ticket_relation(ticket_id, ticket_result.creator)
 
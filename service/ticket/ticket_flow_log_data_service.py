@@ -0,0 +1,178 @@
+import base64
+import json
+import zlib
+
+from django.conf import settings
+
+from apps.ticket.models import TicketFlowLog
+from service.base_service import BaseService
+from service.common.log_service import auto_log
+
+
+class TicketFlowLogDataService(BaseService):
+    """
+    工单流转记录中的工单数据(ticket_data)存储: 完整json(原格式), 或相对上一条记录的差异, 每隔一定条数保存一次完整数据,
+    可选zlib压缩。格式:
+      {...}             完整数据(原格式)
+      Z:<base64>        压缩的完整数据
+      D:{...}           差异, {"base": 基准流转记录id, "set": {变化的字段}, "unset": [删除的字段]}
+      DZ:<base64>       压缩的差异
+    flow log ticket_data storage. full json(legacy format), or a diff against the previous flow log of the ticket with
+    periodic full checkpoints, optionally zlib compressed
+    """
+    MODE_FULL = 'full'
+    MODE_DELTA = 'delta'
+    PREFIX_COMPRESSED = 'Z:'
+    PREFIX_DELTA = 'D:'
+    PREFIX_DELTA_COMPRESSED = 'DZ:'
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def dump(cls, prefix: str, compressed_prefix: str, data: dict) -> str:
+        """
+        序列化, 启用压缩且压缩后更短时使用压缩格式
+        :param prefix: 未压缩时的前缀
+        :param compressed_prefix:
+        :param data:
+        :return:
+        """
+        data_str = json.dumps(data)
+        if settings.TICKET_FLOW_LOG_DATA_COMPRESS:
+            compressed_str = compressed_prefix + base64.b64encode(zlib.compress(data_str.encode('utf-8'))).decode()
+            if len(compressed_str) < len(prefix) + len(data_str):
+                return compressed_str
+        return prefix + data_str
+
+    @classmethod
+    def loads_data(cls, data_str: str) -> dict:
+        data = json.loads(data_str)
+        # 兼容重复json编码的历史数据(处理工单时对工单数据的json再次json.dumps)
+        if isinstance(data, str):
+            data = json.loads(data)
+        return data
+
+    @classmethod
+    def load(cls, ticket_data: str) -> tuple:
+        """
+        反序列化
+        :param ticket_data:
+        :return: (是否为差异, 数据)
+        """
+        if not ticket_data:
+            return False, {}
+        for prefix, is_delta, compressed in ((cls.PREFIX_DELTA_COMPRESSED, True, True),
+                                             (cls.PREFIX_DELTA, True, False),
+                                             (cls.PREFIX_COMPRESSED, False, True)):
+            if ticket_data.startswith(prefix):
+                data_str = ticket_data[len(prefix):]
+                if compressed:
+                    data_str = zlib.decompress(base64.b64decode(data_str)).decode('utf-8')
+                return is_delta, cls.loads_data(data_str)
+        return False, cls.loads_data(ticket_data)
+
+    @classmethod
+    def encode_full(cls, data: dict) -> str:
+        return cls.dump('', cls.PREFIX_COMPRESSED, data)
+
+    @classmethod
+    def encode_delta(cls, base_id: int, base_data: dict, data: dict) -> str:
+        delta = dict(base=base_id, set={key: value for key, value in data.items()
+                                        if key not in base_data or base_data[key] != value},
+                     unset=[key for key in base_data if key not in data])
+        return cls.dump(cls.PREFIX_DELTA, cls.PREFIX_DELTA_COMPRESSED, delta)
+
+    @classmethod
+    def encode_ticket_data(cls, ticket_id: int, ticket_data: str) -> str:
+        """
+        新增流转记录时的工单数据: 差异模式下, 距离上一次完整数据不足TICKET_FLOW_LOG_CHECKPOINT_INTERVAL条时保存差异
+        :param ticket_id:
+        :param ticket_data: 完整数据的json
+        :return:
+        """
+        if settings.TICKET_FLOW_LOG_DATA_MODE != cls.MODE_DELTA:
+            if settings.TICKET_FLOW_LOG_DATA_COMPRESS:
+                return cls.encode_full(cls.loads_data(ticket_data))
+            return ticket_data
+        data = cls.loads_data(ticket_data)
+        flow_log_list = list(TicketFlowLog.objects.filter(ticket_id=ticket_id).order_by('-id').only(
+            'id', 'ticket_data')[:settings.TICKET_FLOW_LOG_CHECKPOINT_INTERVAL - 1])
+        if not flow_log_list:
+            return cls.encode_full(data)
+        # 最近一条完整数据及其后的差异记录, 还原基准数据时复用, 不再逐级查询
+        chain_flow_log_list = []
+        for flow_log in flow_log_list:
+            chain_flow_log_list.append(flow_log)
+            if not cls.load(flow_log.ticket_data)[0]:
+                break
+        else:
+            # 最近的记录中没有完整数据时保存完整数据
+            if len(flow_log_list) >= settings.TICKET_FLOW_LOG_CHECKPOINT_INTERVAL - 1:
+                return cls.encode_full(data)
+        base_flow_log = flow_log_list[0]
+        base_data = cls.get_ticket_data_dict(chain_flow_log_list)[base_flow_log.id]
+        return cls.encode_delta(base_flow_log.id, base_data, data)
+
+    @classmethod
+    def get_ticket_data_dict(cls, flow_log_list: list) -> dict:
+        """
+        还原流转记录的完整工单数据, 差异依赖的基准记录按id批量查询
+        :param flow_log_list:
+        :return: {flow_log_id: ticket_data_dict}
+        """
+        loaded_dict = {flow_log.id: cls.load(flow_log.ticket_data) for flow_log in flow_log_list}
+        while True:
+            missing_id_list = list(set(data['base'] for is_delta, data in loaded_dict.values()
+                                       if is_delta and data['base'] not in loaded_dict))
+            if not missing_id_list:
+                break
+            for flow_log in TicketFlowLog.objects.filter(id__in=missing_id_list).only('id', 'ticket_data'):
+                loaded_dict[flow_log.id] = cls.load(flow_log.ticket_data)
+            # 基准记录不存在
+            for flow_log_id in missing_id_list:
+                loaded_dict.setdefault(flow_log_id, (False, {}))
+
+        ticket_data_dict = {}
+        for flow_log_id in sorted(loaded_dict):
+            is_delta, data = loaded_dict[flow_log_id]
+            if is_delta:
+                # 基准记录id比差异记录小, 按id顺序还原时基准已还原
+                base_data = ticket_data_dict.get(data['base'], {})
+                ticket_data_dict[flow_log_id] = {key: value for key, value in base_data.items()
+                                                 if key not in data['unset']}
+                ticket_data_dict[flow_log_id].update(data['set'])
+            else:
+                ticket_data_dict[flow_log_id] = data
+        return {flow_log.id: ticket_data_dict[flow_log.id] for flow_log in flow_log_list}
+
+    @classmethod
+    @auto_log
+    def convert_ticket_flow_log(cls, ticket_id: int) -> tuple:
+        """
+        按当前配置重新保存工单所有流转记录的工单数据(历史数据迁移)
+        :param ticket_id:
+        :return:
+        """
+        flow_log_list = list(TicketFlowLog.objects.filter(ticket_id=ticket_id).order_by('id').only(
+            'id', 'ticket_data'))
+        ticket_data_dict = cls.get_ticket_data_dict(flow_log_list)
+        delta_mode = settings.TICKET_FLOW_LOG_DATA_MODE == cls.MODE_DELTA
+        update_count = 0
+        base_id, delta_count = 0, 0
+        for flow_log in flow_log_list:
+            data = ticket_data_dict[flow_log.id]
+            if delta_mode and base_id and delta_count < settings.TICKET_FLOW_LOG_CHECKPOINT_INTERVAL - 1:
+                ticket_data = cls.encode_delta(base_id, ticket_data_dict[base_id], data)
+                delta_count += 1
+            else:
+                ticket_data = cls.encode_full(data) if settings.TICKET_FLOW_LOG_DATA_COMPRESS else json.dumps(data)
+                delta_count = 0
+            base_id = flow_log.id
+            if ticket_data != flow_log.ticket_data:
+                TicketFlowLog.objects.filter(id=flow_log.id).update(ticket_data=ticket_data)
+                update_count += 1
+        return True, dict(update_count=update_count)
+
+
+ticket_flow_log_data_service_ins = TicketFlowLogDataService()
@@ -0,0 +1,290 @@
+import asyncio
+import datetime
+import functools
+import json
+import logging
+import time
+
+import aiohttp
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max
+
+from apps.ticket.models import TicketHookOutbox, TicketRecord
+from service.base_service import BaseService
+from service.common.common_service import common_service_ins
+from service.common.constant_service import constant_service_ins
+from service.common.db_queue_service import db_queue_service_ins
+from service.common.log_service import auto_log
+from service.ticket.ticket_base_service import ticket_base_service_ins
+from service.workflow.workflow_state_service import workflow_state_service_ins
+from service.workflow.workflow_transition_service import workflow_transition_service_ins
+
+logger = logging.getLogger('django')
+
+
+class TicketHookOutboxService(BaseService):
+    """
+    工单状态hook发送: 进入hook状态时在同一事务中写入发送队列(ticket_tickethookoutbox)，事务提交后投递发送任务。
+    发送任务分批领取待发送的记录，使用aiohttp并发发送(每个worker同时最多HOOK_SEND_CONCURRENCY个请求)，
+    连接失败、超时及5xx响应时按指数退避重试, 超过重试次数或hook返回失败时置为死信并按原方式记录失败
+    state hook delivery. outbox rows are written in the same transaction as the state change and sent concurrently
+    with aiohttp. transient failures are retried with exponential backoff, then dead-lettered
+    """
+    STATUS_PENDING = 0
+    STATUS_SENDING = 1
+    STATUS_SUCCESS = 2
+    STATUS_DEAD = 3
+    STATUS_INVALID = 4
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    @auto_log
+    def add_hook_delivery(cls, ticket_id: int, state_id: int) -> tuple:
+        """
+        新增hook发送记录, 事务提交后投递发送任务
+        add a hook delivery, sent after the current transaction committed
+        :param ticket_id:
+        :param state_id:
+        :return:
+        """
+        outbox_obj = TicketHookOutbox.objects.create(ticket_id=ticket_id, state_id=state_id,
+                                                     next_retry_time=datetime.datetime.now(), creator='loonrobot')
+        from tasks import send_ticket_hook
+        transaction.on_commit(lambda: send_ticket_hook.apply_async(args=[[outbox_obj.id]], queue='loonflow'))
+        return True, dict(outbox_id=outbox_obj.id)
+
+    @classmethod
+    @auto_log
+    def get_hook_request(cls, outbox_obj: TicketHookOutbox) -> tuple:
+        """
+        hook请求: 工单已不在触发hook的状态时不再发送
+        :param outbox_obj:
+        :return: dict(hook_url, headers, data, wait)
+        """
+        ticket_obj = TicketRecord.objects.filter(id=outbox_obj.ticket_id, is_deleted=0).first()
+        if not ticket_obj or ticket_obj.state_id != outbox_obj.state_id \
+                or ticket_obj.participant_type_id != constant_service_ins.PARTICIPANT_TYPE_HOOK:
+            return False, 'ticket is not in the hook state'
+        flag, state_obj = workflow_state_service_ins.get_workflow_state_by_id(outbox_obj.state_id)
+        if flag is False:
+            return False, state_obj
+        hook_config_dict = json.loads(state_obj.participant)
+        flag, headers = common_service_ins.gen_hook_signature(hook_config_dict.get('hook_token'))
+        if flag is False:
+            return False, headers
+        flag, all_ticket_data = ticket_base_service_ins.get_ticket_all_field_value(outbox_obj.ticket_id)
+        if flag is False:
+            return False, all_ticket_data
+        if hook_config_dict.get('extra_info') is not None:
+            all_ticket_data.update(dict(extra_info=hook_config_dict.get('extra_info')))
+        return True, dict(hook_url=hook_config_dict.get('hook_url'), headers=headers, data=all_ticket_data,
+                          wait=hook_config_dict.get('wait'))
+
+    @classmethod
+    async def post_hook(cls, session: aiohttp.ClientSession, hook_request: dict) -> dict:
+        """
+        发送一个hook请求
+        :param session:
+        :param hook_request:
+        :return: dict(result=dict(code, msg), retry=是否可以重试, latency=耗时毫秒)
+        """
+        start_time = time.time()
+        retry = False
+        try:
+            async with session.post(hook_request['hook_url'], headers=hook_request['headers'],
+                                    json=hook_request['data']) as response:
+                if response.status >= 500:
+                    retry = True
+                    result = dict(code=-1, msg='status code: {}'.format(response.status))
+                else:
+                    result = await response.json(content_type=None)
+                    if not isinstance(result, dict):
+                        result = dict(code=-1, msg='invalid response')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            retry = True
+            result = dict(code=-1, msg=e.__str__() or e.__class__.__name__)
+        except ValueError as e:
+            result = dict(code=-1, msg='invalid json response: {}'.format(e.__str__()))
+        return dict(result=result, retry=retry, latency=int((time.time() - start_time) * 1000))
+
+    @classmethod
+    async def post_hook_dict_async(cls, hook_request_dict: dict) -> dict:
+        connector = aiohttp.TCPConnector(limit=settings.HOOK_SEND_CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(total=settings.HOOK_TIMEOUT)
+        # date等格式转换为str
+        json_serialize = functools.partial(json.dumps, default=str)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         json_serialize=json_serialize) as session:
+            key_list = list(hook_request_dict.keys())
+            delivery_list = await asyncio.gather(*[cls.post_hook(session, hook_request_dict[key])
+                                                   for key in key_list])
+        return dict(zip(key_list, delivery_list))
+
+    @classmethod
+    def post_hook_dict(cls, hook_request_dict: dict) -> dict:
+        """
+        并发发送hook请求
+        send hook requests concurrently
+        :param hook_request_dict: {key: hook_request}
+        :return: {key: dict(result, retry, latency)}
+        """
+        if not hook_request_dict:
+            return {}
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(cls.post_hook_dict_async(hook_request_dict))
+        finally:
+            loop.close()
+
+    @classmethod
+    def handle_hook_success(cls, outbox_obj: TicketHookOutbox, hook_request: dict, result: dict):
+        """
+        hook调用成功: 需要等待回调时记录操作日志，否则直接流转
+        :param outbox_obj:
+        :param hook_request:
+        :param result:
+        :return:
+        """
+        ticket_id = outbox_obj.ticket_id
+        state_id = outbox_obj.state_id
+        if hook_request['wait']:
+            all_ticket_data = hook_request['data']
+            # date等格式需要转换为str
+            for key, value in all_ticket_data.items():
+                if type(value) not in [int, str, bool, float]:
+                    all_ticket_data[key] = str(all_ticket_data[key])
+            return ticket_base_service_ins.add_ticket_flow_log(dict(
+                ticket_id=ticket_id, transition_id=0, suggestion=result.get('msg'),
+                participant_type_id=constant_service_ins.PARTICIPANT_TYPE_HOOK, participant='hook', state_id=state_id,
+                ticket_data=json.dumps(all_ticket_data), creator='loonrobot'))
+        # 不等待hook目标回调，直接流转
+        flag, transition_queryset = workflow_transition_service_ins.get_state_transition_queryset(state_id)
+        if flag is False:
+            return False, transition_queryset
+        transition_id = transition_queryset[0].id  # hook状态只支持一个流转
+        return ticket_base_service_ins.handle_ticket(
+            ticket_id, dict(transition_id=transition_id, suggestion=result.get('msg', ''), username='loonrobot'),
+            by_hook=True)
+
+    @classmethod
+    def handle_hook_fail(cls, outbox_obj: TicketHookOutbox, result: dict):
+        """
+        hook调用失败: 记录执行结果及操作日志，可通过重试接口重新触发
+        :param outbox_obj:
+        :param result:
+        :return:
+        """
+        ticket_id = outbox_obj.ticket_id
+        ticket_base_service_ins.update_ticket_field_value(ticket_id, {'script_run_last_result': False})
+        flag, all_field_value_result = ticket_base_service_ins.get_ticket_all_field_value_json(ticket_id)
+        if flag is False:
+            return False, all_field_value_result
+        return ticket_base_service_ins.add_ticket_flow_log(dict(
+            ticket_id=ticket_id, transition_id=0, suggestion=result.get('msg'),
+            participant_type_id=constant_service_ins.PARTICIPANT_TYPE_HOOK, participant='hook',
+            state_id=outbox_obj.state_id, ticket_data=all_field_value_result.get('all_field_value_json'),
+            creator='loonrobot'))
+
+    @classmethod
+    def save_delivery(cls, outbox_obj: TicketHookOutbox, hook_request: dict, delivery: dict):
+        """
+        保存发送结果: 成功、可重试的失败(计算下次发送时间)、死信
+        :param outbox_obj:
+        :param hook_request:
+        :param delivery: dict(result, retry, latency)
+        :return:
+        """
+        result = delivery['result']
+        outbox_obj.attempt_count += 1
+        outbox_obj.latency = delivery['latency']
+        if result.get('code') == 0:
+            outbox_obj.status = cls.STATUS_SUCCESS
+            outbox_obj.last_error = ''
+        elif delivery['retry'] and outbox_obj.attempt_count <= settings.HOOK_RETRY_COUNT:
+            outbox_obj.status = cls.STATUS_PENDING
+            outbox_obj.next_retry_time = datetime.datetime.now() + datetime.timedelta(
+                seconds=settings.HOOK_RETRY_BACKOFF * 2 ** (outbox_obj.attempt_count - 1))
+            outbox_obj.last_error = str(result.get('msg'))[:1000]
+        else:
+            outbox_obj.status = cls.STATUS_DEAD
+            outbox_obj.last_error = str(result.get('msg'))[:1000]
+        outbox_obj.save(update_fields=['status', 'attempt_count', 'latency', 'next_retry_time', 'last_error',
+                                       'gmt_modified'])
+        if outbox_obj.status == cls.STATUS_SUCCESS:
+            flag, msg = cls.handle_hook_success(outbox_obj, hook_request, result)
+        elif outbox_obj.status == cls.STATUS_DEAD:
+            flag, msg = cls.handle_hook_fail(outbox_obj, result)
+        else:
+            return
+        if flag is False:
+            logger.error('ticket {} hook delivery {} post handle failed: {}'.format(
+                outbox_obj.ticket_id, outbox_obj.id, msg))
+
+    @classmethod
+    @auto_log
+    def send_hook_outbox(cls, outbox_id_list: list = None) -> tuple:
+        """
+        分批发送到期的hook
+        send due hooks in batches
+        :param outbox_id_list: 只发送其中的记录(新增后立即发送)，不提供时发送所有到期的记录(包括待重试的)
+        :return:
+        """
+        outbox_count = 0
+        while True:
+            outbox_list = db_queue_service_ins.claim_due_list(
+                TicketHookOutbox, [cls.STATUS_PENDING, cls.STATUS_SENDING], cls.STATUS_SENDING, 'next_retry_time',
+                settings.HOOK_SEND_LEASE, settings.HOOK_SEND_BATCH_SIZE, outbox_id_list)
+            hook_request_dict = {}
+            for outbox_obj in outbox_list:
+                flag, hook_request = cls.get_hook_request(outbox_obj)
+                if flag is False:
+                    TicketHookOutbox.objects.filter(id=outbox_obj.id).update(
+                        status=cls.STATUS_INVALID, last_error=str(hook_request)[:1000],
+                        gmt_modified=datetime.datetime.now())
+                    continue
+                hook_request_dict[outbox_obj.id] = hook_request
+            delivery_dict = cls.post_hook_dict(hook_request_dict)
+            for outbox_obj in outbox_list:
+                if outbox_obj.id in delivery_dict:
+                    cls.save_delivery(outbox_obj, hook_request_dict[outbox_obj.id], delivery_dict[outbox_obj.id])
+            outbox_count += len(outbox_list)
+            if outbox_id_list is not None or len(outbox_list) < settings.HOOK_SEND_BATCH_SIZE:
+                break
+        return True, dict(outbox_count=outbox_count)
+
+    @classmethod
+    @auto_log
+    def get_hook_delivery_statistics(cls, start_time: str, end_time: str) -> tuple:
+        """
+        hook发送统计: 各状态的个数, 发送成功的请求耗时(平均值、p50、p95、最大值, 毫秒)
+        hook delivery metrics of hooks created in the time range
+        :param start_time:
+        :param end_time:
+        :return:
+        """
+        queryset = TicketHookOutbox.objects.filter(gmt_created__gte=start_time, gmt_created__lte=end_time,
+                                                   is_deleted=0)
+        status_name_dict = {cls.STATUS_PENDING: 'pending', cls.STATUS_SENDING: 'sending',
+                            cls.STATUS_SUCCESS: 'success', cls.STATUS_DEAD: 'dead', cls.STATUS_INVALID: 'invalid'}
+        status_count_dict = {status_name: 0 for status_name in status_name_dict.values()}
+        for status_info in queryset.values('status').annotate(status_count=Count('id')).order_by():
+            status_count_dict[status_name_dict[status_info['status']]] = status_info['status_count']
+
+        success_queryset = queryset.filter(status=cls.STATUS_SUCCESS)
+        success_count = status_count_dict['success']
+        latency_info = success_queryset.aggregate(avg=Avg('latency'), max=Max('latency'),
+                                                  avg_attempt_count=Avg('attempt_count'))
+        latency_dict = dict(avg=int(latency_info['avg'] or 0), max=latency_info['max'] or 0, p50=0, p95=0)
+        if success_count:
+            latency_queryset = success_queryset.order_by('latency').values_list('latency', flat=True)
+            for percentile in (50, 95):
+                latency_dict['p{}'.format(percentile)] = latency_queryset[
+                    min(success_count * percentile // 100, success_count - 1)]
+        return True, dict(status_count=status_count_dict, latency=latency_dict,
+                          avg_attempt_count=round(latency_info['avg_attempt_count'] or 0, 2))
+
+
+ticket_hook_outbox_service_ins = TicketHookOutboxService()
@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.db.models import Q
+
+from apps.ticket.models import TicketInbox, TicketRecord, TicketUser
+from service.base_service import BaseService
+from service.common.constant_service import constant_service_ins
+from service.common.log_service import auto_log
+from service.ticket.ticket_unit_of_work_service import ticket_unit_of_work_service_ins
+
+
+class TicketInboxService(BaseService):
+    """
+    工单列表读模型(ticket_ticketinbox): 按(用户, 类别, 工单创建时间, 工单id)冗余待办、关联的、处理过的工单及列表查询字段，
+    列表查询只需扫描一段索引，不再关联TicketUser表。工单关系人或工单记录变更时重建该工单的记录(工作单元中在写入时统一重建)，
+    settings.TICKET_INBOX_ENABLED为False时不维护也不使用
+    denormalized ticket list read model for the duty, relation and worked categories, rows of a ticket are rebuilt
+    whenever its relations or record change
+    """
+    CATEGORY_DUTY = 'duty'
+    CATEGORY_RELATION = 'relation'
+    CATEGORY_WORKED = 'worked'
+    CATEGORY_LIST = [CATEGORY_DUTY, CATEGORY_RELATION, CATEGORY_WORKED]
+    # 工单列表的过滤条件对应的读模型字段
+    FILTER_FIELD_DICT = {'gmt_created__gte': 'ticket_gmt_created__gte', 'gmt_created__lte': 'ticket_gmt_created__lte',
+                         'id__in': 'ticket_id__in'}
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def mark_ticket_inbox_dirty(cls, ticket_id: int):
+        """
+        工单关系人或工单记录已变更: 工作单元中在写入时重建，否则立即重建
+        :param ticket_id:
+        :return:
+        """
+        if not settings.TICKET_INBOX_ENABLED:
+            return
+        unit_of_work = ticket_unit_of_work_service_ins.get_current(ticket_id)
+        if unit_of_work:
+            unit_of_work.mark_inbox_dirty()
+        else:
+            cls.sync_tickets_inbox([ticket_id])
+
+    @classmethod
+    def sync_tickets_inbox(cls, ticket_id_list: list):
+        """
+        按工单记录及TicketUser重建工单的读模型记录
+        rebuild read model rows of the tickets
+        :param ticket_id_list:
+        :return:
+        """
+        if not settings.TICKET_INBOX_ENABLED or not ticket_id_list:
+            return
+        ticket_queryset = TicketRecord.objects.filter(id__in=ticket_id_list, is_deleted=0)
+        ticket_dict = {ticket_obj.id: ticket_obj for ticket_obj in ticket_queryset}
+        inbox_list = []
+        for ticket_user in TicketUser.objects.filter(ticket_id__in=list(ticket_dict.keys()), is_deleted=0):
+            ticket_obj = ticket_dict[ticket_user.ticket_id]
+            category_list = [cls.CATEGORY_RELATION]
+            if ticket_user.in_process:
+                category_list.append(cls.CATEGORY_DUTY)
+            if ticket_user.worked:
+                category_list.append(cls.CATEGORY_WORKED)
+            for category in category_list:
+                inbox_list.append(TicketInbox(
+                    username=ticket_user.username, category=category, ticket_gmt_created=ticket_obj.gmt_created,
+                    ticket_id=ticket_obj.id, workflow_id=ticket_obj.workflow_id, act_state_id=ticket_obj.act_state_id,
+                    state_id=ticket_obj.state_id, sn=ticket_obj.sn, title=ticket_obj.title,
+                    creator=ticket_obj.creator))
+        TicketInbox.objects.filter(ticket_id__in=ticket_id_list).delete()
+        TicketInbox.objects.bulk_create(inbox_list)
+
+    @classmethod
+    @auto_log
+    def get_ticket_inbox_id_queryset(cls, username: str, category: str, filter_dict: dict, reverse: int = 1,
+                                     workflow_query_params: Q = None):
+        """
+        读模型中满足条件的工单id及创建时间(游标分页使用), 按工单创建时间排序
+        ticket ids and creation time from the read model, ordered by the ticket's creation time
+        :param username:
+        :param category:
+        :param filter_dict: 工单列表的过滤条件(TicketRecord的字段)
+        :param reverse:
+        :param workflow_query_params: 有权限的工作流的查询条件(workflow_id字段)
+        :return:
+        """
+        inbox_filter_dict = dict(username=username, category=category)
+        for key, value in filter_dict.items():
+            inbox_filter_dict[cls.FILTER_FIELD_DICT.get(key, key)] = value
+        queryset = TicketInbox.objects.filter(**inbox_filter_dict)
+        if workflow_query_params is not None:
+            queryset = queryset.filter(workflow_query_params)
+        if category == cls.CATEGORY_DUTY:
+            queryset = queryset.exclude(act_state_id__in=[constant_service_ins.TICKET_ACT_STATE_FINISH,
+                                                          constant_service_ins.TICKET_ACT_STATE_CLOSED])
+        order_by_list = ['-ticket_gmt_created', '-ticket_id'] if reverse else ['ticket_gmt_created', 'ticket_id']
+        return True, queryset.order_by(*order_by_list).values('ticket_id', 'ticket_gmt_created')
+
+    @classmethod
+    @auto_log
+    def rebuild_ticket_inbox(cls, batch_size: int = 1000) -> tuple:
+        """
+        全量重建读模型(首次启用或数据不一致时), 按工单id分批
+        rebuild the whole read model in batches of tickets
+        :param batch_size:
+        :return:
+        """
+        if not settings.TICKET_INBOX_ENABLED:
+            return False, 'TICKET_INBOX_ENABLED is False'
+        last_ticket_id = 0
+        ticket_count = 0
+        while True:
+            ticket_id_list = list(TicketRecord.objects.filter(id__gt=last_ticket_id, is_deleted=0).order_by(
+                'id').values_list('id', flat=True)[:batch_size])
+            if not ticket_id_list:
+                break
+            cls.sync_tickets_inbox(ticket_id_list)
+            ticket_count += len(ticket_id_list)
+            last_ticket_id = ticket_id_list[-1]
+        # 已删除工单的记录
+        TicketInbox.objects.filter(ticket_id__in=TicketRecord.objects.filter(is_deleted=1).values('id')).delete()
+        return True, dict(ticket_count=ticket_count)
+
+
+ticket_inbox_service_ins = TicketInboxService()
@@ -0,0 +1,272 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from django.conf import settings
+
+from apps.ticket.models import TicketRecord
+from apps.workflow.models import CustomNotice, Workflow
+from service.account.account_base_service import account_base_service_ins
+from service.base_service import BaseService
+from service.common.common_service import common_service_ins
+from service.common.constant_service import constant_service_ins
+from service.common.http_service import http_service_ins
+from service.common.log_service import auto_log
+from service.redis_pool import POOL
+from service.ticket.ticket_base_service import ticket_base_service_ins
+
+logger = logging.getLogger('django')
+
+
+class TicketNoticeService(BaseService):
+    """
+    工单通知发送: 一次查询加载所有通知配置，各通知hook在线程池中并发调用(按主机复用连接池，超时及失败重试)，
+    单个hook慢或不可用不影响其他通知
+    ticket notice dispatcher. notice configs are loaded in one query, hooks are called concurrently in a thread pool
+    with pooled sessions, per-hook timeout and retry with backoff.
+    配置NOTICE_COALESCE_WINDOW后通知先进入redis有序集合(score为发送时间)，窗口内同一工单的多次通知合并为一次，
+    由定时任务flush_ticket_notice按工单最新状态发送
+    with NOTICE_COALESCE_WINDOW set, notices of a ticket within the window are coalesced in a redis sorted set and
+    sent once with the latest ticket state by the periodic flush task
+    """
+    PENDING_KEY = 'ticket_notice_pending'
+    lock = threading.Lock()
+    executor = None
+    executor_pid = None
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_redis_conn(cls):
+        return redis.Redis(connection_pool=POOL)
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        with cls.lock:
+            # fork后的子进程中线程池不可用，需要重建
+            if cls.executor is None or cls.executor_pid != os.getpid():
+                cls.executor = ThreadPoolExecutor(max_workers=settings.NOTICE_SEND_CONCURRENCY)
+                cls.executor_pid = os.getpid()
+            return cls.executor
+
+    @classmethod
+    @auto_log
+    def get_ticket_notice_params(cls, ticket_obj: TicketRecord, workflow_obj: Workflow) -> tuple:
+        """
+        通知hook的请求参数: 通知标题、内容, 当前处理人信息, 工单字段及最后一条操作记录
+        :param ticket_obj:
+        :param workflow_obj:
+        :return:
+        """
+        ticket_id = ticket_obj.id
+        flag, ticket_value_info = ticket_base_service_ins.get_ticket_all_field_value(ticket_id)
+        if flag is False:
+            return False, ticket_value_info
+        title_result = workflow_obj.title_template.format(**ticket_value_info)
+        content_result = workflow_obj.content_template.format(**ticket_value_info)
+        # 获取工单最后一条操作记录
+        flag, result = ticket_base_service_ins.get_ticket_flow_log(ticket_id, 'loonrobot')
+        if flag is False:
+            return False, result
+        last_flow_log = result.get('ticket_flow_log_restful_list')[0]
+
+        participant_username_list = []
+        if ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_PERSONAL:
+            participant_username_list = [ticket_obj.participant]
+        elif ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_MULTI:
+            participant_username_list = ticket_obj.participant.split(',')
+        elif ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROLE:
+            flag, participant_username_list = account_base_service_ins.get_role_username_list(ticket_obj.participant)
+            if flag is False:
+                return False, participant_username_list
+        elif ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_DEPT:
+            flag, participant_username_list = account_base_service_ins.get_dept_username_list(ticket_obj.participant)
+            if flag is False:
+                return False, participant_username_list
+
+        participant_info_list = []
+        if participant_username_list:
+            from apps.account.models import LoonUser
+            participant_queryset = LoonUser.objects.filter(username__in=participant_username_list, is_deleted=0)
+            for participant_0 in participant_queryset:
+                participant_info_list.append(dict(username=participant_0.username, alias=participant_0.alias,
+                                                  phone=participant_0.phone, email=participant_0.email))
+
+        return True, {'title_result': title_result, 'content_result': content_result,
+                      'participant': ticket_obj.participant, 'participant_type_id': ticket_obj.participant_type_id,
+                      'multi_all_person': ticket_obj.multi_all_person, 'ticket_value_info': ticket_value_info,
+                      'last_flow_log': last_flow_log, 'participant_info_list': participant_info_list}
+
+    @classmethod
+    def deliver_notice(cls, ticket_id: int, notice_obj: CustomNotice, params: dict) -> dict:
+        """
+        调用一个通知hook, 记录发送结果
+        :param ticket_id:
+        :param notice_obj:
+        :param params:
+        :return: dict(notice_id, result, msg)
+        """
+        start_time = time.time()
+        flag, headers = common_service_ins.gen_signature_by_token(notice_obj.hook_token)
+        flag, result = http_service_ins.post_json(
+            notice_obj.hook_url, headers, params, timeout=settings.NOTICE_HOOK_TIMEOUT,
+            retry_count=settings.NOTICE_HOOK_RETRY_COUNT, retry_backoff=settings.NOTICE_HOOK_RETRY_BACKOFF)
+        if flag is False:
+            delivery_result = dict(notice_id=notice_obj.id, result='fail', msg=result)
+        elif not isinstance(result, dict):
+            delivery_result = dict(notice_id=notice_obj.id, result='fail', msg='invalid response')
+        else:
+            delivery_result = dict(notice_id=notice_obj.id, result='success' if result.get('code') == 0 else 'fail',
+                                   msg=result.get('msg', ''))
+        logger.info('ticket {} notice {} {}, cost {:.0f}ms: {}'.format(
+            ticket_id, notice_obj.id, delivery_result['result'], (time.time() - start_time) * 1000,
+            delivery_result['msg']))
+        return delivery_result
+
+    @classmethod
+    @auto_log
+    def send_tickets_notice(cls, ticket_id_list: list) -> tuple:
+        """
+        发送多个工单的通知, 所有工单的所有通知hook并发调用
+        send notices of tickets, hooks of all the tickets are called concurrently
+        :param ticket_id_list:
+        :return: {ticket_id: dict(send_notice_result_list=[]) 或错误信息}
+        """
+        ticket_notice_result_dict = {}
+        ticket_queryset = TicketRecord.objects.filter(id__in=ticket_id_list, is_deleted=0)
+        ticket_dict = {ticket_obj.id: ticket_obj for ticket_obj in ticket_queryset}
+        workflow_queryset = Workflow.objects.filter(
+            id__in=set(ticket_obj.workflow_id for ticket_obj in ticket_dict.values()), is_deleted=0)
+        workflow_dict = {workflow_obj.id: workflow_obj for workflow_obj in workflow_queryset}
+
+        workflow_notice_id_dict = {}
+        for workflow_obj in workflow_dict.values():
+            if workflow_obj.notices:
+                workflow_notice_id_dict[workflow_obj.id] = [int(notice_str)
+                                                            for notice_str in workflow_obj.notices.split(',')]
+        notice_queryset = CustomNotice.objects.filter(
+            id__in=set(notice_id for notice_id_list in workflow_notice_id_dict.values()
+                       for notice_id in notice_id_list), is_deleted=0)
+        notice_dict = {notice_obj.id: notice_obj for notice_obj in notice_queryset}
+
+        future_list = []
+        executor = cls.get_executor()
+        for ticket_id in ticket_id_list:
+            ticket_obj = ticket_dict.get(ticket_id)
+            if not ticket_obj:
+                ticket_notice_result_dict[ticket_id] = 'ticket is not exist or has been deleted'
+                continue
+            notice_id_list = workflow_notice_id_dict.get(ticket_obj.workflow_id)
+            if not notice_id_list:
+                ticket_notice_result_dict[ticket_id] = 'no notice defined'
+                continue
+            flag, params = cls.get_ticket_notice_params(ticket_obj, workflow_dict[ticket_obj.workflow_id])
+            if flag is False:
+                ticket_notice_result_dict[ticket_id] = params
+                continue
+            ticket_notice_result_dict[ticket_id] = dict(send_notice_result_list=[])
+            for notice_id in notice_id_list:
+                if notice_id in notice_dict:
+                    future_list.append((ticket_id, executor.submit(cls.deliver_notice, ticket_id,
+                                                                   notice_dict[notice_id], params)))
+
+        for ticket_id, future in future_list:
+            ticket_notice_result_dict[ticket_id]['send_notice_result_list'].append(future.result())
+        return True, ticket_notice_result_dict
+
+    @classmethod
+    @auto_log
+    def send_ticket_notice(cls, ticket_id: int) -> tuple:
+        """
+        发送工单通知
+        send notices of the ticket
+        :param ticket_id:
+        :return:
+        """
+        flag, ticket_notice_result_dict = cls.send_tickets_notice([ticket_id])
+        if flag is False:
+            return False, ticket_notice_result_dict
+        result = ticket_notice_result_dict[ticket_id]
+        if result == 'no notice defined':
+            return True, result
+        return isinstance(result, dict), result
+
+    @classmethod
+    def send_ticket_notice_async(cls, ticket_id_list: list):
+        """
+        立即投递发送通知的celery任务
+        :param ticket_id_list:
+        :return:
+        """
+        if len(ticket_id_list) == 1:
+            from tasks import send_ticket_notice
+            send_ticket_notice.apply_async(args=[ticket_id_list[0]], queue='loonflow')
+        else:
+            from tasks import send_ticket_notice_batch
+            send_ticket_notice_batch.apply_async(args=[ticket_id_list], queue='loonflow')
+
+    @classmethod
+    @auto_log
+    def enqueue_ticket_notice(cls, ticket_id_list: list) -> tuple:
+        """
+        工单通知进入合并队列, 已在队列中的工单保持原发送时间(nx). 未配置合并窗口或redis不可用时立即发送
+        enqueue ticket notices for coalescing, tickets already pending keep their send time.
+        sent immediately when coalescing is disabled or redis is unavailable
+        :param ticket_id_list:
+        :return:
+        """
+        if settings.NOTICE_COALESCE_WINDOW <= 0:
+            cls.send_ticket_notice_async(ticket_id_list)
+            return True, ''
+        send_at = time.time() + settings.NOTICE_COALESCE_WINDOW
+        try:
+            redis_conn = cls.get_redis_conn()
+            redis_conn.zadd(cls.PENDING_KEY, {ticket_id: send_at for ticket_id in ticket_id_list}, nx=True)
+        except redis.RedisError as e:
+            logger.warning('enqueue ticket notice failed, send immediately: {}'.format(e.__str__()))
+            cls.send_ticket_notice_async(ticket_id_list)
+        return True, ''
+
+    @classmethod
+    def claim_due_ticket_id_list(cls, redis_conn: redis.Redis, batch_size: int) -> list:
+        """
+        取出到期的工单, 只有zrem成功的工单归当前进程发送(多个flush任务并发时不会重复发送)
+        :param redis_conn:
+        :param batch_size:
+        :return:
+        """
+        member_list = redis_conn.zrangebyscore(cls.PENDING_KEY, '-inf', time.time(), start=0, num=batch_size)
+        if not member_list:
+            return []
+        pipe = redis_conn.pipeline(transaction=False)
+        for member in member_list:
+            pipe.zrem(cls.PENDING_KEY, member)
+        return [int(member) for member, removed in zip(member_list, pipe.execute()) if removed]
+
+    @classmethod
+    @auto_log
+    def flush_pending_notice(cls) -> tuple:
+        """
+        分批发送合并队列中到期的工单通知
+        send due notices in the coalescing queue in batches
+        :return:
+        """
+        redis_conn = cls.get_redis_conn()
+        ticket_count = 0
+        while True:
+            ticket_id_list = cls.claim_due_ticket_id_list(redis_conn, settings.NOTICE_COALESCE_BATCH_SIZE)
+            if ticket_id_list:
+                ticket_count += len(ticket_id_list)
+                flag, result = cls.send_tickets_notice(ticket_id_list)
+                if flag is False:
+                    logger.error('send ticket notice failed, ticket_id_list: {}, {}'.format(ticket_id_list, result))
+            else:
+                break
+        return True, dict(ticket_count=ticket_count)
+
+
+ticket_notice_service_ins = TicketNoticeService()
@@ -0,0 +1,199 @@
+import datetime
+import math
+
+from django.conf import settings
+from django.db.models import Max
+
+from apps.ticket.models import TicketFlowLog, TicketRecord, TicketStateSla
+from service.base_service import BaseService
+from service.common.constant_service import constant_service_ins
+from service.common.log_service import auto_log
+from service.common.paginator_service import paginator_service_ins
+from service.common.working_day_service import working_day_service_ins
+
+
+class TicketSlaService(BaseService):
+    """
+    工单状态时效(SLA): 工单新建或流转到新状态时记录进入时间, 按状态的最后期限(deadline, 工作日)及工作日日历计算到期时间,
+    离开状态时记录离开时间及停留时间。超时、即将超时的工单按(状态, 到期时间)索引查询, 状态停留时间的分位数按
+    (状态id, 状态, 停留时间)索引查询, 不再扫描流转记录。settings.TICKET_SLA_ENABLED为False时不记录
+    state entry, due and leave time of tickets, due time follows the state deadline in working days. overdue
+    queries and dwell time percentiles are answered from indexes instead of scanning the flow log
+    """
+    STATUS_IN_STATE = 0
+    STATUS_LEFT = 1
+    CATEGORY_OVERDUE = 'overdue'
+    CATEGORY_WARNING = 'warning'
+    PERCENTILE_LIST = [50, 90, 95, 99]
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_due_time(cls, state_obj, enter_time: datetime.datetime):
+        """
+        到期时间, 状态未设置最后期限时为None
+        :param state_obj:
+        :param enter_time:
+        :return:
+        """
+        if not state_obj.deadline or state_obj.deadline <= 0:
+            return None
+        return working_day_service_ins.add_working_days(enter_time, state_obj.deadline)
+
+    @classmethod
+    def leave_state(cls, sla_list: list, now: datetime.datetime):
+        """
+        离开状态: 记录离开时间及停留时间
+        :param sla_list: 处于状态中的时效记录
+        :param now:
+        :return:
+        """
+        for sla_obj in sla_list:
+            TicketStateSla.objects.filter(id=sla_obj.id).update(
+                status=cls.STATUS_LEFT, leave_time=now,
+                duration=max(int((now - sla_obj.enter_time).total_seconds()), 0), gmt_modified=now)
+
+    @classmethod
+    def enter_state(cls, ticket_state_list: list):
+        """
+        工单进入状态(新建、处理、关闭、撤回、强制修改状态等): 离开原状态, 非结束状态时记录进入时间及到期时间,
+        状态未变化时保留原记录
+        :param ticket_state_list: [(工单, 状态)]
+        :return:
+        """
+        if not settings.TICKET_SLA_ENABLED or not ticket_state_list:
+            return
+        now = datetime.datetime.now()
+        current_sla_dict = {sla_obj.ticket_id: sla_obj for sla_obj in TicketStateSla.objects.filter(
+            ticket_id__in=[ticket_obj.id for ticket_obj, _ in ticket_state_list], status=cls.STATUS_IN_STATE).only(
+            'id', 'ticket_id', 'state_id', 'enter_time')}
+        due_time_dict = {}
+        leave_sla_list, sla_list = [], []
+        for ticket_obj, state_obj in ticket_state_list:
+            current_sla_obj = current_sla_dict.get(ticket_obj.id)
+            if current_sla_obj:
+                if current_sla_obj.state_id == state_obj.id:
+                    continue
+                leave_sla_list.append(current_sla_obj)
+            if state_obj.type_id == constant_service_ins.STATE_TYPE_END:
+                continue
+            if state_obj.id not in due_time_dict:
+                due_time_dict[state_obj.id] = cls.get_due_time(state_obj, now)
+            sla_list.append(TicketStateSla(ticket_id=ticket_obj.id, workflow_id=ticket_obj.workflow_id,
+                                           state_id=state_obj.id, enter_time=now,
+                                           due_time=due_time_dict[state_obj.id]))
+        cls.leave_state(leave_sla_list, now)
+        TicketStateSla.objects.bulk_create(sla_list)
+
+    @classmethod
+    def delete_ticket_sla(cls, ticket_id: int):
+        """
+        工单删除后不再统计
+        :param ticket_id:
+        :return:
+        """
+        if not settings.TICKET_SLA_ENABLED:
+            return
+        TicketStateSla.objects.filter(ticket_id=ticket_id).delete()
+
+    @classmethod
+    @auto_log
+    def get_ticket_sla_list(cls, workflow_id_list: list, category: str, per_page: int = 10, page: int = 1) -> tuple:
+        """
+        超时(overdue)或即将超时(warning, TICKET_SLA_WARNING_SECONDS秒内到期)的工单, 按到期时间排序
+        :param workflow_id_list:
+        :param category:
+        :param per_page:
+        :param page:
+        :return:
+        """
+        now = datetime.datetime.now()
+        queryset = TicketStateSla.objects.filter(status=cls.STATUS_IN_STATE, workflow_id__in=workflow_id_list)
+        if category == cls.CATEGORY_OVERDUE:
+            queryset = queryset.filter(due_time__lt=now)
+        elif category == cls.CATEGORY_WARNING:
+            queryset = queryset.filter(due_time__gte=now, due_time__lt=now + datetime.timedelta(
+                seconds=settings.TICKET_SLA_WARNING_SECONDS))
+        else:
+            return False, 'category should be in {}, {}'.format(cls.CATEGORY_OVERDUE, cls.CATEGORY_WARNING)
+        flag, result = paginator_service_ins.paginate(queryset.order_by('due_time', 'id'), per_page, page)
+        if flag is False:
+            return False, result
+        sla_result_list = [dict(ticket_id=sla.ticket_id, workflow_id=sla.workflow_id, state_id=sla.state_id,
+                                enter_time=str(sla.enter_time)[:19], due_time=str(sla.due_time)[:19],
+                                overdue_seconds=int((now - sla.due_time).total_seconds()))
+                           for sla in result['object_list']]
+        return True, dict(sla_result_list=sla_result_list, paginator_info=result['paginator_info'])
+
+    @classmethod
+    @auto_log
+    def get_state_sla_statistics(cls, workflow_id_list: list, state_id: int) -> tuple:
+        """
+        状态时效统计: 处于该状态及其中已超时的工单个数, 已离开该状态的停留时间分位数(秒), 分位数按停留时间索引定位
+        :param workflow_id_list: 只统计这些工作流的工单
+        :param state_id:
+        :return:
+        """
+        now = datetime.datetime.now()
+        queryset = TicketStateSla.objects.filter(state_id=state_id, workflow_id__in=workflow_id_list)
+        in_state_queryset = queryset.filter(status=cls.STATUS_IN_STATE)
+        left_queryset = queryset.filter(status=cls.STATUS_LEFT)
+        left_count = left_queryset.count()
+        duration_percentile_dict = {}
+        for percentile in cls.PERCENTILE_LIST:
+            if not left_count:
+                duration_percentile_dict['p{}'.format(percentile)] = None
+                continue
+            index = max(int(math.ceil(percentile / 100 * left_count)) - 1, 0)
+            duration_percentile_dict['p{}'.format(percentile)] = left_queryset.order_by('duration').values_list(
+                'duration', flat=True)[index]
+        return True, dict(in_state_count=in_state_queryset.count(),
+                          overdue_count=in_state_queryset.filter(due_time__lt=now).count(),
+                          left_count=left_count, duration=duration_percentile_dict)
+
+    @classmethod
+    @auto_log
+    def rebuild_ticket_sla(cls, batch_size: int = 1000) -> tuple:
+        """
+        为未结束且没有时效记录的工单补充当前状态的时效记录(首次启用时), 进入时间为最后一条流转记录的时间
+        add the current state record of unfinished tickets without one, entered at their last flow log
+        :param batch_size:
+        :return:
+        """
+        from apps.workflow.models import State
+        if not settings.TICKET_SLA_ENABLED:
+            return False, 'TICKET_SLA_ENABLED is False'
+        last_ticket_id = 0
+        ticket_count = 0
+        while True:
+            ticket_list = list(TicketRecord.objects.filter(id__gt=last_ticket_id, is_deleted=0).exclude(
+                act_state_id__in=[constant_service_ins.TICKET_ACT_STATE_FINISH,
+                                  constant_service_ins.TICKET_ACT_STATE_CLOSED]).order_by('id').only(
+                'id', 'workflow_id', 'state_id', 'gmt_created')[:batch_size])
+            if not ticket_list:
+                break
+            last_ticket_id = ticket_list[-1].id
+            ticket_id_list = [ticket_obj.id for ticket_obj in ticket_list]
+            existed_ticket_id_set = set(TicketStateSla.objects.filter(
+                ticket_id__in=ticket_id_list, status=cls.STATUS_IN_STATE).values_list('ticket_id', flat=True))
+            enter_time_dict = dict(TicketFlowLog.objects.filter(ticket_id__in=ticket_id_list).values(
+                'ticket_id').annotate(enter_time=Max('gmt_created')).values_list('ticket_id', 'enter_time'))
+            state_dict = {state_obj.id: state_obj for state_obj in State.objects.filter(
+                id__in=list(set(ticket_obj.state_id for ticket_obj in ticket_list)))}
+            sla_list = []
+            for ticket_obj in ticket_list:
+                state_obj = state_dict.get(ticket_obj.state_id)
+                if ticket_obj.id in existed_ticket_id_set or not state_obj or \
+                        state_obj.type_id == constant_service_ins.STATE_TYPE_END:
+                    continue
+                enter_time = enter_time_dict.get(ticket_obj.id) or ticket_obj.gmt_created
+                sla_list.append(TicketStateSla(ticket_id=ticket_obj.id, workflow_id=ticket_obj.workflow_id,
+                                               state_id=state_obj.id, enter_time=enter_time,
+                                               due_time=cls.get_due_time(state_obj, enter_time)))
+            TicketStateSla.objects.bulk_create(sla_list)
+            ticket_count += len(sla_list)
+        return True, dict(ticket_count=ticket_count)
+
+
+ticket_sla_service_ins = TicketSlaService()
@@ -0,0 +1,159 @@
+import datetime
+import re
+import threading
+
+import redis
+from django.conf import settings
+from django.db import transaction, IntegrityError
+
+from apps.ticket.models import TicketRecord, TicketSnSequence
+from service.base_service import BaseService
+from service.common.log_service import auto_log
+from service.redis_pool import POOL
+
+
+class TicketSnService(BaseService):
+    """
+    工单流水号序号分配: 每个进程按天从redis(INCRBY)或数据库序列表一次租用一段序号(TICKET_SN_BLOCK_SIZE个)，
+    用完后再租用下一段，跨天时丢弃未用完的序号。不同进程的序号段互不重叠，因此流水号唯一但不保证严格递增，进程重启会留下空号.
+    数据库序列表记录已租用的最大序号, 使用redis时每次租用后同步更新, redis中的序号丢失(重启、淘汰)时从序列表恢复,
+    不会重复分配其他进程仍持有的序号段. 序号需要在事务外分配, 避免调用方回滚时序列表的更新也被回滚
+    ticket sn sequence allocator. every process leases a block of sequence numbers per day from redis (INCRBY) or
+    the db sequence table and hands them out locally. unused numbers are dropped when the day rolls over.
+    the db sequence table is authoritative, redis leases are recorded there and a lost redis counter is reseeded from it
+    """
+    REDIS_KEY_PREFIX = 'ticket_day_count_'
+    lock = threading.Lock()
+    # 当前进程租用的序号段: day, 下一个可用序号, 序号段的最后一个序号
+    block_dict = dict(day='', next_value=1, last_value=0)
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_redis_conn(cls):
+        return redis.Redis(connection_pool=POOL)
+
+    @classmethod
+    def get_sequence_name(cls, day: str) -> str:
+        # 多机房部署时各机房使用独立的序号
+        return '{}{}'.format('{}_'.format(settings.DEPLOY_ZONE) if settings.DEPLOY_ZONE else '', day)
+
+    @classmethod
+    def get_issued_max_sequence(cls, day: str) -> int:
+        """
+        当天已租用的最大序号: 序列表中记录的值与当天工单流水号中的最大序号(包括已删除的工单)取大,
+        只在当天第一次分配或redis中的序号丢失时查询
+        :param day:
+        :return:
+        """
+        max_sequence = TicketSnSequence.objects.filter(name=cls.get_sequence_name(day)).values_list(
+            'value', flat=True).first() or 0
+        # 流水号格式: {前缀}_{机房_}{年月日}{序号}
+        sn_pattern = re.compile(r'_{}{}(\d{{4,}})$'.format(
+            re.escape('{}_'.format(settings.DEPLOY_ZONE) if settings.DEPLOY_ZONE else ''), day.replace('-', '')))
+        today = datetime.datetime.strptime(day, '%Y-%m-%d')
+        # 跨零点时流水号的日期可能早于创建时间
+        sn_queryset = TicketRecord.objects.filter(
+            gmt_created__gte=today, gmt_created__lt=today + datetime.timedelta(days=2)).values_list('sn', flat=True)
+        for sn in sn_queryset.iterator():
+            match = sn_pattern.search(sn)
+            if match:
+                max_sequence = max(max_sequence, int(match.group(1)))
+        return max_sequence
+
+    @classmethod
+    def save_issued_max_sequence(cls, day: str, value: int):
+        """
+        记录已租用的最大序号(只增不减)
+        :param day:
+        :param value:
+        :return:
+        """
+        name = cls.get_sequence_name(day)
+        now = datetime.datetime.now()
+        if TicketSnSequence.objects.filter(name=name, value__lt=value).update(value=value, gmt_modified=now):
+            return
+        if TicketSnSequence.objects.filter(name=name).exists():
+            return
+        try:
+            with transaction.atomic():
+                TicketSnSequence.objects.create(name=name, value=value)
+        except IntegrityError:
+            # 其他进程已创建
+            TicketSnSequence.objects.filter(name=name, value__lt=value).update(value=value, gmt_modified=now)
+
+    @classmethod
+    def lease_block_from_redis(cls, day: str, size: int) -> int:
+        """
+        从redis租用一段序号, 返回序号段的最后一个序号. 租用后记录到序列表, redis中的序号不存在时从序列表恢复
+        :param day:
+        :param size:
+        :return:
+        """
+        redis_conn = cls.get_redis_conn()
+        redis_key = cls.REDIS_KEY_PREFIX + cls.get_sequence_name(day)
+        if not redis_conn.exists(redis_key):
+            # nx保证并发初始化时只有一个进程设置成功
+            redis_conn.set(redis_key, cls.get_issued_max_sequence(day), ex=2 * 86400, nx=True)
+        last_value = redis_conn.incrby(redis_key, size)
+        cls.save_issued_max_sequence(day, last_value)
+        return last_value
+
+    @classmethod
+    def lease_block_from_db(cls, day: str, size: int) -> int:
+        """
+        从数据库序列表租用一段序号, 返回序号段的最后一个序号
+        :param day:
+        :param size:
+        :return:
+        """
+        name = cls.get_sequence_name(day)
+        if not TicketSnSequence.objects.filter(name=name).exists():
+            try:
+                with transaction.atomic():
+                    TicketSnSequence.objects.create(name=name, value=cls.get_issued_max_sequence(day))
+            except IntegrityError:
+                # 其他进程已创建
+                pass
+        with transaction.atomic():
+            sequence_obj = TicketSnSequence.objects.select_for_update().get(name=name)
+            sequence_obj.value += size
+            sequence_obj.save(update_fields=['value', 'gmt_modified'])
+        return sequence_obj.value
+
+    @classmethod
+    def lease_block(cls, day: str, size: int) -> int:
+        if settings.TICKET_SN_STORE == 'db':
+            return cls.lease_block_from_db(day, size)
+        return cls.lease_block_from_redis(day, size)
+
+    @classmethod
+    @auto_log
+    def get_sequence_list(cls, count: int = 1) -> tuple:
+        """
+        分配count个当天的序号, 需要在事务外调用
+        allocate count sequence numbers of today, call it outside of transactions
+        :param count:
+        :return: dict(day=datetime.date, sequence_list=[])
+        """
+        now = datetime.datetime.now()
+        day = str(now)[:10]
+        sequence_list = []
+        with cls.lock:
+            block_dict = cls.block_dict
+            if block_dict['day'] != day:
+                # 跨天丢弃前一天未用完的序号
+                block_dict.update(day=day, next_value=1, last_value=0)
+            while len(sequence_list) < count:
+                if block_dict['next_value'] > block_dict['last_value']:
+                    size = max(settings.TICKET_SN_BLOCK_SIZE, count - len(sequence_list))
+                    last_value = cls.lease_block(day, size)
+                    block_dict.update(next_value=last_value - size + 1, last_value=last_value)
+                take_count = min(count - len(sequence_list), block_dict['last_value'] - block_dict['next_value'] + 1)
+                sequence_list.extend(range(block_dict['next_value'], block_dict['next_value'] + take_count))
+                block_dict['next_value'] += take_count
+        return True, dict(day=now.date(), sequence_list=sequence_list)
+
+
+ticket_sn_service_ins = TicketSnService()
@@ -0,0 +1,192 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+from apps.ticket.models import TicketDailyStatistics, TicketRecord
+from service.account.account_org_index_service import account_org_index_service_ins
+from service.base_service import BaseService
+from service.common.log_service import auto_log
+
+
+class TicketStatisticsService(BaseService):
+    """
+    工单统计: 按(工单创建日期, 工作流, 进行状态, 创建人部门)汇总的每日工单个数(ticket_ticketdailystatistics),
+    工单新建、进行状态变化、删除时在当前事务中增量更新, 统计接口按日期范围查询汇总表。
+    settings.TICKET_STATISTICS_ENABLED为False时不维护汇总表, 统计接口直接按天分组查询工单记录
+    daily ticket count rollups by (creation day, workflow, act state, creator dept), maintained incrementally when a
+    ticket is created, changes its act state or is deleted
+    """
+    GROUP_FIELD_LIST = ['day', 'workflow_id', 'act_state_id', 'creator_dept_id']
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_statistics_key(cls, ticket_obj: TicketRecord, act_state_id: int = None) -> tuple:
+        """
+        工单所属的汇总行: (创建日期, 工作流id, 进行状态, 创建人部门id)
+        :param ticket_obj:
+        :param act_state_id: 为None时使用工单当前的进行状态
+        :return:
+        """
+        if act_state_id is None:
+            act_state_id = ticket_obj.act_state_id
+        return (ticket_obj.gmt_created.date(), ticket_obj.workflow_id, act_state_id,
+                account_org_index_service_ins.get_user_dept_id(ticket_obj.creator))
+
+    @classmethod
+    def apply_count_delta(cls, count_delta_dict: dict):
+        """
+        更新汇总行的工单个数, 汇总行不存在时新增(并发新增时唯一索引冲突后再更新)
+        :param count_delta_dict: {(day, workflow_id, act_state_id, creator_dept_id): 变化的个数}
+        :return:
+        """
+        now = datetime.datetime.now()
+        for statistics_key, count_delta in count_delta_dict.items():
+            if not count_delta:
+                continue
+            key_dict = dict(zip(cls.GROUP_FIELD_LIST, statistics_key))
+            if TicketDailyStatistics.objects.filter(**key_dict).update(
+                    ticket_count=F('ticket_count') + count_delta, gmt_modified=now):
+                continue
+            try:
+                with transaction.atomic():
+                    TicketDailyStatistics.objects.create(ticket_count=count_delta, **key_dict)
+            except IntegrityError:
+                TicketDailyStatistics.objects.filter(**key_dict).update(
+                    ticket_count=F('ticket_count') + count_delta, gmt_modified=now)
+
+    @classmethod
+    def add_tickets(cls, ticket_obj_list: list):
+        """
+        新建工单
+        :param ticket_obj_list: 已保存的工单
+        :return:
+        """
+        if not settings.TICKET_STATISTICS_ENABLED:
+            return
+        count_delta_dict = {}
+        for ticket_obj in ticket_obj_list:
+            statistics_key = cls.get_statistics_key(ticket_obj)
+            count_delta_dict[statistics_key] = count_delta_dict.get(statistics_key, 0) + 1
+        cls.apply_count_delta(count_delta_dict)
+
+    @classmethod
+    def update_tickets_act_state(cls, ticket_act_state_list: list):
+        """
+        工单进行状态变化(处理、关闭、撤回等), 从原进行状态的汇总行移到新进行状态的汇总行
+        :param ticket_act_state_list: [(工单, 原进行状态)], 工单的act_state_id为新的进行状态
+        :return:
+        """
+        if not settings.TICKET_STATISTICS_ENABLED:
+            return
+        count_delta_dict = {}
+        for ticket_obj, old_act_state_id in ticket_act_state_list:
+            if ticket_obj.act_state_id == old_act_state_id:
+                continue
+            old_statistics_key = cls.get_statistics_key(ticket_obj, old_act_state_id)
+            statistics_key = old_statistics_key[:2] + (ticket_obj.act_state_id,) + old_statistics_key[3:]
+            count_delta_dict[old_statistics_key] = count_delta_dict.get(old_statistics_key, 0) - 1
+            count_delta_dict[statistics_key] = count_delta_dict.get(statistics_key, 0) + 1
+        cls.apply_count_delta(count_delta_dict)
+
+    @classmethod
+    def remove_ticket(cls, ticket_obj: TicketRecord):
+        """
+        删除工单
+        :param ticket_obj:
+        :return:
+        """
+        if not settings.TICKET_STATISTICS_ENABLED:
+            return
+        cls.apply_count_delta({cls.get_statistics_key(ticket_obj): -1})
+
+    @classmethod
+    @auto_log
+    def rebuild_ticket_statistics(cls, start_date: str = '', end_date: str = '', batch_size: int = 5000) -> tuple:
+        """
+        按工单记录重建汇总表(首次启用、历史数据回填或创建人部门调整后), 按工单id分批读取, 重建期间新建、处理的工单可能
+        需要再次重建对应日期
+        rebuild the rollups of the date range from ticket records
+        :param start_date: 工单创建日期起, 如2020-03-01, 为空时不限
+        :param end_date: 工单创建日期止(包含)
+        :param batch_size:
+        :return:
+        """
+        if not settings.TICKET_STATISTICS_ENABLED:
+            return False, 'TICKET_STATISTICS_ENABLED is False'
+        ticket_filter_dict, statistics_filter_dict = dict(is_deleted=0), dict()
+        if start_date:
+            ticket_filter_dict['gmt_created__gte'] = start_date
+            statistics_filter_dict['day__gte'] = start_date
+        if end_date:
+            end_day = datetime.datetime.strptime(end_date, '%Y-%m-%d') + datetime.timedelta(days=1)
+            ticket_filter_dict['gmt_created__lt'] = end_day
+            statistics_filter_dict['day__lte'] = end_date
+
+        count_dict = {}
+        last_ticket_id = 0
+        ticket_count = 0
+        while True:
+            ticket_list = list(TicketRecord.objects.filter(id__gt=last_ticket_id, **ticket_filter_dict).order_by(
+                'id').only('id', 'gmt_created', 'workflow_id', 'act_state_id', 'creator')[:batch_size])
+            if not ticket_list:
+                break
+            for ticket_obj in ticket_list:
+                statistics_key = cls.get_statistics_key(ticket_obj)
+                count_dict[statistics_key] = count_dict.get(statistics_key, 0) + 1
+            ticket_count += len(ticket_list)
+            last_ticket_id = ticket_list[-1].id
+
+        with transaction.atomic():
+            TicketDailyStatistics.objects.filter(**statistics_filter_dict).delete()
+            TicketDailyStatistics.objects.bulk_create([
+                TicketDailyStatistics(ticket_count=count, **dict(zip(cls.GROUP_FIELD_LIST, statistics_key)))
+                for statistics_key, count in count_dict.items()], batch_size=1000)
+        return True, dict(ticket_count=ticket_count, row_count=len(count_dict))
+
+    @classmethod
+    @auto_log
+    def get_ticket_count_statistics(cls, workflow_id_list: list, start_date: str = '', end_date: str = '',
+                                    group_field_list: list = None) -> tuple:
+        """
+        按日期范围统计工单个数
+        :param workflow_id_list: 只统计这些工作流的工单
+        :param start_date: 工单创建日期起, 如2020-03-01, 为空时不限
+        :param end_date: 工单创建日期止(包含)
+        :param group_field_list: 分组字段, GROUP_FIELD_LIST中的字段
+        :return: [dict(分组字段..., ticket_count)]
+        """
+        group_field_list = group_field_list or []
+        if [group_field for group_field in group_field_list if group_field not in cls.GROUP_FIELD_LIST]:
+            return False, 'group field should be in {}'.format(','.join(cls.GROUP_FIELD_LIST))
+        if not settings.TICKET_STATISTICS_ENABLED:
+            if 'creator_dept_id' in group_field_list:
+                return False, 'TICKET_STATISTICS_ENABLED is False, creator_dept_id is not supported'
+            # 未启用汇总表时按天分组查询工单记录
+            queryset = TicketRecord.objects.filter(is_deleted=0, workflow_id__in=workflow_id_list)
+            if start_date:
+                queryset = queryset.filter(gmt_created__gte=start_date)
+            if end_date:
+                queryset = queryset.filter(
+                    gmt_created__lt=datetime.datetime.strptime(end_date, '%Y-%m-%d') + datetime.timedelta(days=1))
+            queryset = queryset.annotate(day=TruncDate('gmt_created'))
+            count_expression = Count('id')
+        else:
+            queryset = TicketDailyStatistics.objects.filter(workflow_id__in=workflow_id_list)
+            if start_date:
+                queryset = queryset.filter(day__gte=start_date)
+            if end_date:
+                queryset = queryset.filter(day__lte=end_date)
+            count_expression = Sum('ticket_count')
+        if not group_field_list:
+            return True, [dict(ticket_count=queryset.aggregate(ticket_count=count_expression)['ticket_count'] or 0)]
+        result_queryset = queryset.values(*group_field_list).annotate(ticket_count=count_expression).order_by(
+            *group_field_list)
+        return True, [result for result in result_queryset if result['ticket_count']]
+
+
+ticket_statistics_service_ins = TicketStatisticsService()
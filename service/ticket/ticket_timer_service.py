@@ -0,0 +1,101 @@
+import datetime
+import logging
+
+from django.conf import settings
+
+from apps.ticket.models import TicketRecord, TicketTimer
+from service.base_service import BaseService
+from service.common.db_queue_service import db_queue_service_ins
+from service.common.log_service import auto_log
+
+logger = logging.getLogger('django')
+
+
+class TicketTimerService(BaseService):
+    """
+    定时器流转: 定时器保存在ticket_tickettimer表中(按状态+到期时间索引)，定时任务分批领取到期的定时器执行。
+    领取时将定时器置为执行中并把到期时间延后TICKET_TIMER_LEASE秒作为租约(见DbQueueService)，进程异常退出时租约到期后会被重新执行。
+    工单的状态版本(state_version)与创建定时器时不一致说明工单后续有操作(处理、接单、转交、加签、评论等)，定时器失效
+    durable timer transitions. due timers are claimed in batches with select for update (skip locked when
+    supported), a claimed timer is leased by pushing its due time forward. timers are invalidated by comparing the
+    state version of the ticket
+    """
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_DONE = 2
+    STATUS_INVALID = 3
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    @auto_log
+    def add_ticket_timer(cls, ticket_obj: TicketRecord, state_id: int, transition_list: list) -> tuple:
+        """
+        新增定时器
+        :param ticket_obj:
+        :param state_id:
+        :param transition_list: 定时器流转列表
+        :return:
+        """
+        now = datetime.datetime.now()
+        TicketTimer.objects.bulk_create([
+            TicketTimer(ticket_id=ticket_obj.id, state_id=state_id, state_version=ticket_obj.state_version,
+                        transition_id=transition.id, due_time=now + datetime.timedelta(seconds=transition.timer),
+                        creator='loonrobot')
+            for transition in transition_list])
+        return True, ''
+
+    @classmethod
+    def claim_due_timer_list(cls, batch_size: int) -> list:
+        """
+        领取到期的定时器: 置为执行中, 到期时间延后作为租约
+        :param batch_size:
+        :return:
+        """
+        return db_queue_service_ins.claim_due_list(TicketTimer, [cls.STATUS_PENDING, cls.STATUS_RUNNING],
+                                                   cls.STATUS_RUNNING, 'due_time', settings.TICKET_TIMER_LEASE,
+                                                   batch_size)
+
+    @classmethod
+    def run_ticket_timer(cls, timer_obj: TicketTimer) -> tuple:
+        """
+        执行定时器流转
+        :param timer_obj:
+        :return: (status, result)
+        """
+        ticket_obj = TicketRecord.objects.filter(id=timer_obj.ticket_id, is_deleted=0).first()
+        if not ticket_obj or ticket_obj.state_id != timer_obj.state_id \
+                or ticket_obj.state_version != timer_obj.state_version:
+            return cls.STATUS_INVALID, '后续有操作，定时器失效'
+        from service.ticket.ticket_base_service import ticket_base_service_ins
+        handle_ticket_data = dict(transition_id=timer_obj.transition_id, username='loonrobot', suggestion='定时器流转')
+        flag, msg = ticket_base_service_ins.handle_ticket(timer_obj.ticket_id, handle_ticket_data, True)
+        return cls.STATUS_DONE, str(msg) if flag is False else ''
+
+    @classmethod
+    @auto_log
+    def sweep_ticket_timer(cls) -> tuple:
+        """
+        分批执行到期的定时器
+        run due timers in batches
+        :return:
+        """
+        timer_count = 0
+        while True:
+            timer_list = cls.claim_due_timer_list(settings.TICKET_TIMER_BATCH_SIZE)
+            for timer_obj in timer_list:
+                try:
+                    status, result = cls.run_ticket_timer(timer_obj)
+                except Exception as e:
+                    logger.exception('ticket timer {} failed'.format(timer_obj.id))
+                    status, result = cls.STATUS_DONE, e.__str__()
+                TicketTimer.objects.filter(id=timer_obj.id).update(status=status, result=result[:1000],
+                                                                   gmt_modified=datetime.datetime.now())
+            timer_count += len(timer_list)
+            if len(timer_list) < settings.TICKET_TIMER_BATCH_SIZE:
+                break
+        return True, dict(timer_count=timer_count)
+
+
+ticket_timer_service_ins = TicketTimerService()
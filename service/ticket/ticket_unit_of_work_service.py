@@ -0,0 +1,149 @@
+import threading
+from contextlib import contextmanager
+
+from apps.ticket.models import TicketRecord
+from service.base_service import BaseService
+from service.workflow.workflow_compile_service import workflow_compile_service_ins
+
+
+class TicketUnitOfWork(object):
+    """
+    工单工作单元: 一次请求内工单记录、自定义字段值、工作流快照只加载一次，修改先记录在内存中，结束时统一写入
+    ticket unit of work. the ticket record, its custom field values and its workflow snapshot are loaded once per
+    request, changes are kept in memory and written in one flush at the end
+    """
+    def __init__(self, ticket_obj: TicketRecord, custom_field_value_dict: dict = None):
+        self.ticket_id = ticket_obj.id
+        self.ticket_obj = ticket_obj
+        self.ticket_dirty = False
+        self.inbox_dirty = False
+        self.pending_custom_field_dict = {}
+        self.ref_count = 0
+        self._custom_field_value_dict = custom_field_value_dict
+        self._compiled_workflow = None
+
+    @property
+    def compiled_workflow(self):
+        if self._compiled_workflow is None:
+            flag, result = workflow_compile_service_ins.get_compiled_workflow(self.ticket_obj.workflow_id)
+            if flag is False:
+                raise Exception(result)
+            self._compiled_workflow = result
+        return self._compiled_workflow
+
+    @property
+    def custom_field_value_dict(self) -> dict:
+        """
+        工单自定义字段的值, 包含未写入的修改
+        custom field value of the ticket, pending changes included
+        """
+        if self._custom_field_value_dict is None:
+            from service.ticket.ticket_base_service import ticket_base_service_ins
+            flag, result = ticket_base_service_ins.get_tickets_custom_field_value([self.ticket_obj])
+            if flag is False:
+                raise Exception(result)
+            self._custom_field_value_dict = result[self.ticket_id]
+            self._custom_field_value_dict.update(self.pending_custom_field_dict)
+        return self._custom_field_value_dict
+
+    def mark_ticket_dirty(self):
+        self.ticket_dirty = True
+        self.inbox_dirty = True
+
+    def mark_inbox_dirty(self):
+        self.inbox_dirty = True
+
+    def update_custom_field(self, update_dict: dict):
+        self.pending_custom_field_dict.update(update_dict)
+        if self._custom_field_value_dict is not None:
+            self._custom_field_value_dict.update(update_dict)
+
+    def flush(self):
+        """
+        写入工单记录及自定义字段的修改
+        write the changes of ticket record and custom fields, then rebuild the list read model of the ticket
+        """
+        from service.ticket.ticket_base_service import ticket_base_service_ins
+        from service.ticket.ticket_inbox_service import ticket_inbox_service_ins
+        if self.ticket_dirty:
+            self.ticket_obj.save()
+            self.ticket_dirty = False
+        if self.pending_custom_field_dict:
+            pending_custom_field_dict, self.pending_custom_field_dict = self.pending_custom_field_dict, {}
+            flag, result = ticket_base_service_ins.save_ticket_custom_field(self.ticket_obj, pending_custom_field_dict)
+            if flag is False:
+                raise Exception(result)
+        if self.inbox_dirty:
+            self.inbox_dirty = False
+            ticket_inbox_service_ins.sync_tickets_inbox([self.ticket_id])
+
+
+class TicketUnitOfWorkService(BaseService):
+    """
+    工单工作单元服务, 工作单元保存在线程本地变量中，同一线程中对同一工单的嵌套调用共用一个工作单元
+    ticket unit of work service. units are kept thread local, nested calls for the same ticket share one unit
+    """
+    local = threading.local()
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_unit_of_work_dict(cls) -> dict:
+        if not hasattr(cls.local, 'unit_of_work_dict'):
+            cls.local.unit_of_work_dict = {}
+        return cls.local.unit_of_work_dict
+
+    @classmethod
+    def get_current(cls, ticket_id: int):
+        """
+        获取工单当前的工作单元，不存在返回None
+        get current unit of work of the ticket, None if not in one
+        :param ticket_id:
+        :return:
+        """
+        return cls.get_unit_of_work_dict().get(ticket_id)
+
+    @classmethod
+    @contextmanager
+    def begin(cls, ticket_id: int, ticket_obj: TicketRecord = None, lock: bool = False,
+              custom_field_value_dict: dict = None):
+        """
+        开始工单工作单元，退出时写入修改(包括在with中提前return False的情况)，只有抛出异常时丢弃修改.
+        失败时需要抛出异常, 或在事务中使用(如run_in_transaction, 返回False时回滚)使写入的修改被回滚
+        begin a unit of work for the ticket. changes are flushed on every exit, early returns included, and only dropped
+        when an exception is raised. raise on failure, or run in a transaction that is rolled back on failure
+        :param ticket_id:
+        :param ticket_obj: 已加载的工单记录，不提供时从数据库加载
+        :param lock: 加载时使用select_for_update锁定工单记录, 需要在事务中使用
+        :param custom_field_value_dict: 已批量加载的工单自定义字段值
+        :return:
+        """
+        unit_of_work_dict = cls.get_unit_of_work_dict()
+        unit_of_work = unit_of_work_dict.get(ticket_id)
+        if unit_of_work is None:
+            if ticket_obj is None:
+                ticket_queryset = TicketRecord.objects.select_for_update() if lock else TicketRecord.objects
+                ticket_obj = ticket_queryset.filter(id=ticket_id, is_deleted=0).first()
+            if not ticket_obj:
+                # 工单不存在时不开启工作单元，由调用方自行处理
+                yield None
+                return
+            unit_of_work = TicketUnitOfWork(ticket_obj, custom_field_value_dict)
+            unit_of_work_dict[ticket_id] = unit_of_work
+        unit_of_work.ref_count += 1
+        try:
+            yield unit_of_work
+        except Exception:
+            unit_of_work.ref_count -= 1
+            if unit_of_work.ref_count == 0:
+                del unit_of_work_dict[ticket_id]
+            raise
+        unit_of_work.ref_count -= 1
+        if unit_of_work.ref_count == 0:
+            # 先移出工作单元再写入，写入时直接操作数据库
+            del unit_of_work_dict[ticket_id]
+            unit_of_work.flush()
+
+
+ticket_unit_of_work_service_ins = TicketUnitOfWorkService()
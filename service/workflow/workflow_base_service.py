@@ -1,9 +1,11 @@
 import json
 from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from apps.workflow.models import Workflow
 from service.base_service import BaseService
 from service.common.log_service import auto_log
+from service.common.paginator_service import paginator_service_ins
+from service.workflow.workflow_config_cache_service import workflow_config_cache_service_ins
+from service.account.account_app_token_cache_service import account_app_token_cache_service_ins
 from service.account.account_base_service import AccountBaseService, account_base_service_ins
 
 
@@ -18,7 +20,7 @@ class WorkflowBaseService(BaseService):
     @classmethod
     @auto_log
     def get_workflow_list(cls, name: str, page: int, per_page: int, app_name: str, username: str,
-                          from_admin: int = 1) -> tuple:
+                          from_admin: int = 1, cursor: str = None, with_total: int = 0) -> tuple:
         """
         获取工作流列表
         get workflow list by params
@@ -29,6 +31,8 @@ class WorkflowBaseService(BaseService):
         :param per_page:
         :param username
         :param from_admin 管理后台
+        :param cursor: 游标分页的游标, None时按page分页
+        :param with_total: 游标分页时是否返回近似总数
         :return:
         """
         query_params = Q(is_deleted=False)
@@ -48,15 +52,11 @@ class WorkflowBaseService(BaseService):
             query_params &= Q(app_name=app_name)
 
         workflow_queryset = Workflow.objects.filter(query_params).order_by('id')
-        paginator = Paginator(workflow_queryset, per_page)
-        try:
-            workflow_result_paginator = paginator.page(page)
-        except PageNotAnInteger:
-            workflow_result_paginator = paginator.page(1)
-        except EmptyPage:
-            # If page is out of range (e.g. 9999), deliver last page of results
-            workflow_result_paginator = paginator.page(paginator.num_pages)
-        workflow_result_object_list = workflow_result_paginator.object_list
+        flag, page_result = paginator_service_ins.paginate(workflow_queryset, per_page, page, cursor, with_total,
+                                                           reverse=0)
+        if flag is False:
+            return False, page_result
+        workflow_result_object_list = page_result['object_list']
         workflow_result_restful_list = []
         workflow_result_id_list = []
         for workflow_result_object in workflow_result_object_list:
@@ -74,7 +74,7 @@ class WorkflowBaseService(BaseService):
             )
 
         return True, dict(workflow_result_restful_list=workflow_result_restful_list,
-                          paginator_info=dict(per_page=per_page, page=page, total=paginator.count))
+                          paginator_info=page_result['paginator_info'])
 
     @classmethod
     @auto_log
@@ -175,11 +175,27 @@ class WorkflowBaseService(BaseService):
         :param workflow_id:
         :return:
         """
-        workflow_obj = Workflow.objects.filter(is_deleted=0, id=workflow_id).first()
+        workflow_obj = workflow_config_cache_service_ins.get_config(
+            'workflow', workflow_id, lambda: Workflow.objects.filter(is_deleted=0, id=workflow_id).first())
         if not workflow_obj:
             return False, 'workflow is not existed or has been deleted'
         return True, workflow_obj
 
+    @classmethod
+    @auto_log
+    def get_workflow_dict_by_id_list(cls, workflow_id_list: list) -> tuple:
+        """
+        批量获取工作流, 一次查询
+        get workflow objects by workflow id list with one query
+        :param workflow_id_list:
+        :return: {workflow_id: workflow_obj}
+        """
+        workflow_id_list = list(set(workflow_id_list))
+        if not workflow_id_list:
+            return True, {}
+        workflow_queryset = Workflow.objects.filter(is_deleted=0, id__in=workflow_id_list).all()
+        return True, {workflow_obj.id: workflow_obj for workflow_obj in workflow_queryset}
+
     @classmethod
     @auto_log
     def add_workflow(cls, name: str, description: str, notices: str, view_permission_check: int, limit_expression: str,
@@ -206,6 +222,7 @@ class WorkflowBaseService(BaseService):
                                 content_template=content_template)
         workflow_obj.save()
         workflow_admin_insert_list = []
+        workflow_config_cache_service_ins.bump_version()
         return True, dict(workflow_id=workflow_obj.id)
 
     @classmethod
@@ -234,7 +251,7 @@ class WorkflowBaseService(BaseService):
                                 view_permission_check=view_permission_check,
                                 limit_expression=limit_expression, display_form_str=display_form_str,
                                 title_template=title_template, content_template=content_template)
-
+        workflow_config_cache_service_ins.bump_version()
         return True, ''
 
     @classmethod
@@ -249,6 +266,8 @@ class WorkflowBaseService(BaseService):
         workflow_obj = Workflow.objects.filter(id=workflow_id, is_deleted=0)
         if workflow_obj:
             workflow_obj.update(is_deleted=True)
+        workflow_config_cache_service_ins.bump_version()
+        account_app_token_cache_service_ins.bump_version()
         return True, ''
 
 
@@ -0,0 +1,138 @@
+import json
+from types import MappingProxyType
+
+from apps.workflow.models import State, Transition, Workflow
+from service.base_service import BaseService
+from service.common.constant_service import constant_service_ins
+from service.common.log_service import auto_log
+from service.workflow.workflow_config_cache_service import workflow_config_cache_service_ins
+from service.workflow.workflow_custom_field_service import workflow_custom_field_service_ins
+
+
+class CompiledWorkflow(object):
+    """
+    工作流状态机快照: 根据某个配置版本的工作流、状态、流转、自定义字段构建的只读邻接表，流转时只需字典查找，不再查询数据库
+    immutable state machine snapshot of a workflow config version. ticket handling resolves the graph with dict
+    lookups instead of queries. pickled as its source rows, the lookup maps are rebuilt when loaded
+    """
+    def __init__(self, workflow: Workflow, state_list: list, transition_list: list, custom_field_dict: dict):
+        self.workflow = workflow
+        self.workflow_id = workflow.id
+        self.state_list = tuple(state_list)
+        self.transition_list = tuple(transition_list)
+        self.custom_field_dict = MappingProxyType(dict(custom_field_dict))
+
+        self.state_dict = MappingProxyType({state.id: state for state in self.state_list})
+        self.transition_dict = MappingProxyType({transition.id: transition for transition in self.transition_list})
+        self.transition_destination_dict = MappingProxyType(
+            {transition.id: transition.destination_state_id for transition in self.transition_list})
+
+        start_state_id_list = [state.id for state in self.state_list
+                               if state.type_id == constant_service_ins.STATE_TYPE_START]
+        end_state_id_list = [state.id for state in self.state_list
+                             if state.type_id == constant_service_ins.STATE_TYPE_END]
+        self.start_state_id = start_state_id_list[0] if start_state_id_list else 0
+        self.end_state_id = end_state_id_list[0] if end_state_id_list else 0
+
+        state_transition_dict, timer_transition_dict = {}, {}
+        for transition in sorted(self.transition_list, key=lambda r: r.id):
+            state_transition_dict.setdefault(transition.source_state_id, []).append(transition)
+            if transition.transition_type_id == constant_service_ins.TRANSITION_TYPE_TIMER:
+                timer_transition_dict.setdefault(transition.source_state_id, []).append(transition)
+        self.state_transition_dict = MappingProxyType(
+            {key: tuple(value) for key, value in state_transition_dict.items()})
+        self.timer_transition_dict = MappingProxyType(
+            {key: tuple(value) for key, value in timer_transition_dict.items()})
+
+        state_require_field_dict, state_update_field_dict = {}, {}
+        for state in self.state_list:
+            require_field_list, update_field_list = [], []
+            for key, value in json.loads(state.state_field_str).items():
+                if value == constant_service_ins.FIELD_ATTRIBUTE_REQUIRED:
+                    require_field_list.append(key)
+                    update_field_list.append(key)
+                if value == constant_service_ins.FIELD_ATTRIBUTE_OPTIONAL:
+                    update_field_list.append(key)
+            state_require_field_dict[state.id] = tuple(require_field_list)
+            state_update_field_dict[state.id] = tuple(update_field_list)
+        self.state_require_field_dict = MappingProxyType(state_require_field_dict)
+        self.state_update_field_dict = MappingProxyType(state_update_field_dict)
+
+    def __reduce__(self):
+        return self.__class__, (self.workflow, self.state_list, self.transition_list, dict(self.custom_field_dict))
+
+    @property
+    def start_state(self):
+        return self.state_dict.get(self.start_state_id)
+
+    @property
+    def end_state(self):
+        return self.state_dict.get(self.end_state_id)
+
+    def get_state(self, state_id: int):
+        return self.state_dict.get(state_id)
+
+    def get_transition(self, transition_id: int, source_state_id: int = 0):
+        """
+        获取流转, 提供source_state_id时流转的源状态必须一致
+        get transition, it must start from source_state_id if provided
+        :param transition_id:
+        :param source_state_id:
+        :return:
+        """
+        transition = self.transition_dict.get(transition_id)
+        if transition and source_state_id and transition.source_state_id != source_state_id:
+            return None
+        return transition
+
+    def get_state_transitions(self, state_id: int) -> tuple:
+        return self.state_transition_dict.get(state_id, ())
+
+    def get_timer_transitions(self, state_id: int) -> tuple:
+        return self.timer_transition_dict.get(state_id, ())
+
+    def get_state_field_info(self, state_id: int) -> dict:
+        return dict(require_field_list=list(self.state_require_field_dict.get(state_id, ())),
+                    update_field_list=list(self.state_update_field_dict.get(state_id, ())))
+
+
+class WorkflowCompileService(BaseService):
+    """
+    工作流状态机快照服务
+    """
+    def __init__(self):
+        pass
+
+    @classmethod
+    @auto_log
+    def get_compiled_workflow(cls, workflow_id: int) -> tuple:
+        """
+        获取工作流状态机快照，按配置版本缓存
+        get compiled workflow, cached by workflow config version
+        :param workflow_id:
+        :return:
+        """
+        compiled_workflow = workflow_config_cache_service_ins.get_config(
+            'compiled_workflow', workflow_id, lambda: cls.compile_workflow(workflow_id))
+        if not compiled_workflow:
+            return False, 'workflow is not existed or has been deleted'
+        return True, compiled_workflow
+
+    @classmethod
+    def compile_workflow(cls, workflow_id: int):
+        """
+        从数据库构建工作流状态机快照
+        build compiled workflow from db
+        :param workflow_id:
+        :return:
+        """
+        workflow_obj = Workflow.objects.filter(is_deleted=0, id=workflow_id).first()
+        if not workflow_obj:
+            return None
+        state_list = list(State.objects.filter(workflow_id=workflow_id, is_deleted=False).order_by('order_id'))
+        transition_list = list(Transition.objects.filter(workflow_id=workflow_id, is_deleted=0).all())
+        custom_field_dict = workflow_custom_field_service_ins.load_workflow_custom_field(workflow_id)
+        return CompiledWorkflow(workflow_obj, state_list, transition_list, custom_field_dict)
+
+
+workflow_compile_service_ins = WorkflowCompileService()
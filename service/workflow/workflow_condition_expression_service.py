@@ -0,0 +1,187 @@
+import ast
+import datetime
+import json
+import re
+import time
+
+from service.base_service import BaseService
+from service.common.cache_service import LruCache
+from service.common.log_service import auto_log
+
+
+def numeric_binary_operation(operator_name: str, left, right):
+    """
+    乘法、取模只允许用于数字, 避免字符串、列表重复('a' * 10 ** 8)或格式化('%099999999d' % 1)耗尽内存
+    * and % are only allowed between numbers, sequence repetition and string formatting could exhaust memory
+    """
+    for operand in (left, right):
+        if not isinstance(operand, (int, float)):
+            raise ValueError('{} is only allowed between numbers in condition expression'.format(operator_name))
+    if operator_name == 'Mult':
+        return left * right
+    return left % right
+
+
+class NumericOperationTransformer(ast.NodeTransformer):
+    """
+    将乘法、取模替换为numeric_binary_operation调用
+    """
+    HELPER_NAME = '__numeric_binary_operation'
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if not isinstance(node.op, (ast.Mult, ast.Mod)):
+            return node
+        call_node = ast.Call(func=ast.Name(id=self.HELPER_NAME, ctx=ast.Load()),
+                             args=[ast.Str(s=node.op.__class__.__name__), node.left, node.right], keywords=[])
+        return ast.copy_location(call_node, node)
+
+
+class WorkflowConditionExpressionService(BaseService):
+    """
+    流转条件表达式引擎: 条件表达式只解析一次为语法树，经白名单校验后编译缓存(按transition_id)，计算时直接绑定字段值，不做字符串格式化和eval
+    condition expression engine. expressions are parsed once, validated against a whitelist, compiled and cached by
+    transition id. field values are bound as variables at evaluation time, no str.format and no eval of user data
+    expression example: [{"expression": "{days} > 3 and {days} <= 10", "target_state_id": 11}]
+    """
+    FIELD_NAME_PREFIX = 'field__'
+    ALLOWED_NODE_TYPES = (
+        ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+        ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod, ast.FloorDiv,
+        ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+        ast.IfExp, ast.Name, ast.Load, ast.Attribute, ast.Call, ast.keyword, ast.Tuple, ast.List,
+    ) + tuple(getattr(ast, node_name) for node_name in ('Num', 'Str', 'NameConstant', 'Constant')
+              if hasattr(ast, node_name))
+    # 表达式中可以使用的时间函数
+    ALLOWED_HELPER_DICT = {
+        'datetime': datetime, 'time': time, 'int': int, 'float': float, 'str': str, 'len': len,
+    }
+    # 编译时插入的函数, 不能在表达式中直接使用
+    INTERNAL_HELPER_DICT = {NumericOperationTransformer.HELPER_NAME: numeric_binary_operation}
+    ALLOWED_DOTTED_NAME_LIST = (
+        'datetime.datetime', 'datetime.date', 'datetime.timedelta', 'datetime.datetime.now',
+        'datetime.datetime.strptime', 'datetime.date.today', 'time.time', 'time.mktime', 'time.strptime',
+        'time.localtime', 'time.strftime',
+    )
+    ALLOWED_ATTRIBUTE_LIST = (
+        'year', 'month', 'day', 'hour', 'minute', 'second', 'days', 'seconds', 'date', 'timestamp',
+        'total_seconds', 'strftime', 'weekday', 'isoweekday', 'startswith', 'endswith', 'split', 'strip',
+        'lower', 'upper',
+    )
+    compiled_cache = LruCache(max_size=4096)
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_dotted_name(cls, node) -> str:
+        if isinstance(node, ast.Name):
+            return node.id
+        if isinstance(node, ast.Attribute):
+            value_name = cls.get_dotted_name(node.value)
+            return '{}.{}'.format(value_name, node.attr) if value_name else ''
+        return ''
+
+    @classmethod
+    def validate_node(cls, tree) -> list:
+        """
+        按白名单校验语法树, 返回表达式中引用的字段
+        validate the syntax tree against the whitelist, return referenced field keys
+        :param tree:
+        :return:
+        """
+        field_key_list = []
+        for node in ast.walk(tree):
+            if not isinstance(node, cls.ALLOWED_NODE_TYPES):
+                raise ValueError('{} is not allowed in condition expression'.format(node.__class__.__name__))
+            if isinstance(node, ast.Name):
+                if node.id.startswith(cls.FIELD_NAME_PREFIX):
+                    field_key_list.append(node.id[len(cls.FIELD_NAME_PREFIX):])
+                elif node.id not in cls.ALLOWED_HELPER_DICT:
+                    raise ValueError('name {} is not allowed in condition expression'.format(node.id))
+            elif isinstance(node, ast.Attribute):
+                if node.attr.startswith('_') or (cls.get_dotted_name(node) not in cls.ALLOWED_DOTTED_NAME_LIST
+                                                 and node.attr not in cls.ALLOWED_ATTRIBUTE_LIST):
+                    raise ValueError('attribute {} is not allowed in condition expression'.format(node.attr))
+        return field_key_list
+
+    @classmethod
+    def compile_expression(cls, expression: str) -> tuple:
+        """
+        编译单个表达式, {field_key}占位符替换为变量
+        compile one expression, {field_key} placeholders become variables
+        :param expression:
+        :return: (code, field_key_list)
+        """
+        # 兼容'{field_key}'写法，原实现中为格式化后的字符串
+        source = re.sub(r'''(['"])\{(\w+)\}\1''', r'str({}\2)'.format(cls.FIELD_NAME_PREFIX), expression)
+        source = re.sub(r'\{(\w+)\}', r'{}\1'.format(cls.FIELD_NAME_PREFIX), source)
+        tree = ast.parse(source.strip(), mode='eval')
+        field_key_list = cls.validate_node(tree)
+        tree = ast.fix_missing_locations(NumericOperationTransformer().visit(tree))
+        return compile(tree, '<condition_expression>', 'eval'), field_key_list
+
+    @classmethod
+    @auto_log
+    def get_compiled_condition_list(cls, transition_id: int, condition_expression: str) -> tuple:
+        """
+        获取编译后的条件列表, 按transition_id缓存, 表达式变更后重新编译
+        get compiled condition list cached by transition id, recompiled after the expression changed
+        :param transition_id:
+        :param condition_expression: transition的条件表达式json
+        :return: [(code, field_key_list, target_state_id)]
+        """
+        cached = cls.compiled_cache.get(transition_id)
+        if cached and cached[0] == condition_expression:
+            return True, cached[1]
+        compiled_condition_list = []
+        for condition_expression0 in json.loads(condition_expression or '[]'):
+            code, field_key_list = cls.compile_expression(condition_expression0.get('expression'))
+            compiled_condition_list.append((code, field_key_list, condition_expression0.get('target_state_id')))
+        cls.compiled_cache.set(transition_id, (condition_expression, compiled_condition_list))
+        return True, compiled_condition_list
+
+    @classmethod
+    @auto_log
+    def get_condition_field_key_list(cls, transition_id: int, condition_expression: str) -> tuple:
+        """
+        获取条件表达式中引用的字段
+        get field keys referenced by the condition expression
+        :param transition_id:
+        :param condition_expression:
+        :return:
+        """
+        flag, compiled_condition_list = cls.get_compiled_condition_list(transition_id, condition_expression)
+        if flag is False:
+            return False, compiled_condition_list
+        field_key_set = set()
+        for code, field_key_list, target_state_id in compiled_condition_list:
+            field_key_set.update(field_key_list)
+        return True, list(field_key_set)
+
+    @classmethod
+    @auto_log
+    def get_target_state_id(cls, transition_id: int, condition_expression: str, value_dict: dict) -> tuple:
+        """
+        依次计算条件，返回第一个满足条件的目标状态id, 都不满足时返回0
+        evaluate conditions in order, return target_state_id of the first matched one, 0 if none matched
+        :param transition_id:
+        :param condition_expression:
+        :param value_dict: 工单字段的值
+        :return:
+        """
+        flag, compiled_condition_list = cls.get_compiled_condition_list(transition_id, condition_expression)
+        if flag is False:
+            return False, compiled_condition_list
+        for code, field_key_list, target_state_id in compiled_condition_list:
+            variable_dict = dict(cls.ALLOWED_HELPER_DICT, **cls.INTERNAL_HELPER_DICT)
+            for field_key in field_key_list:
+                if field_key not in value_dict:
+                    return False, 'field {} in condition expression is not provided'.format(field_key)
+                variable_dict[cls.FIELD_NAME_PREFIX + field_key] = value_dict[field_key]
+            if eval(code, {'__builtins__': {}}, variable_dict):
+                return True, target_state_id
+        return True, 0
+
+
+workflow_condition_expression_service_ins = WorkflowConditionExpressionService()
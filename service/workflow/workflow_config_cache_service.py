@@ -0,0 +1,118 @@
+import logging
+import pickle
+
+import time
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from service.base_service import BaseService
+from service.common.cache_service import LruCache
+from service.redis_pool import POOL
+
+logger = logging.getLogger('django')
+
+NOT_FOUND = object()
+
+
+class WorkflowConfigCacheService(BaseService):
+    """
+    工作流配置缓存: 进程内LRU + redis两级缓存。
+    缓存key中包含配置版本号，工作流配置(工作流、状态、流转、自定义字段)变更的事务提交后递增版本号，
+    所有进程在WORKFLOW_CONFIG_VERSION_CHECK_INTERVAL秒内丢弃旧缓存。
+    workflow config cache, in-process lru + redis. cache key contains the config version, editing any workflow
+    config bumps the version on commit so that every worker drops its stale entries within the version check interval.
+    cached values are shared, do not modify them.
+    """
+    VERSION_KEY = 'workflow_config_version'
+    local_cache = LruCache(max_size=settings.WORKFLOW_CONFIG_LOCAL_CACHE_SIZE)
+    _version = None
+    _checked_at = 0
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_redis_conn(cls):
+        return redis.Redis(connection_pool=POOL)
+
+    @classmethod
+    def get_version(cls):
+        """
+        获取当前配置版本号, 每WORKFLOW_CONFIG_VERSION_CHECK_INTERVAL秒从redis获取一次, redis不可用时为None
+        get current workflow config version, checked in redis at most once per interval. None if redis is unavailable
+        :return:
+        """
+        now = time.time()
+        if now - cls._checked_at < settings.WORKFLOW_CONFIG_VERSION_CHECK_INTERVAL:
+            return cls._version
+        try:
+            version = cls.get_redis_conn().get(cls.VERSION_KEY)
+            version = int(version) if version else 0
+        except redis.RedisError:
+            logger.warning('redis is unavailable, load workflow config from db')
+            version = None
+        cls._version = version
+        cls._checked_at = now
+        return version
+
+    @classmethod
+    def get_config(cls, kind: str, key, loader):
+        """
+        获取缓存的配置，缓存不存在时调用loader从数据库加载。redis不可用时直接从数据库加载
+        get cached config, call loader when missing. load from db directly when redis is unavailable
+        :param kind: 配置类型, 如state, transition
+        :param key: 工作流id或记录id
+        :param loader: 无参数的加载函数
+        :return:
+        """
+        version = cls.get_version()
+        if version is None:
+            return loader()
+
+        cache_key = 'workflow_config:{}:{}:{}'.format(version, kind, key)
+        value = cls.local_cache.get(cache_key, NOT_FOUND)
+        if value is not NOT_FOUND:
+            return value
+
+        redis_conn = cls.get_redis_conn()
+        try:
+            cached_value = redis_conn.get(cache_key)
+        except redis.RedisError:
+            cached_value = None
+        if cached_value is not None:
+            value = pickle.loads(cached_value)
+        else:
+            value = loader()
+            try:
+                redis_conn.set(cache_key, pickle.dumps(value), ex=settings.WORKFLOW_CONFIG_CACHE_TIMEOUT)
+            except redis.RedisError:
+                pass
+        cls.local_cache.set(cache_key, value)
+        return value
+
+    @classmethod
+    def bump_version(cls):
+        """
+        工作流配置变更后调用，当前事务提交后使所有进程的缓存失效(提交前其他进程读到的仍是旧配置, 不能缓存到新版本下)
+        invalidate the cache of all workers once the current transaction commits, call it after workflow config changed
+        :return:
+        """
+        transaction.on_commit(cls.incr_version)
+
+    @classmethod
+    def incr_version(cls):
+        """
+        递增版本号, 当前进程立即重新获取版本号
+        :return:
+        """
+        cls.local_cache.clear()
+        cls._checked_at = 0
+        try:
+            cls.get_redis_conn().incr(cls.VERSION_KEY)
+        except redis.RedisError:
+            logger.error('redis is unavailable, workflow config version is not bumped')
+
+
+workflow_config_cache_service_ins = WorkflowConfigCacheService()
@@ -5,6 +5,7 @@ from django.db.models import Q
 from apps.workflow.models import CustomField
 from service.base_service import BaseService
 from service.common.log_service import auto_log
+from service.workflow.workflow_config_cache_service import workflow_config_cache_service_ins
 
 
 class WorkflowCustomFieldService(BaseService):
@@ -20,6 +21,17 @@ class WorkflowCustomFieldService(BaseService):
         :param workflow_id:
         :return:
         """
+        return True, workflow_config_cache_service_ins.get_config(
+            'custom_field', workflow_id, lambda: cls.load_workflow_custom_field(workflow_id))
+
+    @classmethod
+    def load_workflow_custom_field(cls, workflow_id: int) -> dict:
+        """
+        从数据库加载工作流的自定义字段信息
+        load workflow custom field from db
+        :param workflow_id:
+        :return:
+        """
         custom_field_queryset = CustomField.objects.filter(workflow_id=workflow_id, is_deleted=0).all()
         format_custom_field_dict = {}
         for custom_field in custom_field_queryset:
@@ -33,7 +45,7 @@ class WorkflowCustomFieldService(BaseService):
                 default_value=custom_field.default_value, description=custom_field.description,
                 field_template=custom_field.field_template, boolean_field_display=custom_field.boolean_field_display,
                 field_choice=custom_field.field_choice, label=label)
-        return True, format_custom_field_dict
+        return format_custom_field_dict
 
     @classmethod
     @auto_log
@@ -136,6 +148,7 @@ class WorkflowCustomFieldService(BaseService):
             custom_filed_queryset = CustomField.objects.filter(id=custom_field_id, is_deleted=0)
             if custom_filed_queryset:
                 custom_filed_queryset.update(**data)
+        workflow_config_cache_service_ins.bump_version()
         return True, dict(custom_field_id=custom_field_id)
 
     @classmethod
@@ -149,6 +162,7 @@ class WorkflowCustomFieldService(BaseService):
         custom_field_queryset = CustomField.objects.filter(id=custom_field_id, is_deleted=0)
         if custom_field_queryset:
             custom_field_queryset.update(is_deleted=True)
+        workflow_config_cache_service_ins.bump_version()
         return True, ''
 
     @classmethod
@@ -1,9 +1,9 @@
 import json
 from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from apps.workflow.models import CustomNotice
 from service.base_service import BaseService
 from service.common.log_service import auto_log
+from service.common.paginator_service import paginator_service_ins
 
 
 class WorkflowCustomNoticeService(BaseService):
@@ -15,12 +15,15 @@ class WorkflowCustomNoticeService(BaseService):
 
     @classmethod
     @auto_log
-    def get_notice_list(cls, query_value: str, page: int, per_page: int) -> tuple:
+    def get_notice_list(cls, query_value: str, page: int, per_page: int, cursor: str = None,
+                        with_total: int = 0) -> tuple:
         """
         获取通知列表
         :param query_value:
         :param page:
         :param per_page:
+        :param cursor: 游标分页的游标, None时按page分页
+        :param with_total: 游标分页时是否返回近似总数
         :return:
         """
         query_params = Q(is_deleted=False)
@@ -28,19 +31,15 @@ class WorkflowCustomNoticeService(BaseService):
             query_params &= Q(name__contains=query_value) | Q(description__contains=query_value)
 
         custom_notice_querset = CustomNotice.objects.filter(query_params).order_by('id')
-        paginator = Paginator(custom_notice_querset, per_page)
-        try:
-            custom_notice_result_paginator = paginator.page(page)
-        except PageNotAnInteger:
-            custom_notice_result_paginator = paginator.page(1)
-        except EmptyPage:
-            # If page is out of range (e.g. 9999), deliver last page of results
-            custom_notice_result_paginator = paginator.page(paginator.num_pages)
-        custom_notice_result_object_list = custom_notice_result_paginator.object_list
+        flag, page_result = paginator_service_ins.paginate(custom_notice_querset, per_page, page, cursor, with_total,
+                                                           reverse=0)
+        if flag is False:
+            return False, page_result
+        custom_notice_result_object_list = page_result['object_list']
         custom_notice_result_restful_list = []
         for custom_notice_result_object in custom_notice_result_object_list:
             custom_notice_result_restful_list.append(custom_notice_result_object.get_dict())
-        return custom_notice_result_restful_list, dict(per_page=per_page, page=page, total=paginator.count)
+        return custom_notice_result_restful_list, page_result['paginator_info']
 
     @classmethod
     @auto_log
@@ -1,9 +1,9 @@
 import json
 from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from apps.workflow.models import WorkflowScript
 from service.base_service import BaseService
 from service.common.log_service import auto_log
+from service.common.paginator_service import paginator_service_ins
 
 
 class WorkflowRunScriptService(BaseService):
@@ -15,13 +15,16 @@ class WorkflowRunScriptService(BaseService):
 
     @classmethod
     @auto_log
-    def get_run_script_list(cls, query_value: str, page: int, per_page: int) -> tuple:
+    def get_run_script_list(cls, query_value: str, page: int, per_page: int, cursor: str = None,
+                            with_total: int = 0) -> tuple:
         """
         获取执行脚本列表
         get run script list
         :param query_value:
         :param page:
         :param per_page:
+        :param cursor: 游标分页的游标, None时按page分页
+        :param with_total: 游标分页时是否返回近似总数
         :return:
         """
         query_params = Q(is_deleted=False)
@@ -29,15 +32,11 @@ class WorkflowRunScriptService(BaseService):
             query_params &= Q(name__contains=query_value) | Q(description__contains=query_value)
 
         run_script_querset = WorkflowScript.objects.filter(query_params).order_by('id')
-        paginator = Paginator(run_script_querset, per_page)
-        try:
-            run_script_result_paginator = paginator.page(page)
-        except PageNotAnInteger:
-            run_script_result_paginator = paginator.page(1)
-        except EmptyPage:
-            # If page is out of range (e.g. 9999), deliver last page of results
-            run_script_result_paginator = paginator.page(paginator.num_pages)
-        run_script_result_object_list = run_script_result_paginator.object_list
+        flag, page_result = paginator_service_ins.paginate(run_script_querset, per_page, page, cursor, with_total,
+                                                           reverse=0)
+        if flag is False:
+            return False, page_result
+        run_script_result_object_list = page_result['object_list']
         run_script_result_restful_list = []
         for run_script_result_object in run_script_result_object_list:
             run_script_result_restful_list.append(dict(
@@ -46,7 +45,7 @@ class WorkflowRunScriptService(BaseService):
                 is_active=run_script_result_object.is_active, creator=run_script_result_object.creator,
                 gmt_created=str(run_script_result_object.gmt_created)[:19]))
         return True, dict(run_script_result_restful_list=run_script_result_restful_list,
-                          paginator_info=dict(per_page=per_page, page=page, total=paginator.count))
+                          paginator_info=page_result['paginator_info'])
 
     @classmethod
     @auto_log
@@ -0,0 +1,192 @@
+import io
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import traceback
+
+from django.conf import settings
+from django.db import connections
+
+from service.base_service import BaseService
+from service.common.cache_service import LruCache
+from service.common.log_service import auto_log
+
+logger = logging.getLogger('django')
+
+
+def execute_script(script_file: str, ticket_id: int, action_from: str) -> tuple:
+    """
+    执行脚本, 也是进程池中执行的方法(需要为模块级函数以便序列化)
+    :param script_file:
+    :param ticket_id:
+    :param action_from:
+    :return:
+    """
+    return WorkflowScriptExecuteService.execute(script_file, ticket_id, action_from)
+
+
+def init_pool_process():
+    # 子进程不复用父进程的数据库连接
+    for conn in connections.all():
+        conn.close()
+
+
+def script_worker_loop(conn):
+    """
+    脚本执行进程: 循环接收(script_file, ticket_id, action_from)并返回执行结果，父进程关闭连接后退出
+    :param conn:
+    :return:
+    """
+    init_pool_process()
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        conn.send(execute_script(*args))
+
+
+class ScriptWorker(object):
+    """
+    预先启动的脚本执行进程, 每个进程同时只执行一个脚本, 超时时只终止该进程
+    """
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=script_worker_loop, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def run(self, args: tuple, timeout: int) -> tuple:
+        self.conn.send(args)
+        if not self.conn.poll(timeout):
+            raise multiprocessing.TimeoutError
+        return self.conn.recv()
+
+    def terminate(self):
+        self.conn.close()
+        self.process.terminate()
+        self.process.join()
+
+
+class WorkflowScriptExecuteService(BaseService):
+    """
+    工作流脚本执行: 脚本编译后按文件路径缓存(文件修改时间或大小变化后重新编译)，每次执行使用独立的输出缓冲(脚本中的print)，
+    不修改全局的sys.stdout。配置WORKFLOW_SCRIPT_POOL_SIZE后脚本在预先启动的执行进程中执行(每个进程同时只执行一个脚本)，
+    超过WORKFLOW_SCRIPT_TIMEOUT未完成时只终止执行该脚本的进程并补充新进程，不影响其他进程中正在执行的脚本
+    workflow script engine. compiled code is cached by file path and invalidated by mtime/size, output of print in
+    the script is captured per invocation. with WORKFLOW_SCRIPT_POOL_SIZE set, scripts run in pre-forked worker
+    processes, one script per worker at a time, and only the worker of a timed out script is killed and replaced
+    """
+    compiled_cache = LruCache(max_size=settings.WORKFLOW_SCRIPT_CACHE_SIZE)
+    # 空闲的执行进程
+    idle_worker_queue = None
+    pool_lock = threading.Lock()
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def get_compiled_script(cls, script_file: str):
+        """
+        获取编译后的脚本, 文件修改时间或大小变化后重新编译
+        get compiled code of the script, recompiled after the file changed
+        :param script_file:
+        :return:
+        """
+        file_stat = os.stat(script_file)
+        version = (file_stat.st_mtime_ns, file_stat.st_size)
+        cached = cls.compiled_cache.get(script_file)
+        if cached and cached[0] == version:
+            return cached[1]
+        with open(script_file, encoding='utf-8') as f:
+            code = compile(f.read(), script_file, 'exec')
+        cls.compiled_cache.set(script_file, (version, code))
+        return code
+
+    @classmethod
+    def execute(cls, script_file: str, ticket_id: int, action_from: str) -> tuple:
+        """
+        在当前进程中执行脚本, 脚本中抛出异常即为执行失败
+        execute the script in current process, the script fails by raising an exception
+        :param script_file:
+        :param ticket_id:
+        :param action_from:
+        :return: (flag, 脚本输出或异常信息)
+        """
+        output = io.StringIO()
+
+        def script_print(*args, **kwargs):
+            kwargs.setdefault('file', output)
+            print(*args, **kwargs)
+
+        script_globals = {'__name__': '__loonflow_script__', 'ticket_id': ticket_id, 'action_from': action_from,
+                          'print': script_print}
+        try:
+            exec(cls.get_compiled_script(script_file), script_globals)
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            return False, e.__str__()
+        return True, output.getvalue()
+
+    @classmethod
+    def new_worker(cls) -> ScriptWorker:
+        # fork前关闭数据库连接，避免子进程继承
+        connections.close_all()
+        return ScriptWorker()
+
+    @classmethod
+    def replace_worker(cls, worker: ScriptWorker) -> ScriptWorker:
+        """
+        终止执行进程(其中的脚本执行超时或进程已退出)并启动新进程替换, 其他进程不受影响
+        :param worker:
+        :return:
+        """
+        worker.terminate()
+        return cls.new_worker()
+
+    @classmethod
+    def get_idle_worker_queue(cls) -> queue.Queue:
+        with cls.pool_lock:
+            if cls.idle_worker_queue is None:
+                idle_worker_queue = queue.Queue()
+                for index in range(settings.WORKFLOW_SCRIPT_POOL_SIZE):
+                    idle_worker_queue.put(cls.new_worker())
+                cls.idle_worker_queue = idle_worker_queue
+            return cls.idle_worker_queue
+
+    @classmethod
+    @auto_log
+    def run_script(cls, script_file: str, ticket_id: int, action_from: str = 'loonrobot') -> tuple:
+        """
+        执行工作流脚本, 配置了进程池时在进程池中执行并限制执行时间
+        run workflow script, in the process pool with timeout if configured
+        :param script_file:
+        :param ticket_id:
+        :param action_from:
+        :return: (flag, 脚本输出或异常信息)
+        """
+        if not settings.WORKFLOW_SCRIPT_POOL_SIZE:
+            return cls.execute(script_file, ticket_id, action_from)
+
+        idle_worker_queue = cls.get_idle_worker_queue()
+        # 所有进程都在执行时等待空闲进程
+        worker = idle_worker_queue.get()
+        try:
+            result = worker.run((script_file, ticket_id, action_from), settings.WORKFLOW_SCRIPT_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            logger.error('workflow script {} of ticket {} timeout'.format(script_file, ticket_id))
+            result = False, 'script timeout after {} seconds'.format(settings.WORKFLOW_SCRIPT_TIMEOUT)
+            worker = cls.replace_worker(worker)
+        except (EOFError, OSError) as e:
+            # 执行进程异常退出(如脚本中调用os._exit或进程被系统终止)
+            logger.error('workflow script {} of ticket {} worker exited'.format(script_file, ticket_id))
+            result = False, 'script worker exited: {}'.format(e.__str__())
+            worker = cls.replace_worker(worker)
+        finally:
+            idle_worker_queue.put(worker)
+        return result
+
+
+workflow_script_execute_service_ins = WorkflowScriptExecuteService()
@@ -1,11 +1,12 @@
 import json
 from django.db.models import Q
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from apps.workflow.models import State
 from service.account.account_base_service import account_base_service_ins
 from service.base_service import BaseService
 from service.common.constant_service import constant_service_ins
 from service.common.log_service import auto_log
+from service.common.paginator_service import paginator_service_ins
+from service.workflow.workflow_config_cache_service import workflow_config_cache_service_ins
 from service.workflow.workflow_custom_field_service import workflow_custom_field_service_ins
 from service.workflow.workflow_runscript_service import workflow_run_script_service_ins
 from service.workflow.workflow_transition_service import workflow_transition_service_ins
@@ -33,7 +34,8 @@ class WorkflowStateService(BaseService):
     @staticmethod
     @auto_log
     def get_app_states_serialize(app_name: int, per_page: int = 10, page: int = 1,
-                                 query_value: str = '', module: str = '') -> tuple:
+                                 query_value: str = '', module: str = '', cursor: str = None,
+                                 with_total: int = 0) -> tuple:
         """
         获取序列化工作流状态记录
         get restful workflow's state by params
@@ -42,6 +44,8 @@ class WorkflowStateService(BaseService):
         :param per_page:
         :param page:
         :param query_value:
+        :param cursor: 游标分页的游标, None时按page分页
+        :param with_total: 游标分页时是否返回近似总数
         :return:
         """
         query_params = Q(app_name=app_name, is_deleted=False)
@@ -51,17 +55,11 @@ class WorkflowStateService(BaseService):
             query_params &= Q(module=module)
 
         workflow_states = State.objects.filter(query_params).order_by('order_id')
-
-        paginator = Paginator(workflow_states, per_page)
-
-        try:
-            workflow_states_result_paginator = paginator.page(page)
-        except PageNotAnInteger:
-            workflow_states_result_paginator = paginator.page(1)
-        except EmptyPage:
-            # If page is out of range (e.g. 9999), deliver last page of results
-            workflow_states_result_paginator = paginator.page(paginator.num_pages)
-        workflow_states_object_list = workflow_states_result_paginator.object_list
+        flag, page_result = paginator_service_ins.paginate(workflow_states, per_page, page, cursor, with_total,
+                                                           reverse=0)
+        if flag is False:
+            return False, page_result
+        workflow_states_object_list = page_result['object_list']
         workflow_states_restful_list = []
         for workflow_states_object in workflow_states_object_list:
             result_dict = workflow_states_object.get_dict()
@@ -72,7 +70,7 @@ class WorkflowStateService(BaseService):
 
             workflow_states_restful_list.append(result_dict)
         return True, dict(workflow_states_restful_list=workflow_states_restful_list,
-                          paginator_info=dict(per_page=per_page, page=page, total=paginator.count))
+                          paginator_info=page_result['paginator_info'])
 
     @staticmethod
     @auto_log
@@ -86,7 +84,8 @@ class WorkflowStateService(BaseService):
         if not state_id:
             return False, 'except state_id but not provided'
         else:
-            workflow_state = State.objects.filter(id=state_id, is_deleted=False).first()
+            workflow_state = workflow_config_cache_service_ins.get_config(
+                'state', state_id, lambda: State.objects.filter(id=state_id, is_deleted=False).first())
             if not workflow_state:
                 return False, '工单状态不存在或已被删除'
             return True, workflow_state
@@ -253,6 +252,7 @@ class WorkflowStateService(BaseService):
             state_obj = State.objects.filter(id=state_id, is_deleted=0)
             if state_obj:
                 state_obj.update(**data)
+        workflow_config_cache_service_ins.bump_version()
         return True, dict(workflow_state_id=state_id)
 
     @classmethod
@@ -266,6 +266,7 @@ class WorkflowStateService(BaseService):
         state_obj = State.objects.filter(id=state_id, is_deleted=0)
         if state_obj:
             state_obj.update(is_deleted=1)
+        workflow_config_cache_service_ins.bump_version()
         return True, {}
 
 
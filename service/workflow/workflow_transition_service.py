@@ -4,6 +4,7 @@ from django.db.models import Q
 from apps.workflow.models import Transition
 from service.base_service import BaseService
 from service.common.log_service import auto_log
+from service.workflow.workflow_config_cache_service import workflow_config_cache_service_ins
 
 
 class WorkflowTransitionService(BaseService):
@@ -19,7 +20,10 @@ class WorkflowTransitionService(BaseService):
         :param state_id:
         :return:
         """
-        return True, Transition.objects.filter(is_deleted=0, source_state_id=state_id).all()
+        transition_list = workflow_config_cache_service_ins.get_config(
+            'state_transitions', state_id,
+            lambda: list(Transition.objects.filter(is_deleted=0, source_state_id=state_id).all()))
+        return True, transition_list
 
     @classmethod
     @auto_log
@@ -30,7 +34,24 @@ class WorkflowTransitionService(BaseService):
         :param transition_id:
         :return:
         """
-        return True, Transition.objects.filter(is_deleted=0, id=transition_id).first()
+        transition_obj = workflow_config_cache_service_ins.get_config(
+            'transition', transition_id, lambda: Transition.objects.filter(is_deleted=0, id=transition_id).first())
+        return True, transition_obj
+
+    @classmethod
+    @auto_log
+    def get_transition_dict_by_id_list(cls, transition_id_list: list) -> tuple:
+        """
+        批量获取流转, 一次查询
+        get transitions by id list with one query
+        :param transition_id_list:
+        :return: {transition_id: transition_obj}
+        """
+        transition_id_list = [transition_id for transition_id in set(transition_id_list) if transition_id]
+        if not transition_id_list:
+            return True, {}
+        transition_queryset = Transition.objects.filter(id__in=transition_id_list, is_deleted=0).all()
+        return True, {transition_obj.id: transition_obj for transition_obj in transition_queryset}
 
     @classmethod
     @auto_log
@@ -122,6 +143,7 @@ class WorkflowTransitionService(BaseService):
                                     attribute_type_id=attribute_type_id, field_require_check=field_require_check,
                                     alert_enable=alert_enable, alert_text=alert_text, creator=creator)
         transition_obj.save()
+        workflow_config_cache_service_ins.bump_version()
         return True, dict(transition_id=transition_obj.id)
 
     @classmethod
@@ -138,6 +160,7 @@ class WorkflowTransitionService(BaseService):
                                        condition_expression=condition_expression,
                                        attribute_type_id=attribute_type_id, field_require_check=field_require_check,
                                        alert_enable=alert_enable, alert_text=alert_text)
+        workflow_config_cache_service_ins.bump_version()
         return True, ''
 
     @classmethod
@@ -146,6 +169,7 @@ class WorkflowTransitionService(BaseService):
         transition_queryset = Transition.objects.filter(is_deleted=0, id=transition_id)
         if transition_queryset:
             transition_queryset.update(is_deleted=1)
+        workflow_config_cache_service_ins.bump_version()
         return True, ''
 
 
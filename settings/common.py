@@ -155,3 +155,108 @@ if platform.system() == 'Windows':
     HOMEPATH = os.environ['HOMEPATH']
 else:
     HOMEPATH = os.environ['HOME']
+
+# 工作流配置缓存(进程内LRU + redis), 配置变更时通过版本号失效
+WORKFLOW_CONFIG_LOCAL_CACHE_SIZE = 2048  # 进程内缓存条数
+WORKFLOW_CONFIG_CACHE_TIMEOUT = 3600  # redis缓存过期时间(秒)
+WORKFLOW_CONFIG_VERSION_CHECK_INTERVAL = 1  # 每隔多少秒检查一次redis中的版本号
+
+# 工单处理事务遇到死锁、锁等待超时时的重试次数
+TICKET_HANDLE_RETRY_COUNT = 3
+
+# 批量新建、批量处理工单接口一次允许的最大工单数
+TICKET_BATCH_MAX_SIZE = 1000
+
+# 工单流水号序号分配: 每个进程一次租用的序号个数; 序号存储, redis(INCRBY)或db(ticket_ticketsnsequence表)
+TICKET_SN_BLOCK_SIZE = 100
+TICKET_SN_STORE = 'redis'
+
+# 工作流脚本执行: 编译缓存的脚本个数; 进程池大小, 0表示在任务进程中直接执行; 进程池中脚本的超时时间(秒)
+# 进程池适用于threads/gevent/solo方式启动的celery worker(prefork方式的worker进程不允许再创建子进程)
+WORKFLOW_SCRIPT_CACHE_SIZE = 256
+WORKFLOW_SCRIPT_POOL_SIZE = 0
+WORKFLOW_SCRIPT_TIMEOUT = 300
+
+# 通知hook调用: 并发线程数; 每个目标主机的连接池大小; 超时时间(秒); 失败重试次数及退避时间(秒, 第n次重试前等待backoff * 2^(n-1))
+NOTICE_SEND_CONCURRENCY = 20
+HTTP_POOL_MAX_SIZE = 20
+NOTICE_HOOK_TIMEOUT = 5
+NOTICE_HOOK_RETRY_COUNT = 2
+NOTICE_HOOK_RETRY_BACKOFF = 0.5
+
+# 工单通知合并: 合并窗口(秒)，窗口内同一工单的多次通知只按最新状态发送一次, 0表示不合并立即发送;
+# 定时任务flush_ticket_notice的执行间隔(秒, 需要启动celery beat)及每批发送的工单数
+NOTICE_COALESCE_WINDOW = 0
+NOTICE_COALESCE_FLUSH_INTERVAL = 5
+NOTICE_COALESCE_BATCH_SIZE = 100
+
+# 定时器流转: 定时任务sweep_ticket_timer的执行间隔(秒); 每批领取的定时器个数; 执行租约(秒), 超时未完成的定时器将被重新执行
+TICKET_TIMER_SWEEP_INTERVAL = 10
+TICKET_TIMER_BATCH_SIZE = 100
+TICKET_TIMER_LEASE = 300
+
+# 定时器、hook发送等数据库队列领取任务时是否使用FOR UPDATE SKIP LOCKED(mysql8.0+支持, 多个worker并发领取时互不阻塞)
+SELECT_FOR_UPDATE_SKIP_LOCKED = False
+
+# 状态hook发送: 定时任务send_ticket_hook的执行间隔(秒, 发送待重试的hook); 每批领取的hook个数; 每个worker同时发送的最大请求数;
+# 请求超时时间(秒); 失败重试次数及退避时间(秒, 第n次重试前等待backoff * 2^(n-1)); 发送租约(秒), 超时未完成的将被重新发送
+HOOK_SEND_INTERVAL = 10
+HOOK_SEND_BATCH_SIZE = 200
+HOOK_SEND_CONCURRENCY = 100
+HOOK_TIMEOUT = 10
+HOOK_RETRY_COUNT = 5
+HOOK_RETRY_BACKOFF = 10
+HOOK_SEND_LEASE = 300
+
+# 是否启用工单列表读模型(待办、关联、处理过的工单列表直接查询ticket_ticketinbox, 启用前先执行python manage.py rebuild_ticket_inbox)
+TICKET_INBOX_ENABLED = False
+
+# 流转记录中工单数据(ticket_data)的存储方式: full每条保存完整数据; delta保存相对上一条流转记录的差异，
+# 每TICKET_FLOW_LOG_CHECKPOINT_INTERVAL条保存一次完整数据。修改后可执行python manage.py convert_ticket_flow_log转换历史数据
+TICKET_FLOW_LOG_DATA_MODE = 'full'
+TICKET_FLOW_LOG_CHECKPOINT_INTERVAL = 10
+# 是否使用zlib压缩流转记录中的工单数据(压缩后更短时才使用压缩格式)
+TICKET_FLOW_LOG_DATA_COMPRESS = False
+
+# 组织架构内存索引(部门成员、角色成员、上级部门、部门审批人): 每隔多少秒检查一次redis中的版本号; 索引最长使用时间(秒, redis不可用时兜底)
+ORG_INDEX_VERSION_CHECK_INTERVAL = 5
+ORG_INDEX_MAX_AGE = 600
+
+# 调用方应用凭证(AppToken及有权限的工作流)进程内缓存: 最长使用时间(秒); 每隔多少秒检查一次redis中的版本号(AppToken或工作流变更后失效)
+APP_TOKEN_CACHE_TIMEOUT = 60
+APP_TOKEN_VERSION_CHECK_INTERVAL = 1
+# 接口签名防重放: 是否启用(启用后同一签名只能使用一次, 调用方每次请求需重新生成签名); 签名记录保存时间(秒, 不小于签名有效期);
+# redis不可用时进程内最多保存的签名个数(超过时清理已过期的)
+API_SIGNATURE_NONCE_ENABLED = False
+API_SIGNATURE_NONCE_TIMEOUT = 120
+API_SIGNATURE_NONCE_LOCAL_SIZE = 100000
+
+# 是否启用工单每日统计汇总表(工单新建、进行状态变化、删除时增量更新, 工单统计接口查询汇总表), 启用前先执行python manage.py rebuild_ticket_statistics
+TICKET_STATISTICS_ENABLED = False
+
+# 是否记录工单状态时效(进入、到期、离开时间, 到期时间按状态的最后期限及工作日日历计算), 启用前先执行python manage.py rebuild_ticket_sla;
+# 即将超时: 多少秒内到期
+TICKET_SLA_ENABLED = False
+TICKET_SLA_WARNING_SECONDS = 14400
+# 工作日日历: 工作日的星期(0为星期一); 节假日; 调休上班的日期, 格式如'2020-10-01'
+WORKING_DAY_WEEKDAYS = [0, 1, 2, 3, 4]
+WORKING_DAY_HOLIDAYS = []
+WORKING_DAY_WORKDAYS = []
+
+CELERY_BEAT_SCHEDULE = {
+    'flush_ticket_notice': {
+        'task': 'tasks.flush_ticket_notice',
+        'schedule': NOTICE_COALESCE_FLUSH_INTERVAL,
+        'options': {'queue': 'loonflow'},
+    },
+    'sweep_ticket_timer': {
+        'task': 'tasks.sweep_ticket_timer',
+        'schedule': TICKET_TIMER_SWEEP_INTERVAL,
+        'options': {'queue': 'loonflow'},
+    },
+    'send_ticket_hook': {
+        'task': 'tasks.send_ticket_hook',
+        'schedule': HOOK_SEND_INTERVAL,
+        'options': {'queue': 'loonflow'},
+    },
+}
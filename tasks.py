@@ -1,19 +1,15 @@
 # from __future__ import absolute_import, unicode_literals
 from django.conf import settings
-from service.workflow.workflow_transition_service import WorkflowTransitionService, workflow_transition_service_ins
-from service.common.common_service import CommonService, common_service_ins
-from service.ticket.ticket_base_service import TicketBaseService, ticket_base_service_ins
+from service.workflow.workflow_script_execute_service import workflow_script_execute_service_ins
+from service.ticket.ticket_base_service import ticket_base_service_ins
+from service.ticket.ticket_hook_outbox_service import ticket_hook_outbox_service_ins
+from service.ticket.ticket_notice_service import ticket_notice_service_ins
+from service.ticket.ticket_timer_service import ticket_timer_service_ins
 from service.common.constant_service import constant_service_ins
-from service.account.account_base_service import account_base_service_ins
-from apps.workflow.models import Transition, State, WorkflowScript, Workflow, CustomNotice
+from apps.workflow.models import Transition, WorkflowScript
 from apps.ticket.models import TicketRecord
-import requests
-import json
 import django
-import contextlib
 import os
-import sys
-import traceback
 import logging
 from celery import Celery
 
@@ -33,11 +29,6 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
-try:
-    from StringIO import StringIO
-except ImportError:
-    from io import StringIO
-
 logger = logging.getLogger('django')
 
 
@@ -52,20 +43,6 @@ def test_task(a, b):
     print(a + b)
 
 
-@contextlib.contextmanager
-def stdoutIO(stdout=None):
-    old = sys.stdout
-    if stdout is None:
-        try:
-            # for python2
-            stdout = StringIO.StringIO()
-        except Exception:
-            stdout = StringIO()
-    sys.stdout = stdout
-    yield stdout
-    sys.stdout = old
-
-
 @app.task
 def run_flow_task(ticket_id, script_id_str, state_id, action_from='loonrobot'):
     """
@@ -86,19 +63,9 @@ def run_flow_task(ticket_id, script_id_str, state_id, action_from='loonrobot'):
             return False, '脚本未注册或非激活状态'
 
         script_file = os.path.join(settings.MEDIA_ROOT, script_obj.saved_name.name)
-        globals = {'ticket_id': ticket_id, 'action_from': action_from}
         # 如果需要脚本执行完成后，工单不往下流转(也就脚本执行失败或调用其他接口失败的情况)，需要在脚本中抛出异常
-        try:
-            with stdoutIO() as s:
-                # execfile(script_file, globals)  # for python 2
-                exec(open(script_file, encoding='utf-8').read(), globals)
-            script_result = True
-            # script_result_msg = ''.join(s.buflist)
-            script_result_msg = ''.join(s.getvalue())
-        except Exception as e:
-            logger.error(traceback.format_exc())
-            script_result = False
-            script_result_msg = e.__str__()
+        script_result, script_result_msg = workflow_script_execute_service_ins.run_script(
+            script_file, ticket_id, action_from)
 
         logger.info('*' * 20 + '工作流脚本回调,ticket_id:[%s]' % ticket_id + '*' * 20)
         logger.info('*******工作流脚本回调，ticket_id:{}*****'.format(ticket_id))
@@ -134,7 +101,7 @@ def run_flow_task(ticket_id, script_id_str, state_id, action_from='loonrobot'):
 @app.task
 def timer_transition(ticket_id, state_id, date_time, transition_id):
     """
-    定时器流转
+    定时器流转(已由sweep_ticket_timer替代, 保留用于执行升级前已投递的countdown任务)
     :param ticket_id:
     :param state_id:
     :param date_time:
@@ -156,6 +123,15 @@ def timer_transition(ticket_id, state_id, date_time, transition_id):
     ticket_base_service_ins.handle_ticket(ticket_id, handle_ticket_data, True)
 
 
+@app.task
+def sweep_ticket_timer():
+    """
+    执行到期的定时器流转, 由celery beat定时触发
+    :return:
+    """
+    return ticket_timer_service_ins.sweep_ticket_timer()
+
+
 @app.task
 def send_ticket_notice(ticket_id):
     """
@@ -163,154 +139,50 @@ def send_ticket_notice(ticket_id):
     :param ticket_id:
     :return:
     """
-    # 获取工单信息
-    # 获取工作流信息，获取工作流的通知信息
-    # 获取通知信息的标题和内容模板
-    # 将通知内容，通知标题，通知人，作为hook的请求参数
-    ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-    if not ticket_obj:
-        return False, 'ticket is not exist or has been deleted'
-
-    workflow_id = ticket_obj.workflow_id
-    workflow_obj = Workflow.objects.filter(id=workflow_id, is_deleted=0).first()
-    notices = workflow_obj.notices
-    if not notices:
-        return True, 'no notice defined'
-    notice_str_list = notices.split(',')
-    notice_id_list = [int(notice_str) for notice_str in notice_str_list]
-    send_notice_result_list = []
+    return ticket_notice_service_ins.send_ticket_notice(ticket_id)
 
-    title_template = workflow_obj.title_template
-    content_template = workflow_obj.content_template
 
-    # 获取工单所有字段的变量
-    flag, ticket_value_info = ticket_base_service_ins.get_ticket_all_field_value(ticket_id)
+@app.task
+def send_ticket_notice_batch(ticket_id_list):
+    """
+    批量发送工单通知, 批量新建、处理工单时合并为一个任务
+    :param ticket_id_list:
+    :return:
+    """
+    flag, result = ticket_notice_service_ins.send_tickets_notice(ticket_id_list)
     if flag is False:
-        return False, ticket_value_info
-    title_result = title_template.format(**ticket_value_info)
-    content_result = content_template.format(**ticket_value_info)
-    # 获取工单最后一条操作记录
-    flag, result = ticket_base_service_ins.get_ticket_flow_log(ticket_id, 'loonrobot')
-    flow_log_list = result.get('ticket_flow_log_restful_list')
-
-    last_flow_log = flow_log_list[0]
-    participant_info_list = []
-    participant_username_list = []
-    from apps.account.models import LoonUser
-    if ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_PERSONAL:
-        participant_username_list = [ticket_obj.participant]
-    elif ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_MULTI:
-        participant_username_list = ticket_obj.participant.split(',')
-    elif ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_ROLE:
-        flag, participant_username_list = account_base_service_ins.get_role_username_list(ticket_obj.participant)
-        if flag is False:
-            return False, participant_username_list
-
-    elif ticket_obj.participant_type_id == constant_service_ins.PARTICIPANT_TYPE_DEPT:
-        flag, participant_username_list = account_base_service_ins.get_dept_username_list(ticket_obj.participant)
-        if not flag:
-            return flag, participant_username_list
-
-    if participant_username_list:
-        participant_queryset = LoonUser.objects.filter(username__in=participant_username_list, is_deleted=0)
-        for participant_0 in participant_queryset:
-            participant_info_list.append(dict(username=participant_0.username, alias=participant_0.alias,
-                                              phone=participant_0.phone, email=participant_0.email))
+        return False, result
+    return True, dict(ticket_notice_result_dict=result)
 
-    params = {'title_result': title_result, 'content_result': content_result,
-              'participant': ticket_obj.participant, 'participant_type_id': ticket_obj.participant_type_id,
-              'multi_all_person': ticket_obj.multi_all_person, 'ticket_value_info': ticket_value_info,
-              'last_flow_log': last_flow_log, 'participant_info_list': participant_info_list}
-    for notice_id in notice_id_list:
-        notice_obj = CustomNotice.objects.filter(id=notice_id, is_deleted=0).first()
-        if not notice_obj:
-            continue
-        hook_url = notice_obj.hook_url
-        hook_token = notice_obj.hook_token
-        # gen signature
-        flag, headers = common_service_ins.gen_signature_by_token(hook_token)
-        try:
-            r = requests.post(hook_url, headers=headers, json=params)
-            result = r.json()
-            if result.get('code') == 0:
-                send_notice_result_list.append(dict(notice_id=notice_id, result='success', msg=result.get('msg', '')))
-            else:
-                send_notice_result_list.append(dict(notice_id=notice_id, result='fail', msg=result.get('msg', '')))
-        except Exception as e:
-            send_notice_result_list.append(dict(notice_id=notice_id, result='fail', msg=e.__str__()))
 
-    return True, dict(send_notice_result_list=send_notice_result_list)
+@app.task
+def flush_ticket_notice():
+    """
+    发送合并队列中到期的工单通知, 由celery beat定时触发
+    :return:
+    """
+    return ticket_notice_service_ins.flush_pending_notice()
 
 
 @app.task
 def flow_hook_task(ticket_id):
     """
-    hook 任务
+    hook 任务(已由hook发送队列替代, 保留用于执行升级前已投递的任务)
     :param ticket_id:
     :return:
     """
-    # 查询工单状态
     ticket_obj = TicketRecord.objects.filter(id=ticket_id, is_deleted=0).first()
-    state_id = ticket_obj.state_id
-    state_obj = State.objects.filter(id=state_id, is_deleted=0).first()
-
-    participant_type_id = state_obj.participant_type_id
-    if participant_type_id != constant_service_ins.PARTICIPANT_TYPE_HOOK:
+    if not ticket_obj or ticket_obj.participant_type_id != constant_service_ins.PARTICIPANT_TYPE_HOOK:
         return False, ''
-    hook_config = state_obj.participant
-    hook_config_dict = json.loads(hook_config)
-    hook_url = hook_config_dict.get('hook_url')
-    hook_token = hook_config_dict.get('hook_token')
-    wait = hook_config_dict.get('wait')
-    extra_info = hook_config_dict.get('extra_info')
-
-    flag, msg = common_service_ins.gen_hook_signature(hook_token)
-    if not flag:
-        return False, msg
-    flag, all_ticket_data = ticket_base_service_ins.get_ticket_all_field_value(ticket_id)
-    if extra_info is not None:
-        all_ticket_data.update(dict(extra_info=extra_info))
-    try:
-        r = requests.post(hook_url, headers=msg, json=all_ticket_data, timeout=10)
-        result = r.json()
-    except Exception as e:
-        result = dict(code=-1, msg=e.__str__())
-    if result.get('code') == 0:
-        # 调用成功
-        if wait:
-            # date等格式需要转换为str
-            for key, value in all_ticket_data.items():
-                if type(value) not in [int, str, bool, float]:
-                    all_ticket_data[key] = str(all_ticket_data[key])
+    # 不在事务中, 新增后立即投递发送任务
+    return ticket_hook_outbox_service_ins.add_hook_delivery(ticket_id, ticket_obj.state_id)
 
-            all_ticket_data_json = json.dumps(all_ticket_data)
-            TicketBaseService().add_ticket_flow_log(dict(ticket_id=ticket_id, transition_id=0,
-                                                         suggestion=result.get('msg'),
-                                                         participant_type_id=constant_service_ins.PARTICIPANT_TYPE_HOOK,
-                                                         participant='hook', state_id=state_id,
-                                                         ticket_data=all_ticket_data_json,
-                                                         creator='loonrobot'
-                                                         ))
-            return True, ''
-        else:
-            # 不等待hook目标回调，直接流转
-            flag, transition_queryset = workflow_transition_service_ins.get_state_transition_queryset(state_id)
-            transition_id = transition_queryset[0].id  # hook状态只支持一个流转
 
-            new_request_dict = {}
-            new_request_dict.update({'transition_id': transition_id, 'suggestion': msg, 'username': 'loonrobot'})
-            # 执行流转
-            flag, msg = ticket_base_service_ins.handle_ticket(ticket_id, new_request_dict, by_hook=True)
-            if not flag:
-                return False, msg
-
-    else:
-        ticket_base_service_ins.update_ticket_field_value(ticket_id, {'script_run_last_result': False})
-
-        flag, all_field_value_result = ticket_base_service_ins.get_ticket_all_field_value_json(ticket_id)
-
-        all_ticket_data_json = all_field_value_result.get('all_field_value_json')
-        ticket_base_service_ins.add_ticket_flow_log(
-            dict(ticket_id=ticket_id, transition_id=0, suggestion=result.get('msg'),
-                 participant_type_id=constant_service_ins.PARTICIPANT_TYPE_HOOK,
-                 participant='hook', state_id=state_id, ticket_data=all_ticket_data_json, creator='loonrobot'))
+@app.task
+def send_ticket_hook(outbox_id_list=None):
+    """
+    发送hook队列中到期的hook, 新增hook时投递(只发送新增的)，celery beat定时触发(发送所有到期的，包括待重试的)
+    :param outbox_id_list:
+    :return:
+    """
+    return ticket_hook_outbox_service_ins.send_hook_outbox(outbox_id_list)
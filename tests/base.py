@@ -48,3 +48,89 @@ class LoonflowApiCall(object):
         response_content_dict = json.loads(str(response_content, encoding='utf-8'))
 
         return response_content_dict
+
+
+class InMemoryRedis(object):
+    """
+    测试用的进程内redis, 只实现服务中用到的命令, 不处理过期时间
+    in-memory stand-in for the redis commands used by services, keys never expire
+    """
+    def __init__(self):
+        self.data = {}
+
+    @staticmethod
+    def encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def get(self, name):
+        return self.data.get(name)
+
+    def set(self, name, value, ex=None, nx=False):
+        if nx and name in self.data:
+            return None
+        self.data[name] = self.encode(value)
+        return True
+
+    def exists(self, name):
+        return int(name in self.data)
+
+    def delete(self, *names):
+        return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+    def incrby(self, name, amount=1):
+        value = int(self.data.get(name, 0)) + amount
+        self.data[name] = self.encode(value)
+        return value
+
+    def incr(self, name, amount=1):
+        return self.incrby(name, amount)
+
+    def zadd(self, name, mapping, nx=False):
+        zset = self.data.setdefault(name, {})
+        added_count = 0
+        for member, score in mapping.items():
+            member = self.encode(member)
+            if member not in zset:
+                added_count += 1
+            elif nx:
+                continue
+            zset[member] = score
+        return added_count
+
+    def zrem(self, name, *members):
+        zset = self.data.get(name, {})
+        return sum(1 for member in members if zset.pop(self.encode(member), None) is not None)
+
+    def zscore(self, name, member):
+        return self.data.get(name, {}).get(self.encode(member))
+
+    def zrangebyscore(self, name, min, max, start=None, num=None):
+        min = float(min)
+        max = float(max)
+        member_list = [member for member, score in sorted(self.data.get(name, {}).items(), key=lambda item: item[1])
+                       if min <= score <= max]
+        if start is not None:
+            member_list = member_list[start:start + num]
+        return member_list
+
+    def pipeline(self, transaction=True):
+        return InMemoryRedisPipeline(self)
+
+
+class InMemoryRedisPipeline(object):
+    def __init__(self, redis_conn):
+        self.redis_conn = redis_conn
+        self.command_list = []
+
+    def __getattr__(self, name):
+        def add_command(*args, **kwargs):
+            self.command_list.append((name, args, kwargs))
+            return self
+        return add_command
+
+    def execute(self):
+        result_list = [getattr(self.redis_conn, name)(*args, **kwargs) for name, args, kwargs in self.command_list]
+        self.command_list = []
+        return result_list
@@ -0,0 +1,62 @@
+"""
+条件表达式计算的微基准: 原str.format + eval实现 vs 预编译的条件表达式引擎
+micro benchmark of condition expression evaluation, legacy str.format + eval vs the precompiled engine
+usage: python -m tests.benchmarks.bench_condition_expression [loop_count]
+"""
+import copy
+import json
+import sys
+import timeit
+
+from service.workflow.workflow_condition_expression_service import workflow_condition_expression_service_ins
+
+CONDITION_EXPRESSION = json.dumps([
+    {'expression': "{leave_days} > 10 and {leave_type} == 'annual'", 'target_state_id': 11},
+    {'expression': "{leave_days} > 3 and {leave_days} <= 10", 'target_state_id': 12},
+    {'expression': "{leave_days} <= 3", 'target_state_id': 13},
+])
+TICKET_VALUE_DICT = dict(
+    id=1, title='请假申请', workflow_id=1, sn='loonflow_202001010001', state_id=1, creator='lilei',
+    relation='lilei,zhangsan', participant='zhangsan', participant_type_id=1, gmt_created='2020-01-01 10:00:00',
+    leave_start='2020-01-02 09:00:00', leave_end='2020-01-04 18:00:00', leave_proxy='lisi',
+    leave_reason='家中有事', leave_type='sick', leave_days=2)
+
+
+def legacy_get_target_state_id(condition_expression, value_dict):
+    """
+    原实现: 深拷贝工单字段值，字符串包上三引号后格式化表达式再eval
+    """
+    value_dict_copy = copy.deepcopy(value_dict)
+    for key, value in value_dict_copy.items():
+        if isinstance(value_dict_copy[key], str):
+            value_dict_copy[key] = "'''" + value_dict_copy[key] + "'''"
+    for condition_expression0 in json.loads(condition_expression):
+        expression_format = condition_expression0.get('expression').format(**value_dict_copy)
+        if eval(expression_format):
+            return condition_expression0.get('target_state_id')
+    return 0
+
+
+def engine_get_target_state_id(condition_expression, value_dict):
+    flag, target_state_id = workflow_condition_expression_service_ins.get_target_state_id(
+        1, condition_expression, value_dict)
+    return target_state_id
+
+
+def main():
+    loop_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    assert legacy_get_target_state_id(CONDITION_EXPRESSION, TICKET_VALUE_DICT) == \
+        engine_get_target_state_id(CONDITION_EXPRESSION, TICKET_VALUE_DICT) == 13
+
+    legacy_seconds = timeit.timeit(
+        lambda: legacy_get_target_state_id(CONDITION_EXPRESSION, TICKET_VALUE_DICT), number=loop_count)
+    engine_seconds = timeit.timeit(
+        lambda: engine_get_target_state_id(CONDITION_EXPRESSION, TICKET_VALUE_DICT), number=loop_count)
+    print('loop count: {}'.format(loop_count))
+    print('legacy format + eval: {:.2f} us/op'.format(legacy_seconds / loop_count * 1000000))
+    print('compiled engine:      {:.2f} us/op'.format(engine_seconds / loop_count * 1000000))
+    print('speedup: {:.1f}x'.format(legacy_seconds / engine_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+工单热点查询索引基准: 在sqlite中生成工单、自定义字段、流转记录、关系人、流转数据，
+分别在只有主键及加上组合索引(与loonflow_init.sql一致)时输出各查询的执行计划及耗时
+benchmark of hot ticket queries on synthetic data, EXPLAIN QUERY PLAN and latency before and after the composite
+indexes. the table layout and queries follow ticket_base_service, so plans carry over to mysql
+usage: python -m tests.benchmarks.bench_ticket_index [ticket_count] [db_path]
+       ticket_count默认1000000, db_path默认内存数据库
+"""
+import datetime
+import random
+import sqlite3
+import sys
+import time
+
+WORKFLOW_COUNT = 50
+STATE_COUNT = 500
+FIELD_KEY_LIST = ['leave_start', 'leave_end', 'leave_days', 'leave_reason']
+USERNAME_COUNT = 5000
+QUERY_LOOP_COUNT = 50
+
+TABLE_SQL_LIST = [
+    'CREATE TABLE ticket_ticketrecord (id INTEGER PRIMARY KEY, workflow_id INT, state_id INT, parent_ticket_id INT, '
+    'parent_ticket_state_id INT, act_state_id INT, creator VARCHAR(50), title VARCHAR(500), is_deleted BOOL, '
+    'gmt_created DATETIME)',
+    'CREATE TABLE ticket_ticketcustomfield (id INTEGER PRIMARY KEY, ticket_id INT, field_key VARCHAR(50), '
+    'char_value VARCHAR(1000), is_deleted BOOL)',
+    'CREATE TABLE ticket_ticketflowlog (id INTEGER PRIMARY KEY, ticket_id INT, state_id INT, transition_id INT, '
+    'participant VARCHAR(50), is_deleted BOOL, gmt_created DATETIME)',
+    'CREATE TABLE ticket_ticketuser (id INTEGER PRIMARY KEY, ticket_id INT, username VARCHAR(100), in_process BOOL, '
+    'worked BOOL, is_deleted BOOL)',
+    'CREATE TABLE workflow_transition (id INTEGER PRIMARY KEY, workflow_id INT, source_state_id INT, '
+    'destination_state_id INT, is_deleted BOOL)',
+]
+
+# 与loonflow_init.sql中的索引一致(ticket_ticketuser的ticket_id索引由外键生成, 两种情况下都保留)
+INDEX_SQL_LIST = [
+    'CREATE INDEX idx_workflow_id_is_deleted_gmt_created ON ticket_ticketrecord (workflow_id, is_deleted, gmt_created)',
+    'CREATE INDEX idx_parent_ticket_id_state_id ON ticket_ticketrecord (parent_ticket_id, parent_ticket_state_id)',
+    'CREATE INDEX idx_ticket_id_field_key_is_deleted ON ticket_ticketcustomfield (ticket_id, field_key, is_deleted)',
+    'CREATE INDEX idx_ticket_id_is_deleted_id ON ticket_ticketflowlog (ticket_id, is_deleted, id)',
+    'CREATE INDEX idx_ticket_id_state_id ON ticket_ticketflowlog (ticket_id, state_id)',
+    'CREATE INDEX idx_username_in_process ON ticket_ticketuser (username, in_process)',
+    'CREATE INDEX idx_source_state_id_is_deleted ON workflow_transition (source_state_id, is_deleted)',
+]
+
+
+def get_query_list(ticket_count):
+    """
+    ticket_base_service中的查询: (名称, sql, 参数生成函数)
+    """
+    def random_ticket_id():
+        return random.randint(1, ticket_count)
+
+    def ticket_list_params():
+        workflow_id_list = random.sample(range(1, WORKFLOW_COUNT + 1), 3)
+        return workflow_id_list + ['2020-03-01 00:00:00', '2020-03-31 23:59:59']
+
+    return [
+        ('ticket list(workflow_id, gmt_created)',
+         'SELECT id FROM ticket_ticketrecord WHERE is_deleted = 0 AND workflow_id IN (?, ?, ?) '
+         'AND gmt_created >= ? AND gmt_created <= ? ORDER BY gmt_created DESC LIMIT 10',
+         ticket_list_params),
+        ('sub tickets(parent_ticket_id, parent_ticket_state_id)',
+         'SELECT id FROM ticket_ticketrecord WHERE parent_ticket_id = ? AND parent_ticket_state_id = ? '
+         'AND is_deleted = 0',
+         lambda: [random_ticket_id(), random.randint(1, STATE_COUNT)]),
+        ('custom field(ticket_id, field_key)',
+         'SELECT id, char_value FROM ticket_ticketcustomfield WHERE ticket_id = ? AND field_key = ? AND is_deleted = 0',
+         lambda: [random_ticket_id(), random.choice(FIELD_KEY_LIST)]),
+        ('flow log list(ticket_id order by id)',
+         'SELECT id, state_id FROM ticket_ticketflowlog WHERE ticket_id = ? AND is_deleted = 0 ORDER BY id DESC '
+         'LIMIT 10',
+         lambda: [random_ticket_id()]),
+        ('flow log(ticket_id, state_id)',
+         'SELECT id FROM ticket_ticketflowlog WHERE ticket_id = ? AND state_id = ?',
+         lambda: [random_ticket_id(), random.randint(1, STATE_COUNT)]),
+        ('duty tickets(username, in_process)',
+         'SELECT ticket_id FROM ticket_ticketuser WHERE username = ? AND in_process = 1 AND is_deleted = 0',
+         lambda: ['user_{}'.format(random.randint(1, USERNAME_COUNT))]),
+        ('transitions(source_state_id)',
+         'SELECT id, destination_state_id FROM workflow_transition WHERE source_state_id = ? AND is_deleted = 0',
+         lambda: [random.randint(1, STATE_COUNT)]),
+    ]
+
+
+def load_data(conn, ticket_count, batch_size=50000):
+    """
+    生成数据: 每个工单2个自定义字段, 3条流转记录, 2个关系人
+    """
+    for sql in TABLE_SQL_LIST:
+        conn.execute(sql)
+    conn.execute('CREATE INDEX idx_ticket_id ON ticket_ticketuser (ticket_id)')
+    conn.executemany('INSERT INTO workflow_transition VALUES (?, ?, ?, ?, 0)', [
+        (index, index % WORKFLOW_COUNT + 1, index % STATE_COUNT + 1, (index + 1) % STATE_COUNT + 1)
+        for index in range(1, STATE_COUNT * 3 + 1)])
+    start_time = datetime.datetime(2020, 1, 1)
+    for batch_start in range(1, ticket_count + 1, batch_size):
+        ticket_list, field_list, flow_log_list, user_list = [], [], [], []
+        for ticket_id in range(batch_start, min(batch_start + batch_size, ticket_count + 1)):
+            gmt_created = str(start_time + datetime.timedelta(seconds=ticket_id * 30))
+            parent_ticket_id = random.randint(1, ticket_id) if random.random() < 0.05 else 0
+            ticket_list.append((ticket_id, random.randint(1, WORKFLOW_COUNT), random.randint(1, STATE_COUNT),
+                                parent_ticket_id, random.randint(1, STATE_COUNT) if parent_ticket_id else 0,
+                                random.randint(1, 5), 'admin', 'ticket', 0, gmt_created))
+            for field_key in random.sample(FIELD_KEY_LIST, 2):
+                field_list.append((None, ticket_id, field_key, 'value', 0))
+            for _ in range(3):
+                flow_log_list.append((None, ticket_id, random.randint(1, STATE_COUNT), 1, 'admin', 0, gmt_created))
+            for in_process in (0, 1):
+                user_list.append((None, ticket_id, 'user_{}'.format(random.randint(1, USERNAME_COUNT)), in_process,
+                                  1 - in_process, 0))
+        conn.executemany('INSERT INTO ticket_ticketrecord VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', ticket_list)
+        conn.executemany('INSERT INTO ticket_ticketcustomfield VALUES (?, ?, ?, ?, ?)', field_list)
+        conn.executemany('INSERT INTO ticket_ticketflowlog VALUES (?, ?, ?, ?, ?, ?, ?)', flow_log_list)
+        conn.executemany('INSERT INTO ticket_ticketuser VALUES (?, ?, ?, ?, ?, ?)', user_list)
+        conn.commit()
+
+
+def run_query_list(conn, query_list):
+    """
+    返回{查询名称: (执行计划, 平均耗时毫秒)}
+    """
+    result_dict = {}
+    for name, sql, params_func in query_list:
+        plan = '; '.join(row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params_func()))
+        start = time.perf_counter()
+        for _ in range(QUERY_LOOP_COUNT):
+            conn.execute(sql, params_func()).fetchall()
+        result_dict[name] = (plan, (time.perf_counter() - start) / QUERY_LOOP_COUNT * 1000)
+    return result_dict
+
+
+def main():
+    ticket_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    db_path = sys.argv[2] if len(sys.argv) > 2 else ':memory:'
+    random.seed(0)
+    conn = sqlite3.connect(db_path)
+    load_start = time.perf_counter()
+    load_data(conn, ticket_count)
+    print('ticket count: {}, load data: {:.1f}s'.format(ticket_count, time.perf_counter() - load_start))
+
+    query_list = get_query_list(ticket_count)
+    before_dict = run_query_list(conn, query_list)
+    index_start = time.perf_counter()
+    for sql in INDEX_SQL_LIST:
+        conn.execute(sql)
+    conn.execute('ANALYZE')
+    print('create index: {:.1f}s'.format(time.perf_counter() - index_start))
+    after_dict = run_query_list(conn, query_list)
+
+    for name, _, _ in query_list:
+        before_plan, before_ms = before_dict[name]
+        after_plan, after_ms = after_dict[name]
+        print('\n{}'.format(name))
+        print('  before: {:10.3f} ms  {}'.format(before_ms, before_plan))
+        print('  after:  {:10.3f} ms  {}'.format(after_ms, after_plan))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
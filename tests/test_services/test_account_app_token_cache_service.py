@@ -0,0 +1,62 @@
+from django.db.models import Q
+
+from apps.workflow.models import Workflow
+from service.account.account_app_token_cache_service import account_app_token_cache_service_ins
+from service.account.account_base_service import account_base_service_ins
+from tests.base import LoonflowTest
+
+
+class TestAccountAppTokenCacheService(LoonflowTest):
+    def test_get_credential(self):
+        """
+        应用凭证缓存: token及有权限的工作流, token删除后失效
+        :return:
+        """
+        workflow_obj = Workflow.objects.create(name='cache test', app_name='cache_app', creator='admin')
+        flag, result = account_base_service_ins.add_token_record('cache_app', 'cache', 'admin')
+        self.assertTrue(flag)
+        app_token_id = result.get('app_token_id')
+        credential = account_app_token_cache_service_ins.get_credential('cache_app')
+        self.assertEqual(credential.app_token_obj.id, app_token_id)
+        self.assertEqual(credential.workflow_id_set, frozenset([workflow_obj.id]))
+        self.assertEqual(account_base_service_ins.app_workflow_permission_check('cache_app', workflow_obj.id)[0], True)
+        self.assertEqual(account_base_service_ins.app_workflow_permission_check('cache_app', 0)[0], False)
+
+        account_base_service_ins.del_token_record(app_token_id)
+        self.assertIsNone(account_app_token_cache_service_ins.get_credential('cache_app').app_token_obj)
+        self.assertEqual(account_base_service_ins.app_workflow_permission_list('cache_app')[0], False)
+
+    def test_check_nonce(self):
+        """
+        同一签名在有效期内只能使用一次
+        :return:
+        """
+        self.assertTrue(account_app_token_cache_service_ins.check_nonce('test_nonce_signature', 120))
+        self.assertFalse(account_app_token_cache_service_ins.check_nonce('test_nonce_signature', 120))
+        self.assertTrue(account_app_token_cache_service_ins.check_nonce('test_nonce_signature_other', 120))
+
+    def test_get_app_workflow_query_params(self):
+        """
+        工单列表中调用方有权限的工作流的查询条件
+        :return:
+        """
+        workflow_obj = Workflow.objects.create(name='query test', app_name='query_app', creator='admin')
+        deleted_workflow_obj = Workflow.objects.create(name='query test deleted', app_name='query_app',
+                                                       creator='admin', is_deleted=True)
+        account_base_service_ins.add_token_record('query_app', 'query', 'admin')
+        # 已删除的工作流
+        flag, query_params = account_base_service_ins.get_app_workflow_query_params('loonflow')
+        self.assertEqual(query_params, ~Q(workflow_id__in=[deleted_workflow_obj.id]))
+        flag, query_params = account_base_service_ins.get_app_workflow_query_params(
+            'loonflow', [workflow_obj.id, deleted_workflow_obj.id])
+        self.assertEqual(query_params, Q(workflow_id__in=[workflow_obj.id]))
+
+        flag, query_params = account_base_service_ins.get_app_workflow_query_params('query_app')
+        # 关联查询工作流表
+        workflow_queryset = dict(query_params.children)['workflow_id__in']
+        self.assertEqual([workflow['id'] for workflow in workflow_queryset], [workflow_obj.id])
+        flag, query_params = account_base_service_ins.get_app_workflow_query_params(
+            'query_app', [deleted_workflow_obj.id])
+        self.assertIsNone(query_params)
+        flag, result = account_base_service_ins.get_app_workflow_query_params('unknown_app')
+        self.assertFalse(flag)
@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from service.account.account_org_index_service import AccountOrgIndexService, OrgIndex
+from tests.base import InMemoryRedis, LoonflowTest
+
+
+class TestOrgIndex(LoonflowTest):
+    def test_org_index(self):
+        """
+        部门上级、部门成员、角色成员、部门审批人
+        :return:
+        """
+        dept_dict = {1: (0, 'boss', ''), 2: (1, 'lilei', 'hanmeimei'), 3: (2, 'lucy', ''), 4: (5, '', ''),
+                     5: (4, '', '')}
+        index = OrgIndex(1, dict(boss=1, lilei=2, lucy=3, jim=3, tom=4), dept_dict,
+                         dict(lilei=[1, 2], lucy=[2]))
+        self.assertEqual(index.dept_ancestor_dict[3], (3, 2, 1))
+        self.assertEqual(index.dept_ancestor_dict[1], (1,))
+        # 上级部门出现环时截止
+        self.assertEqual(index.dept_ancestor_dict[4], (4, 5))
+        self.assertEqual(index.dept_ancestor_dict[5], (5, 4))
+        self.assertEqual(index.dept_username_dict[3], ('lucy', 'jim'))
+        self.assertEqual(index.role_username_dict[2], ('lilei', 'lucy'))
+        self.assertEqual(index.user_role_dict['lilei'], (1, 2))
+        self.assertEqual(index.dept_approver_dict[2], 'hanmeimei')
+        self.assertEqual(index.dept_approver_dict[3], 'lucy')
+
+
+class TestAccountOrgIndexService(TransactionTestCase):
+    def setUp(self):
+        self.redis_conn = InMemoryRedis()
+        self.build_count = 0
+        patcher_list = [
+            mock.patch.object(AccountOrgIndexService, 'get_redis_conn', return_value=self.redis_conn),
+            mock.patch.object(AccountOrgIndexService, 'build_index', side_effect=self.build_index),
+            mock.patch.object(AccountOrgIndexService, '_index', None),
+            mock.patch.object(AccountOrgIndexService, '_checked_at', 0),
+        ]
+        for patcher in patcher_list:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def build_index(self, version):
+        self.build_count += 1
+        return OrgIndex(version, dict(lilei=self.build_count), {}, {})
+
+    def test_bump_version_rebuild(self):
+        """
+        组织架构模型变更的事务提交后递增版本号, 当前进程立即重建, 其他进程在检查间隔后重建
+        :return:
+        """
+        self.assertEqual(AccountOrgIndexService.get_user_dept_id('lilei'), 1)
+        self.assertEqual(AccountOrgIndexService.get_user_dept_id('lilei'), 1)
+        with transaction.atomic():
+            AccountOrgIndexService.on_org_model_changed(sender=None, update_fields=None)
+            self.assertIsNone(self.redis_conn.get(AccountOrgIndexService.VERSION_KEY))
+        self.assertEqual(self.redis_conn.get(AccountOrgIndexService.VERSION_KEY), b'1')
+        self.assertEqual(AccountOrgIndexService.get_user_dept_id('lilei'), 2)
+
+        # 其他进程递增版本号
+        self.redis_conn.incr(AccountOrgIndexService.VERSION_KEY)
+        AccountOrgIndexService._checked_at = 0
+        self.assertEqual(AccountOrgIndexService.get_user_dept_id('lilei'), 3)
+
+        # 登录更新last_login不递增版本号
+        AccountOrgIndexService.on_org_model_changed(sender=None, update_fields=frozenset(['last_login']))
+        self.assertEqual(self.redis_conn.get(AccountOrgIndexService.VERSION_KEY), b'2')
+        self.assertEqual(self.build_count, 3)
@@ -0,0 +1,58 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from service.common.http_service import http_service_ins
+from tests.base import LoonflowTest
+
+
+class HookHandler(BaseHTTPRequestHandler):
+    # 前fail_count次请求返回500
+    fail_count = 0
+    request_count = 0
+
+    def do_POST(self):
+        HookHandler.request_count += 1
+        self.rfile.read(int(self.headers['Content-Length']))
+        if HookHandler.request_count <= HookHandler.fail_count:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps(dict(code=0, msg='ok')).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpService(LoonflowTest):
+    def setUp(self):
+        HookHandler.request_count = 0
+        self.server = HTTPServer(('127.0.0.1', 0), HookHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/hook'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_post_json_retry(self):
+        """
+        5xx响应时重试, 同一主机复用session
+        :return:
+        """
+        HookHandler.fail_count = 2
+        flag, result = http_service_ins.post_json(self.url, {}, dict(a=1), timeout=5, retry_count=2, retry_backoff=0)
+        self.assertEqual((flag, result), (True, dict(code=0, msg='ok')))
+        self.assertEqual(HookHandler.request_count, 3)
+        self.assertIs(http_service_ins.get_session(self.url), http_service_ins.get_session(self.url + '?b=1'))
+
+        HookHandler.request_count = 0
+        HookHandler.fail_count = 5
+        flag, result = http_service_ins.post_json(self.url, {}, dict(a=1), timeout=5, retry_count=1, retry_backoff=0)
+        self.assertEqual((flag, result), (False, 'status code: 500'))
+        self.assertEqual(HookHandler.request_count, 2)
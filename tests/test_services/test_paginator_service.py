@@ -0,0 +1,49 @@
+import datetime
+
+from apps.ticket.models import TicketRecord
+from service.common.paginator_service import paginator_service_ins
+from tests.base import LoonflowTest
+
+
+class TestPaginatorService(LoonflowTest):
+    def setUp(self):
+        gmt_created = datetime.datetime(2020, 1, 1, 10, 0, 0)
+        for index in range(5):
+            ticket_obj = TicketRecord.objects.create(title='ticket', workflow_id=1, sn='loonflow_{}'.format(index),
+                                                     state_id=1, creator='admin')
+            # 前三个工单创建时间相同, 按id区分先后
+            TicketRecord.objects.filter(id=ticket_obj.id).update(
+                gmt_created=gmt_created + datetime.timedelta(seconds=max(index - 2, 0)))
+        self.ticket_id_list = list(TicketRecord.objects.order_by('-gmt_created', '-id').values_list('id', flat=True))
+
+    def test_cursor_paginate(self):
+        """
+        游标分页逐页读取与按创建时间、id排序的结果一致
+        :return:
+        """
+        queryset = TicketRecord.objects.filter(is_deleted=0)
+        cursor, ticket_id_list = '', []
+        while True:
+            flag, result = paginator_service_ins.paginate(queryset, 2, cursor=cursor)
+            self.assertTrue(flag)
+            ticket_id_list.extend([ticket_obj.id for ticket_obj in result['object_list']])
+            if not result['paginator_info']['has_next']:
+                break
+            cursor = result['paginator_info']['next_cursor']
+        self.assertEqual(ticket_id_list, self.ticket_id_list)
+        self.assertIsNone(result['paginator_info']['total'])
+
+        flag, result = paginator_service_ins.paginate(queryset, 2, cursor='', with_total=1, reverse=0)
+        self.assertEqual([ticket_obj.id for ticket_obj in result['object_list']], self.ticket_id_list[::-1][:2])
+        self.assertEqual(result['paginator_info']['total'], 5)
+        self.assertEqual(paginator_service_ins.paginate(queryset, 2, cursor='invalid'), (False, 'cursor is invalid'))
+
+    def test_page_paginate(self):
+        """
+        未提供游标时按页码分页
+        :return:
+        """
+        queryset = TicketRecord.objects.order_by('-gmt_created', '-id')
+        flag, result = paginator_service_ins.paginate(queryset, 2, page=3)
+        self.assertEqual([ticket_obj.id for ticket_obj in result['object_list']], self.ticket_id_list[4:])
+        self.assertEqual(result['paginator_info'], dict(per_page=2, page=3, total=5))
@@ -0,0 +1,394 @@
+import datetime
+from unittest import mock
+
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from apps.ticket.models import TicketCustomField, TicketFlowLog, TicketRecord
+from apps.workflow.models import State, Transition, Workflow
+from service.account.account_base_service import account_base_service_ins
+from service.common.constant_service import constant_service_ins
+from service.ticket.ticket_base_service import ticket_base_service_ins
+from service.ticket.ticket_inbox_service import ticket_inbox_service_ins
+from service.ticket.ticket_unit_of_work_service import ticket_unit_of_work_service_ins
+from service.workflow.workflow_compile_service import CompiledWorkflow, workflow_compile_service_ins
+from service.workflow.workflow_custom_field_service import workflow_custom_field_service_ins
+from tests.base import LoonflowTest
+
+
+class TestTicketBaseService(LoonflowTest):
+    def setUp(self):
+        self.workflow_obj = Workflow.objects.create(name='请假申请', description='请假申请', creator='admin')
+        self.state_obj = State.objects.create(name='发起人-编辑中', creator='admin', label='{}')
+        for index in range(30):
+            TicketRecord.objects.create(
+                title='ticket_{}'.format(index), workflow_id=self.workflow_obj.id, sn='loonflow_{}'.format(index),
+                state_id=self.state_obj.id, participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL,
+                participant='lilei', creator='admin')
+
+    def patch_handle_workflow(self):
+        """
+        工单在两个状态间来回流转的工作流, title可选填
+        :return: [去审批, 退回]
+        """
+        self.state_obj.participant_type_id = constant_service_ins.PARTICIPANT_TYPE_PERSONAL
+        self.state_obj.participant = 'lilei'
+        self.state_obj.save()
+        approve_state_obj = State.objects.create(name='审批中', participant='lilei', creator='admin',
+                                                 participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL)
+        transition_list = [
+            Transition.objects.create(name='提交', workflow_id=self.workflow_obj.id, creator='admin',
+                                      source_state_id=self.state_obj.id, destination_state_id=approve_state_obj.id),
+            Transition.objects.create(name='退回', workflow_id=self.workflow_obj.id, creator='admin',
+                                      source_state_id=approve_state_obj.id, destination_state_id=self.state_obj.id)]
+        state_list = [self.state_obj, approve_state_obj]
+        for state_obj in state_list:
+            state_obj.state_field_str = '{"title": 3}'
+        compiled_workflow = CompiledWorkflow(self.workflow_obj, state_list, transition_list, {})
+        for patcher in (mock.patch.object(workflow_compile_service_ins, 'get_compiled_workflow',
+                                          return_value=(True, compiled_workflow)),
+                        mock.patch.object(workflow_custom_field_service_ins, 'get_workflow_custom_field',
+                                          return_value=(True, {}))):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return transition_list
+
+    def get_ticket_list_query_count(self, per_page):
+        with CaptureQueriesContext(connection) as query_context:
+            flag, result = ticket_base_service_ins.get_ticket_list(
+                username='admin', category='all', per_page=per_page, page=1, app_name='loonflow',
+                act_state_id='', from_admin='')
+        self.assertTrue(flag)
+        self.assertEqual(len(result.get('ticket_result_restful_list')), per_page)
+        return len(query_context.captured_queries)
+
+    def test_get_ticket_list_query_count(self):
+        """
+        工单列表的查询次数不随每页条数增长
+        :return:
+        """
+        # 先加载进程内缓存(调用方有权限的工作流等)
+        self.get_ticket_list_query_count(5)
+        self.assertEqual(self.get_ticket_list_query_count(5), self.get_ticket_list_query_count(20))
+
+    def test_format_ticket_list(self):
+        """
+        批量格式化工单列表保持原有的返回结构
+        :return:
+        """
+        ticket_obj_list = list(TicketRecord.objects.filter(workflow_id=self.workflow_obj.id)[:3])
+        flag, result = ticket_base_service_ins.format_ticket_list(ticket_obj_list)
+        self.assertTrue(flag)
+        self.assertEqual(result[0]['state']['state_name'], self.state_obj.name)
+        self.assertEqual(result[0]['workflow_info']['workflow_name'], self.workflow_obj.name)
+        self.assertEqual(result[0]['participant_info']['participant'], 'lilei')
+        self.assertEqual(result[0]['creator_info']['username'], 'admin')
+
+    def get_ticket_flow_log_query_count(self, ticket_id, per_page):
+        with CaptureQueriesContext(connection) as query_context:
+            flag, result = ticket_base_service_ins.get_ticket_flow_log(ticket_id, 'admin', per_page, 1)
+        self.assertTrue(flag)
+        self.assertEqual(len(result.get('ticket_flow_log_restful_list')), per_page)
+        return len(query_context.captured_queries), result.get('ticket_flow_log_restful_list')
+
+    def test_get_ticket_flow_log(self):
+        """
+        流转记录的状态、流转、处理人批量查询, 查询次数不随每页条数增长
+        :return:
+        """
+        ticket_obj = TicketRecord.objects.filter(workflow_id=self.workflow_obj.id).first()
+        transition_obj = Transition.objects.create(name='提交', workflow_id=self.workflow_obj.id,
+                                                   source_state_id=self.state_obj.id, destination_state_id=0,
+                                                   creator='admin')
+        for index in range(20):
+            TicketFlowLog.objects.create(
+                ticket_id=ticket_obj.id, transition_id=transition_obj.id if index % 2 else 0,
+                intervene_type_id=0 if index % 2 else constant_service_ins.TRANSITION_INTERVENE_TYPE_COMMENT,
+                participant_type_id=constant_service_ins.PARTICIPANT_TYPE_PERSONAL, participant='lilei',
+                state_id=self.state_obj.id, creator='lilei')
+        query_count, flow_log_list = self.get_ticket_flow_log_query_count(ticket_obj.id, 5)
+        self.assertEqual(query_count, self.get_ticket_flow_log_query_count(ticket_obj.id, 20)[0])
+        self.assertEqual(flow_log_list[0]['state']['state_name'], self.state_obj.name)
+        self.assertEqual(flow_log_list[0]['transition']['transition_name'], '提交')
+        self.assertEqual(flow_log_list[1]['transition']['transition_name'], '新增评论')
+        self.assertEqual(flow_log_list[0]['participant_info']['participant'], 'lilei')
+
+    @override_settings(TICKET_FLOW_LOG_DATA_MODE='delta', TICKET_FLOW_LOG_CHECKPOINT_INTERVAL=10)
+    def test_handle_ticket_flow_log_delta(self):
+        """
+        差异模式下处理工单的流转记录保存为差异, 读取时还原完整的工单数据
+        :return:
+        """
+        transition_list = self.patch_handle_workflow()
+        ticket_obj = TicketRecord.objects.filter(workflow_id=self.workflow_obj.id).first()
+        for index, title in enumerate(['first', 'second', 'third']):
+            flag, result = ticket_base_service_ins.handle_ticket(
+                ticket_obj.id, dict(transition_id=transition_list[index % 2].id, username='lilei', title=title))
+            self.assertTrue(flag, result)
+        ticket_data_list = list(TicketFlowLog.objects.filter(ticket_id=ticket_obj.id).order_by('id').values_list(
+            'ticket_data', flat=True))
+        self.assertEqual([ticket_data.startswith('D:') for ticket_data in ticket_data_list], [False, True, True])
+
+        flag, result = ticket_base_service_ins.get_ticket_flow_log(ticket_obj.id, 'lilei', ticket_data=1)
+        self.assertTrue(flag, result)
+        self.assertEqual([flow_log['ticket_data']['title'] for flow_log in result['ticket_flow_log_restful_list']],
+                         ['third', 'second', 'first'])
+
+    def test_get_tickets_all_field_value(self):
+        """
+        批量获取工单字段的值: 按字段类型取值, 日期转换为字符串, 未赋值的字段为None, 忽略已删除的记录, 与逐个获取的结果一致
+        :return:
+        """
+        field_type_dict = dict(days=constant_service_ins.FIELD_TYPE_INT, reason=constant_service_ins.FIELD_TYPE_TEXT,
+                               start_date=constant_service_ins.FIELD_TYPE_DATE,
+                               start_time=constant_service_ins.FIELD_TYPE_DATETIME,
+                               urgent=constant_service_ins.FIELD_TYPE_BOOL, remark=constant_service_ins.FIELD_TYPE_STR)
+        format_custom_field_dict = {field_key: dict(field_type_id=field_type_id, field_name=field_key)
+                                    for field_key, field_type_id in field_type_dict.items()}
+        ticket_obj_list = list(TicketRecord.objects.filter(workflow_id=self.workflow_obj.id).order_by('id')[:2])
+        value_list = [
+            dict(days=3, reason='家中有事', start_date=datetime.date(2026, 10, 1),
+                 start_time=datetime.datetime(2026, 10, 1, 9, 30), urgent=True),
+            dict(days=5, start_date=datetime.date(2026, 10, 8)),
+        ]
+        value_enum = constant_service_ins.FIELD_VALUE_ENUM
+        for ticket_obj, value_dict in zip(ticket_obj_list, value_list):
+            for field_key, value in value_dict.items():
+                field_type_id = field_type_dict[field_key]
+                TicketCustomField.objects.create(name=field_key, field_key=field_key, ticket_id=ticket_obj.id,
+                                                 field_type_id=field_type_id, creator='admin',
+                                                 **{value_enum[field_type_id]: value})
+        # 已删除的记录
+        TicketCustomField.objects.create(name='remark', field_key='remark', ticket_id=ticket_obj_list[1].id,
+                                         field_type_id=constant_service_ins.FIELD_TYPE_STR, char_value='deleted',
+                                         is_deleted=True, creator='admin')
+
+        ticket_id_list = [ticket_obj.id for ticket_obj in ticket_obj_list]
+        with mock.patch.object(workflow_custom_field_service_ins, 'get_workflow_custom_field',
+                               return_value=(True, format_custom_field_dict)):
+            with CaptureQueriesContext(connection) as query_context:
+                flag, field_value_dict = ticket_base_service_ins.get_tickets_all_field_value(ticket_id_list)
+            self.assertTrue(flag, field_value_dict)
+            self.assertEqual(len(query_context.captured_queries), 2)
+            self.assertEqual(field_value_dict, {ticket_id: ticket_base_service_ins.get_ticket_all_field_value(
+                ticket_id)[1] for ticket_id in ticket_id_list})
+
+        first_value_dict = field_value_dict[ticket_id_list[0]]
+        self.assertEqual(first_value_dict['title'], ticket_obj_list[0].title)
+        self.assertEqual({field_key: first_value_dict[field_key] for field_key in field_type_dict},
+                         dict(days=3, reason='家中有事', start_date='2026-10-01', start_time='2026-10-01 09:30:00',
+                              urgent=True, remark=None))
+        second_value_dict = field_value_dict[ticket_id_list[1]]
+        self.assertEqual({field_key: second_value_dict[field_key] for field_key in field_type_dict},
+                         dict(days=5, reason=None, start_date='2026-10-08', start_time=None, urgent=None,
+                              remark=None))
+
+    def test_ticket_unit_of_work(self):
+        """
+        工作单元中工单只加载一次，修改在退出时统一写入，异常时丢弃
+        :return:
+        """
+        ticket_obj = TicketRecord.objects.filter(workflow_id=self.workflow_obj.id).first()
+        with ticket_unit_of_work_service_ins.begin(ticket_obj.id) as unit_of_work:
+            with CaptureQueriesContext(connection) as query_context:
+                flag, result = ticket_base_service_ins.get_ticket_by_id(ticket_obj.id)
+                ticket_base_service_ins.update_ticket_field_value(ticket_obj.id, dict(title='new title'))
+            self.assertIs(result, unit_of_work.ticket_obj)
+            self.assertEqual(len(query_context.captured_queries), 0)
+            self.assertEqual(TicketRecord.objects.get(id=ticket_obj.id).title, ticket_obj.title)
+        self.assertEqual(TicketRecord.objects.get(id=ticket_obj.id).title, 'new title')
+        self.assertIsNone(ticket_unit_of_work_service_ins.get_current(ticket_obj.id))
+
+        with self.assertRaises(ValueError):
+            with ticket_unit_of_work_service_ins.begin(ticket_obj.id):
+                ticket_base_service_ins.update_ticket_field_value(ticket_obj.id, dict(title='dropped title'))
+                raise ValueError
+        self.assertEqual(TicketRecord.objects.get(id=ticket_obj.id).title, 'new title')
+
+    def test_unit_of_work_rollback_on_failure(self):
+        """
+        工作单元提前返回失败时仍会写入修改, 在run_in_transaction中返回False时回滚
+        :return:
+        """
+        ticket_obj = TicketRecord.objects.filter(workflow_id=self.workflow_obj.id).first()
+
+        def handle_failed():
+            with ticket_unit_of_work_service_ins.begin(ticket_obj.id, lock=True):
+                ticket_base_service_ins.update_ticket_field_value(ticket_obj.id, dict(title='failed title'))
+                TicketRecord.objects.create(title='half created', workflow_id=self.workflow_obj.id, sn='failed_sn',
+                                            state_id=self.state_obj.id, creator='admin')
+                return False, 'failed'
+
+        self.assertEqual(ticket_base_service_ins.run_in_transaction(handle_failed), (False, 'failed'))
+        self.assertEqual(TicketRecord.objects.get(id=ticket_obj.id).title, ticket_obj.title)
+        self.assertFalse(TicketRecord.objects.filter(sn='failed_sn').exists())
+
+    @override_settings(TICKET_SN_STORE='db')
+    def test_new_ticket_batch(self):
+        """
+        批量新建工单: 任一工单校验失败时全部不创建, 返回的工单id与请求顺序一致
+        :return:
+        """
+        start_state_obj = State.objects.create(name='发起人-新建', type_id=constant_service_ins.STATE_TYPE_START,
+                                               creator='admin')
+        approve_state_obj = State.objects.create(name='审批中', participant='lilei', creator='admin')
+        end_state_obj = State.objects.create(name='结束', type_id=constant_service_ins.STATE_TYPE_END, creator='admin')
+        transition_list = [
+            Transition.objects.create(name='提交', workflow_id=self.workflow_obj.id, creator='admin',
+                                      source_state_id=start_state_obj.id, destination_state_id=approve_state_obj.id),
+            Transition.objects.create(name='直接结束', workflow_id=self.workflow_obj.id, creator='admin',
+                                      source_state_id=start_state_obj.id, destination_state_id=end_state_obj.id)]
+        state_list = [start_state_obj, approve_state_obj, end_state_obj]
+        for state_obj in state_list:
+            state_obj.state_field_str = '{}'
+        compiled_workflow = CompiledWorkflow(self.workflow_obj, state_list, transition_list, {})
+        with mock.patch.object(workflow_compile_service_ins, 'get_compiled_workflow',
+                               return_value=(True, compiled_workflow)), \
+                mock.patch.object(workflow_custom_field_service_ins, 'get_workflow_custom_field',
+                                  return_value=(True, {})):
+            flag, result = ticket_base_service_ins.new_ticket_batch(
+                self.workflow_obj.id, [dict(title='batch_0', transition_id=transition_list[0].id),
+                                       dict(title='batch_1', transition_id=0)], 'admin')
+            self.assertFalse(flag)
+            self.assertIn('ticket_list[1]', result)
+            self.assertFalse(TicketRecord.objects.filter(title__startswith='batch_').exists())
+
+            ticket_data_list = [dict(title='batch_{}'.format(index), transition_id=transition_list[index % 2].id)
+                                for index in range(5)]
+            flag, result = ticket_base_service_ins.new_ticket_batch(self.workflow_obj.id, ticket_data_list, 'admin')
+        self.assertTrue(flag, result)
+        ticket_obj_dict = TicketRecord.objects.in_bulk(result['new_ticket_id_list'])
+        ticket_obj_list = [ticket_obj_dict[ticket_id] for ticket_id in result['new_ticket_id_list']]
+        self.assertEqual([ticket_obj.title for ticket_obj in ticket_obj_list],
+                         ['batch_{}'.format(index) for index in range(5)])
+        self.assertEqual([ticket_obj.act_state_id for ticket_obj in ticket_obj_list[:2]],
+                         [constant_service_ins.TICKET_ACT_STATE_ONGOING, constant_service_ins.TICKET_ACT_STATE_FINISH])
+        self.assertEqual(TicketFlowLog.objects.filter(ticket_id__in=result['new_ticket_id_list']).count(), 5)
+
+    def test_handle_ticket_batch_result(self):
+        """
+        批量处理返回每个工单的结果，不存在或重复的工单单独返回失败
+        :return:
+        """
+        flag, result = ticket_base_service_ins.handle_ticket_batch(
+            [dict(ticket_id=0, transition_id=1), dict(ticket_id=-1, transition_id=1)], 'lilei')
+        self.assertTrue(flag)
+        self.assertEqual([ticket_result['ticket_id'] for ticket_result in result], [0, -1])
+        self.assertFalse(any([ticket_result['result'] for ticket_result in result]))
+
+    def test_handle_ticket_batch_base_field(self):
+        """
+        批量处理时写入状态允许修改的基础字段, 与逐个处理的结果一致
+        :return:
+        """
+        transition_list = self.patch_handle_workflow()
+        ticket_obj_list = list(TicketRecord.objects.filter(workflow_id=self.workflow_obj.id).order_by('id')[:3])
+        with mock.patch.object(ticket_base_service_ins, 'handle_ticket') as handle_ticket:
+            flag, result = ticket_base_service_ins.handle_ticket_batch(
+                [dict(ticket_id=ticket_obj.id, transition_id=transition_list[0].id,
+                      fields=dict(title='batch_{}'.format(index)))
+                 for index, ticket_obj in enumerate(ticket_obj_list[:2])] +
+                [dict(ticket_id=ticket_obj_list[2].id, transition_id=transition_list[0].id)], 'lilei')
+        self.assertTrue(flag, result)
+        handle_ticket.assert_not_called()
+        self.assertTrue(all(ticket_result['result'] for ticket_result in result), result)
+        ticket_obj_dict = TicketRecord.objects.in_bulk([ticket_obj.id for ticket_obj in ticket_obj_list])
+        self.assertEqual([ticket_obj_dict[ticket_obj.id].title for ticket_obj in ticket_obj_list],
+                         ['batch_0', 'batch_1', ticket_obj_list[2].title])
+        self.assertEqual(set(ticket_obj.state_id for ticket_obj in ticket_obj_dict.values()),
+                         {transition_list[0].destination_state_id})
+        flow_log = TicketFlowLog.objects.get(ticket_id=ticket_obj_list[0].id)
+        self.assertIn('"title": "batch_0"', flow_log.ticket_data)
+
+    def test_handle_ticket_batch_app_permission(self):
+        """
+        调用方对工单无权限时只有该工单失败
+        :return:
+        """
+        ticket_obj_list = list(TicketRecord.objects.filter(workflow_id=self.workflow_obj.id)[:2])
+        other_workflow_obj = Workflow.objects.create(name='other', app_name='batch_app', creator='admin')
+        account_base_service_ins.add_token_record('batch_app', 'batch', 'admin')
+        ticket_obj_list[1].workflow_id = other_workflow_obj.id
+        ticket_obj_list[1].save()
+        with mock.patch.object(workflow_custom_field_service_ins, 'get_workflow_custom_field',
+                               return_value=(True, {})):
+            flag, result = ticket_base_service_ins.handle_ticket_batch(
+                [dict(ticket_id=ticket_obj.id, transition_id=1) for ticket_obj in ticket_obj_list] +
+                [dict(ticket_id=0, transition_id=1)], 'lilei', 'batch_app')
+        self.assertTrue(flag, result)
+        self.assertEqual(result[0]['msg'], 'the app has no permission to the workflow_id')
+        # 有权限的工单继续处理
+        self.assertNotEqual(result[1]['msg'], 'the app has no permission to the workflow_id')
+        self.assertEqual(result[2]['msg'], '工单不存在或已被删除, 或在本次请求中重复出现')
+
+    def test_update_ticket_state_version(self):
+        """
+        基于旧的工单对象更新时原子递增状态版本号, 不覆盖其他字段
+        :return:
+        """
+        ticket_obj = TicketRecord.objects.get(sn='loonflow_0')
+        TicketRecord.objects.filter(id=ticket_obj.id).update(title='changed', state_version=3)
+        ticket_base_service_ins.update_ticket_state_version(ticket_obj, participant='hanmeimei')
+        self.assertEqual(ticket_obj.state_version, 4)
+        ticket_obj = TicketRecord.objects.get(id=ticket_obj.id)
+        self.assertEqual((ticket_obj.title, ticket_obj.participant, ticket_obj.state_version),
+                         ('changed', 'hanmeimei', 4))
+
+    def test_update_ticket_field_value_inbox_dirty(self):
+        """
+        不在工作单元中更新基础字段时标记待办收件箱需要刷新
+        :return:
+        """
+        ticket_obj = TicketRecord.objects.get(sn='loonflow_0')
+        with mock.patch.object(workflow_custom_field_service_ins, 'get_workflow_custom_field',
+                               return_value=(True, {})), \
+                mock.patch.object(ticket_inbox_service_ins, 'mark_ticket_inbox_dirty') as mark_dirty:
+            flag, result = ticket_base_service_ins.update_ticket_field_value(ticket_obj.id, dict(title='changed'))
+        self.assertTrue(flag, result)
+        mark_dirty.assert_called_once_with(ticket_obj.id)
+        self.assertEqual(TicketRecord.objects.get(id=ticket_obj.id).title, 'changed')
+
+
+class TestTicketBaseServiceTransaction(TransactionTestCase):
+    def test_run_in_transaction_retry(self):
+        """
+        死锁、锁等待超时时重试, 其他数据库错误不重试
+        :return:
+        """
+        call_list = []
+
+        def handle_conflicted():
+            call_list.append(1)
+            if len(call_list) == 1:
+                raise OperationalError(1213, 'Deadlock found when trying to get lock')
+            return True, ''
+
+        self.assertEqual(ticket_base_service_ins.run_in_transaction(handle_conflicted), (True, ''))
+        self.assertEqual(len(call_list), 2)
+
+        def handle_disconnected():
+            call_list.append(1)
+            raise OperationalError(2006, 'MySQL server has gone away')
+
+        call_list.clear()
+        with self.assertRaises(OperationalError):
+            ticket_base_service_ins.run_in_transaction(handle_disconnected)
+        self.assertEqual(len(call_list), 1)
+
+    def test_apply_async_on_commit(self):
+        """
+        事务提交后才投递任务, 回滚时不投递
+        :return:
+        """
+        task = mock.Mock()
+
+        def handle(flag):
+            ticket_base_service_ins.apply_async_on_commit(task, args=[1], queue='loonflow')
+            self.assertFalse(task.apply_async.called)
+            return flag, ''
+
+        ticket_base_service_ins.run_in_transaction(handle, False)
+        self.assertFalse(task.apply_async.called)
+        ticket_base_service_ins.run_in_transaction(handle, True)
+        task.apply_async.assert_called_once_with(args=[1], queue='loonflow')
@@ -0,0 +1,85 @@
+import json
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+from apps.ticket.models import TicketFlowLog
+from service.ticket.ticket_flow_log_data_service import ticket_flow_log_data_service_ins
+from tests.base import LoonflowTest
+
+
+class TestTicketFlowLogDataService(LoonflowTest):
+    def add_flow_log(self, ticket_data_dict, ticket_data=None):
+        if ticket_data is None:
+            ticket_data = ticket_flow_log_data_service_ins.encode_ticket_data(1, json.dumps(ticket_data_dict))
+        return TicketFlowLog.objects.create(ticket_id=1, transition_id=1, participant_type_id=1, participant='admin',
+                                            state_id=1, ticket_data=ticket_data)
+
+    @override_settings(TICKET_FLOW_LOG_DATA_MODE='delta', TICKET_FLOW_LOG_CHECKPOINT_INTERVAL=3,
+                       TICKET_FLOW_LOG_DATA_COMPRESS=True)
+    def test_delta_ticket_data(self):
+        """
+        差异保存, 每3条保存一次完整数据, 还原后与原数据一致
+        :return:
+        """
+        data_list = [dict(title='ticket', content='x' * 2000, days=index, **({'reason': 'r'} if index % 2 else {}))
+                     for index in range(7)]
+        flow_log_list = [self.add_flow_log(data) for data in data_list]
+        is_delta_list = [ticket_flow_log_data_service_ins.load(flow_log.ticket_data)[0] for flow_log in flow_log_list]
+        self.assertEqual(is_delta_list, [False, True, True, False, True, True, False])
+        self.assertLess(len(flow_log_list[1].ticket_data), 200)
+
+        ticket_data_dict = ticket_flow_log_data_service_ins.get_ticket_data_dict(flow_log_list[::-1][:2])
+        self.assertEqual(ticket_data_dict, {flow_log_list[6].id: data_list[6], flow_log_list[5].id: data_list[5]})
+        ticket_data_dict = ticket_flow_log_data_service_ins.get_ticket_data_dict([flow_log_list[5]])
+        self.assertEqual(ticket_data_dict, {flow_log_list[5].id: data_list[5]})
+
+    def test_convert_ticket_flow_log(self):
+        """
+        历史的完整数据转换为差异保存, 还原结果不变
+        :return:
+        """
+        data_list = [dict(title='ticket', days=index) for index in range(4)]
+        flow_log_list = [self.add_flow_log(data, json.dumps(data)) for data in data_list]
+        with self.settings(TICKET_FLOW_LOG_DATA_MODE='delta', TICKET_FLOW_LOG_CHECKPOINT_INTERVAL=10):
+            flag, result = ticket_flow_log_data_service_ins.convert_ticket_flow_log(1)
+        self.assertEqual((flag, result), (True, dict(update_count=3)))
+        flow_log_list = list(TicketFlowLog.objects.filter(id__in=[flow_log.id for flow_log in flow_log_list]))
+        self.assertEqual(ticket_flow_log_data_service_ins.get_ticket_data_dict(flow_log_list),
+                         {flow_log.id: data for flow_log, data in zip(flow_log_list, data_list)})
+
+    @override_settings(TICKET_FLOW_LOG_DATA_MODE='delta', TICKET_FLOW_LOG_CHECKPOINT_INTERVAL=10)
+    def test_legacy_double_encoded(self):
+        """
+        兼容重复json编码的历史数据: 读取、以其为基准保存差异及转换
+        :return:
+        """
+        data_list = [dict(title='ticket', days=index) for index in range(3)]
+        flow_log_list = [self.add_flow_log(data, json.dumps(json.dumps(data))) for data in data_list[:2]]
+        flow_log_list.append(self.add_flow_log(data_list[2], ticket_flow_log_data_service_ins.encode_ticket_data(
+            1, json.dumps(json.dumps(data_list[2])))))
+        self.assertTrue(ticket_flow_log_data_service_ins.load(flow_log_list[2].ticket_data)[0])
+        self.assertEqual(ticket_flow_log_data_service_ins.get_ticket_data_dict(flow_log_list),
+                         {flow_log.id: data for flow_log, data in zip(flow_log_list, data_list)})
+        flag, result = ticket_flow_log_data_service_ins.convert_ticket_flow_log(1)
+        self.assertTrue(flag, result)
+        flow_log_list = list(TicketFlowLog.objects.filter(id__in=[flow_log.id for flow_log in flow_log_list]))
+        self.assertEqual(ticket_flow_log_data_service_ins.get_ticket_data_dict(flow_log_list),
+                         {flow_log.id: data for flow_log, data in zip(flow_log_list, data_list)})
+
+    @override_settings(TICKET_FLOW_LOG_DATA_MODE='delta', TICKET_FLOW_LOG_CHECKPOINT_INTERVAL=10)
+    def test_encode_query_count(self):
+        """
+        保存差异时复用已加载的最近记录还原基准数据, 不再逐级查询
+        :return:
+        """
+        data_list = [dict(title='ticket', days=index) for index in range(12)]
+        for data in data_list[:11]:
+            self.add_flow_log(data)
+        with CaptureQueriesContext(connection) as query_context:
+            ticket_data = ticket_flow_log_data_service_ins.encode_ticket_data(1, json.dumps(data_list[11]))
+        self.assertEqual(len(query_context.captured_queries), 1)
+        flow_log = self.add_flow_log(data_list[11], ticket_data)
+        self.assertEqual(ticket_flow_log_data_service_ins.get_ticket_data_dict([flow_log]),
+                         {flow_log.id: data_list[11]})
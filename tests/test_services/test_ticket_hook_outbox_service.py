@@ -0,0 +1,80 @@
+import datetime
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from django.test import override_settings
+
+from apps.ticket.models import TicketHookOutbox
+from service.ticket.ticket_hook_outbox_service import ticket_hook_outbox_service_ins
+from tests.base import LoonflowTest
+
+
+class HookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request_data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        if self.path == '/error':
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = json.dumps(dict(code=0, msg=request_data.get('title'))).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestTicketHookOutboxService(LoonflowTest):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), HookHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_post_hook_dict(self):
+        """
+        并发发送hook, 连接失败及5xx响应可重试
+        :return:
+        """
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        closed_url = 'http://127.0.0.1:{}/hook'.format(sock.getsockname()[1])
+        sock.close()
+        hook_request_dict = {
+            1: dict(hook_url=self.base_url + '/hook', headers={},
+                    data=dict(title='t1', gmt_created=datetime.date.today())),
+            2: dict(hook_url=self.base_url + '/error', headers={}, data={}),
+            3: dict(hook_url=closed_url, headers={}, data={}),
+        }
+        delivery_dict = ticket_hook_outbox_service_ins.post_hook_dict(hook_request_dict)
+        self.assertEqual(delivery_dict[1]['result'], dict(code=0, msg='t1'))
+        self.assertFalse(delivery_dict[1]['retry'])
+        self.assertEqual(delivery_dict[2]['result']['msg'], 'status code: 500')
+        self.assertTrue(delivery_dict[2]['retry'])
+        self.assertTrue(delivery_dict[3]['retry'])
+
+    @override_settings(HOOK_RETRY_COUNT=3, HOOK_RETRY_BACKOFF=10)
+    def test_retry_backoff(self):
+        """
+        可重试的失败按指数退避设置下次发送时间，未到期前不会被领取
+        :return:
+        """
+        outbox_obj = TicketHookOutbox.objects.create(ticket_id=1, state_id=1, next_retry_time=datetime.datetime.now())
+        outbox_obj.attempt_count = 1
+        start_time = datetime.datetime.now()
+        ticket_hook_outbox_service_ins.save_delivery(
+            outbox_obj, {}, dict(result=dict(code=-1, msg='timeout'), retry=True, latency=10))
+        outbox_obj.refresh_from_db()
+        self.assertEqual(outbox_obj.status, ticket_hook_outbox_service_ins.STATUS_PENDING)
+        self.assertEqual(outbox_obj.attempt_count, 2)
+        self.assertGreaterEqual(outbox_obj.next_retry_time, start_time + datetime.timedelta(seconds=20))
+        flag, result = ticket_hook_outbox_service_ins.send_hook_outbox([outbox_obj.id])
+        self.assertEqual((flag, result), (True, dict(outbox_count=0)))
@@ -0,0 +1,40 @@
+from django.test import override_settings
+
+from apps.ticket.models import TicketInbox, TicketRecord, TicketUser
+from service.ticket.ticket_inbox_service import ticket_inbox_service_ins
+from tests.base import LoonflowTest
+
+
+@override_settings(TICKET_INBOX_ENABLED=True)
+class TestTicketInboxService(LoonflowTest):
+    def add_ticket(self, sn, act_state_id=1):
+        ticket_obj = TicketRecord.objects.create(title=sn, workflow_id=1, sn=sn, state_id=2, creator='admin',
+                                                 act_state_id=act_state_id)
+        TicketUser.objects.create(ticket_id=ticket_obj.id, username='lilei', in_process=True)
+        TicketUser.objects.create(ticket_id=ticket_obj.id, username='admin', worked=True)
+        return ticket_obj
+
+    def get_ticket_id_list(self, username, category, filter_dict=None):
+        flag, result = ticket_inbox_service_ins.get_ticket_inbox_id_queryset(username, category, filter_dict or {})
+        self.assertTrue(flag)
+        return [inbox_dict['ticket_id'] for inbox_dict in result]
+
+    def test_sync_tickets_inbox(self):
+        """
+        按TicketUser重建读模型, 待办不包括已完成的工单
+        :return:
+        """
+        ticket_obj = self.add_ticket('loonflow_inbox_1')
+        finished_ticket_obj = self.add_ticket('loonflow_inbox_2', act_state_id=4)
+        ticket_inbox_service_ins.sync_tickets_inbox([ticket_obj.id, finished_ticket_obj.id])
+        self.assertEqual(self.get_ticket_id_list('lilei', 'duty'), [ticket_obj.id])
+        self.assertEqual(self.get_ticket_id_list('lilei', 'relation'), [finished_ticket_obj.id, ticket_obj.id])
+        self.assertEqual(self.get_ticket_id_list('admin', 'worked', dict(id__in=[ticket_obj.id])), [ticket_obj.id])
+
+        TicketUser.objects.filter(ticket_id=ticket_obj.id, username='lilei').update(in_process=False)
+        ticket_inbox_service_ins.mark_ticket_inbox_dirty(ticket_obj.id)
+        self.assertEqual(self.get_ticket_id_list('lilei', 'duty'), [])
+
+        flag, result = ticket_inbox_service_ins.rebuild_ticket_inbox(batch_size=1)
+        self.assertEqual((flag, result), (True, dict(ticket_count=2)))
+        self.assertEqual(TicketInbox.objects.count(), 7)
@@ -0,0 +1,75 @@
+from unittest import mock
+
+import redis
+from django.test import override_settings
+
+from service.ticket.ticket_notice_service import TicketNoticeService, ticket_notice_service_ins
+from tests.base import InMemoryRedis, LoonflowTest
+
+
+@override_settings(NOTICE_COALESCE_WINDOW=60, NOTICE_COALESCE_BATCH_SIZE=2)
+class TestTicketNoticeService(LoonflowTest):
+    def setUp(self):
+        self.redis_conn = InMemoryRedis()
+        patcher = mock.patch.object(TicketNoticeService, 'get_redis_conn', return_value=self.redis_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enqueue_keep_first_send_time(self):
+        """
+        窗口内同一工单再次通知时保持第一次的发送时间
+        :return:
+        """
+        with mock.patch('service.ticket.ticket_notice_service.time') as mock_time:
+            mock_time.time.return_value = 1000
+            ticket_notice_service_ins.enqueue_ticket_notice([1])
+            mock_time.time.return_value = 1030
+            ticket_notice_service_ins.enqueue_ticket_notice([1, 2])
+        self.assertEqual(self.redis_conn.zscore(TicketNoticeService.PENDING_KEY, 1), 1060)
+        self.assertEqual(self.redis_conn.zscore(TicketNoticeService.PENDING_KEY, 2), 1090)
+
+    def test_claim_exclusive(self):
+        """
+        两个flush任务同时取出到期工单时, 每个工单只归zrem成功的一方
+        :return:
+        """
+        self.redis_conn.zadd(TicketNoticeService.PENDING_KEY, {1: 0, 2: 0, 3: 0})
+        zrangebyscore = self.redis_conn.zrangebyscore
+        other_claim_dict = {}
+
+        def zrangebyscore_with_other_claimer(*args, **kwargs):
+            member_list = zrangebyscore(*args, **kwargs)
+            if 'claim_list' not in other_claim_dict:
+                # 另一个任务在当前任务zrem之前取出了部分相同的工单
+                other_claim_dict['claim_list'] = []
+                other_claim_dict['claim_list'] = TicketNoticeService.claim_due_ticket_id_list(self.redis_conn, 2)
+            return member_list
+
+        with mock.patch.object(self.redis_conn, 'zrangebyscore', side_effect=zrangebyscore_with_other_claimer):
+            claim_list = TicketNoticeService.claim_due_ticket_id_list(self.redis_conn, 3)
+        self.assertEqual(other_claim_dict['claim_list'], [1, 2])
+        self.assertEqual(claim_list, [3])
+
+    def test_flush_pending_notice(self):
+        """
+        只发送到期的工单通知, 按批次发送
+        :return:
+        """
+        self.redis_conn.zadd(TicketNoticeService.PENDING_KEY, {1: 0, 2: 0, 3: 0})
+        ticket_notice_service_ins.enqueue_ticket_notice([4])
+        with mock.patch.object(TicketNoticeService, 'send_tickets_notice', return_value=(True, {})) as send:
+            flag, result = ticket_notice_service_ins.flush_pending_notice()
+        self.assertEqual(result, dict(ticket_count=3))
+        self.assertEqual([call[0][0] for call in send.call_args_list], [[1, 2], [3]])
+        self.assertIsNotNone(self.redis_conn.zscore(TicketNoticeService.PENDING_KEY, 4))
+
+    def test_enqueue_redis_unavailable(self):
+        """
+        redis不可用时立即发送
+        :return:
+        """
+        with mock.patch.object(self.redis_conn, 'zadd', side_effect=redis.ConnectionError('connection refused')), \
+                mock.patch.object(TicketNoticeService, 'send_ticket_notice_async') as send_async:
+            flag, result = ticket_notice_service_ins.enqueue_ticket_notice([1, 2])
+        self.assertTrue(flag)
+        send_async.assert_called_once_with([1, 2])
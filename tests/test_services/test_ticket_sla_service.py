@@ -0,0 +1,64 @@
+import datetime
+
+from django.test import override_settings
+
+from apps.ticket.models import TicketRecord, TicketStateSla
+from apps.workflow.models import State
+from service.common.constant_service import constant_service_ins
+from service.common.working_day_service import working_day_service_ins
+from service.ticket.ticket_sla_service import ticket_sla_service_ins
+from tests.base import LoonflowTest
+
+
+@override_settings(TICKET_SLA_ENABLED=True, WORKING_DAY_HOLIDAYS=['2020-10-01'], WORKING_DAY_WORKDAYS=['2020-10-10'])
+class TestTicketSlaService(LoonflowTest):
+    def test_add_working_days(self):
+        """
+        工作日日历: 跳过周末及节假日, 调休的周末为工作日
+        :return:
+        """
+        # 2020-09-30为星期三
+        self.assertEqual(working_day_service_ins.add_working_days(datetime.datetime(2020, 9, 30, 10), 1),
+                         datetime.datetime(2020, 10, 2, 10))
+        self.assertEqual(working_day_service_ins.add_working_days(datetime.datetime(2020, 10, 9, 10), 1),
+                         datetime.datetime(2020, 10, 10, 10))
+        # 星期日从下一个工作日0点开始计算
+        self.assertEqual(working_day_service_ins.add_working_days(datetime.datetime(2020, 10, 4, 10), 1),
+                         datetime.datetime(2020, 10, 6, 0))
+
+    def test_enter_state(self):
+        """
+        进入状态时记录到期时间, 离开时记录停留时间, 结束状态不记录
+        :return:
+        """
+        state_obj = State.objects.create(name='审批中', creator='admin', label='{}', deadline=1)
+        next_state_obj = State.objects.create(name='执行中', creator='admin', label='{}', deadline=0)
+        end_state_obj = State.objects.create(name='结束', creator='admin', label='{}',
+                                             type_id=constant_service_ins.STATE_TYPE_END)
+        ticket_obj = TicketRecord.objects.create(title='sla', workflow_id=1, sn='loonflow_sla', state_id=state_obj.id,
+                                                 creator='admin')
+        ticket_sla_service_ins.enter_state([(ticket_obj, state_obj)])
+        sla_obj = TicketStateSla.objects.get(ticket_id=ticket_obj.id)
+        self.assertEqual(sla_obj.due_time, working_day_service_ins.add_working_days(sla_obj.enter_time, 1))
+        # 状态未变化
+        ticket_sla_service_ins.enter_state([(ticket_obj, state_obj)])
+        self.assertEqual(TicketStateSla.objects.filter(ticket_id=ticket_obj.id).count(), 1)
+
+        TicketStateSla.objects.filter(id=sla_obj.id).update(
+            enter_time=datetime.datetime.now() - datetime.timedelta(days=10),
+            due_time=datetime.datetime.now() - datetime.timedelta(days=9))
+        flag, result = ticket_sla_service_ins.get_ticket_sla_list([1], 'overdue')
+        self.assertEqual([sla['ticket_id'] for sla in result['sla_result_list']], [ticket_obj.id])
+
+        ticket_sla_service_ins.enter_state([(ticket_obj, next_state_obj)])
+        ticket_sla_service_ins.enter_state([(ticket_obj, end_state_obj)])
+        self.assertEqual(list(TicketStateSla.objects.filter(ticket_id=ticket_obj.id).order_by('id').values_list(
+            'state_id', 'status')), [(state_obj.id, 1), (next_state_obj.id, 1)])
+        # 未设置最后期限的状态没有到期时间
+        self.assertIsNone(TicketStateSla.objects.get(ticket_id=ticket_obj.id, state_id=next_state_obj.id).due_time)
+        flag, result = ticket_sla_service_ins.get_ticket_sla_list([1], 'overdue')
+        self.assertEqual(result['sla_result_list'], [])
+
+        flag, result = ticket_sla_service_ins.get_state_sla_statistics([1], state_obj.id)
+        self.assertEqual(result['left_count'], 1)
+        self.assertGreaterEqual(result['duration']['p50'], 10 * 86400)
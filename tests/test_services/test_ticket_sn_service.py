@@ -0,0 +1,93 @@
+import datetime
+from unittest import mock
+
+from django.test import override_settings
+
+from apps.ticket.models import TicketRecord, TicketSnSequence
+from service.ticket.ticket_sn_service import TicketSnService, ticket_sn_service_ins
+from tests.base import InMemoryRedis, LoonflowTest
+
+
+@override_settings(TICKET_SN_STORE='db', TICKET_SN_BLOCK_SIZE=10, DEPLOY_ZONE='')
+class TestTicketSnService(LoonflowTest):
+    def setUp(self):
+        ticket_sn_service_ins.block_dict.update(day='', next_value=1, last_value=0)
+
+    def test_get_sequence_list(self):
+        """
+        进程内按序号段分配，用完后租用下一段
+        :return:
+        """
+        flag, result = ticket_sn_service_ins.get_sequence_list(3)
+        self.assertTrue(flag)
+        self.assertEqual(result['sequence_list'], [1, 2, 3])
+        flag, result = ticket_sn_service_ins.get_sequence_list(12)
+        self.assertEqual(result['sequence_list'], list(range(4, 16)))
+        day = str(datetime.datetime.now())[:10]
+        self.assertEqual(TicketSnSequence.objects.get(name=day).value, 20)
+
+    def test_day_rollover(self):
+        """
+        跨天时丢弃前一天未用完的序号，从新的一天重新分配
+        :return:
+        """
+        ticket_sn_service_ins.get_sequence_list(1)
+        tomorrow = datetime.datetime.now() + datetime.timedelta(days=1)
+        with mock.patch('service.ticket.ticket_sn_service.datetime') as mock_datetime:
+            mock_datetime.datetime.now.return_value = tomorrow
+            mock_datetime.datetime.strptime = datetime.datetime.strptime
+            mock_datetime.timedelta = datetime.timedelta
+            flag, result = ticket_sn_service_ins.get_sequence_list(1)
+        self.assertEqual(result['day'], tomorrow.date())
+        self.assertEqual(result['sequence_list'], [1])
+
+
+@override_settings(TICKET_SN_STORE='redis', TICKET_SN_BLOCK_SIZE=10, DEPLOY_ZONE='')
+class TestTicketSnServiceRedis(LoonflowTest):
+    def setUp(self):
+        self.redis_conn = InMemoryRedis()
+        patcher = mock.patch.object(TicketSnService, 'get_redis_conn', return_value=self.redis_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        ticket_sn_service_ins.block_dict.update(day='', next_value=1, last_value=0)
+
+    def allocate(self, block_dict, count):
+        """
+        模拟持有序号段block_dict的进程分配序号并保存工单
+        """
+        ticket_sn_service_ins.block_dict.clear()
+        ticket_sn_service_ins.block_dict.update(block_dict)
+        flag, result = ticket_sn_service_ins.get_sequence_list(count)
+        block_dict.update(ticket_sn_service_ins.block_dict)
+        day = result['day']
+        for sequence in result['sequence_list']:
+            TicketRecord.objects.create(sn='loonflow_%04d%02d%02d%04d' % (day.year, day.month, day.day, sequence),
+                                        state_id=1, workflow_id=1, creator='admin')
+        return result['sequence_list']
+
+    def test_redis_key_lost(self):
+        """
+        redis中的序号丢失后从序列表恢复, 不会分配已分配或其他进程仍持有的序号
+        :return:
+        """
+        block_a, block_b = dict(day='', next_value=1, last_value=0), dict(day='', next_value=1, last_value=0)
+        sequence_list = self.allocate(block_a, 3)
+        sequence_list += self.allocate(block_b, 3)
+        self.assertEqual(sequence_list, [1, 2, 3, 11, 12, 13])
+        day = str(datetime.datetime.now())[:10]
+        self.assertEqual(TicketSnSequence.objects.get(name=day).value, 20)
+
+        # redis重启或淘汰
+        self.redis_conn.data.clear()
+        block_c = dict(day='', next_value=1, last_value=0)
+        sequence_list += self.allocate(block_c, 3)
+        sequence_list += self.allocate(block_a, 10)
+        sequence_list += self.allocate(block_b, 10)
+        self.assertEqual(len(sequence_list), len(set(sequence_list)))
+        self.assertEqual(TicketRecord.objects.count(), len(set(TicketRecord.objects.values_list('sn', flat=True))))
+
+        # 序列表记录也丢失时从当天的流水号恢复
+        self.redis_conn.data.clear()
+        TicketSnSequence.objects.all().delete()
+        block_d = dict(day='', next_value=1, last_value=0)
+        self.assertEqual(self.allocate(block_d, 1), [max(sequence_list) + 1])
@@ -0,0 +1,48 @@
+import datetime
+
+from django.test import override_settings
+
+from apps.ticket.models import TicketDailyStatistics, TicketRecord
+from service.ticket.ticket_statistics_service import ticket_statistics_service_ins
+from tests.base import LoonflowTest
+
+
+class TestTicketStatisticsService(LoonflowTest):
+    @override_settings(TICKET_STATISTICS_ENABLED=True)
+    def test_get_ticket_count_statistics(self):
+        """
+        按日期范围从汇总表统计, 增量更新汇总行
+        :return:
+        """
+        day = datetime.date(2020, 3, 1)
+        ticket_statistics_service_ins.apply_count_delta({(day, 1, 1, 2): 3, (day, 1, 4, 2): 1, (day, 2, 1, 3): 2})
+        # 一个工单从进行中变为已完成
+        ticket_statistics_service_ins.apply_count_delta({(day, 1, 1, 2): -1, (day, 1, 4, 2): 1})
+        ticket_statistics_service_ins.apply_count_delta({(day + datetime.timedelta(days=1), 1, 1, 2): 5})
+        self.assertEqual(TicketDailyStatistics.objects.get(day=day, workflow_id=1, act_state_id=4).ticket_count, 2)
+
+        flag, result = ticket_statistics_service_ins.get_ticket_count_statistics(
+            [1, 2], '2020-03-01', '2020-03-01', ['workflow_id', 'act_state_id'])
+        self.assertTrue(flag)
+        self.assertEqual(result, [dict(workflow_id=1, act_state_id=1, ticket_count=2),
+                                  dict(workflow_id=1, act_state_id=4, ticket_count=2),
+                                  dict(workflow_id=2, act_state_id=1, ticket_count=2)])
+        flag, result = ticket_statistics_service_ins.get_ticket_count_statistics([1], '2020-03-01', '2020-03-02')
+        self.assertEqual(result, [dict(ticket_count=9)])
+        flag, result = ticket_statistics_service_ins.get_ticket_count_statistics([1], '', '', ['creator'])
+        self.assertFalse(flag)
+
+    def test_get_ticket_count_statistics_without_rollup(self):
+        """
+        未启用汇总表时按天分组查询工单记录
+        :return:
+        """
+        for index in range(3):
+            TicketRecord.objects.create(title='statistics', workflow_id=1 + index % 2, sn='loonflow_s_{}'.format(index),
+                                        state_id=1, creator='admin')
+        today = datetime.date.today()
+        flag, result = ticket_statistics_service_ins.get_ticket_count_statistics(
+            [1, 2], str(today), str(today), ['day', 'workflow_id'])
+        self.assertTrue(flag)
+        self.assertEqual([(statistics['workflow_id'], statistics['ticket_count']) for statistics in result],
+                         [(1, 2), (2, 1)])
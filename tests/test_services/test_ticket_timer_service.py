@@ -0,0 +1,60 @@
+import datetime
+from unittest import mock
+
+from apps.ticket.models import TicketRecord, TicketTimer
+from service.ticket.ticket_base_service import ticket_base_service_ins
+from service.ticket.ticket_timer_service import ticket_timer_service_ins
+from service.workflow.workflow_custom_field_service import workflow_custom_field_service_ins
+from tests.base import LoonflowTest
+
+
+class TestTicketTimerService(LoonflowTest):
+    def setUp(self):
+        self.ticket_obj = TicketRecord.objects.create(title='ticket', workflow_id=1, sn='loonflow_timer', state_id=2,
+                                                      state_version=1, creator='admin')
+
+    def add_timer(self, state_version, seconds):
+        return TicketTimer.objects.create(ticket_id=self.ticket_obj.id, state_id=2, state_version=state_version,
+                                          transition_id=1, creator='loonrobot',
+                                          due_time=datetime.datetime.now() + datetime.timedelta(seconds=seconds))
+
+    def test_claim_due_timer(self):
+        """
+        只领取到期的定时器，领取后租约期内不会被重复领取，租约到期后重新领取
+        :return:
+        """
+        due_timer = self.add_timer(1, -10)
+        self.add_timer(1, 3600)
+        timer_list = ticket_timer_service_ins.claim_due_timer_list(10)
+        self.assertEqual([timer_obj.id for timer_obj in timer_list], [due_timer.id])
+        self.assertEqual(timer_list[0].status, ticket_timer_service_ins.STATUS_RUNNING)
+        self.assertEqual(ticket_timer_service_ins.claim_due_timer_list(10), [])
+
+        TicketTimer.objects.filter(id=due_timer.id).update(
+            due_time=datetime.datetime.now() - datetime.timedelta(seconds=1))
+        self.assertEqual([timer_obj.id for timer_obj in ticket_timer_service_ins.claim_due_timer_list(10)],
+                         [due_timer.id])
+
+    def test_sweep_stale_timer(self):
+        """
+        工单状态版本变化后定时器失效
+        :return:
+        """
+        stale_timer = self.add_timer(0, -10)
+        flag, result = ticket_timer_service_ins.sweep_ticket_timer()
+        self.assertTrue(flag)
+        self.assertEqual(result['timer_count'], 1)
+        self.assertEqual(TicketTimer.objects.get(id=stale_timer.id).status, ticket_timer_service_ins.STATUS_INVALID)
+
+    def test_comment_invalidate_timer(self):
+        """
+        评论后定时器失效
+        :return:
+        """
+        timer_obj = self.add_timer(1, -10)
+        with mock.patch.object(workflow_custom_field_service_ins, 'get_workflow_custom_field',
+                               return_value=(True, {})):
+            flag, result = ticket_base_service_ins.add_comment(self.ticket_obj.id, 'lilei', 'comment')
+        self.assertTrue(flag, result)
+        self.assertEqual(ticket_timer_service_ins.run_ticket_timer(timer_obj),
+                         (ticket_timer_service_ins.STATUS_INVALID, '后续有操作，定时器失效'))
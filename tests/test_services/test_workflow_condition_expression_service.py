@@ -0,0 +1,63 @@
+import json
+
+from service.workflow.workflow_condition_expression_service import workflow_condition_expression_service_ins
+from tests.base import LoonflowTest
+
+
+class TestWorkflowConditionExpressionService(LoonflowTest):
+    def get_target_state_id(self, expression_list, value_dict, transition_id=1):
+        return workflow_condition_expression_service_ins.get_target_state_id(
+            transition_id, json.dumps(expression_list), value_dict)
+
+    def test_get_target_state_id(self):
+        """
+        按顺序计算条件表达式，返回第一个满足的目标状态
+        :return:
+        """
+        expression_list = [dict(expression="{days} > 3 and {leave_type} == 'annual'", target_state_id=11),
+                           dict(expression="'{days}' == '2'", target_state_id=12)]
+        self.assertEqual(self.get_target_state_id(expression_list, dict(days=5, leave_type='annual')), (True, 11))
+        self.assertEqual(self.get_target_state_id(expression_list, dict(days=2, leave_type='annual')), (True, 12))
+        self.assertEqual(self.get_target_state_id(expression_list, dict(days=1, leave_type='sick')), (True, 0))
+
+    def test_datetime_helper(self):
+        """
+        表达式中可以使用时间函数
+        :return:
+        """
+        expression_list = [dict(expression="datetime.datetime.strptime({start}, '%Y-%m-%d') < datetime.datetime.now()",
+                                target_state_id=11)]
+        self.assertEqual(self.get_target_state_id(expression_list, dict(start='2020-01-01')), (True, 11))
+
+    def test_reject_unsafe_expression(self):
+        """
+        白名单外的语法和名称不允许执行
+        :return:
+        """
+        for expression in ("__import__('os').system('ls')", "{days}.__class__", "open('/etc/passwd')",
+                           "[x for x in {days}]", "time.sleep(1)"):
+            flag, msg = self.get_target_state_id([dict(expression=expression, target_state_id=11)], dict(days=1))
+            self.assertFalse(flag, expression)
+
+    def test_numeric_only_operation(self):
+        """
+        乘法、取模只允许用于数字
+        :return:
+        """
+        expression_list = [dict(expression='{days} * 2 > 5 and {days} % 2 == 1', target_state_id=11)]
+        self.assertEqual(self.get_target_state_id(expression_list, dict(days=3)), (True, 11))
+        for expression in ("'a' * 100000000 == ''", "{name} * {days} == ''", "[1] * {days} == []",
+                           "'%0999999999d' % 1 == ''"):
+            flag, msg = self.get_target_state_id([dict(expression=expression, target_state_id=11)],
+                                                 dict(name='a', days=100000000))
+            self.assertFalse(flag, expression)
+
+    def test_recompile_when_expression_changed(self):
+        """
+        同一transition的表达式修改后重新编译
+        :return:
+        """
+        self.assertEqual(self.get_target_state_id([dict(expression='{days} > 3', target_state_id=11)],
+                                                  dict(days=5), transition_id=100), (True, 11))
+        self.assertEqual(self.get_target_state_id([dict(expression='{days} > 10', target_state_id=11)],
+                                                  dict(days=5), transition_id=100), (True, 0))
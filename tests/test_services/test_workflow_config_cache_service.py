@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from service.workflow.workflow_config_cache_service import WorkflowConfigCacheService
+from tests.base import InMemoryRedis
+
+
+@override_settings(WORKFLOW_CONFIG_VERSION_CHECK_INTERVAL=60)
+class TestWorkflowConfigCacheService(TransactionTestCase):
+    def setUp(self):
+        self.redis_conn = InMemoryRedis()
+        patcher = mock.patch.object(WorkflowConfigCacheService, 'get_redis_conn', return_value=self.redis_conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        WorkflowConfigCacheService.local_cache.clear()
+        WorkflowConfigCacheService._checked_at = 0
+        self.load_count = 0
+
+    def loader(self):
+        self.load_count += 1
+        return self.load_count
+
+    def test_get_config(self):
+        """
+        命中进程内缓存时不访问redis, 其他进程的缓存从redis获取
+        :return:
+        """
+        self.assertEqual(WorkflowConfigCacheService.get_config('state', 1, self.loader), 1)
+        with mock.patch.object(self.redis_conn, 'get', side_effect=AssertionError('redis is called')):
+            self.assertEqual(WorkflowConfigCacheService.get_config('state', 1, self.loader), 1)
+        WorkflowConfigCacheService.local_cache.clear()
+        self.assertEqual(WorkflowConfigCacheService.get_config('state', 1, self.loader), 1)
+        self.assertEqual(self.load_count, 1)
+
+    def test_bump_version(self):
+        """
+        事务提交后才递增版本号, 当前进程立即重新加载
+        :return:
+        """
+        WorkflowConfigCacheService.get_config('state', 1, self.loader)
+        with transaction.atomic():
+            WorkflowConfigCacheService.bump_version()
+            self.assertIsNone(self.redis_conn.get(WorkflowConfigCacheService.VERSION_KEY))
+            self.assertEqual(WorkflowConfigCacheService.get_config('state', 1, self.loader), 1)
+        self.assertEqual(self.redis_conn.get(WorkflowConfigCacheService.VERSION_KEY), b'1')
+        self.assertEqual(WorkflowConfigCacheService.get_config('state', 1, self.loader), 2)
+
+        # 事务回滚时不递增
+        try:
+            with transaction.atomic():
+                WorkflowConfigCacheService.bump_version()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.redis_conn.get(WorkflowConfigCacheService.VERSION_KEY), b'1')
+
+    def test_stale_version(self):
+        """
+        其他进程递增版本号后, 当前进程在检查间隔内使用旧缓存, 间隔后重新加载
+        :return:
+        """
+        WorkflowConfigCacheService.get_config('state', 1, self.loader)
+        self.redis_conn.incr(WorkflowConfigCacheService.VERSION_KEY)
+        self.assertEqual(WorkflowConfigCacheService.get_config('state', 1, self.loader), 1)
+        WorkflowConfigCacheService._checked_at -= 60
+        self.assertEqual(WorkflowConfigCacheService.get_config('state', 1, self.loader), 2)
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from django.test import override_settings
+
+from service.workflow.workflow_script_execute_service import WorkflowScriptExecuteService, \
+    workflow_script_execute_service_ins
+from tests.base import LoonflowTest
+
+
+class TestWorkflowScriptExecuteService(LoonflowTest):
+    def setUp(self):
+        fd, self.script_file = tempfile.mkstemp(suffix='.py')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.script_file)
+
+    def write_script(self, source, mtime):
+        with open(self.script_file, 'w', encoding='utf-8') as f:
+            f.write(source)
+        os.utime(self.script_file, (mtime, mtime))
+
+    def test_run_script(self):
+        """
+        脚本的print输出按次捕获，不修改sys.stdout; 脚本修改后重新编译
+        :return:
+        """
+        stdout = sys.stdout
+        self.write_script("print('ticket', ticket_id, action_from)\n", 1000000000)
+        self.assertEqual(workflow_script_execute_service_ins.run_script(self.script_file, 1),
+                         (True, 'ticket 1 loonrobot\n'))
+        self.assertIs(sys.stdout, stdout)
+
+        self.write_script("raise Exception('script failed')\n", 1000000100)
+        self.assertEqual(workflow_script_execute_service_ins.run_script(self.script_file, 1),
+                         (False, 'script failed'))
+
+    @override_settings(WORKFLOW_SCRIPT_POOL_SIZE=2, WORKFLOW_SCRIPT_TIMEOUT=2)
+    def test_run_script_timeout(self):
+        """
+        脚本超时只终止执行该脚本的进程，其他进程中正在执行的脚本不受影响
+        :return:
+        """
+        self.addCleanup(self.terminate_workers)
+        self.write_script("import time\ntime.sleep(10)\n", 1000000000)
+        fd, quick_script_file = tempfile.mkstemp(suffix='.py')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write("import time\ntime.sleep(1.5)\nprint('done', ticket_id)\n")
+        self.addCleanup(os.remove, quick_script_file)
+
+        result_list = []
+        slow_thread = threading.Thread(
+            target=lambda: result_list.append(workflow_script_execute_service_ins.run_script(self.script_file, 1)))
+        slow_thread.start()
+        time.sleep(1)
+        # 执行期间另一个脚本超时
+        self.assertEqual(workflow_script_execute_service_ins.run_script(quick_script_file, 2), (True, 'done 2\n'))
+        slow_thread.join()
+        self.assertEqual(result_list, [(False, 'script timeout after 2 seconds')])
+        # 超时的进程已被替换
+        self.assertEqual(workflow_script_execute_service_ins.run_script(quick_script_file, 3), (True, 'done 3\n'))
+
+    def terminate_workers(self):
+        idle_worker_queue = WorkflowScriptExecuteService.idle_worker_queue
+        WorkflowScriptExecuteService.idle_worker_queue = None
+        while not idle_worker_queue.empty():
+            idle_worker_queue.get().terminate()
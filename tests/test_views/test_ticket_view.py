@@ -1,4 +1,6 @@
 import json
+from schema import SchemaError
+from apps.ticket.views import TicketsBatch
 from tests.base import LoonflowTest
 from django.test.client import Client
 from tests.base import LoonflowApiCall
@@ -171,3 +173,23 @@ class TestTicketView(LoonflowTest):
         url = '/api/v1.0/tickets'
         response_content_dict = LoonflowApiCall().api_call('get', url, params)
         return response_content_dict
+
+    def test_tickets_batch_post_schema(self):
+        """
+        批量新建工单只需要workflow_id及ticket_list, ticket_list的每项为dict
+        :return:
+        """
+        TicketsBatch.post_schema.validate(dict(workflow_id=1, ticket_list=[dict(transition_id=1)]))
+        for ticket_list in ([], [1]):
+            with self.assertRaises(SchemaError):
+                TicketsBatch.post_schema.validate(dict(workflow_id=1, ticket_list=ticket_list))
+
+    def test_tickets_batch_patch_schema(self):
+        """
+        批量处理工单的每项需要包含int类型的ticket_id及transition_id
+        :return:
+        """
+        TicketsBatch.patch_schema.validate(dict(ticket_list=[dict(ticket_id=1, transition_id=2, fields={})]))
+        for ticket_list in ([], [1], [dict(ticket_id='1', transition_id=2)], [dict(ticket_id=1)]):
+            with self.assertRaises(SchemaError):
+                TicketsBatch.patch_schema.validate(dict(ticket_list=ticket_list))